@@ -1,5 +1,5 @@
 from primitives import Vector2, Segment, segmentsFromString
-from trajectory.scbData import NPFrameSet
+from trajectory.dataLoader import loadSCB
 import Crowd
 import os
 import time
@@ -446,7 +446,7 @@ class DensityAnalysisTask( DiscreteAnalysisTask ):
         if ( self.work ):
             print 'Density analysis: %s' % ( self.workName )
             print "\tAccessing scb file:", self.scbName
-            frameSet = NPFrameSet( self.scbName )
+            frameSet = loadSCB( self.scbName )
             workPath = self.getWorkPath( 'density' )
             tempFile = os.path.join( workPath, self.workName )
             grids = Crowd.GridFileSequence( tempFile )
@@ -501,7 +501,7 @@ class SpeedAnalysisTask( DiscreteAnalysisTask ):
         if ( self.work ):
             print 'Speed analysis: %s' % ( self.workName )
             print "\tAccessing scb file:", self.scbName
-            frameSet = NPFrameSet( self.scbName )
+            frameSet = loadSCB( self.scbName )
             workPath = self.getWorkPath( 'speed' )
             tempFile = os.path.join( workPath, self.workName )
             grids = Crowd.GridFileSequence( tempFile )
@@ -551,7 +551,7 @@ class FlowAnalysisTask( AnalysisTask ):
         if ( self.work ):
             print 'Flow analysis: %s' % ( self.workName )
             print "\tAccessing scb file:", self.scbName
-            frameSet = NPFrameSet( self.scbName )
+            frameSet = loadSCB( self.scbName )
             names = self.lineNames
             lines = self.lines
             workPath = self.getWorkPath( 'flow' )
@@ -661,7 +661,7 @@ class PopulationAnalysisTask( RectRegionAnalysisTask ):
         if ( self.work ):
             print 'Population analysis: %s' % ( self.workName )
             print "\tAccessing scb file:", self.scbName
-            frameSet = NPFrameSet( self.scbName )
+            frameSet = loadSCB( self.scbName )
             names = self.rectNames
             rects = self.rects
             workPath = self.getWorkPath( 'population' )
@@ -695,7 +695,7 @@ class FundDiagAnalysisTask( RectRegionAnalysisTask ):
         if ( self.work ):
             print 'Fundamental diagram analysis: %s' % ( self.workName )
             print "\tAccessing scb file:", self.scbName
-            frameSet = NPFrameSet( self.scbName )
+            frameSet = loadSCB( self.scbName )
             names = self.rectNames
             rects = self.rects
             workPath = self.getWorkPath( 'fundDiag' )
@@ -38,6 +38,40 @@ import pylab as plt
 from GFSVis import visualizeGFS
 from stats import StatRecord
 
+
+# The number of frames the block-based analyses process at a time
+BLOCK_FRAMES = 64
+
+def frameBlocks( frameSet, blockSize=BLOCK_FRAMES ):
+    '''Iterates through the remaining frames of a frame set in blocks of frames.
+
+    Frame sets that support block reads (see NPFrameSet.iterBlocks) produce blocks of up to
+    blockSize frames.  For all other trajectory data, where each frame can contain a different
+    set of agents, every block contains a single frame.
+
+    @param      frameSet        An instance of trajectory data.
+    @param      blockSize       An int.  The maximum number of frames in a block.
+    @returns    A generator of 3-tuples: ( block, indices, ids ).
+                    block:      A numpy array of shape (K, N, M) for K frames of N agents.
+                    indices:    A sequence of K ints.  The index of each frame.
+                    ids:        A numpy array of N ints.  The global id of each agent in the block.
+    '''
+    if ( hasattr( frameSet, 'iterBlocks' ) ):
+        # a filtered frame set (see FilteredFrameSet) reports the ids of its selected agents
+        ids = getattr( frameSet, 'agentIds', None )
+        if ( ids is None ):
+            ids = np.arange( frameSet.agentCount() )
+        for block, indices in frameSet.iterBlocks( blockSize ):
+            yield block, indices, ids
+    else:
+        while ( True ):
+            try:
+                frame, idx = frameSet.next()
+            except StopIteration:
+                return
+            ids = frameSet.getFrameIds()   # mapping from frame IDs to global IDs
+            frameIDs = np.array( map( lambda x: ids[ x ], xrange( frame.shape[0] ) ), dtype=np.int )
+            yield frame[ np.newaxis ], ( idx, ), frameIDs
         
 ##          HELPER FUNCTION FOR REGION TESTS
 def findCurrentRegion( frame, polygons, excludeStates ):
@@ -343,44 +377,35 @@ def computeFlow( frameSet, segments, outFileName, names=None ):
     COULD_CROSS[ frameIDs, : ] = PREV_SDIST & BETWEEN
 ##    COULD_CROSS = PREV_SDIST & BETWEEN
     
-    while ( True ):
-        try:
-            frame, idx = frameSet.next()
-        except StopIteration:
-            break
-        else:
-            ids = frameSet.getFrameIds()   # mapping from frame IDs to global IDs
-            frameIDs = map( lambda x: ids[ x ], xrange( frame.shape[0] ) )
-        # compute crossability for the current frame
-        pX = frame[:, :1 ]
+    # Process the remaining frames in blocks.  Within a block, every frame has the same agents, so
+    #   the crossing tests are evaluated for all of the block's frames at once.
+    for block, indices, frameIDs in frameBlocks( frameSet ):
+        # compute crossability for every frame in the block (K x N x 1 arrays)
+        pX = block[ :, :, :1 ]
         if ( frameSet.is3D ):
-            pY = frame[:, 2:3 ]
+            pY = block[ :, :, 2:3 ]
         else:
-            pY = frame[:, 1:2 ]
-##        if ( idx > 30 and idx < 40 ):
-##            print "Frame:", idx
-##            print "\tAgents in frame: ", frameIDs
-##            print "\tx:", pX.T
-##            print "\ty:", pY.T
+            pY = block[ :, :, 1:2 ]
         SDIST = ( A * pX + B * pY + C ) < 0 
         T = (pX - S0X) * dX + (pY - S0Y) * dY
         BETWEEN = ( T >= 0 ) & ( T <= L )
-##        if ( idx > 30 and idx < 40 ):
-##            print "\tSDIST:", SDIST
-##            print "\tBETWEEN:", BETWEEN
-##            print "\tCOULD_CROSS:", COULD_CROSS[ frameIDs,: ]
+        NEXT_COULD_CROSS = SDIST & BETWEEN
         # in order to cross, in the previous time step, I had to be in a position to cross
         #   and in this frame, my sign has to reversed AND I have to not already crossed it.
-        CROSSED = COULD_CROSS[ frameIDs, : ] & ~SDIST & ~alreadyCrossed[ frameIDs, : ]
-        alreadyCrossed[ frameIDs, : ] |= CROSSED
-        crossed += CROSSED.sum( axis=0 )
-        outFile.write('{0:10d}'.format( idx ) )
-        for val in crossed:
-            outFile.write('{0:10d}'.format( val ) )
-        outFile.write('\n')
-        COULD_CROSS[ frameIDs, : ] = SDIST & BETWEEN
-##        prevIdx = idx
-##        frame, idx = frameSet.next()
+        #   Only an agent's first crossing of a segment counts.
+        PREV_COULD_CROSS = np.concatenate( ( COULD_CROSS[ np.newaxis, frameIDs, : ], NEXT_COULD_CROSS[ :-1 ] ), axis=0 )
+        CROSSINGS = PREV_COULD_CROSS & ~SDIST
+        CROSSED = CROSSINGS & ( np.cumsum( CROSSINGS, axis=0 ) == 1 ) & ~alreadyCrossed[ np.newaxis, frameIDs, : ]
+        alreadyCrossed[ frameIDs, : ] |= CROSSED.any( axis=0 )
+        # the cumulative crossing counts at each frame in the block
+        counts = crossed + np.cumsum( CROSSED.sum( axis=1 ), axis=0 )
+        crossed = counts[ -1 ]
+        for idx, frameCounts in zip( indices, counts ):
+            outFile.write('{0:10d}'.format( idx ) )
+            for val in frameCounts:
+                outFile.write('{0:10d}'.format( val ) )
+            outFile.write('\n')
+        COULD_CROSS[ frameIDs, : ] = NEXT_COULD_CROSS[ -1 ]
 
     outFile.close()
 
@@ -408,7 +433,6 @@ def computePopulation( frameSet, rectDomains, outFileName, names=None ):
     # write names
     outFile.write( '# %s\n' % '~'.join( names ) )
     frameSet.setNext( 0 )
-    X_COL_LIMIT = 1
     Y_COL = 1
     if ( frameSet.is3D ):
         Y_COL = 2
@@ -417,32 +441,23 @@ def computePopulation( frameSet, rectDomains, outFileName, names=None ):
     for i, rect in enumerate( rectDomains ):
         rect.maxCorner = ( rect.minCorner[0] + rect.size[0], rect.minCorner[1] + rect.size[1] )
 
-    for i, rect in enumerate( rectDomains ):
-    
-     while ( True ):
-        try:
-            frame, idx = frameSet.next()
-        except StopIteration:
-            break
-        else:
-            ids = frameSet.getFrameIds()   # mapping from frame IDs to global IDs
-            frameIDs = map( lambda x: ids[ x ], xrange( frame.shape[0] ) )
-        # compute crossability for the current frame
-        
-        pX = frame[:, :X_COL_LIMIT ]
-        pY = frame[:, Y_COL:Y_COL+1 ]
+    for block, indices, frameIDs in frameBlocks( frameSet ):
+        # positions for every frame in the block (K x N arrays)
+        pX = block[ :, :, 0 ]
+        pY = block[ :, :, Y_COL ]
 
-        # the number of agents in each rect
-        population = np.zeros( rectCount, dtype=np.int )
+        # the number of agents in each rect for each frame
+        population = np.zeros( ( block.shape[0], rectCount ), dtype=np.int )
         
         for i, rect in enumerate( rectDomains ):
             inside = ( pX >= rect.minCorner[0] ) & ( pX <= rect.maxCorner[0] ) & ( pY >= rect.minCorner[1] ) & ( pY <= rect.maxCorner[1] )
-            population[ i ] = np.sum( inside )
+            population[ :, i ] = np.sum( inside, axis=1 )
 
-        outFile.write('{0:10d}'.format( idx ) )
-        for val in population:
-            outFile.write('{0:10d}'.format( val ) )
-        outFile.write('\n')
+        for idx, framePop in zip( indices, population ):
+            outFile.write('{0:10d}'.format( idx ) )
+            for val in framePop:
+                outFile.write('{0:10d}'.format( val ) )
+            outFile.write('\n')
 
     outFile.close()
     
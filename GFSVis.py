@@ -66,7 +66,23 @@ def visualizeGrid( grid, cMap, outFileName, minVal, maxVal, sites=None, obstacle
         drawObstacles( obstacles, s, grid )
     pygame.image.save( s, outFileName )
 
-def visualizeMultiGFS( gfsFiles, cMap, outFileBases, imgFormat, mapRange=1.0, mapLimits=None, sites=None, obstacles=None ):
+def dataRange( gfsFile, percentile=None ):
+    '''Reports the range of the values of a grid file sequence.
+
+    @param      gfsFile         An instance of a GridFileSequenceReader.
+    @param      percentile      An optional 2-tuple of floats: ( low, high ).  If given, and the
+                                file holds the statistics of its grids, the range spans these
+                                percentiles of the values (see GridFileSequenceReader.percentileRange).
+                                No grid is read.
+    @returns    A 2-tuple of floats: ( minVal, maxVal ).
+    '''
+    if ( percentile is not None ):
+        if ( gfsFile.hasStats() ):
+            return gfsFile.percentileRange( percentile[0], percentile[1] )
+        print "\t%s has no grid statistics; using its full range" % ( gfsFile.file.name )
+    return gfsFile.range
+
+def visualizeMultiGFS( gfsFiles, cMap, outFileBases, imgFormat, mapRange=1.0, mapLimits=None, sites=None, obstacles=None, percentile=None ):
     '''Visualizes multiple grid file sequence with the given color map (including a single, commmon range).
 
     @param      gfsFile         A list of GridFileSequenceReader instances.  The grids to visualize.
@@ -86,6 +102,8 @@ def visualizeMultiGFS( gfsFiles, cMap, outFileBases, imgFormat, mapRange=1.0, ma
                                 of data as there are grids in the sequence.
     @param      obstacles       An instance of ObstacleSet (optional).  If obstacle are provided,
                                 Then they will be drawn over the top of the data.
+    @param      percentile      An optional 2-tuple of floats: ( low, high ).  The data range spans
+                                these percentiles of each file's values (see dataRange).
     '''
     pygame.init()
 
@@ -97,8 +115,9 @@ def visualizeMultiGFS( gfsFiles, cMap, outFileBases, imgFormat, mapRange=1.0, ma
     
     
     digits = map( lambda x: int( np.ceil( np.log10( x.gridCount() ) ) ), gfsFiles )
-    minVal = min( map( lambda x: x.range[0], gfsFiles ) )
-    maxVal = max( map( lambda x: x.range[1], gfsFiles ) )
+    ranges = map( lambda x: dataRange( x, percentile ), gfsFiles )
+    minVal = min( map( lambda x: x[0], ranges ) )
+    maxVal = max( map( lambda x: x[1], ranges ) )
     maxVal = ( maxVal - minVal ) * mapRange + minVal
 
     if ( not mapLimits is None ):
@@ -126,7 +145,7 @@ def visualizeMultiGFS( gfsFiles, cMap, outFileBases, imgFormat, mapRange=1.0, ma
                 raise
         pygame.image.save( cMap.lastMapBar(7), '%s_bar.png' % ( outFileBase ) )
     
-def visualizeGFS( gfsFile, cMap, outFileBase, imgFormat, mapRange=1.0, mapLimits=None, sites=None, obstacles=None ):
+def visualizeGFS( gfsFile, cMap, outFileBase, imgFormat, mapRange=1.0, mapLimits=None, sites=None, obstacles=None, percentile=None ):
     '''Visualizes a grid file sequence with the given color map.
 
     @param      gfsFile         An instance of a GridFileSequenceReader.  The grids to visualize.
@@ -146,6 +165,8 @@ def visualizeGFS( gfsFile, cMap, outFileBase, imgFormat, mapRange=1.0, mapLimits
                                 of data as there are grids in the sequence.
     @param      obstacles       An instance of ObstacleSet (optional).  If obstacle are provided,
                                 Then they will be drawn over the top of the data.
+    @param      percentile      An optional 2-tuple of floats: ( low, high ).  The data range spans
+                                these percentiles of the values (see dataRange).
     '''
     pygame.init()
 
@@ -161,15 +182,13 @@ def visualizeGFS( gfsFile, cMap, outFileBase, imgFormat, mapRange=1.0, mapLimits
             raise ValueError, "The parmeter mapLimits must be a tuple"
         elif ( len( mapLimits ) != 2 ):
             raise ValueError, "The parameter mapLimits must have two values"
-        minVal = gfsFile.range[0]
+        minVal, maxVal = dataRange( gfsFile, percentile )
         if ( not mapLimits[0] is None ):
             minVal = mapLimits[0]
-        maxVal = gfsFile.range[1]
         if ( not mapLimits[1] is None ):
             maxVal = mapLimits[1]
     else:
-        minVal = gfsFile.range[0]
-        maxVal = gfsFile.range[1]
+        minVal, maxVal = dataRange( gfsFile, percentile )
         maxVal = ( maxVal - minVal ) * mapRange + minVal
     
     for grid, gridID in gfsFile:
@@ -184,7 +203,7 @@ def visualizeGFS( gfsFile, cMap, outFileBase, imgFormat, mapRange=1.0, mapLimits
             raise
     pygame.image.save( cMap.lastMapBar(7), '%sbar.png' % ( outFileBase ) )
         
-def visualizeGFSName( gfsFileName, outFileBase, imgFormat='png', cMap=ColorMap.BlackBodyMap(), mapRange=1.0, mapLimits=None, sitesName=None, obstacles=None ):
+def visualizeGFSName( gfsFileName, outFileBase, imgFormat='png', cMap=ColorMap.BlackBodyMap(), mapRange=1.0, mapLimits=None, sitesName=None, obstacles=None, window=None, percentile=None ):
     '''Visualizes a grid file sequence with the given color map.
 
     @param      gfsFileName     A string.  The name of the GridFileSequence to visualize.
@@ -203,14 +222,20 @@ def visualizeGFSName( gfsFileName, outFileBase, imgFormat='png', cMap=ColorMap.B
     @param      sitesName       A string.  The path to a set of trajectory sites
     @param      obstacles       An instance of ObstacleSet (optional).  If obstacle are provided,
                                 Then they will be drawn over the top of the data.
+    @param      window          An optional 2-tuple of 2-tuples of floats: ( minCorner, size ).  Only
+                                the cells covering this region of the domain are read and visualized.
+    @param      percentile      An optional 2-tuple of floats: ( low, high ).  The data range spans
+                                these percentiles of the values (see dataRange).
     '''
-    reader = GFS.GridFileSequenceReader( gfsFileName )
+    reader = GFS.openGridFileSequence( gfsFileName )
+    if ( window is not None ):
+        reader.setWindow( window[0], window[1] )
     reader.setNext( 0 )
     try:
         sites = loadTrajectory( sitesName )
     except:
         sites = None
-    visualizeGFS( reader, cMap, outFileBase, imgFormat, mapRange, mapLimits, sites, obstacles )
+    visualizeGFS( reader, cMap, outFileBase, imgFormat, mapRange, mapLimits, sites, obstacles, percentile )
 
 if __name__ == '__main__':
     def main():
@@ -232,6 +257,10 @@ if __name__ == '__main__':
                            action='store', dest='ext', default='png' )
         parser.add_option( '-b', '--obstacles', help='Path to an obstacle xml file',
                            action='store', dest='obstXML', default=None )
+        parser.add_option( '-w', '--window', help='(Optional) Visualize only the region of the domain: minX minY width height.',
+                           nargs=4, type='float', action='store', dest='window', default=None )
+        parser.add_option( '-p', '--percentile', help='(Optional) Map the colors to the range between two percentiles of the data: low high (e.g., 1 99).  Requires grid statistics in the file.',
+                           nargs=2, type='float', action='store', dest='percentile', default=None )
         options, args = parser.parse_args()
 
         if ( options.input == '' ):
@@ -263,14 +292,16 @@ if __name__ == '__main__':
             if ( not os.path.exists( folder ) ):
                 os.makedirs( folder )
 
-        reader = GFS.GridFileSequenceReader( options.input )
+        reader = GFS.openGridFileSequence( options.input )
+        if ( options.window is not None ):
+            reader.setWindow( options.window[:2], options.window[2:] )
         reader.setNext( 0 )    
 
         obstacles = None
         if ( options.obstXML ):
             obstacles, bb = obstacles.readObstacles( options.obstXML )
 
-        visualizeGFS( reader, colorMap, options.output, options.ext, 1.0, trajData, obstacles )
+        visualizeGFS( reader, colorMap, options.output, options.ext, 1.0, None, trajData, obstacles, options.percentile )
         
     main()    
     
\ No newline at end of file
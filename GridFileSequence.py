@@ -6,59 +6,436 @@ import threading
 import time
 import multiprocessing
 import os
+import zlib
 
 from stats import StatRecord
 from Grid import *
 from RasterGrid import RasterGrid
 from primitives import Vector2
 from ThreadRasterization import *
+from GridOutput import RasterReport, OrderedGridWriter, GridPool, WRITE_WINDOW
+import ProcessRasterization
 import Kernels
 import Signals
 
 THREAD_COUNT = 1#max( 1, multiprocessing.cpu_count() / 2 )
 ##THREAD_COUNT = multiprocessing.cpu_count() - 1
-        
-# the thread that does the file output
-def threadOutput( outFile, buffer, bufferLock, startTime, gfs ):
-    """Reads grids from the buffer and writes them to the output file"""
-    nextGrid = 0
-    while ( buffer or gfs.activeThreadCount ):
-        # keep doing the work as long as the buffer has contents or there are active raster threads
-        bufferLock.acquire()
-        try:
-            i = buffer.index( nextGrid )
-            bg = buffer.pop( i )
-            bufferLock.release()
-            if ( nextGrid & 0xFF == 0 ):
-                print "\t\tWriting buffer %d at time %f s" % ( nextGrid, time.clock() - startTime )
-            outFile.write( bg.grid.binaryString() )
-            nextGrid += 1
-        except ValueError:
-            bufferLock.release()
-            time.sleep( 1.0 )
-    print "\t\tLast grid %d at time %f s" % ( nextGrid - 1, time.clock() - startTime )
-    
-class RasterReport:
-    """Simple class to return the results of rasterization"""
-    def __init__( self ):
-        self.maxVal = 0.0
-        self.minVal = 1e6
-        self.count = 0
-
-    def incCount( self ):
-        self.count += 1
 
-    def setMax( self, val ):
-        if ( val > self.maxVal ):
-            self.maxVal = val
-
-    def setMin( self, val ):
-        if ( val < self.minVal ):
-            self.minVal = val
 
 # A mapping of numpy array type to an int iterator for storing in the file
 NP_TYPES = ( np.float32, np.float64, np.int8, np.int16, np.int32, np.int64 )
 TYPE_ID_MAP = dict( map( lambda x: ( x[1], x[0] ), enumerate( NP_TYPES ) ) )
+# The number of grids compared at once by computeDifference (for memory-mapped readers)
+DIFF_BLOCK = 64
+# The type id in the header also holds flags for encoded grid file sequences (see GridCodec).
+#   The low byte is the index of the data type in NP_TYPES.
+TYPE_MASK = 0xFF
+GFS_COMPRESSED = 0x100      # every grid is compressed with zlib
+GFS_SPARSE = 0x200          # only the tiles of a grid with non-zero values are stored
+# The default width and height (in cells) of a sparse tile
+TILE_SIZE = 16
+# The default zlib compression level
+COMPRESSION_LEVEL = 6
+# The string which ends a file with a footer (see GridFileWriter)
+FOOTER_MAGIC = 'GFSF'
+FOOTER_TRAILER = struct.calcsize( 'q4s' )
+# The default number of histogram bins of the per-grid statistics (see GridStatistics)
+STAT_BINS = 32
+
+def readFooter( file, dataEnd=None ):
+    '''Reads the footer of a grid file sequence.
+
+    The footer follows the grids.  It is a sequence of tagged blocks (a 4-character tag, an int
+    length and the block's data) followed by the trailer: the offset of the first block and the
+    magic string, FOOTER_MAGIC.
+
+    @param      file        An open, binary file.  The grid file sequence.
+    @param      dataEnd     An optional int.  The offset at which the grids end.  If given, the
+                            footer must start there.
+    @returns    A dictionary mapping tag to the block's data (a binary string).  It is empty if the
+                file has no footer.
+    '''
+    file.seek( 0, os.SEEK_END )
+    trailerStart = file.tell() - FOOTER_TRAILER
+    if ( trailerStart < 0 ):
+        return {}
+    file.seek( trailerStart )
+    start, magic = struct.unpack( 'q4s', file.read( FOOTER_TRAILER ) )
+    if ( magic != FOOTER_MAGIC or start < 0 or start > trailerStart ):
+        return {}
+    if ( dataEnd is not None and start != dataEnd ):
+        return {}
+    blocks = {}
+    file.seek( start )
+    pos = start
+    while ( pos + 8 <= trailerStart ):
+        tag, length = struct.unpack( '4si', file.read( 8 ) )
+        blocks[ tag ] = file.read( length )
+        pos += 8 + length
+    if ( pos != trailerStart ):
+        # this isn't a footer
+        return {}
+    return blocks
+
+class GridCodec:
+    '''Encodes and decodes the grids of an encoded grid file sequence.
+
+    A sparse grid is divided into square tiles.  It is stored as a bit mask of the tiles with
+    non-zero values (in row-major order of the tiles) followed by the values of those tiles; the
+    tiles on the upper edges are padded with zeros.  With compression, the stored grid is
+    compressed with zlib.'''
+    def __init__( self, resolution, arrayType=np.float32, flags=GFS_COMPRESSED, tileSize=TILE_SIZE, level=COMPRESSION_LEVEL ):
+        '''Constructor.
+
+        @param      resolution      A 2-tuple of ints.  The width and height of the grids (in cells).
+        @param      arrayType       A numpy datatype.  The type of the grid values.
+        @param      flags           An int.  A combination of GFS_COMPRESSED and GFS_SPARSE.
+        @param      tileSize        An int.  The width and height of a sparse tile (in cells).
+        @param      level           An int.  The zlib compression level.
+        '''
+        self.w, self.h = resolution
+        self.arrayType = np.dtype( arrayType )
+        self.flags = flags
+        self.tileSize = tileSize
+        self.level = level
+        # the number of tiles along each axis
+        self.tx = -( -self.w // tileSize )
+        self.ty = -( -self.h // tileSize )
+
+    def isSparse( self ):
+        '''Reports if the grids are stored as sparse tiles.'''
+        return bool( self.flags & GFS_SPARSE )
+
+    def isCompressed( self ):
+        '''Reports if the grids are compressed.'''
+        return bool( self.flags & GFS_COMPRESSED )
+
+    def _tiles( self, cells ):
+        '''Views grid cells, padded to whole tiles, as an array of tiles.
+
+        @param      cells       A numpy array of shape (tx * tileSize, ty * tileSize).
+        @returns    A numpy array of shape (tx, ty, tileSize, tileSize).
+        '''
+        t = self.tileSize
+        return cells.reshape( self.tx, t, self.ty, t ).swapaxes( 1, 2 )
+
+    def encode( self, data ):
+        '''Encodes a grid.
+
+        @param      data        A binary string or a numpy array of shape (w, h).  The grid's values.
+        @returns    A binary string.  The encoded grid.
+        '''
+        if ( isinstance( data, str ) ):
+            cells = np.fromstring( data, self.arrayType ).reshape( self.w, self.h )
+        else:
+            cells = np.asarray( data, dtype=self.arrayType )
+        if ( self.isSparse() ):
+            t = self.tileSize
+            padded = np.zeros( ( self.tx * t, self.ty * t ), dtype=self.arrayType )
+            padded[ :self.w, :self.h ] = cells
+            tiles = self._tiles( padded )
+            mask = ( tiles != 0 ).any( axis=3 ).any( axis=2 )
+            payload = np.packbits( mask.ravel() ).tostring() + tiles[ mask ].tostring()
+        else:
+            payload = cells.tostring()
+        if ( self.isCompressed() ):
+            payload = zlib.compress( payload, self.level )
+        return payload
+
+    def decode( self, chunk ):
+        '''Decodes a grid.
+
+        @param      chunk       A binary string.  The encoded grid.
+        @returns    A numpy array of shape (w, h).
+        '''
+        if ( self.isCompressed() ):
+            chunk = zlib.decompress( chunk )
+        if ( not self.isSparse() ):
+            return np.fromstring( chunk, self.arrayType ).reshape( self.w, self.h )
+        t = self.tileSize
+        maskBytes = -( -self.tx * self.ty // 8 )
+        mask = np.unpackbits( np.fromstring( chunk[ :maskBytes ], np.uint8 ) )[ :self.tx * self.ty ]
+        mask = mask.reshape( self.tx, self.ty ).astype( bool )
+        padded = np.zeros( ( self.tx * t, self.ty * t ), dtype=self.arrayType )
+        self._tiles( padded )[ mask ] = np.fromstring( chunk[ maskBytes: ], self.arrayType ).reshape( -1, t, t )
+        return padded[ :self.w, :self.h ]
+
+class GridStatistics:
+    '''The statistics of every grid of a grid file sequence: the minimum, maximum and sum of its
+    values, the number of non-zero values and a histogram of the values (with bins evenly spanning
+    the grid's own range).  Non-finite values are ignored.
+
+    The statistics are stored in the footer (see GridFileWriter) as the 'STAT' block: the bin count
+    and cell count (ints) followed by a record per grid.'''
+    def __init__( self, cellCount, arrayType=np.float32, bins=STAT_BINS, table=None ):
+        '''Constructor.
+
+        @param      cellCount       An int.  The number of cells in a grid.
+        @param      arrayType       A numpy datatype.  The type of the grid values.
+        @param      bins            An int.  The number of bins of the histograms.
+        @param      table           An optional numpy array of records (see record).  The statistics
+                                    of the grids already recorded.
+        '''
+        self.cellCount = cellCount
+        self.arrayType = np.dtype( arrayType )
+        self.bins = bins
+        self.dtype = np.dtype( [ ( 'min', np.float64 ), ( 'max', np.float64 ), ( 'sum', np.float64 ),
+                                 ( 'nonzero', np.int64 ), ( 'hist', np.int32, ( bins, ) ) ] )
+        self.records = []
+        if ( table is not None ):
+            self.records.append( table )
+
+    def __len__( self ):
+        return sum( [ r.size for r in self.records ] )
+
+    def record( self, data ):
+        '''Computes the statistics of a grid.
+
+        @param      data        A binary string or a numpy array.  The grid's values.
+        @returns    A numpy array with a single record.
+        '''
+        if ( isinstance( data, str ) ):
+            values = np.fromstring( data, self.arrayType )
+        else:
+            values = np.asarray( data ).ravel()
+        rec = np.zeros( 1, dtype=self.dtype )
+        if ( values.size ):
+            lo = values.min()
+            hi = values.max()
+            if ( not ( np.isfinite( lo ) and np.isfinite( hi ) ) ):
+                values = values[ np.isfinite( values ) ]
+                if ( values.size ):
+                    lo = values.min()
+                    hi = values.max()
+        if ( values.size ):
+            rec[ 'min' ] = lo
+            rec[ 'max' ] = hi
+            rec[ 'sum' ] = values.sum( dtype=np.float64 )
+            rec[ 'nonzero' ] = np.count_nonzero( values )
+            rec[ 'hist' ] = np.histogram( values, self.bins, ( lo, hi ) )[0]
+        return rec
+
+    def add( self, data ):
+        '''Records the statistics of the next grid (see record).'''
+        self.records.append( self.record( data ) )
+
+    def extend( self, records ):
+        '''Appends the records of the next grids.
+
+        @param      records     A sequence of numpy arrays of records (see record).
+        '''
+        self.records.extend( records )
+
+    @property
+    def table( self ):
+        '''A numpy array with the record of every grid, in order.'''
+        if ( len( self.records ) != 1 ):
+            if ( self.records ):
+                self.records = [ np.concatenate( self.records ) ]
+            else:
+                return np.zeros( 0, dtype=self.dtype )
+        return self.records[0]
+
+    def toBlock( self ):
+        '''Produces the 'STAT' block of the footer.
+
+        @returns    A binary string.
+        '''
+        return struct.pack( 'ii', self.bins, self.cellCount ) + self.table.tostring()
+
+    @staticmethod
+    def fromBlock( data, arrayType=np.float32 ):
+        '''Reads the statistics from the 'STAT' block of a footer.
+
+        @param      data        A binary string.  The block's data.
+        @param      arrayType   A numpy datatype.  The type of the grid values.
+        @returns    An instance of GridStatistics.
+        '''
+        bins, cellCount = struct.unpack( 'ii', data[ :8 ] )
+        stats = GridStatistics( cellCount, arrayType, bins )
+        stats.records.append( np.fromstring( data[ 8: ], stats.dtype ) )
+        return stats
+
+    def select( self, start=0, count=-1, step=1 ):
+        '''Produces the statistics of a subset of the grids.
+
+        @param      start       An int.  The first grid.
+        @param      count       An int.  The maximum number of grids (negative for all).
+        @param      step        An int.  The stride between grids.
+        @returns    An instance of GridStatistics.
+        '''
+        table = self.table[ start::step ]
+        if ( count >= 0 ):
+            table = table[ :count ]
+        return GridStatistics( self.cellCount, self.arrayType, self.bins, table )
+
+    def mass( self ):
+        '''Reports the sum of the values of each grid.
+
+        @returns    A numpy array of floats.
+        '''
+        return self.table[ 'sum' ].copy()
+
+    def emptyGrids( self ):
+        '''Reports the grids in which every value is zero.
+
+        @returns    A numpy array of ints.  The indices of the empty grids.
+        '''
+        return np.nonzero( self.table[ 'nonzero' ] == 0 )[0]
+
+    def valueRange( self ):
+        '''Reports the range of the values of all grids.
+
+        @returns    A 2-tuple of floats: ( minVal, maxVal ).  ( 0, 0 ) if there are no grids.
+        '''
+        table = self.table
+        if ( table.size == 0 ):
+            return ( 0.0, 0.0 )
+        return ( table[ 'min' ].min(), table[ 'max' ].max() )
+
+    def percentileRange( self, low=1.0, high=99.0, ignoreZero=False ):
+        '''Estimates percentiles of the values of all grids from the histograms.  The values of
+        a bin are taken to be evenly spread across it.
+
+        @param      low         A float.  The lower percentile (in the range [0, 100]).
+        @param      high        A float.  The upper percentile (in the range [0, 100]).
+        @param      ignoreZero  A boolean.  If True, zero values are excluded (e.g., so that the
+                                empty space doesn't dominate the range of a density field).
+        @returns    A 2-tuple of floats: ( lowVal, highVal ).  ( 0, 0 ) if there are no values.
+        '''
+        table = self.table
+        width = ( table[ 'max' ] - table[ 'min' ] ) / self.bins
+        lower = table[ 'min' ][ :, np.newaxis ] + width[ :, np.newaxis ] * np.arange( self.bins )
+        counts = table[ 'hist' ].astype( np.float64 )
+        if ( ignoreZero ):
+            # remove the zeros from the bin which holds them; a grid with a single value holds
+            #   nothing but zeros if it holds any
+            zeros = ( self.cellCount - table[ 'nonzero' ] ).astype( np.float64 )
+            zeroBin = np.zeros( table.size, dtype=np.int64 )
+            spread = width > 0
+            zeroBin[ spread ] = np.floor( -table[ 'min' ][ spread ] / width[ spread ] )
+            zeroBin = np.clip( zeroBin, 0, self.bins - 1 )
+            rows = np.nonzero( spread & ( zeros > 0 ) )[0]
+            counts[ rows, zeroBin[ rows ] ] = np.maximum( 0, counts[ rows, zeroBin[ rows ] ] - zeros[ rows ] )
+            counts[ ~spread & ( zeros > 0 ) ] = 0
+        widths = np.repeat( width, self.bins )
+        lower = lower.ravel()
+        counts = counts.ravel()
+        order = np.argsort( lower + widths * 0.5, kind='mergesort' )
+        lower = lower[ order ]
+        widths = widths[ order ]
+        counts = counts[ order ]
+        cumulative = np.cumsum( counts )
+        if ( cumulative.size == 0 or cumulative[ -1 ] <= 0 ):
+            return ( 0.0, 0.0 )
+
+        def value( q ):
+            rank = cumulative[ -1 ] * min( 100.0, max( 0.0, q ) ) / 100.0
+            i = min( np.searchsorted( cumulative, rank ), cumulative.size - 1 )
+            # skip empty bins
+            while ( counts[ i ] == 0 and i + 1 < counts.size ):
+                i += 1
+            frac = ( rank - ( cumulative[ i ] - counts[ i ] ) ) / counts[ i ]
+            return lower[ i ] + min( 1.0, max( 0.0, frac ) ) * widths[ i ]
+        return ( value( low ), value( high ) )
+
+class GridFileWriter:
+    '''A file-like object which writes a grid file sequence (see GridFileSequence.openFile).
+
+    The header is written (and filled in) as for a plain file.  Every other write is a single grid;
+    if there is a codec, the grid is encoded and the offset of every grid is recorded.  When the
+    file is closed, a footer (see readFooter) with the offset table ('OFFS': count + 1 int64
+    offsets; the last is the end of the grids), the tile size of sparse grids ('TILE'), the
+    statistics of the grids ('STAT', see GridStatistics) and any added blocks is written.  A plain
+    file without statistics or added blocks has no footer.'''
+    def __init__( self, fileName, codec=None, headerSize=40, stats=None ):
+        '''Constructor.
+
+        @param      fileName        A string.  The path to the file.
+        @param      codec           An optional instance of GridCodec.  If None, the grids are
+                                    written as they are.
+        @param      headerSize      An int.  The size of the header (in bytes).
+        @param      stats           An optional instance of GridStatistics.  If given, the
+                                    statistics of every written grid are recorded in it.
+        '''
+        self.name = fileName
+        self.file = open( fileName, 'wb' )
+        self.codec = codec
+        self.headerSize = headerSize
+        self.stats = stats
+        self.offsets = []
+        self.end = 0
+        self.blocks = []
+
+    def write( self, data ):
+        '''Writes the header (or part of it) or a single grid.
+
+        @param      data        A binary string.
+        '''
+        if ( self.file.tell() < self.headerSize ):
+            self.file.write( data )
+            self.end = max( self.end, self.file.tell() )
+            return
+        if ( self.stats is not None ):
+            self.stats.add( data )
+        if ( self.codec is None ):
+            self.writeChunk( data )
+        else:
+            self.writeChunk( self.codec.encode( data ) )
+
+    def writeChunk( self, chunk ):
+        '''Appends an encoded grid to the file.
+
+        @param      chunk       A binary string.  The grid (see GridCodec.encode).
+        '''
+        if ( self.file.tell() != self.end ):
+            self.file.seek( self.end )
+        self.offsets.append( self.end )
+        self.file.write( chunk )
+        self.end += len( chunk )
+
+    def addBlock( self, tag, data ):
+        '''Adds a block to the footer.
+
+        @param      tag         A string.  Four characters which identify the block.
+        @param      data        A binary string.  The block's data.
+        '''
+        assert( len( tag ) == 4 )
+        self.blocks.append( ( tag, data ) )
+
+    def seek( self, offset, whence=0 ):
+        self.file.seek( offset, whence )
+
+    def tell( self ):
+        return self.file.tell()
+
+    def flush( self ):
+        self.file.flush()
+
+    def close( self ):
+        '''Writes the footer (if any) and closes the file.
+
+        The grids of a plain file may also have been written to it directly (see
+        ProcessRasterization); the footer follows the last byte in the file.'''
+        blocks = []
+        if ( self.codec is not None ):
+            blocks.append( ( 'OFFS', np.array( self.offsets + [ self.end ], dtype=np.int64 ).tostring() ) )
+            if ( self.codec.isSparse() ):
+                blocks.append( ( 'TILE', struct.pack( 'i', self.codec.tileSize ) ) )
+        else:
+            self.file.seek( 0, os.SEEK_END )
+            self.end = max( self.end, self.file.tell() )
+        if ( self.stats is not None ):
+            blocks.append( ( 'STAT', self.stats.toBlock() ) )
+        blocks.extend( self.blocks )
+        if ( blocks ):
+            self.file.seek( self.end )
+            for tag, data in blocks:
+                self.file.write( struct.pack( '4si', tag, len( data ) ) )
+                self.file.write( data )
+            self.file.write( struct.pack( 'q4s', self.end, FOOTER_MAGIC ) )
+        self.file.close()
+
 
 
 class GridFileSequenceReader:
@@ -84,11 +461,29 @@ class GridFileSequenceReader:
         if ( maxGrids == -1 ):
             self.maxGrids = self.count
         else:
-            self.maxGrids = min( self.count, self.maxGrids )
+            self.maxGrids = min( self.count, maxGrids )
         assert( gridStep > 0 )
+        self.gridStep = gridStep
         self.gridStride = self.gridSize() * ( gridStep - 1 )
         self.currGrid = DataGrid( self.corner, self.size, ( self.w, self.h ), arrayType=self.arrayType, leaveEmpty=True )
         self.activeThreadCount = 0
+        # encoded grids are located with the offset table in the footer
+        self.codec = None
+        self.offsets = None
+        if ( self.flags ):
+            self.readEncoding()
+        else:
+            self.footer = readFooter( self.file, self.headerSize + self.count * self.w * self.h * self.arrayType.itemsize )
+            self.file.seek( self.headerSize )
+        # the statistics of the grids (if the file has them)
+        self.stats = None
+        if ( 'STAT' in self.footer ):
+            stats = GridStatistics.fromBlock( self.footer[ 'STAT' ], self.arrayType )
+            if ( len( stats ) == self.count ):
+                self.stats = stats
+        # the cells produced by next (see setWindow)
+        self.windowKey = None
+        self.windowDomain = None
 
     def __str__( self ):
         return self.summary()
@@ -117,11 +512,84 @@ class GridFileSequenceReader:
         size = struct.unpack( 'ff', self.file.read( 8 ) )
         self.size = Vector2( size[0], size[1] )
         self.w, self.h = struct.unpack( 'ii', self.file.read( 8 ) )
-        self.arrayType = np.dtype( NP_TYPES[ struct.unpack( 'i', self.file.read( 4 ) )[0] ] )
+        typeId = struct.unpack( 'i', self.file.read( 4 ) )[0]
+        self.arrayType = np.dtype( NP_TYPES[ typeId & TYPE_MASK ] )
+        self.flags = typeId & ~TYPE_MASK
         self.count = struct.unpack( 'i', self.file.read( 4 ) )[0]
         self.range = struct.unpack( self.arrayType.char * 2, self.file.read( self.arrayType.itemsize * 2 ) )
         self.headerSize = 32 + self.arrayType.itemsize * 2
 
+    def readEncoding( self ):
+        '''Reads the offset table (and tile size) of an encoded grid file sequence.
+
+        @raises     IOError if the file has no offset table.
+        '''
+        self.footer = footer = readFooter( self.file )
+        if ( not 'OFFS' in footer ):
+            raise IOError, "The encoded grid file sequence has no offset table"
+        self.offsets = np.fromstring( footer[ 'OFFS' ], np.int64 )
+        tileSize = TILE_SIZE
+        if ( 'TILE' in footer ):
+            tileSize = struct.unpack( 'i', footer[ 'TILE' ] )[0]
+        self.codec = GridCodec( ( self.w, self.h ), self.arrayType, self.flags, tileSize )
+
+    def isEncoded( self ):
+        '''Reports if the grids are encoded (see GridCodec).'''
+        return self.codec is not None
+
+    def decodeGrid( self, index ):
+        '''Reads and decodes a grid of an encoded grid file sequence.
+
+        @param      index       An int.  The index of the grid in the file.
+        @returns    A numpy array of shape ( self.w, self.h ).
+        @raises     StopIteration if the grid doesn't exist.
+        '''
+        if ( index < 0 or index + 1 >= self.offsets.size ):
+            raise StopIteration
+        self.file.seek( self.offsets[ index ] )
+        return self.codec.decode( self.file.read( self.offsets[ index + 1 ] - self.offsets[ index ] ) )
+
+    def hasStats( self ):
+        '''Reports if the file holds the statistics of its grids (see GridStatistics).'''
+        return self.stats is not None
+
+    def gridStats( self ):
+        '''Returns the statistics of the grids iterated across (accounting for startGrid, maxGrids
+        and gridStep).  No grid is read.
+
+        @returns    An instance of GridStatistics.
+        @raises     ValueError if the file has no statistics.
+        '''
+        if ( self.stats is None ):
+            raise ValueError, "The grid file sequence %s has no statistics" % ( self.file.name )
+        return self.stats.select( self.startGrid, self.maxGrids, self.gridStep )
+
+    def percentileRange( self, low=1.0, high=99.0, ignoreZero=False ):
+        '''Estimates percentiles of the values of the grids (see GridStatistics.percentileRange).
+        For example, a colour range which isn't dominated by a few extreme values.
+
+        @raises     ValueError if the file has no statistics.
+        '''
+        return self.gridStats().percentileRange( low, high, ignoreZero )
+
+    def mass( self ):
+        '''Reports the sum of the values of each grid (e.g., the number of agents in a density
+        field over time).
+
+        @returns    A numpy array of floats.
+        @raises     ValueError if the file has no statistics.
+        '''
+        return self.gridStats().mass()
+
+    def emptyGrids( self ):
+        '''Reports the grids in which every value is zero.
+
+        @returns    A numpy array of ints.  The indices of the empty grids (with respect to the
+                    stride and starting grid).
+        @raises     ValueError if the file has no statistics.
+        '''
+        return self.gridStats().emptyGrids()
+
     def gridSize( self ):
         '''Returns the size of a grid in bytes.capitalize
 
@@ -156,9 +624,10 @@ class GridFileSequenceReader:
             self.currGridID = self.maxGrids
         else:
             self.currGridID = gridID - 1
-            size = self.gridSize()
-            byteAddr = self.headerSize + ( self.startGrid + gridID ) * size + ( gridID * self.gridStride )
-            self.file.seek( byteAddr, 0 )
+            if ( self.codec is None ):
+                size = self.gridSize()
+                byteAddr = self.headerSize + ( self.startGrid + gridID ) * size + ( gridID * self.gridStride )
+                self.file.seek( byteAddr, 0 )
             
     def next( self ):
         '''Returns the next frame in the sequence.
@@ -170,24 +639,176 @@ class GridFileSequenceReader:
         '''
         if ( self.currGridID + 1 >= self.maxGrids ):
             raise StopIteration
-        dataCount = self.w * self.h
-        try:
-            self.currGrid.cells[:, :] = np.reshape( np.fromstring( self.file.read( self.gridSize() ), self.arrayType, dataCount), ( self.w, self.h ) )
-        except ValueError:
-            raise StopIteration
+        if ( self.codec is None ):
+            dataCount = self.w * self.h
+            try:
+                cells = np.reshape( np.fromstring( self.file.read( self.gridSize() ), self.arrayType, dataCount), ( self.w, self.h ) )
+            except ValueError:
+                raise StopIteration
+            if ( self.gridStride ):
+                self.file.seek( self.gridStride, 1 )    # 1 = seek offset from current position
+        else:
+            cells = self.decodeGrid( self.startGrid + ( self.currGridID + 1 ) * self.gridStep )
         self.currGridID += 1
-        if ( self.gridStride ):
-            self.file.seek( self.gridStride, 1 )    # 1 = seek offset from current position
+        if ( self.windowKey is None ):
+            self.currGrid.cells[:, :] = cells
+        else:
+            self.currGrid.cells[:, :] = cells[ self.windowKey ]
         return self.currGrid, self.currGridID
 
+    def cellWindow( self, minCorner, size ):
+        '''Computes the cells which cover a rectangular region of the domain.
+
+        @param      minCorner       A 2-tuple-like object of floats.  The minimum corner of the region.
+        @param      size            A 2-tuple-like object of floats.  The width and height of the region.
+        @returns    A 2-tuple: ( key, domain ).  The key is a 2-tuple of slices: the columns and rows of
+                    the cells.  The domain is an instance of AbstractGrid spanning those cells.
+        @raises     ValueError if the region doesn't overlap the domain.
+        '''
+        cellSize = self.getCellSize()
+        x0 = max( 0, int( np.floor( ( minCorner[0] - self.corner[0] ) / cellSize[0] ) ) )
+        y0 = max( 0, int( np.floor( ( minCorner[1] - self.corner[1] ) / cellSize[1] ) ) )
+        x1 = min( self.w, int( np.ceil( ( minCorner[0] + size[0] - self.corner[0] ) / cellSize[0] ) ) )
+        y1 = min( self.h, int( np.ceil( ( minCorner[1] + size[1] - self.corner[1] ) / cellSize[1] ) ) )
+        if ( x0 >= x1 or y0 >= y1 ):
+            raise ValueError, "The region doesn't overlap the domain of the grids"
+        corner = Vector2( self.corner[0] + x0 * cellSize[0], self.corner[1] + y0 * cellSize[1] )
+        extent = Vector2( ( x1 - x0 ) * cellSize[0], ( y1 - y0 ) * cellSize[1] )
+        return ( slice( x0, x1 ), slice( y0, y1 ) ), AbstractGrid( corner, extent, ( x1 - x0, y1 - y0 ) )
+
+    def setWindow( self, minCorner=None, size=None ):
+        '''Restricts the grids produced by next (and the domain) to the cells which cover a
+        rectangular region (see cellWindow).  Without arguments, the whole domain is restored.'''
+        if ( minCorner is None ):
+            self.windowKey = None
+            self.windowDomain = None
+            self.currGrid = DataGrid( self.corner, self.size, ( self.w, self.h ), arrayType=self.arrayType, leaveEmpty=True )
+        else:
+            self.windowKey, self.windowDomain = self.cellWindow( minCorner, size )
+            self.currGrid = self.windowDomain.getDataGrid( arrayType=self.arrayType, leaveEmpty=True )
+
     @property
     def domain( self ):
-        '''Returns the domain of the GridFileSequence data.
+        '''Returns the domain of the grids produced by next (see setWindow).
 
         @returns        An instance of Grid.AbstractGrid.
         '''
-        return AbstractGrid( self.corner, self.size, ( self.w, self.h ) )
-    
+        if ( self.windowDomain is None ):
+            return AbstractGrid( self.corner, self.size, ( self.w, self.h ) )
+        return self.windowDomain.copy()
+
+    def close( self ):
+        '''Closes the file'''
+        self.file.close()
+
+class MMGridFileSequenceReader( GridFileSequenceReader ):
+    '''A reader which memory-maps the grid file sequence.  The grids are exposed as a single
+    read-only (count, w, h) array (see grids); indexing and slicing it (in time and space) views
+    the file without copying or reading the remaining grids.
+
+    The i-th grid of the reader is the file grid: startGrid + i * gridStep.  Any trailing, partial
+    grid at the end of the file is ignored.  The grids produced by next are views of the file; they
+    must not be modified.  Encoded files (see GridCodec) can't be mapped.'''
+    def __init__( self, fileName, startGrid=0, maxGrids=-1, gridStep=1 ):
+        GridFileSequenceReader.__init__( self, fileName, startGrid, maxGrids, gridStep )
+        if ( self.isEncoded() ):
+            self.file.close()
+            raise ValueError, "The grids of %s are encoded; they can't be memory mapped" % ( fileName )
+        self.fileName = fileName
+        gridBytes = self.w * self.h * self.arrayType.itemsize
+        count = min( self.count, max( 0, ( os.path.getsize( fileName ) - self.headerSize ) // gridBytes ) )
+        shape = ( count, self.w, self.h )
+        if ( count == 0 ):
+            # numpy can't map an empty region
+            self._map = np.empty( shape, dtype=self.arrayType )
+        else:
+            self._map = np.memmap( fileName, dtype=self.arrayType, mode='r', offset=self.headerSize, shape=shape )
+        self.grids = self._map[ startGrid::gridStep ]
+        if ( maxGrids >= 0 ):
+            self.grids = self.grids[ :maxGrids ]
+        self.maxGrids = self.grids.shape[0]
+
+    def __len__( self ):
+        return self.maxGrids
+
+    def __getitem__( self, key ):
+        '''Provides random access to the grids.
+
+        @param      key     Any numpy index of the (count, w, h) array of grids.  For example,
+                            an int, a slice of grids, or a tuple which also slices the cells.
+        @returns    A read-only numpy array.  A view of the file, if the key is made of ints and slices.
+        '''
+        return self.grids[ key ]
+
+    def gridRange( self, start, stop, step=1 ):
+        '''Returns the grids in the range [start, stop) as a single strided array.
+
+        @param      start       An int.  The index of the first grid.
+        @param      stop        An int.  One past the index of the last grid.
+        @param      step        An int.  The stride between grids.  Defaults to 1.
+        @returns    A read-only numpy array of shape (K, w, h) which views the mapped file.
+        '''
+        return self.grids[ start:stop:step ]
+
+    def window( self, minCorner, size ):
+        '''Returns the cells of every grid which cover a rectangular region of the domain (see cellWindow).
+
+        @returns    A 2-tuple: ( grids, domain ).  The grids are a read-only (count, w', h') view of
+                    the mapped file.  The domain is an instance of AbstractGrid spanning the cells.
+        '''
+        key, domain = self.cellWindow( minCorner, size )
+        return self.grids[ :, key[0], key[1] ], domain
+
+    def setNext( self, gridID ):
+        '''Sets the reader so that the grid returned on the next invocaiton of "next" is gridID.
+
+        @param      gridID      An int.  The index of the next next grid.  Should be in the range [0, self.maxGrids ].
+        '''
+        assert( gridID >= 0 and gridID <= self.maxGrids )
+        self.currGridID = gridID - 1
+
+    def next( self ):
+        '''Returns the next grid in the sequence (see GridFileSequenceReader.next).  Its cells are a
+        read-only view of the mapped file.'''
+        if ( self.currGridID + 1 >= self.maxGrids ):
+            raise StopIteration
+        self.currGridID += 1
+        self.currGrid.cells = self.grids[ self.currGridID ]
+        if ( self.windowKey is not None ):
+            self.currGrid.cells = self.currGrid.cells[ self.windowKey ]
+        return self.currGrid, self.currGridID
+
+    def close( self ):
+        '''Closes the file and releases the mapping'''
+        self.grids = None
+        self._map = None
+        self.currGrid.cells = None
+        GridFileSequenceReader.close( self )
+
+def openGridFileSequence( fileName, startGrid=0, maxGrids=-1, gridStep=1 ):
+    '''Opens the fastest reader for a grid file sequence: plain files are memory mapped (see
+    MMGridFileSequenceReader) and encoded files are decoded as they are read.
+
+    @param      fileName        A string.  The path to a grid file sequence file.
+    @returns    An instance of GridFileSequenceReader (see GridFileSequenceReader for the arguments).
+    '''
+    reader = GridFileSequenceReader( fileName, startGrid, maxGrids, gridStep )
+    if ( reader.isEncoded() ):
+        return reader
+    reader.close()
+    return MMGridFileSequenceReader( fileName, startGrid, maxGrids, gridStep )
+
+def _requirePairedFrames( frameSet ):
+    '''Confirms that each row of a frame set's frames is the same agent in every frame.  The
+    routines which pair the rows of two frames (e.g., GridFileSequence.computeSpeeds) require it.
+
+    @param      frameSet        A frame set.
+    @raises     ValueError if the agents of the frames change from frame to frame (e.g., a
+                FilteredFrameSet with a bounding box only produces the agents inside it).
+    '''
+    if ( getattr( frameSet, 'bbox', None ) is not None ):
+        raise ValueError, "The agents of a bounding-box filtered frame set change from frame to frame; their frames can't be paired"
+
 class GridFileSequence:
     """Creates a grid sequence from a frame file and streams the resulting grids to
        a file"""
@@ -199,15 +820,36 @@ class GridFileSequence:
     NORM_CONTRIB_SPEED = 4 # distribute speed with normalized gaussian and then divide by contribution matrix
     LAPLACE_SPEED = 5   # compute the magnitude of the laplacian of the velocity field
     
-    def __init__( self, outFileName, obstacles=None, arrayType=np.float32 ):
+    def __init__( self, outFileName, obstacles=None, arrayType=np.float32, workers=1,
+                  compress=False, tileSize=None, stats=False ):
         """Constructs a GridFileSequence which caches to the indicated file name.
 
         @param  outFileName     The name of the file to which the gridFileSequence writes.
         @param  obstacles       An optional obstacleHandler object.  Used for obstacle-dependent
                                 computations.
         @param  arrayType       A numpy datatype.  Defaults to np.float32.
+        @param  workers         An int.  The number of processes which rasterize the frames (see
+                                ProcessRasterization.py), e.g., ProcessRasterization.PROCESS_COUNT.
+                                With a single worker (the default), or with frame sets the
+                                processes can't read, the frames are rasterized by threads.  The
+                                worker processes import the caller's main module, so a script
+                                which uses several must guard its work with
+                                if __name__ == '__main__'.
+        @param  compress        A boolean.  If True, every grid is compressed (see GridCodec).
+        @param  tileSize        An optional int.  If given, grids are stored as sparse tiles of this
+                                size (in cells); tiles whose values are all zero are skipped.
+        @param  stats           A boolean.  If True, the statistics of every grid are stored in
+                                the file (see GridStatistics).
         """
         self.outFileName = outFileName
+        self.workers = workers
+        self.encoding = 0
+        if ( compress ):
+            self.encoding |= GFS_COMPRESSED
+        if ( tileSize is not None ):
+            self.encoding |= GFS_SPARSE
+        self.tileSize = tileSize
+        self.stats = stats
         # TODO: This currently doesn't have any effect.  Eventually, it can be used for object-aware convolution
         #   or other operations.
         self.obstacles = obstacles
@@ -229,12 +871,29 @@ class GridFileSequence:
         s = struct.pack( 'ff', corner[0], corner[1] )           # minimum corner of grid
         s += struct.pack( 'ff', size[0], size[1] )              # domain width and height
         s += struct.pack( 'ii', resolution[0], resolution[1] )  # size of grid (cell counts)
-        s += struct.pack( 'i', TYPE_ID_MAP[ self.arrayType.type ] )  # the data type of the grids
+        s += struct.pack( 'i', TYPE_ID_MAP[ self.arrayType.type ] | self.encoding )  # the data type (and encoding) of the grids
         s += struct.pack( 'i', 0 )                              # grid count
         s += struct.pack( 2 * self.arrayType.char, 0, 0 )       # range of grid values
         self.headerSize = len( s )
         return s
 
+    def openFile( self, fileName, resolution ):
+        '''Opens a file to write a grid file sequence with this sequence's encoding.
+
+        @param      fileName    A string.  The path to the file.
+        @param      resolution  A 2-tuple of ints.  Indicates the (width, height) of the grids.
+        @returns    An instance of GridFileWriter.  The header and then the grids (one per call)
+                    are written to it, just as to a file.  It records the grids' statistics if
+                    this sequence stores them.
+        '''
+        codec = None
+        if ( self.encoding ):
+            codec = GridCodec( resolution, self.arrayType, self.encoding, self.tileSize or TILE_SIZE )
+        stats = None
+        if ( self.stats ):
+            stats = GridStatistics( resolution[0] * resolution[1], self.arrayType )
+        return GridFileWriter( fileName, codec, 32 + 2 * self.arrayType.itemsize, stats )
+
     def fillInHeader( self, file, gridCount, minVal, maxVal ):
         '''Writes the final grid count, minimum and maximum values to the file's header section.
 
@@ -264,7 +923,9 @@ class GridFileSequence:
     def computeDifference( self, reader1, reader2 ):
         '''Computes the per-frame difference between two grid file sequences and saves it.
 
-        @param      reader1     An instance of a GridFileSequenceReader.
+        @param      reader1     An instance of a GridFileSequenceReader.  If both readers are
+                                memory-mapped (see MMGridFileSequenceReader), whole blocks of grids
+                                are compared at once.
         @param      reader2     An instance of a GridFileSequenceReader.
 
         @returns    A string.  The name of the file created.        
@@ -276,12 +937,23 @@ class GridFileSequence:
         assert( reader1.size == reader2.size )
 
         fileName = self.outFileName + '.error'
-        outFile = open( fileName, 'wb' )
+        outFile = self.openFile( fileName, ( reader1.w, reader1.h ) )
         outFile.write( self.header( reader1.corner, reader1.size, ( reader1.w, reader1.h ) ) )
+        maxError = 0
+        if ( isinstance( reader1, MMGridFileSequenceReader ) and isinstance( reader2, MMGridFileSequenceReader ) ):
+            # the grids are compared a block at a time, directly from the mapped files
+            for start in xrange( 0, len( reader1 ), DIFF_BLOCK ):
+                err = np.abs( reader1.gridRange( start, start + DIFF_BLOCK ) - reader2.gridRange( start, start + DIFF_BLOCK ) )
+                for grid in err:
+                    outFile.write( grid.tostring() )
+                if ( err.size ):
+                    maxError = max( maxError, err.max() )
+            self.fillInHeader( outFile, reader1.count, 0.0, maxError )
+            outFile.close()
+            return fileName
+
         reader1.setNext( 0 )
         reader2.setNext( 0 )
-
-        maxError = 0
         while( True ):
             try:
                 frame1, frameID1 = reader1.next()
@@ -325,7 +997,9 @@ class GridFileSequence:
         
         frameSet.setNext( 0 )
         argsFunc = lambda: ( signal.copyEmpty(), frameSet, gridDomain, kernel )
-        return self._threadWork( 'density', threadConvolve, argsFunc, gridDomain, overwrite )
+        return self._rasterWork( 'density', threadConvolve, argsFunc,
+                                 convolveFrame, frameSet, ( signal.copyEmpty(), gridDomain, kernel ),
+                                 gridDomain, overwrite )
 
     def computeVoronoiDensity( self, gridDomain, frameSet, obstacles=None, limit=-1 ):
         '''Computes a density field for the frameset based on the voronoi diagram.
@@ -346,7 +1020,9 @@ class GridFileSequence:
         print "\t", frameSet
         frameSet.setNext( 0 )
         argsFunc = lambda: ( frameSet, gridDomain, obstacles, limit )
-        return self._threadWork( 'voronoiDensity', threadVoronoiDensity, argsFunc, gridDomain )
+        return self._rasterWork( 'voronoiDensity', threadVoronoiDensity, argsFunc,
+                                 voronoiDensityFrame, frameSet, ( gridDomain, obstacles, limit ),
+                                 gridDomain )
         
 
     def computeVoronoi( self, gridDomain, frameSet, obstacles=None, limit=-1 ):
@@ -368,19 +1044,58 @@ class GridFileSequence:
         print "\t", frameSet
         frameSet.setNext( 0 )
         argsFunc = lambda: ( frameSet, gridDomain, obstacles, limit )
-        return self._threadWork( 'voronoi', threadVoronoi, argsFunc, gridDomain )
+        return self._rasterWork( 'voronoi', threadVoronoi, argsFunc,
+                                 voronoiFrame, frameSet, ( gridDomain, obstacles, limit ),
+                                 gridDomain )
         
 
+    def _rasterWork( self, fileExt, threadFunc, threadArgs, frameFunc, frameSet, frameArgs, gridDomain, overwrite=True ):
+        '''Rasterizes every frame of a frame set with worker processes, if possible; otherwise,
+        with threads (see _threadWork).
+
+        @param      fileExt         A string.  The extension applied to the GFS file.
+        @param      threadFunc      A function object.  The function executed by each thread
+                                    (see _threadWork).
+        @param      threadArgs      A callable object.  It produces the additional arguments for
+                                    each thread (see _threadWork).
+        @param      frameFunc       A function object.  A module-level function which rasterizes
+                                    the next frame of the frame set (see
+                                    ProcessRasterization.rasterizeFrames).
+        @param      frameSet        The frame set to rasterize.
+        @param      frameArgs       A tuple.  The additional arguments of frameFunc.
+        @param      gridDomain      An instance of AbstractGrid, specifying the grid domain
+                                    and resolution over which the field is calculated.
+        @param      overwrite       A boolean.  Indicates whether files should be created even if they
+                                    already exist or computed from scratch.  If True, they are always created,
+                                    if False, pre-existing files are used.
+        @returns    A string.  The name of the output file.
+        '''
+        if ( self.workers <= 1 or not ProcessRasterization.canProcess( frameSet, frameArgs ) ):
+            return self._threadWork( fileExt, threadFunc, threadArgs, gridDomain, overwrite )
+        fileName = '%s.%s' % ( self.outFileName, fileExt )
+        if ( not overwrite ):
+            if ( os.path.exists( fileName ) ):
+                return fileName
+        outFile = self.openFile( fileName, gridDomain.resolution )
+        outFile.write( self.header( gridDomain.minCorner, gridDomain.size, gridDomain.resolution ) )
+        log = RasterReport()
+        startTime = time.time()
+        ProcessRasterization.rasterizeFrames( outFile, self.headerSize, frameFunc, frameArgs, frameSet, log, self.workers )
+        print "\t\t%d grids rasterized by %d processes in %f s" % ( log.count, self.workers, time.time() - startTime )
+
+        # add the additional information about grid count and maximum values
+        self.fillInHeader( outFile, log.count, log.minVal, log.maxVal )
+        outFile.close()
+        return fileName
+
     def _threadWork( self, fileExt, function, funcArgs, gridDomain, overwrite=True ):
         '''Sets up threaded work.
 
         @param      fileExt         A string.  The extension applied to the GFS file.
         @param      function        A function object.  The function executed by each thread.
-                                    For the function to work its first four args must be:
-                                       1. a RasterReport instance
-                                       2. a threading lock for the buffer
-                                       3. A buffer instance ( simply a python list)
-                                       4. A threading lock for the data
+                                    For the function to work its first two args must be:
+                                       1. an OrderedGridWriter instance (see GridOutput.py)
+                                       2. A threading lock for the data
         @param      funcArgs        A callable object.  Its return value is a tuple of values.
                                     These values are the additional arguments for the work function.
                                     They will be concatenated to the arguments liated above.
@@ -398,43 +1113,27 @@ class GridFileSequence:
         if ( not overwrite ):
             if ( os.path.exists( fileName ) ):
                 return fileName
-        outFile = open( fileName, 'wb' )
+        outFile = self.openFile( fileName, gridDomain.resolution )
         outFile.write( self.header( gridDomain.minCorner, gridDomain.size, gridDomain.resolution ) )
-        buffer = []
-        bufferLock = threading.Lock()
-        saveThread = threading.Thread( target=threadOutput, args=(outFile, buffer, bufferLock, time.clock(), self ) )
-        self.activeThreadCount = THREAD_COUNT
-        saveThread.start()
+        writer = OrderedGridWriter( outFile, GridPool( gridDomain, THREAD_COUNT + WRITE_WINDOW ) )
+        writer.start()
 
         # prepare rasterization        
         frameLock = threading.Lock()
         rasterThreads = []
-        rasterLogs = []
         for i in range( THREAD_COUNT ):
-            rasterLogs.append( RasterReport() )
             # This has self.obstacles
-            threadArgs = ( rasterLogs[-1], bufferLock, buffer, frameLock )
+            threadArgs = ( writer, frameLock )
             rasterThreads.append( threading.Thread( target=function, args=threadArgs + funcArgs() )  )
 
         for i in range( THREAD_COUNT ):
             rasterThreads[i].start()
         for i in range( THREAD_COUNT ):
             rasterThreads[i].join()
-            self.activeThreadCount -= 1
-        saveThread.join()
-
-        gridCount = 0
-        maxVal = 0.0
-        minVal = 1e8
-        for log in rasterLogs:
-            gridCount += log.count
-            if ( log.maxVal > maxVal ):
-                maxVal = log.maxVal
-            if ( log.minVal < minVal ):
-                minVal = log.minVal
+        log = writer.close()
 
         # add the additional information about grid count and maximum values
-        self.fillInHeader( outFile, gridCount, minVal, maxVal )
+        self.fillInHeader( outFile, log.count, log.minVal, log.maxVal )
         outFile.close()
         return fileName
         
@@ -454,7 +1153,9 @@ class GridFileSequence:
         signal = Signals.PedestrianSignal( gridDomain.rectDomain )
         pedData.setNext( 0 )
         argsFunc = lambda: ( signal.copyEmpty(), pedData, gridDomain, kernel )
-        return self._threadWork( 'splat', threadConvolve, argsFunc, gridDomain, overwrite )
+        return self._rasterWork( 'splat', threadConvolve, argsFunc,
+                                 convolveFrame, pedData, ( signal.copyEmpty(), gridDomain, kernel ),
+                                 gridDomain, overwrite )
         
     def computeSpeeds( self, gridDomain, pedData, timeStep, excludeStates=(), speedType=BLIT_SPEED, timeWindow=1, overwrite=True, maxSpeed=3.0 ):
         '''Splats the agents onto a grid based on position and the given radius
@@ -473,7 +1174,9 @@ class GridFileSequence:
                                     can grow arbitrarily high.  The computed speed is clamped to maxSpeed.
         @returns    A 2-tuple (StatRecord instance, string).  The former is a record of the per-frame statistics
                     of the speed.  The latter is the name of the output file.
+        @raises     ValueError if the agents of pedData change from frame to frame.
         '''
+        _requirePairedFrames( pedData )
         print "Computing speeds:"
         print "\tminCorner:  ", gridDomain.minCorner
         print "\tsize:       ", gridDomain.size
@@ -482,7 +1185,7 @@ class GridFileSequence:
         print "\ttime window:", timeWindow
 
         fileName = self.outFileName + '.speed'
-        outFile = open( fileName, 'wb' )
+        outFile = self.openFile( fileName, gridDomain.resolution )
         outFile.write( self.header( gridDomain.minCorner, gridDomain.size, gridDomain.resolution ) )
         
         maxVal = -1e6
@@ -584,6 +1287,7 @@ class GridFileSequence:
     def computeProgress( self, minCorner, size, resolution, maxRad, frameSet, timeStep, excludeStates, timeWindow=1 ):
         """Computes the progress from one frame to the next - progress is measured in the fraction
         of the circle traversed from the initial position"""
+        _requirePairedFrames( frameSet )
         print "Computing progress:"
         print "\tminCorner:  ", minCorner
         print "\tsize:       ", size
@@ -591,7 +1295,7 @@ class GridFileSequence:
         print "\tmaxRad:     ", maxRad
         print "\ttime step:  ", timeStep
         print "\ttime window:", timeWindow
-        outFile = open( self.outFileName + '.progress', 'wb' )
+        outFile = self.openFile( self.outFileName + '.progress', resolution )
         outFile.write( self.header( minCorner, size, resolution ) )
         maxVal = -1e6
         minVal = 1e6
@@ -631,6 +1335,7 @@ class GridFileSequence:
 
     def computeAngularSpeeds( self, minCorner, size, resolution, maxRad, frameSet, timeStep, excludeStates, speedType=BLIT_SPEED, timeWindow=1 ):
         """Computes the displacements from one cell to the next"""
+        _requirePairedFrames( frameSet )
         print "Computing angular speed:"
         print "\tminCorner:  ", minCorner
         print "\tsize:       ", size
@@ -638,7 +1343,7 @@ class GridFileSequence:
         print "\tmaxRad:     ", maxRad
         print "\ttime step:  ", timeStep
         print "\ttime window:", timeWindow
-        outFile = open( self.outFileName + '.omega', 'wb' )
+        outFile = self.openFile( self.outFileName + '.omega', resolution )
         outFile.write( self.header( minCorner, size, resolution ) )
         maxVal = -1e6
         minVal = 1e6
@@ -770,6 +1475,7 @@ class GridFileSequence:
         '''Given an ordered set of polygons, computes the average speed for all agents in each polygon
         per time step.'''
         # NOTE: This only really applies to the tawaf.
+        _requirePairedFrames( frameSet )
         print "Computing regional speed:"
         print "\ttime step:       ", timeStep
         print "Number of polygons:", len(polygons)
@@ -0,0 +1,212 @@
+# The output stage of threaded rasterization (see GridFileSequence._threadWork).
+#
+#   Raster threads finish their grids in an arbitrary order, but a grid file sequence stores them
+#   in frame order.  An OrderedGridWriter is a reorder buffer: finished grids are kept in a heap
+#   keyed on their frame index and the writer thread is woken (through a condition variable) as
+#   soon as the next grid in order arrives.  The buffer spans a bounded window of frames; a raster
+#   thread which finishes a grid beyond the window waits for the writer to catch up.  Written grids
+#   are returned to a GridPool and reused by the raster threads.
+
+import heapq
+import threading
+import time
+import numpy as np
+
+# The default number of frames spanned by the reorder buffer
+WRITE_WINDOW = 32
+# The number of grids between progress reports
+PROGRESS_INTERVAL = 256
+
+class RasterReport:
+    """Simple class to return the results of rasterization"""
+    def __init__( self ):
+        self.maxVal = 0.0
+        self.minVal = 1e6
+        self.count = 0
+
+    def incCount( self ):
+        self.count += 1
+
+    def setMax( self, val ):
+        if ( val > self.maxVal ):
+            self.maxVal = val
+
+    def setMin( self, val ):
+        if ( val < self.minVal ):
+            self.minVal = val
+
+    def addGrid( self, minVal, maxVal ):
+        '''Records a grid.
+
+        @param      minVal      The smallest value in the grid.
+        @param      maxVal      The largest value in the grid.
+        '''
+        self.count += 1
+        self.setMin( minVal )
+        self.setMax( maxVal )
+
+class GridPool:
+    """A bounded pool of DataGrids which share a domain.  Grids are recycled instead of
+    allocating a new grid for every frame."""
+    def __init__( self, gridDomain, capacity, arrayType=np.float32 ):
+        '''Constructor.
+
+        @param      gridDomain      An instance of AbstractGrid.  The domain of the grids.
+        @param      capacity        An int.  The maximum number of idle grids kept by the pool.
+        @param      arrayType       A numpy datatype.  The type of the grid values.
+        '''
+        self.gridDomain = gridDomain
+        self.capacity = capacity
+        self.arrayType = arrayType
+        self.idle = []
+        self.lock = threading.Lock()
+        # statistics
+        self.allocated = 0
+        self.reused = 0
+
+    def getGrid( self, initVal=0.0, leaveEmpty=False ):
+        '''Provides a grid (see AbstractGrid.getDataGrid).
+
+        @param      initVal         The initial value of the grid's cells.
+        @param      leaveEmpty      A boolean.  If True, the cells are not initialized.
+        @returns    An instance of DataGrid.
+        '''
+        with self.lock:
+            grid = self.idle.pop() if self.idle else None
+            if ( grid is None ):
+                self.allocated += 1
+            else:
+                self.reused += 1
+        if ( grid is None ):
+            return self.gridDomain.getDataGrid( initVal, self.arrayType, leaveEmpty )
+        grid.initVal = initVal
+        if ( not leaveEmpty ):
+            grid.cells.fill( initVal )
+        return grid
+
+    def recycle( self, grid ):
+        '''Returns a grid which is no longer used to the pool.
+
+        @param      grid        An instance of DataGrid.  Grids which don't match the pool's
+                                resolution and type are discarded.
+        '''
+        if ( grid.cells.shape != tuple( self.gridDomain.resolution ) or grid.cells.dtype != self.arrayType ):
+            return
+        with self.lock:
+            if ( len( self.idle ) < self.capacity ):
+                self.idle.append( grid )
+
+class OrderedGridWriter:
+    """Writes grids, produced by several threads in any order, to a file in frame order.
+
+    The frame indices of the grids must be consecutive, starting at zero."""
+    def __init__( self, outFile, pool=None, window=WRITE_WINDOW ):
+        '''Constructor.
+
+        @param      outFile     An open, binary file.  The grids are written at its current position.
+        @param      pool        An optional instance of GridPool.  Written grids are recycled to it.
+        @param      window      An int.  The number of frames spanned by the reorder buffer.  The
+                                grid of frame i is only accepted once the grids of the frames
+                                before i - window have been written.
+        '''
+        self.outFile = outFile
+        self.pool = pool
+        self.window = max( 1, window )
+        self.heap = []
+        self.condition = threading.Condition()
+        self.nextIndex = 0
+        self.closed = False
+        self.log = RasterReport()
+        self.thread = None
+        self.startTime = 0.0
+        # statistics
+        self.maxDepth = 0
+        self.writerStall = 0.0
+        self.producerStall = 0.0
+        self.producerWaits = 0
+
+    def start( self ):
+        '''Starts the writer thread.'''
+        self.startTime = time.time()
+        self.thread = threading.Thread( target=self._run, name='grid writer' )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put( self, index, grid ):
+        '''Submits a finished grid.  Blocks while the grid lies beyond the reorder window.
+
+        @param      index       An int.  The index of the grid's frame.
+        @param      grid        An instance of DataGrid.  It must not be modified afterwards.
+        '''
+        minVal = grid.minVal()
+        maxVal = grid.maxVal()
+        with self.condition:
+            if ( index >= self.nextIndex + self.window ):
+                self.producerWaits += 1
+                start = time.time()
+                while ( index >= self.nextIndex + self.window and not self.closed ):
+                    self.condition.wait()
+                self.producerStall += time.time() - start
+            heapq.heappush( self.heap, ( index, grid ) )
+            self.log.addGrid( minVal, maxVal )
+            if ( len( self.heap ) > self.maxDepth ):
+                self.maxDepth = len( self.heap )
+            if ( index == self.nextIndex ):
+                self.condition.notify_all()
+
+    def depth( self ):
+        '''Reports the number of grids waiting to be written.'''
+        with self.condition:
+            return len( self.heap )
+
+    def _ready( self ):
+        '''Reports if the next grid in order has arrived (the condition must be held).'''
+        return self.heap and self.heap[0][0] == self.nextIndex
+
+    def _run( self ):
+        '''The work of the writer thread.'''
+        while ( True ):
+            with self.condition:
+                if ( not self._ready() ):
+                    start = time.time()
+                    while ( not ( self._ready() or self.closed ) ):
+                        self.condition.wait()
+                    self.writerStall += time.time() - start
+                    if ( not self._ready() ):
+                        break
+                index, grid = heapq.heappop( self.heap )
+                self.nextIndex += 1
+                # space has been freed in the window
+                self.condition.notify_all()
+            if ( index % PROGRESS_INTERVAL == 0 ):
+                print "\t\tWriting buffer %d at time %f s" % ( index, time.time() - self.startTime )
+            self.outFile.write( grid.binaryString() )
+            if ( self.pool is not None ):
+                self.pool.recycle( grid )
+
+    def close( self ):
+        '''Writes the remaining grids and stops the writer thread.  It must only be called once
+        every grid has been submitted.
+
+        @returns    An instance of RasterReport.  The count and range of the grids.
+        @raises     ValueError if a grid is missing from the sequence.
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        print "\t\tLast grid %d at time %f s" % ( self.nextIndex - 1, time.time() - self.startTime )
+        print "\t\t%s" % ( self.stats() )
+        if ( self.heap ):
+            raise ValueError, "The grid of frame %d is missing; %d grids weren't written" % ( self.nextIndex, len( self.heap ) )
+        return self.log
+
+    def stats( self ):
+        '''Summarizes the reorder buffer's behavior.
+
+        @returns    A string.
+        '''
+        s = 'Max queue depth: %d, writer stalled %.3f s, producers stalled %.3f s (%d waits)' % ( self.maxDepth, self.writerStall, self.producerStall, self.producerWaits )
+        if ( self.pool is not None ):
+            s += ', grids allocated: %d, reused: %d' % ( self.pool.allocated, self.pool.reused )
+        return s
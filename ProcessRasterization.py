@@ -0,0 +1,192 @@
+# This file contains the multi-process rasterization backend used by GridFileSequence.
+#
+#   The rasterization kernels are numpy mixed with a great deal of python; threads serialize on
+#   the interpreter lock.  Here, the frames are divided into contiguous work items and rasterized
+#   by a pool of worker processes:
+#       - No frame data is sent to the workers.  Each worker re-opens the frame set as a
+#         memory-mapped reader (see readerSpec) and reads the frames of its work items itself.
+#       - Every grid of a sequence has the same size, so its place in the file follows from its
+#         frame index.  Workers write their grids directly to their offsets in the output file;
+#         the order of the sequence is preserved without the grids ever passing through the
+#         parent process.
+#       - Workers only report the number of grids and their range of values (and, if the file
+#         stores them, the statistics of the grids; see GridFileSequence.GridStatistics).
+#   Encoded grids (see GridFileSequence.GridCodec) have no fixed size.  Then, the workers encode
+#   their grids and return them; the parent appends them to the file in order.
+
+import cPickle
+import multiprocessing
+from trajectory.scbData import NPFrameSet, MMFrameSet
+from trajectory.scbFilter import FilteredFrameSet
+from trajectory.scbShards import ShardedFrameSet
+from trajectory.frameCache import CachedFrameSet
+
+# One worker process per processor (GridFileSequence only uses workers when asked to)
+PROCESS_COUNT = multiprocessing.cpu_count()
+# The number of work items each worker gets (on average); more items balance the load better
+ITEMS_PER_WORKER = 4
+# The maximum number of frames in a single work item
+MAX_ITEM_FRAMES = 64
+
+def readerSpec( frameSet ):
+    '''Describes how a worker process can open its own reader of a frame set.
+
+    @param      frameSet        A frame set.
+    @returns    A 2-tuple: ( class, args ) such that class( *args ) opens a memory-mapped frame set
+                with the same frames (and frame indices) as the given one.  None if the frame set
+                can't be re-opened (e.g., it isn't backed by scb files).
+    '''
+    if ( isinstance( frameSet, CachedFrameSet ) ):
+        return readerSpec( frameSet.frameSet )
+    if ( isinstance( frameSet, ShardedFrameSet ) ):
+        return ShardedFrameSet, ( frameSet.fileNames, )
+    if ( isinstance( frameSet, FilteredFrameSet ) ):
+        return FilteredFrameSet, ( frameSet.fileName, frameSet.startFrame, frameSet.maxFrames, frameSet.frameStep,
+                                   frameSet.agentIds, None, frameSet.bbox, frameSet.columns )
+    if ( isinstance( frameSet, NPFrameSet ) ):
+        return MMFrameSet, ( frameSet.file.name, frameSet.startFrame, frameSet.maxFrames, frameSet.readAgtCount,
+                             frameSet.frameStep, frameSet.readAgtStride )
+    return None
+
+def canProcess( frameSet, funcArgs ):
+    '''Reports if a rasterization can be performed by worker processes.
+
+    @param      frameSet        The frame set to rasterize.
+    @param      funcArgs        A tuple.  The arguments of the rasterization function.
+    @returns    A boolean.  True if the frame set can be re-opened by the workers and the
+                arguments can be sent to them.
+    '''
+    if ( readerSpec( frameSet ) is None ):
+        return False
+    try:
+        cPickle.dumps( funcArgs, cPickle.HIGHEST_PROTOCOL )
+    except ( cPickle.PicklingError, TypeError, AttributeError ):
+        return False
+    return True
+
+# The state of a worker process: the job it works on and its reader
+_job = None
+
+def _initWorker( spec, rasterFunc, funcArgs, fileName, headerSize, codec, stats ):
+    '''Initializes a worker process with the job (see rasterizeFrames).'''
+    global _job
+    factory, args = spec
+    _job = ( factory( *args ), rasterFunc, funcArgs, fileName, headerSize, codec, stats )
+
+def _rasterizeItem( item ):
+    '''Rasterizes a work item: a contiguous range of frames.
+
+    @param      item        A 2-tuple of ints: ( start, count ).  The first frame and the number of
+                            frames.
+    @returns    A 6-tuple: ( start, count, minVal, maxVal, chunks, records ).  The first frame
+                of the item, the number of grids, the smallest and largest values in them (None if
+                there are no grids), if the grids are encoded, the list of encoded grids (otherwise,
+                the grids were written to the file and it is None) and, if statistics are
+                recorded, the list of the grids' statistics (otherwise None).
+    '''
+    frameSet, rasterFunc, funcArgs, fileName, headerSize, codec, stats = _job
+    start, count = item
+    frameSet.setNext( start )
+    written = 0
+    minVal = maxVal = None
+    chunks = None
+    records = None
+    if ( stats is not None ):
+        records = []
+    if ( codec is None ):
+        outFile = open( fileName, 'r+b' )
+    else:
+        chunks = []
+    try:
+        for i in xrange( count ):
+            try:
+                index, grid = rasterFunc( frameSet, *funcArgs )
+            except StopIteration:
+                break
+            data = grid.binaryString()
+            if ( codec is None ):
+                outFile.seek( headerSize + index * len( data ) )
+                outFile.write( data )
+            else:
+                chunks.append( codec.encode( data ) )
+            if ( stats is not None ):
+                records.append( stats.record( data ) )
+            written += 1
+            gridMin = grid.minVal()
+            gridMax = grid.maxVal()
+            if ( minVal is None or gridMin < minVal ):
+                minVal = gridMin
+            if ( maxVal is None or gridMax > maxVal ):
+                maxVal = gridMax
+    finally:
+        if ( codec is None ):
+            outFile.close()
+    return start, written, minVal, maxVal, chunks, records
+
+def workItems( frameCount, workers ):
+    '''Divides the frames into contiguous work items.
+
+    @param      frameCount      An int.  The number of frames.
+    @param      workers         An int.  The number of worker processes.
+    @returns    A list of 2-tuples of ints: ( start, count ).
+    '''
+    size = max( 1, min( MAX_ITEM_FRAMES, frameCount // ( workers * ITEMS_PER_WORKER ) ) )
+    return [ ( start, min( size, frameCount - start ) ) for start in xrange( 0, frameCount, size ) ]
+
+def rasterizeFrames( outFile, headerSize, rasterFunc, funcArgs, frameSet, log, workers=PROCESS_COUNT ):
+    '''Rasterizes every frame of a frame set with a pool of worker processes, writing the grids
+    to an open grid file sequence.
+
+    @param      outFile         An open, binary file.  The grid file sequence.  Its header must
+                                have been written; the grids are written after it, in frame order.
+                                If it has a codec (see GridFileSequence.GridFileWriter), the
+                                encoded grids are appended with its writeChunk method.  If it
+                                records statistics, those of the grids are added to it in order.
+    @param      headerSize      An int.  The size of the header (in bytes).
+    @param      rasterFunc      A function defined at module level.  rasterFunc( frameSet, *funcArgs )
+                                reads the next frame from the frame set and returns the 2-tuple
+                                ( index, grid ): the frame's index and its DataGrid.  It raises
+                                StopIteration when there are no more frames.
+    @param      funcArgs        A tuple.  The additional arguments of the function.  Each worker
+                                gets its own copy.
+    @param      frameSet        The frame set to rasterize (see readerSpec).
+    @param      log             An instance of RasterReport.  The grid count and the range of the
+                                grids' values are added to it.
+    @param      workers         An int.  The number of worker processes.
+    @raises     ValueError if the frame set can't be re-opened by the workers.
+    '''
+    spec = readerSpec( frameSet )
+    if ( spec is None ):
+        raise ValueError, "The frame set can't be read by worker processes"
+    outFile.flush()
+    codec = getattr( outFile, 'codec', None )
+    stats = getattr( outFile, 'stats', None )
+    items = workItems( frameSet.totalFrames(), workers )
+    pool = multiprocessing.Pool( workers, _initWorker, ( spec, rasterFunc, funcArgs, outFile.name, headerSize, codec, stats ) )
+    try:
+        if ( codec is None ):
+            results = pool.imap_unordered( _rasterizeItem, items )
+        else:
+            # the encoded grids are appended in order
+            results = pool.imap( _rasterizeItem, items )
+        itemRecords = []
+        for start, count, minVal, maxVal, chunks, records in results:
+            if ( chunks is not None ):
+                for chunk in chunks:
+                    outFile.writeChunk( chunk )
+            if ( records is not None ):
+                itemRecords.append( ( start, records ) )
+            log.count += count
+            if ( count ):
+                log.setMin( minVal )
+                log.setMax( maxVal )
+        pool.close()
+        if ( stats is not None ):
+            itemRecords.sort( key=lambda x: x[0] )
+            for start, records in itemRecords:
+                stats.extend( records )
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -6,6 +6,8 @@ from fieldTools import *
 import numpy as np
 from OpenGL.GL import *
 import trajectory.scbData as scbData
+from trajectory.dataLoader import loadSCB
+from trajectory.frameCache import CachedFrameSet
 from primitives import Vector2
 from obstacles import GLPoly
 import paths
@@ -234,7 +236,9 @@ class SCBContext( PGContext ):
         
     def loadSCBData( self, fileName ):
         if ( fileName ):
-            self.scbData = scbData.NPFrameSet( fileName )
+            if ( isinstance( self.scbData, CachedFrameSet ) ):
+                self.scbData.stopPrefetch()
+            self.scbData = CachedFrameSet( loadSCB( fileName ) )
             self.currFrame, self.currFrameID = self.scbData.next()
             self.classes = self.scbData.getClasses()
             self.is3D = self.scbData.is3D
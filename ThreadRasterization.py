@@ -8,18 +8,6 @@ import threading
 
 V_RAD = 1.0 # radius to compute constraint Voronoi
 
-class BufferGrid:
-    """Entry into a buffer for a grid"""
-    def __init__( self, id, grid ):
-        self.id = id
-        self.grid = grid
-
-    def __eq__( self, id ):
-        return self.id == id
-
-    def __str__( self ):
-        return "BufferGrid %d, %f" % ( self.id, self.grid.maxVal() )
-
 # The function that does the rasterization work
 
 DEBUG = False
@@ -44,16 +32,13 @@ def threadPrint( msg ):
 #   Then this could be a single function, with a single argument that is responsible for
 #   knowin what the work is.
 
-def threadConvolve( log, bufferLock, buffer, frameLock,     # thread info
+def threadConvolve( writer, frameLock,                      # thread info
                     signal, frameSet,                       # the input signal
                     gridDomain, kernel ):                   # the convolution domain and convolution kernel
     '''Function for performing simple convolution across a sequence of pedestrian data.
     
-    @param      log             An instance of RasterReport (see GridFileSequence.py).
-                                Each thread gets its own copy.
-    @param      bufferLock      A threading.Lock for accessing the buffer.
-    @param      buffer          The buffer for storing the finished convolution.  Shared
-                                across all threads.
+    @param      writer          An instance of OrderedGridWriter (see GridOutput.py).  The
+                                finished grids are submitted to it.  Shared across all threads.
     @param      frameLock       A threading.Lock for accessing the pedestrian data.
     @param      signal          An instance of the signal.  Each thread has a unique signal instance.
     @param      frameSet        An instance of signal data.  In each iteration, the signal's
@@ -77,22 +62,15 @@ def threadConvolve( log, bufferLock, buffer, frameLock,     # thread info
         finally:            
             frameLock.release()
               
-        g = gridDomain.getDataGrid( initVal=iValue, leaveEmpty=not needInit )
+        g = writer.pool.getGrid( initVal=iValue, leaveEmpty=not needInit )
         threadPrint('Grid %d- %s' % ( signal.index, hex( id( g ) ) ) )
         kernel.convolve( signal, g )
-
-        # update log
-        log.setMax( g.maxVal() )
-        log.setMin( g.minVal() )
-        log.incCount()
         threadPrint( "\tAfter convolve: min/max/mean values: %f, %f, %f" % ( g.minVal(), g.maxVal(), g.cells.mean() ) )
         # put into buffer
-        bufferLock.acquire()
-        buffer.append( BufferGrid( signal.index, g ) )
-        bufferLock.release()
+        writer.put( signal.index, g )
 
 
-def threadVoronoiDensity( log, bufferLock, buffer, frameLock,  # thread management
+def threadVoronoiDensity( writer, frameLock,  # thread management
                           frameSet,            # the iterable set of sites
                           gridDomain,          # the domain over which the voronoi is computed
                           obstacles=None,      # the optional set of obstacles (for the constraints)
@@ -100,11 +78,8 @@ def threadVoronoiDensity( log, bufferLock, buffer, frameLock,  # thread manageme
                    ):
     '''Function for computing the discrete, constrained voronoi diagram over a given domain.
 
-    @param      log             An instance of RasterReport (see GridFileSequence.py).
-                                Each thread gets its own copy.
-    @param      bufferLock      A threading.Lock for accessing the buffer.
-    @param      buffer          The buffer for storing the finished convolution.  Shared
-                                across all threads.
+    @param      writer          An instance of OrderedGridWriter (see GridOutput.py).  The
+                                finished grids are submitted to it.  Shared across all threads.
     @param      frameLock       A threading.Lock for accessing the pedestrian data.
     @param      frameSet        An instance of site data.  Typically, it is pedestrian data
                                 (real or synthesized).
@@ -134,17 +109,11 @@ def threadVoronoiDensity( log, bufferLock, buffer, frameLock,  # thread manageme
             print "ERROR", e
             raise
 
-        # update log
-        log.setMax( density.maxVal() )
-        log.setMin( density.minVal() )
-        log.incCount()
         threadPrint( "Grid %d has min/max/mean values: %f, %f, %f" % ( index, density.minVal(), density.maxVal(), density.cells.mean() ) )
         # put into buffer
-        bufferLock.acquire()
-        buffer.append( BufferGrid( index, density ) )
-        bufferLock.release()
+        writer.put( index, density )
 
-def threadVoronoi( log, bufferLock, buffer, frameLock,  # thread management
+def threadVoronoi( writer, frameLock,  # thread management
                    frameSet,            # the iterable set of sites
                    gridDomain,          # the domain over which the voronoi is computed
                    obstacles=None,      # the optional set of obstacles (for the constraints)
@@ -152,11 +121,8 @@ def threadVoronoi( log, bufferLock, buffer, frameLock,  # thread management
                    ):
     '''Function for computing the discrete, constrained voronoi diagram over a given domain.
 
-    @param      log             An instance of RasterReport (see GridFileSequence.py).
-                                Each thread gets its own copy.
-    @param      bufferLock      A threading.Lock for accessing the buffer.
-    @param      buffer          The buffer for storing the finished convolution.  Shared
-                                across all threads.
+    @param      writer          An instance of OrderedGridWriter (see GridOutput.py).  The
+                                finished grids are submitted to it.  Shared across all threads.
     @param      frameLock       A threading.Lock for accessing the pedestrian data.
     @param      frameSet        An instance of site data.  Typically, it is pedestrian data
                                 (real or synthesized).
@@ -182,12 +148,58 @@ def threadVoronoi( log, bufferLock, buffer, frameLock,  # thread management
 
         voronoi = computeVoronoi( gridDomain, frame, ids, obstacles, limit )
 
-        # update log
-        log.setMax( voronoi.maxVal() )
-        log.setMin( voronoi.minVal() )
-        log.incCount()
         threadPrint( "Grid %d has min/max/mean values: %f, %f, %f" % ( index, voronoi.minVal(), voronoi.maxVal(), voronoi.cells.mean() ) )
         # put into buffer
-        bufferLock.acquire()
-        buffer.append( BufferGrid( index, voronoi ) )
-        bufferLock.release()
+        writer.put( index, voronoi )
+
+# Functions which rasterize a single frame.  They are the work of the rasterization processes
+#   (see ProcessRasterization.py); each process reads its own frames, so no locks are required.
+
+def convolveFrame( frameSet, signal, gridDomain, kernel ):
+    '''Convolves the next frame of pedestrian data with a kernel (see threadConvolve).
+
+    @param      frameSet        An instance of signal data.  The signal's data is set with it.
+    @param      signal          An instance of the signal.
+    @param      gridDomain      An instance of AbstractGrid defining the extents and resolution
+                                of the convolution domain.
+    @param      kernel          An instance of a BaseKernel (see Kernels.py).
+    @returns    A 2-tuple: ( index, grid ).  The index of the frame and the convolved DataGrid.
+    @raises     StopIteration if there are no more frames.
+    '''
+    needInit, iValue = kernel.needsInitOutput( signal )
+    signal.setData( frameSet )
+    g = gridDomain.getDataGrid( initVal=iValue, leaveEmpty=not needInit )
+    kernel.convolve( signal, g )
+    return signal.index, g
+
+def voronoiDensityFrame( frameSet, gridDomain, obstacles=None, limit=-1 ):
+    '''Computes the voronoi density of the next frame of sites (see threadVoronoiDensity).
+
+    @param      frameSet        An instance of site data.
+    @param      gridDomain      An instance of AbstractGrid defining the extents and resolution
+                                of the domain in which the Voronoi is computed.
+    @param      obstacles       Enables the constrained voronoi computations.  Currently not supported.
+    @param      limit           A float.  The maximum distance a point can be and still lie
+                                in a voronoi region.
+    @returns    A 2-tuple: ( index, grid ).  The index of the frame and the density DataGrid.
+    @raises     StopIteration if there are no more frames.
+    '''
+    frame, index = frameSet.next()
+    ids = frameSet.getFrameIds()
+    return index, computeVoronoiDensity( gridDomain, frame, ids, obstacles, limit )
+
+def voronoiFrame( frameSet, gridDomain, obstacles=None, limit=10.0 ):
+    '''Computes the voronoi diagram of the next frame of sites (see threadVoronoi).
+
+    @param      frameSet        An instance of site data.
+    @param      gridDomain      An instance of AbstractGrid defining the extents and resolution
+                                of the domain in which the Voronoi is computed.
+    @param      obstacles       Enables the constrained voronoi computations.  Currently not supported.
+    @param      limit           A float.  The maximum distance a point can be and still lie
+                                in a voronoi region.
+    @returns    A 2-tuple: ( index, grid ).  The index of the frame and the voronoi DataGrid.
+    @raises     StopIteration if there are no more frames.
+    '''
+    frame, index = frameSet.next()
+    ids = frameSet.getFrameIds()
+    return index, computeVoronoi( gridDomain, frame, ids, obstacles, limit )
@@ -41,8 +41,10 @@ VPREF_X = 4
 VPREF_Y = 5
 VEL_X = 6
 VEL_Y = 7
+# The columns the deviation is computed from; only these are read from the scb file
+DEVIATION_COLUMNS = ( VPREF_X, VPREF_Y, VEL_X, VEL_Y )
 
-from trajectory.scbData import NPFrameSet
+from trajectory.scbFilter import FilteredFrameSet
 import numpy as np
 import os
 import struct
@@ -325,7 +327,8 @@ def deviationFile( config ):
     return os.path.join( outPath, config[ 'tempName' ] + '.deviation' )
 
 def computeDeviation( scbData, config ):
-    '''Given a set of scbData and a config file, computes the deviation and caches it in an intermediate file'''
+    '''Given a set of scbData and a config file, computes the deviation and caches it in an intermediate file.
+    The frames of the scbData consist of the DEVIATION_COLUMNS (see FilteredFrameSet).'''
     file = DeviationWriter( deviationFile( config ) )
         
     scbData.setNext( 0 )    # don't assume I'm at the beginning
@@ -345,10 +348,10 @@ def computeDeviation( scbData, config ):
             frame, idx = scbData.next()
         except StopIteration:
             break
-        displacement[:,:] = frame[:, VEL_X:] - frame[:, VPREF_X:VEL_X]
+        displacement[:,:] = frame[:, 2:4] - frame[:, 0:2]
         # transform deviation
-        prefSpeed[:] = np.sqrt( frame[:,VPREF_X:VPREF_Y] ** 2 + frame[:,VPREF_Y:VEL_X] ** 2 )
-        xform[:,:] = frame[:, VPREF_X:VEL_X ] / prefSpeed
+        prefSpeed[:] = np.sqrt( frame[:,0:1] ** 2 + frame[:,1:2] ** 2 )
+        xform[:,:] = frame[:, 0:2 ] / prefSpeed
         deviation[:,0] = displacement[:,0] * xform[:,0] + displacement[:,1] * xform[:,1]
         deviation[:,1] = displacement[:,1] * xform[:,0] - displacement[:,0] * xform[:,1]
         file.write( deviation )
@@ -368,10 +371,13 @@ def processConsistency( config, scbFile=None ):
     # TODO: ultimately extract start, max frames, max agents, target agent, frame sample from config
     try:
         # TODO: for testing purposes, I've got these arguments to facilitate testing
-##        data = NPFrameSet( scbFile )
-        data = NPFrameSet( scbFile, startFrame=5, maxFrames=15, maxAgents=1 )
+##        data = FilteredFrameSet( scbFile, columns=DEVIATION_COLUMNS )
+        data = FilteredFrameSet( scbFile, startFrame=5, maxFrames=15, agents=[ 0 ], columns=DEVIATION_COLUMNS )
     except IOError:
         raise IOError( 'No such scb file: %s' % ( scbFile ) )
+    except ValueError:
+        # the file doesn't have the velocity columns
+        raise ValueError( 'Can only perform consistency analysis on scb version 2.2: %s' % ( scbFile ) )
     except:
         raise IOError("Unable to read scb file: %s" % ( scbFile ) )
 
@@ -383,6 +389,7 @@ def processConsistency( config, scbFile=None ):
 
     # compute the deviation, producing a .deviation file
     computeDeviation( data, config )
+    print "\t" + data.byteReport()
     # compute the consistency, producing a .consistency file
     computeConsistency( config )
     # compute correlation between density and consistency
@@ -1,136 +1,383 @@
-# add fake rotation to the scb file
-#
-#   Given an scb file, overwrites the current orientation values
-#    based on the inter-frame velocity and some angular acceleration
-#    limit
-
-import numpy as np
-from trajectory.scbData import NPFrameSet, writeNPSCB
-
-DEF_VEL_LIMIT = 10.0 * np.pi / 180.0  # 10 degrees per sec
-
-# The minimum distance an agent has to travel in order to consider a possible angular change
-MOVE_THRESH = 0.001
-
-def addOrientation( data, maxThetaDelta, window=1 ):
-    '''Given an M x N x K array of simulation data,
-    computes orientation of each agent such that between timesteps the agent's orientation cannot change
-    by more than maxThetaDelta. The data is modified IN PLACE.
-
-    @param data: an M x N x K numpy array.  Where there are M agents with N float attributes over K frames.
-    @param maxThetaDelta: a float.  The maximum allowable change in orientation for a single timestep.
-    @param window: an int.  The size of the window used to compute the finite differences.  I.e., the
-            angular change at frame i is the difference of the direction of velocity at i and i + window.
-    '''
-    TWO_PI = 2.0 * np.pi
-    # compute the original orientation based on the first two time steps
-    disp = data[ :, :2, window ] - data[ :, :2, 0 ]
-    dist = np.sqrt( np.sum( disp * disp, axis=1 ) )
-    k = window
-    while ( np.sum( dist < MOVE_THRESH ) > 0 and k < data.shape[2] ):
-        disp = data[ :, :2, k ] - data[ :, :2, 0 ]
-        dist = np.sqrt( np.sum( disp * disp, axis=1 ) )
-        k += 1
-    
-    # make sure I have meaningful displacements for EVERYONE
-    print "Initial direction computed from frame %d" % k 
-        
-    angles = np.arctan2( disp[:,1], disp[:,0] )
-    angles[ angles < 0 ] += TWO_PI
-    data[ :, 2, 0 ] = angles
-    
-    # for each successive frame,
-    #   1. compute the direction of travel from frame i to frame i + 1
-    #   2. Compute delta = the angular difference between orientation at i and the orientation of the direction 
-    #   3. Increment the orientation by max( maxThetaDelta, delta )
-    for f in xrange( 1, data.shape[2] - window ):
-        disp = data[ :, :2, f + window ] - data[ :, :2, f ]
-        dist = np.sqrt( np.sum( disp * disp, axis=1 ) )
-        noMovement = dist < MOVE_THRESH
-        angles = np.arctan2( disp[:,1], disp[:,0] )
-##        angles[ angles < 0 ] += TWO_PI
-        angles[ noMovement ] = data[ noMovement, 2, f - 1 ]
-
-        # detect the ones that have gone around the the periodic        
-        prevAngles = data[ :, 2, f - 1 ]
-        delta = prevAngles - angles
-        absDelta = np.abs( delta )
-        periodic = absDelta > np.pi # all of the items where I've split over the period
-        bigger = delta < 0  # the new angle is bigger than the prev angle
-        smaller = delta > 0  # the new angle is smaller than the prev angle
-        angles[ bigger & periodic ] -= TWO_PI
-        angles[ smaller & periodic ] += TWO_PI
-
-        delta = prevAngles - angles
-        absDelta = np.abs( delta )
-        periodic = absDelta > np.pi # all of the items where I've split over the period
-        assert( np.sum( periodic ) == 0 )
-
-        # now clamp it to maximum velocity        
-        delta = prevAngles - angles
-        absDelta = np.abs( delta )
-        clamp = absDelta > maxThetaDelta
-        delta[ clamp ] *= maxThetaDelta / absDelta[ clamp ]
-        angles = prevAngles - ( delta / window )
-
-        # now clamp it to the range [0, 2pi]
-        tooSmall = angles < 0
-        while ( np.sum( tooSmall ) > 0 ):
-            angles[ tooSmall ] += TWO_PI
-            tooSmall = angles < 0
-        tooBig = angles >= TWO_PI
-        while ( np.sum( tooBig ) > 0 ):
-            angles[ tooBig ] -= TWO_PI
-            tooBig = angles < 0
-        # set orientation
-        data[ :, 2, f ] = angles
-
-    # final orientation is simply copied from second to last
-    for f in range( -window, 0 ):
-        data[ :, 2, f ] = data[ :, 2, f-1 ]
-
-def addSCBOrientation( inFile, outFile, maxVel, window=1 ):
-    '''Given an scb file, adds orientation to it based on max angular velocity, saving the result to
-    the outFile.'''
-    scbData = NPFrameSet( inFile )
-    fullData = scbData.fullData()
-    addOrientation( fullData, scbData.simStepSize * maxVel * window, window)
-
-    scbData.close()
-    writeNPSCB( outFile, fullData, scbData, scbData.version )  
-
-def main():
-    import optparse, sys
-    parser = optparse.OptionParser()
-    parser.set_description( 'Computes orientation for the agents trajectories after the fact.' )
-    parser.add_option( '-i', '--in', help='The name of the file to add orientation to (must be valid scb file)',
-                       action='store', dest='inFileName', default='' )
-    parser.add_option( '-o', '--out', help='The name of the output scb file (defaults to overwriting input file)',
-                       action='store', dest='outFileName', default='' )
-    parser.add_option( '-a', '--angularVelocity', help='The maximum angular velocity allowed (in radians/s).  Default is %g' % DEF_VEL_LIMIT,
-                       action='store', dest='velocity', type='float', default=DEF_VEL_LIMIT )
-    parser.add_option( '-w', '--window', help='Number of frames overwhich to compute angular velocity.  This smooths the signal (default is 1)',
-                       action='store', dest='window', type='int', default=1 )
-
-    options, args = parser.parse_args()
-
-    if ( options.inFileName == '' ):
-        print "You must specify an input name"
-        parser.print_help()
-        sys.exit( 1 )
-
-    outFile = options.outFileName
-    if ( options.outFileName == '' ):
-        outFile = options.inFileName
-
-    print
-    print "Adding orientation to:", options.inFileName
-    print "\tOutput to:", outFile
-    print "\tMaximum angular velocity: %g radians/s (%g deg/s)" % ( options.velocity, options.velocity / np.pi * 180.0 )
-
-    addSCBOrientation( options.inFileName, outFile, options.velocity, options.window )
-
-
-if __name__ == '__main__':
-    main()
+# add fake rotation to the scb file
+#
+#   Given an scb file, overwrites the current orientation values
+#    based on the inter-frame velocity and some angular acceleration
+#    limit
+
+import numpy as np
+from trajectory.scbData import MMFrameSet, SCBWriter, SCBVersion, outputFile
+
+DEF_VEL_LIMIT = 10.0 * np.pi / 180.0  # 10 degrees per sec
+
+# The minimum distance an agent has to travel in order to consider a possible angular change
+MOVE_THRESH = 0.001
+
+# The target number of bytes of frames to process at a time when streaming
+BLOCK_BYTES = 16 * 1024 * 1024
+
+def initialDisplacement( positions, frameCount, window=1 ):
+    '''Finds the displacements used to define the agents' initial orientations.  The displacement
+    of each agent is measured from the first frame to the first frame (no earlier than frame
+    window) at which every agent has moved at least MOVE_THRESH from its initial position.
+
+    @param      positions       A callable.  positions( i ) returns the M x 2 array of agent
+                                positions in frame i.
+    @param      frameCount      An int.  The number of frames.
+    @param      window          An int.  The earliest frame considered.
+    @returns    A 2-tuple: ( disp, k ).  The M x 2 array of displacements and the number of the
+                frame at which the search stopped.
+    '''
+    first = positions( 0 )
+    disp = positions( window ) - first
+    dist = np.sqrt( np.sum( disp * disp, axis=1 ) )
+    k = window
+    while ( np.sum( dist < MOVE_THRESH ) > 0 and k < frameCount ):
+        disp = positions( k ) - first
+        dist = np.sqrt( np.sum( disp * disp, axis=1 ) )
+        k += 1
+    return disp, k
+
+class OrientationIntegrator:
+    '''Computes the orientations of a set of agents one frame at a time.  The orientation at
+    frame i turns towards the direction of travel from frame i to frame i + window, but cannot
+    change by more than maxThetaDelta between frames.  Only the orientations of the previous frame
+    are kept, so arbitrarily long trajectories can be processed with bounded memory.'''
+    def __init__( self, maxThetaDelta, window=1, dtype=np.float32 ):
+        '''Constructor.
+
+        @param      maxThetaDelta   A float.  The maximum allowable change in orientation for a
+                                    single timestep.
+        @param      window          An int.  The number of frames over which the direction of
+                                    travel is computed.
+        @param      dtype           A numpy type.  The type the orientations are stored in.  The
+                                    previous orientations are kept with this precision.
+        '''
+        self.maxThetaDelta = maxThetaDelta
+        self.window = window
+        self.dtype = dtype
+        self.angles = None
+
+    def start( self, disp ):
+        '''Defines the orientations of the first frame.
+
+        @param      disp        An M x 2 numpy array.  The initial displacement of each agent
+                                (see initialDisplacement).
+        @returns    An M-array of orientations in the range [0, 2pi].
+        '''
+        angles = np.arctan2( disp[:,1], disp[:,0] )
+        angles[ angles < 0 ] += 2.0 * np.pi
+        self.angles = np.array( angles, dtype=self.dtype )
+        return self.angles
+
+    def step( self, curr, ahead ):
+        '''Computes the orientations of the next frame.
+
+        @param      curr        An M x 2 numpy array.  The agent positions in this frame.
+        @param      ahead       An M x 2 numpy array.  The agent positions window frames later.
+        @returns    An M-array of orientations in the range [0, 2pi].
+        '''
+        TWO_PI = 2.0 * np.pi
+        #   1. compute the direction of travel from frame i to frame i + window
+        #   2. Compute delta = the angular difference between orientation at i and the orientation of the direction 
+        #   3. Increment the orientation by max( maxThetaDelta, delta )
+        disp = ahead - curr
+        dist = np.sqrt( np.sum( disp * disp, axis=1 ) )
+        noMovement = dist < MOVE_THRESH
+        angles = np.arctan2( disp[:,1], disp[:,0] )
+        prevAngles = self.angles
+        angles[ noMovement ] = prevAngles[ noMovement ]
+
+        # detect the ones that have gone around the the periodic        
+        delta = prevAngles - angles
+        absDelta = np.abs( delta )
+        periodic = absDelta > np.pi # all of the items where I've split over the period
+        bigger = delta < 0  # the new angle is bigger than the prev angle
+        smaller = delta > 0  # the new angle is smaller than the prev angle
+        angles[ bigger & periodic ] -= TWO_PI
+        angles[ smaller & periodic ] += TWO_PI
+
+        delta = prevAngles - angles
+        absDelta = np.abs( delta )
+        periodic = absDelta > np.pi # all of the items where I've split over the period
+        assert( np.sum( periodic ) == 0 )
+
+        # now clamp it to maximum velocity        
+        delta = prevAngles - angles
+        absDelta = np.abs( delta )
+        clamp = absDelta > self.maxThetaDelta
+        delta[ clamp ] *= self.maxThetaDelta / absDelta[ clamp ]
+        angles = prevAngles - ( delta / self.window )
+
+        # now clamp it to the range [0, 2pi]
+        tooSmall = angles < 0
+        while ( np.sum( tooSmall ) > 0 ):
+            angles[ tooSmall ] += TWO_PI
+            tooSmall = angles < 0
+        tooBig = angles >= TWO_PI
+        while ( np.sum( tooBig ) > 0 ):
+            angles[ tooBig ] -= TWO_PI
+            tooBig = angles < 0
+        self.angles = np.array( angles, dtype=self.dtype )
+        return self.angles
+
+def addOrientation( data, maxThetaDelta, window=1 ):
+    '''Given an M x N x K array of simulation data,
+    computes orientation of each agent such that between timesteps the agent's orientation cannot change
+    by more than maxThetaDelta. The data is modified IN PLACE.
+
+    @param data: an M x N x K numpy array.  Where there are M agents with N float attributes over K frames.
+    @param maxThetaDelta: a float.  The maximum allowable change in orientation for a single timestep.
+    @param window: an int.  The size of the window used to compute the finite differences.  I.e., the
+            angular change at frame i is the difference of the direction of velocity at i and i + window.
+    '''
+    # compute the original orientation based on the first two time steps
+    disp, k = initialDisplacement( lambda f: data[ :, :2, f ], data.shape[2], window )
+    
+    # make sure I have meaningful displacements for EVERYONE
+    print "Initial direction computed from frame %d" % k 
+
+    integrator = OrientationIntegrator( maxThetaDelta, window, data.dtype )
+    data[ :, 2, 0 ] = integrator.start( disp )
+    
+    for f in xrange( 1, data.shape[2] - window ):
+        data[ :, 2, f ] = integrator.step( data[ :, :2, f ], data[ :, :2, f + window ] )
+
+    # final orientation is simply copied from second to last
+    for f in range( -window, 0 ):
+        data[ :, 2, f ] = data[ :, 2, f-1 ]
+
+def orientationStream( blocks, maxThetaDelta, window=1, posCols=( 0, 1 ), disp=None, searchFrames=None ):
+    '''Computes the orientations of agents from a stream of consecutive blocks of frames.  Each
+    frame is produced as soon as the frame window frames after it has arrived.
+
+    If the initial displacement isn't given, it is searched for in the first searchFrames frames
+    (see initialDisplacement); the frames are held until it is found.  If some agent hasn't moved
+    by then (or never will, e.g., it stands still or its position is missing), the search stops
+    and the displacements of the last frame searched are used.  The result is the same as
+    addOrientation's if every agent moves within the searched frames; otherwise, give the
+    displacement (e.g., found with a pass over a seekable reader, as orientationBlocks does).
+
+    @param      blocks          An iterable of numpy arrays with shape (k, M, C).  The consecutive
+                                frames of M agents with C floats per agent.
+    @param      maxThetaDelta   A float.  The maximum allowable change in orientation for a single
+                                timestep.
+    @param      window          An int.  The size of the window used to compute the finite
+                                differences (see addOrientation).
+    @param      posCols         A sequence of two ints.  The columns of the agents' positions.
+    @param      disp            An optional M x 2 numpy array.  The initial displacement of each
+                                agent.  If None, it is found from the frames.
+    @param      searchFrames    An optional int.  The number of frames searched for the initial
+                                displacement (at least window + 1).  If None, only the window + 1
+                                frames needed to produce the first frame are searched, so no more
+                                than that are held.
+    @returns    A generator of 2-tuples: ( frames, orientations ), for each run of K frames
+                produced.  The K x M x C input frames and the K x M orientations (float32).
+    @raises     ValueError if there aren't more than window frames.
+    '''
+    posCols = list( posCols )
+    integrator = OrientationIntegrator( maxThetaDelta, window, np.float32 )
+    angles = None
+    if ( disp is not None ):
+        angles = integrator.start( disp )
+    # the frames which haven't been produced; the first is frame done
+    buffer = None
+    done = 0
+    # the next frame to test in the search for the initial displacement and the end of the search
+    searched = window
+    searchEnd = window + 1
+    if ( searchFrames is not None ):
+        searchEnd = max( searchEnd, searchFrames )
+
+    def orientFrames( count ):
+        # computes the orientations of the first count buffered frames
+        positions = buffer[ :, :, posCols ]
+        orient = np.empty( ( count, buffer.shape[1] ), dtype=np.float32 )
+        for i in xrange( count ):
+            # the final window frames copy the last computed orientation
+            if ( done + i > 0 and i + window < positions.shape[0] ):
+                orient[ i ] = integrator.step( positions[ i ], positions[ i + window ] )
+            else:
+                orient[ i ] = integrator.angles
+        return orient
+
+    for block in blocks:
+        if ( block.shape[0] == 0 ):
+            continue
+        if ( buffer is None ):
+            buffer = block
+        else:
+            buffer = np.concatenate( ( buffer, block ) )
+        if ( angles is None ):
+            first = buffer[ 0 ][ :, posCols ]
+            while ( searched < min( buffer.shape[0], searchEnd ) ):
+                delta = buffer[ searched ][ :, posCols ] - first
+                if ( np.all( np.sqrt( np.sum( delta * delta, axis=1 ) ) >= MOVE_THRESH ) ):
+                    angles = integrator.start( delta )
+                    break
+                searched += 1
+            if ( angles is None ):
+                if ( buffer.shape[0] < searchEnd ):
+                    continue
+                # some agent hasn't moved; the displacement of the last frame searched is used
+                angles = integrator.start( buffer[ searchEnd - 1 ][ :, posCols ] - first )
+        # the frames followed by a full window can be finished
+        ready = buffer.shape[0] - window
+        if ( ready > 0 ):
+            yield buffer[ :ready ], orientFrames( ready )
+            buffer = buffer[ ready: ]
+            done += ready
+
+    if ( buffer is None or done + buffer.shape[0] <= window ):
+        frameCount = 0 if buffer is None else buffer.shape[0]
+        raise ValueError, "%d frames are too few for a window of %d frames" % ( frameCount, window )
+    if ( angles is None ):
+        # some agent never moves (within the frames); the displacement of the last frame is used
+        angles = integrator.start( buffer[ -1 ][ :, posCols ] - buffer[ 0 ][ :, posCols ] )
+    yield buffer, orientFrames( buffer.shape[0] )
+
+def orientationBlocks( positionBlock, frameCount, maxThetaDelta, window=1, blockFrames=1024 ):
+    '''Computes the orientations of agents, a block of frames at a time, with the same result as
+    addOrientation.  Only a block of frames (plus window frames of look ahead) is needed at a time.
+
+    @param      positionBlock   A callable.  positionBlock( start, end ) returns the positions of
+                                the agents in the frames [start, end) as a K x M x 2 numpy array.
+    @param      frameCount      An int.  The number of frames.
+    @param      maxThetaDelta   A float.  The maximum allowable change in orientation for a single
+                                timestep.
+    @param      window          An int.  The size of the window used to compute the finite
+                                differences (see addOrientation).
+    @param      blockFrames     An int.  The number of frames in each block.
+    @returns    A generator of 2-tuples: ( positions, orientations ), for each run of K consecutive
+                frames.  The K x M x 2 positions and the K x M orientations (float32).
+    @raises     ValueError if there aren't more than window frames.
+    '''
+    if ( frameCount <= window ):
+        raise ValueError, "%d frames are too few for a window of %d frames" % ( frameCount, window )
+    # the positions can be read out of order, so the frames aren't held while searching
+    disp, k = initialDisplacement( lambda f: positionBlock( f, f + 1 )[ 0 ], frameCount, window )
+    print "Initial direction computed from frame %d" % k
+    blocks = ( positionBlock( start, min( start + blockFrames, frameCount ) )
+               for start in xrange( 0, frameCount, blockFrames ) )
+    for positions, orient in orientationStream( blocks, maxThetaDelta, window, disp=disp ):
+        yield positions, orient
+
+def orientationLayout( inVersion, is3D, version=None ):
+    '''Determines how the frames of scb data are copied into a version with orientation.
+
+    @param      inVersion   A string.  The version of the input data.
+    @param      is3D        A bool.  Whether the input data is 3D.
+    @param      version     A string.  The version of the output data.  It must have a scalar
+                            orientation and be 3D if, and only if, the input is.  Defaults to 2.4
+                            for 3D input and 2.1 otherwise.
+    @returns    A 4-tuple: ( version, posCols, copyCols, orientCol ).  The output version, the
+                columns of the positions, the columns the versions have in common (the
+                positions and, where both versions have them, the state and velocities) and the
+                column of the output orientation.
+    @raises     ValueError if the output version can't hold the input data.
+    '''
+    if ( version is None ):
+        version = SCBVersion.V2_4 if is3D else SCBVersion.V2_1
+    if ( version == SCBVersion.V2_3 or is3D != ( version == SCBVersion.V2_4 ) ):
+        raise ValueError, "Version %s can't hold the orientation of version %s data" % ( version, inVersion )
+    if ( is3D ):
+        posCols = [ 0, 2 ]
+        copyCols = [ 0, 1, 2 ]
+        orientCol = 3
+    else:
+        posCols = [ 0, 1 ]
+        copyCols = [ 0, 1 ]
+        orientCol = 2
+    stateVersions = ( SCBVersion.V2_1, SCBVersion.V2_2 )
+    if ( inVersion in stateVersions and version in stateVersions ):
+        copyCols.append( 3 )
+    if ( inVersion == SCBVersion.V2_2 and version == SCBVersion.V2_2 ):
+        copyCols.extend( range( 4, 8 ) )
+    return version, posCols, copyCols, orientCol
+
+def addSCBOrientation( inFile, outFile, maxVel, window=1, version=None ):
+    '''Given an scb file, adds orientation to it based on max angular velocity, saving the result to
+    the outFile.  The input is memory mapped and the output written a block of frames at a time, so
+    the memory used doesn't depend on the length of the file.
+
+    @param      inFile      A string.  The path to the input scb file.
+    @param      outFile     A string.  The path to the output scb file.  It can be the input file;
+                            the input is only replaced once the output is complete.
+    @param      maxVel      A float.  The maximum angular velocity (in radians/s).
+    @param      window      An int.  The number of frames over which angular velocity is computed.
+    @param      version     A string.  The version of the output file.  It must have a scalar
+                            orientation and be 3D if, and only if, the input is.  Defaults to 2.4
+                            for 3D input and 2.1 otherwise.  The positions are copied and, where
+                            both versions have them, the state and velocities.
+    @returns    An int.  The number of frames written.
+    @raises     ValueError if the output version can't hold the input data.
+    '''
+    scbData = MMFrameSet( inFile )
+    try:
+        version, posCols, copyCols, orientCol = orientationLayout( scbData.version, scbData.is3D, version )
+    except ValueError:
+        scbData.close()
+        raise
+
+    fieldCount = SCBVersion.AGENT_BYTE_SIZE[ version ] / 4
+    agtCount = scbData.agentCount()
+    blockFrames = max( 1, BLOCK_BYTES // max( 1, agtCount * scbData.colCount * 4 ) )
+    positionBlock = lambda start, end: np.array( scbData.frameRange( start, end )[ :, :, posCols ] )
+    # the input is read while the output is written, so overwriting goes through a temporary file
+    with outputFile( inFile, outFile ) as writeName:
+        try:
+            writer = SCBWriter.fromFrameSet( writeName, scbData, version )
+        except:
+            scbData.close()
+            raise
+        try:
+            start = 0
+            for positions, orient in orientationBlocks( positionBlock, scbData.totalFrames(),
+                                                        scbData.simStepSize * maxVel * window, window, blockFrames ):
+                end = start + orient.shape[0]
+                block = np.zeros( ( end - start, agtCount, fieldCount ), dtype=np.float32 )
+                block[ :, :, copyCols ] = scbData.frameRange( start, end )[ :, :, copyCols ]
+                block[ :, :, orientCol ] = orient
+                writer.writeFrames( block )
+                start = end
+        finally:
+            scbData.close()
+            frameCount = writer.close()
+    return frameCount
+
+def main():
+    import optparse, sys
+    parser = optparse.OptionParser()
+    parser.set_description( 'Computes orientation for the agents trajectories after the fact.' )
+    parser.add_option( '-i', '--in', help='The name of the file to add orientation to (must be valid scb file)',
+                       action='store', dest='inFileName', default='' )
+    parser.add_option( '-o', '--out', help='The name of the output scb file (defaults to overwriting input file)',
+                       action='store', dest='outFileName', default='' )
+    parser.add_option( '-a', '--angularVelocity', help='The maximum angular velocity allowed (in radians/s).  Default is %g' % DEF_VEL_LIMIT,
+                       action='store', dest='velocity', type='float', default=DEF_VEL_LIMIT )
+    parser.add_option( '-w', '--window', help='Number of frames overwhich to compute angular velocity.  This smooths the signal (default is 1)',
+                       action='store', dest='window', type='int', default=1 )
+    parser.add_option( '-v', '--version', help='The version of the output scb file.  Defaults to 2.1 (2.4 for 3D data)',
+                       action='store', dest='version', default=None )
+
+    options, args = parser.parse_args()
+
+    if ( options.inFileName == '' ):
+        print "You must specify an input name"
+        parser.print_help()
+        sys.exit( 1 )
+
+    outFile = options.outFileName
+    if ( options.outFileName == '' ):
+        outFile = options.inFileName
+
+    print
+    print "Adding orientation to:", options.inFileName
+    print "\tOutput to:", outFile
+    print "\tMaximum angular velocity: %g radians/s (%g deg/s)" % ( options.velocity, options.velocity / np.pi * 180.0 )
+
+    addSCBOrientation( options.inFileName, outFile, options.velocity, options.window, options.version )
+
+
+if __name__ == '__main__':
+    main()
     
\ No newline at end of file
@@ -1,8 +1,18 @@
 # Measure various quantities in an scb file.close
+#
+#   The metrics are accumulated (see SCBMetrics) from blocks of frames, so files of any length can
+#   be measured with memory proportional to the number of agents.  The frames can be split into
+#   ranges which are measured by separate processes and the partial results merged.
 
+import json
+import multiprocessing
 import trajectory.scbData as scbData
 import numpy as np
-import pylab as plt
+
+# The default number of frames read at a time
+BLOCK_FRAMES = 1024
+# The maximum number of agents with NaN positions described in the report
+REPORTED_NAN_AGENTS = 10
 
 def totalSimTime( rawData, step ):
     '''Compute the total duration of the simuation'''
@@ -69,35 +79,358 @@ def instSpeedExtrema( segLength, stepTime ):
 
     return ( minID, minFrame, minVal ), (maxID, maxFrame, maxVal )    
     
-def printMetrics( frames ):
-    print '\tNumber of agents:', frames.agtCount
+def combineMoments( countA, meanA, m2A, countB, meanB, m2B ):
+    '''Combines the running moments (Welford's count, mean and sum of squared differences) of two
+    disjoint sets of values.  The arguments can be scalars or arrays of equal shape.
 
-    rawData = frames.fullData()
-    badAgents, newData = findNaNPos( rawData )
-    print "\tNumber of agents with nan values in position:", badAgents.size, badAgents
-    print "\tNew number of agents:", newData.shape[0]
-    
+    @returns    A 3-tuple: ( count, mean, m2 ).  The moments of the union of the sets.
+    '''
+    count = countA + countB
+    safe = np.maximum( count, 1 )
+    delta = meanB - meanA
+    mean = meanA + delta * countB / safe
+    m2 = m2A + m2B + delta * delta * countA * countB / safe
+    return count, mean, m2
+
+class SCBMetrics:
+    '''Running measurements of agent trajectories.  The frames are added in order, a block at a
+    time (see update), and the state only depends on the number of agents.  The metrics of
+    consecutive frame ranges, accumulated separately, can be merged (see merge).
+
+    Positions with NaN in them are counted (for each agent, the number of such frames and the
+    first and last of them) and the segments touching them are ignored.  A segment is the
+    displacement of an agent between consecutive frames; it is identified by its first frame.'''
+    def __init__( self, agentCount, startFrame=0 ):
+        '''Constructor.
+
+        @param      agentCount      An int.  The number of agents in each frame.
+        @param      startFrame      An int.  The index of the first frame that will be added.
+        '''
+        N = agentCount
+        self.agentCount = agentCount
+        self.startFrame = startFrame
+        self.frameCount = 0
+        # the positions of the first and last frame, for joining consecutive ranges
+        self.firstPos = None
+        self.lastPos = None
+        self.nanFrames = np.zeros( N, dtype=np.int64 )
+        self.nanFirst = np.full( N, -1, dtype=np.int64 )
+        self.nanLast = np.full( N, -1, dtype=np.int64 )
+        self.posMin = np.full( 2, np.inf )
+        self.posMax = np.full( 2, -np.inf )
+        # per-agent segment lengths: total, moments and extrema
+        self.pathLength = np.zeros( N )
+        self.segCount = np.zeros( N, dtype=np.int64 )
+        self.segMean = np.zeros( N )
+        self.segM2 = np.zeros( N )
+        self.minSeg = np.full( N, np.inf )
+        self.minSegFrame = np.full( N, -1, dtype=np.int64 )
+        self.maxSeg = np.full( N, -np.inf )
+        self.maxSegFrame = np.full( N, -1, dtype=np.int64 )
+
+    def endFrame( self ):
+        '''Reports the index of the frame following the last frame added'''
+        return self.startFrame + self.frameCount
+
+    def update( self, positions ):
+        '''Adds the frames that follow the frames already added.
+
+        @param      positions       A numpy array of floats with shape (K, N, 2).  The positions
+                                    of the N agents in K frames.
+        '''
+        K = positions.shape[0]
+        if ( K == 0 ):
+            return
+        positions = np.asarray( positions, dtype=np.float64 )
+        frames = self.endFrame() + np.arange( K )
+        isNaN = np.any( np.isnan( positions ), axis=2 )
+        hasNaN = np.any( isNaN, axis=0 )
+        self.nanFrames += np.sum( isNaN, axis=0 )
+        first = frames[ np.argmax( isNaN, axis=0 ) ]
+        last = frames[ K - 1 - np.argmax( isNaN[ ::-1 ], axis=0 ) ]
+        newNaN = hasNaN & ( self.nanFirst < 0 )
+        self.nanFirst[ newNaN ] = first[ newNaN ]
+        self.nanLast[ hasNaN ] = last[ hasNaN ]
+        finite = ~isNaN
+        if ( np.any( finite ) ):
+            self.posMin = np.minimum( self.posMin, positions[ finite ].min( axis=0 ) )
+            self.posMax = np.maximum( self.posMax, positions[ finite ].max( axis=0 ) )
+
+        if ( self.lastPos is None ):
+            self.firstPos = positions[ 0 ].copy()
+            self._addSegments( positions, frames[ 0 ] )
+        else:
+            self._addSegments( np.concatenate( ( self.lastPos[ np.newaxis ], positions ) ), frames[ 0 ] - 1 )
+        self.lastPos = positions[ -1 ].copy()
+        self.frameCount += K
+
+    def _addSegments( self, positions, firstSegment ):
+        '''Adds the segments between consecutive frames of positions.
+
+        @param      positions       A numpy array of floats with shape (K, N, 2).
+        @param      firstSegment    An int.  The index of the first of the K - 1 segments.
+        '''
+        if ( positions.shape[0] < 2 ):
+            return
+        deltas = np.diff( positions, axis=0 )
+        lengths = np.sqrt( np.sum( deltas * deltas, axis=2 ) )
+        valid = ~np.isnan( lengths )
+        known = np.where( valid, lengths, 0.0 )
+        count = np.sum( valid, axis=0 )
+        total = np.sum( known, axis=0 )
+        mean = total / np.maximum( count, 1 )
+        spread = np.where( valid, lengths - mean, 0.0 )
+        self._addMoments( count, mean, np.sum( spread * spread, axis=0 ) )
+        self.pathLength += total
+
+        agents = np.arange( self.agentCount )
+        low = np.where( valid, lengths, np.inf )
+        i = np.argmin( low, axis=0 )
+        self._setExtrema( self.minSeg, self.minSegFrame, low[ i, agents ], firstSegment + i, np.less )
+        high = np.where( valid, lengths, -np.inf )
+        i = np.argmax( high, axis=0 )
+        self._setExtrema( self.maxSeg, self.maxSegFrame, high[ i, agents ], firstSegment + i, np.greater )
+
+    def _addMoments( self, count, mean, m2 ):
+        '''Combines the moments of new segments into the moments of each agent'''
+        self.segCount, self.segMean, self.segM2 = combineMoments( self.segCount, self.segMean, self.segM2,
+                                                                  count, mean, m2 )
+
+    @staticmethod
+    def _setExtrema( values, frames, newValues, newFrames, better ):
+        '''Replaces the extreme values (and their frames) which the new values improve on.  On
+        ties, the earlier segment is kept.'''
+        replace = better( newValues, values )
+        values[ replace ] = newValues[ replace ]
+        frames[ replace ] = newFrames[ replace ]
+
+    def merge( self, other ):
+        '''Adds the metrics of the frames immediately following this instance's frames.
+
+        @param      other       An instance of SCBMetrics for the same agents, starting at
+                                this instance's endFrame.
+        @raises     ValueError if the other metrics don't follow these.
+        '''
+        if ( other.agentCount != self.agentCount or
+             ( other.frameCount and self.frameCount and other.startFrame != self.endFrame() ) ):
+            raise ValueError, "Only the metrics of consecutive frames of the same agents can be merged"
+        if ( other.frameCount == 0 ):
+            return
+        if ( self.frameCount == 0 ):
+            self.__dict__.update( other.__dict__ )
+            return
+        self.nanFrames += other.nanFrames
+        newNaN = self.nanFirst < 0
+        self.nanFirst[ newNaN ] = other.nanFirst[ newNaN ]
+        laterNaN = other.nanLast >= 0
+        self.nanLast[ laterNaN ] = other.nanLast[ laterNaN ]
+        self.posMin = np.minimum( self.posMin, other.posMin )
+        self.posMax = np.maximum( self.posMax, other.posMax )
+        # the segment which joins the two ranges
+        self._addSegments( np.array( ( self.lastPos, other.firstPos ) ), other.startFrame - 1 )
+        self._addMoments( other.segCount, other.segMean, other.segM2 )
+        self.pathLength += other.pathLength
+        self._setExtrema( self.minSeg, self.minSegFrame, other.minSeg, other.minSegFrame, np.less )
+        self._setExtrema( self.maxSeg, self.maxSegFrame, other.maxSeg, other.maxSegFrame, np.greater )
+        self.lastPos = other.lastPos
+        self.frameCount += other.frameCount
+
+    def badAgents( self ):
+        '''Returns the indices of the agents with NaN in their positions'''
+        return np.where( self.nanFrames > 0 )[0]
+
+    def summary( self, step ):
+        '''Summarizes the metrics.  Agents with NaN positions are excluded from the trajectory and
+        speed measurements.
+
+        @param      step        A float.  The duration of a frame (in seconds).
+        @returns    A dictionary of the scalar metrics (python types only).  The extrema are
+                    dictionaries with the agent, the value, and, for segments, the frame.
+        '''
+        simTime = self.frameCount * step
+        bad = self.badAgents()
+        good = np.where( self.nanFrames == 0 )[0]
+        result = { 'agentCount':self.agentCount,
+                   'frameCount':self.frameCount,
+                   'startFrame':self.startFrame,
+                   'timeStep':step,
+                   'simulationTime':simTime,
+                   'nanAgents':[ { 'agent':int( a ), 'frames':int( self.nanFrames[ a ] ),
+                                   'first':int( self.nanFirst[ a ] ), 'last':int( self.nanLast[ a ] ) }
+                                 for a in bad ],
+                   }
+        if ( good.size and self.frameCount ):
+            result[ 'bounds' ] = { 'min':self.posMin.tolist(), 'max':self.posMax.tolist() }
+            def extremum( values, index ):
+                a = good[ index( values[ good ] ) ]
+                return { 'agent':int( a ), 'value':float( values[ a ] ) }
+            result[ 'shortestTrajectory' ] = extremum( self.pathLength, np.argmin )
+            result[ 'longestTrajectory' ] = extremum( self.pathLength, np.argmax )
+            if ( simTime > 0 ):
+                avgSpeed = self.pathLength / simTime
+                result[ 'lowestAverageSpeed' ] = extremum( avgSpeed, np.argmin )
+                result[ 'highestAverageSpeed' ] = extremum( avgSpeed, np.argmax )
+            moving = good[ self.segCount[ good ] > 0 ]
+            if ( moving.size ):
+                def segment( values, frames, index ):
+                    a = moving[ index( values[ moving ] ) ]
+                    return { 'agent':int( a ), 'frame':int( frames[ a ] ), 'value':float( values[ a ] / step ) }
+                result[ 'lowestInstantaneousSpeed' ] = segment( self.minSeg, self.minSegFrame, np.argmin )
+                result[ 'highestInstantaneousSpeed' ] = segment( self.maxSeg, self.maxSegFrame, np.argmax )
+                count, mean, m2 = self.segCount[ moving[0] ], self.segMean[ moving[0] ], self.segM2[ moving[0] ]
+                for a in moving[ 1: ]:
+                    count, mean, m2 = combineMoments( count, mean, m2, self.segCount[ a ], self.segMean[ a ], self.segM2[ a ] )
+                result[ 'meanSpeed' ] = float( mean / step )
+                result[ 'speedStdDev' ] = float( np.sqrt( m2 / count ) / step )
+        return result
+
+    def report( self, step ):
+        '''Produces the human-readable report printed by printMetrics.
+
+        @param      step        A float.  The duration of a frame (in seconds).
+        @returns    A list of strings.  The lines of the report.
+        '''
+        s = self.summary( step )
+        bad = self.badAgents()
+        lines = [ '\tNumber of agents: %d' % self.agentCount,
+                  '\tNumber of agents with nan values in position: %d %s' % ( bad.size, bad ) ]
+        for nan in s[ 'nanAgents' ][ :REPORTED_NAN_AGENTS ]:
+            lines.append( '\t\tAgent %(agent)d: %(frames)d frames, from frame %(first)d to %(last)d' % nan )
+        if ( bad.size > REPORTED_NAN_AGENTS ):
+            lines.append( '\t\t...' )
+        lines.append( '\tNew number of agents: %d' % ( self.agentCount - bad.size ) )
+        lines.append( '\tSimulation time step: %.3f' % step )
+        lines.append( '\tTotal simulation time: %.2f seconds' % s[ 'simulationTime' ] )
+        labels = ( ( 'shortestTrajectory', 'Shortest trajectory' ),
+                   ( 'longestTrajectory', 'Longest trajectory' ),
+                   ( 'lowestAverageSpeed', 'Lowest average speed' ),
+                   ( 'highestAverageSpeed', 'Highest average speed' ),
+                   ( 'lowestInstantaneousSpeed', 'Lowest instantanesous speed' ),
+                   ( 'highestInstantaneousSpeed', 'Highest instantaneous speed' ) )
+        for key, label in labels:
+            if ( key in s ):
+                value = s[ key ]
+                if ( 'frame' in value ):
+                    lines.append( '\t%s: %g (agent %d, frame %d)' % ( label, value[ 'value' ], value[ 'agent' ], value[ 'frame' ] ) )
+                else:
+                    lines.append( '\t%s: %g (agent %d)' % ( label, value[ 'value' ], value[ 'agent' ] ) )
+        if ( 'meanSpeed' in s ):
+            lines.append( '\tInstantaneous speed mean: %g, standard deviation: %g' % ( s[ 'meanSpeed' ], s[ 'speedStdDev' ] ) )
+        if ( 'bounds' in s ):
+            lines.append( '\tBounding box: ( %g, %g ) to ( %g, %g )' % tuple( s[ 'bounds' ][ 'min' ] + s[ 'bounds' ][ 'max' ] ) )
+        return lines
+
+    def save( self, fileName, step ):
+        '''Writes the metrics to a file.  A .npz file holds the per-agent arrays as well as the
+        summary; any other file gets the summary as JSON.
+
+        @param      fileName    A string.  The path to the file to write.
+        @param      step        A float.  The duration of a frame (in seconds).
+        '''
+        summary = self.summary( step )
+        if ( fileName.lower().endswith( '.npz' ) ):
+            np.savez( fileName, summary=json.dumps( summary ), pathLength=self.pathLength,
+                      nanFrames=self.nanFrames, nanFirst=self.nanFirst, nanLast=self.nanLast,
+                      segmentCount=self.segCount, meanSpeed=self.segMean / step,
+                      speedVariance=self.segM2 / np.maximum( self.segCount, 1 ) / ( step * step ),
+                      minSpeed=self.minSeg / step, minSpeedFrame=self.minSegFrame,
+                      maxSpeed=self.maxSeg / step, maxSpeedFrame=self.maxSegFrame )
+        else:
+            with open( fileName, 'w' ) as f:
+                json.dump( summary, f, indent=2, sort_keys=True )
+
+def positionColumns( frames ):
+    '''Reports the columns of the agent positions in the frame set's frames'''
+    if ( frames.is3D ):
+        return [ 0, 2 ]
+    return [ 0, 1 ]
+
+def frameSetMetrics( frames, blockFrames=BLOCK_FRAMES, startFrame=0 ):
+    '''Accumulates the metrics of all of the frames of a frame set, a block at a time.
+
+    @param      frames          An instance of NPFrameSet (or any frame set with iterBlocks).
+    @param      blockFrames     An int.  The number of frames read at a time.
+    @param      startFrame      An int.  The index of the frame set's first frame.
+    @returns    An instance of SCBMetrics.
+    '''
+    metrics = SCBMetrics( frames.agentCount(), startFrame )
+    columns = positionColumns( frames )
+    frames.setNext( 0 )
+    for block, indices in frames.iterBlocks( blockFrames ):
+        metrics.update( block[ :, :, columns ] )
+    return metrics
+
+def _rangeMetrics( args ):
+    '''Accumulates the metrics of a range of frames of an scb file (run in a worker process).
+
+    @param      args        A 4-tuple: ( scbName, startFrame, frameCount, blockFrames ).
+    @returns    An instance of SCBMetrics.
+    '''
+    scbName, startFrame, frameCount, blockFrames = args
+    frames = scbData.NPFrameSet( scbName, startFrame=startFrame, maxFrames=frameCount )
+    try:
+        return frameSetMetrics( frames, blockFrames, startFrame )
+    finally:
+        frames.close()
+
+def computeMetrics( scbName, workers=1, blockFrames=BLOCK_FRAMES ):
+    '''Computes the metrics of an scb file.  The frames can be divided into contiguous ranges
+    measured in parallel by worker processes; the partial metrics are merged in order.
+
+    @param      scbName         A string.  The path to the scb file.
+    @param      workers         An int.  The number of worker processes.  If one, the file is
+                                measured in this process.
+    @param      blockFrames     An int.  The number of frames read at a time.
+    @returns    A 2-tuple: ( metrics, frames ).  The instance of SCBMetrics and the (closed)
+                frame set of the file, for its header data.
+    @raises     SCBError if the file isn't a valid scb file.
+    '''
+    frames = scbData.NPFrameSet( scbName )
+    frameCount = frames.totalFrames()
+    frames.close()
+    workers = max( 1, min( workers, frameCount ) )
+    bounds = [ frameCount * i // workers for i in xrange( workers + 1 ) ]
+    ranges = [ ( scbName, bounds[ i ], bounds[ i + 1 ] - bounds[ i ], blockFrames ) for i in xrange( workers ) ]
+    if ( workers == 1 ):
+        parts = [ _rangeMetrics( ranges[0] ) ]
+    else:
+        pool = multiprocessing.Pool( workers )
+        try:
+            parts = pool.map( _rangeMetrics, ranges )
+        finally:
+            pool.close()
+            pool.join()
+    metrics = parts[0]
+    for part in parts[ 1: ]:
+        metrics.merge( part )
+    return metrics, frames
+
+def timeStep( frames ):
+    '''Reports the time step of the frame set, asking the user for one if the file doesn't
+    define it'''
     step = frames.simStepSize
     while ( step < 0 ):
-        ans = raw_input('\tPlease enter simulation time step: ' )
+        ans = raw_input( '\tPlease enter simulation time step: ' )
         try:
             step = float( ans )
         except:
             pass
-    print '\tSimulation time step: %.3f' % step
-    segments = segmentLength( newData )
-    segSpeeds = segmentSpeeds( segments, step )
-    simTime = totalSimTime( rawData, step )
-    print '\tTotal simulation time: %.2f seconds' % simTime
-    ( mID, m ), ( MID, M ) = trajectoryExtrema( segments )
-    print '\tShortest trajectory:', m
-    print '\tLongest trajectory:', M
-    ( mID, m ), ( MID, M ) = avgSpeedExtrema( segments, simTime )
-    print '\tLowest average speed:', m
-    print '\tHighest average speed:', M
-    ( mID, mFrame, m ), ( MID, MFrame, M ) = instSpeedExtrema( segments, step )
-    print '\tLowest instantanesous speed:', m
-    print '\tHighest instantaneous speed:', M
+    return step
+
+def printMetrics( frames, metrics=None ):
+    '''Prints the metrics of a frame set.
+
+    @param      frames      An instance of NPFrameSet.
+    @param      metrics     An optional instance of SCBMetrics for the frame set.  If None, they are
+                            computed by streaming through the frame set.
+    @returns    A 2-tuple: ( metrics, step ).  The metrics and the time step used.
+    '''
+    if ( metrics is None ):
+        metrics = frameSetMetrics( frames )
+    step = timeStep( frames )
+    for line in metrics.report( step ):
+        print line
+    return metrics, step
     
 def main():
     import sys
@@ -108,6 +441,10 @@ def main():
                        action="store", dest="scbName", default='' )
     parser.add_option( "-p", "--plot", help="Index of the agent to plot.  In the range [0, N-1]",
                        action="store", dest="plotID", default=-1, type='int' )
+    parser.add_option( "-j", "--jobs", help="The number of processes over which the frames are divided (default is 1)",
+                       action="store", dest="jobs", default=1, type='int' )
+    parser.add_option( "-o", "--output", help="Name of a file to write the metrics to.  A .npz file gets per-agent arrays; anything else gets a JSON summary",
+                       action="store", dest="output", default='' )
     options, args = parser.parse_args()
 
     if ( options.scbName == '' ):
@@ -119,9 +456,14 @@ def main():
     print
     
     try:
-        frames = scbData.NPFrameSet( options.scbName, maxFrames=10 )
-        printMetrics( frames )
+        metrics, frames = computeMetrics( options.scbName, options.jobs )
+        metrics, step = printMetrics( frames, metrics )
+        if ( options.output ):
+            metrics.save( options.output, step )
+            print "\tMetrics written to:", options.output
         if ( options.plotID != -1 ):
+            import pylab as plt
+            frames = scbData.NPFrameSet( options.scbName )
             rawData = frames.fullData()
             plt.plot( rawData[ options.plotID, 0, :], rawData[ options.plotID, 1, : ], 'b-o' )
             plt.show()
@@ -130,4 +472,4 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
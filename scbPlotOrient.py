@@ -1,5 +1,5 @@
 # This creates plots of agent orientation
-from trajectory import NPFrameSet
+from trajectory import NPFrameSet, agentMajorCache
 import numpy as np
 import pylab as plt
 import sys
@@ -7,7 +7,7 @@ import sys
 class PlotException( Exception ):
     pass
 
-def plotOrientation( fileName, agtID, useDegrees ):
+def plotOrientation( fileName, agtID, useDegrees, useAgentCache=False ):
     '''Creates a plot of the orientation of the specified agent(s).
 
     @param  fileName:   A string.  The path to the scb file to open.
@@ -15,16 +15,27 @@ def plotOrientation( fileName, agtID, useDegrees ):
                         negative plot all agents.
     @param  useDegrees: A boolean.  If true, convert the data from radians to
                         degrees.
+    @param  useAgentCache:  A boolean.  If true, a single agent's trajectory is read
+                        from the agent-major cache of the file (building it if necessary)
+                        instead of loading every frame.
     '''
-    data = NPFrameSet( fileName )
-    fullData = data.fullData()
+    if ( agtID > -1 and useAgentCache ):
+        data = agentMajorCache( fileName )
+        agtCount = data.agentCount()
+    else:
+        data = NPFrameSet( fileName )
+        fullData = data.fullData()
+        agtCount = fullData.shape[0]
     
     if ( agtID > -1 ):
         # single agent
-        if ( agtID >= fullData.shape[0] ):
-            print '\n*** Target agent id (%d) not valid.  Should be in the range [0, %d]\n' % ( agtID, fullData.shape[0] - 1 )
+        if ( agtID >= agtCount ):
+            print '\n*** Target agent id (%d) not valid.  Should be in the range [0, %d]\n' % ( agtID, agtCount - 1 )
             raise PlotException
-        orientation = fullData[ agtID, 2, : ]
+        if ( useAgentCache ):
+            orientation = np.array( data.agentTrajectory( agtID )[ 2, : ] )
+        else:
+            orientation = fullData[ agtID, 2, : ]
         ylabel = "Orientation (radians)"
         ylim = ( (0, 2 * np.pi ) )
         if ( useDegrees ):
@@ -63,6 +74,8 @@ def main():
                        action='store', dest='agtID', type='int', default=-1 )
     parser.add_option( '-d', '--degrees', help='Plot in degrees.  Default is to plot with radians',
                        action='store_true', default=False, dest='degrees' )
+    parser.add_option( '-c', '--agentCache', help='Read a single agent from an agent-major cache of the scb file (created next to it if necessary) instead of loading the full file',
+                       action='store_true', default=False, dest='agentCache' )
 
     options, args = parser.parse_args()
 
@@ -76,7 +89,7 @@ def main():
     print "\tAgent:", options.agtID
 
     try:
-        plotOrientation( options.inFileName, options.agtID, options.degrees )
+        plotOrientation( options.inFileName, options.agtID, options.degrees, options.agentCache )
     except PlotException as e:
         parser.print_help()
         sys.exit(1)
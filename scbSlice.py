@@ -1,59 +1,26 @@
 # this takes an scb file and mutliple scb files by chopping it up into
 # smaller files
 
-import struct
 import sys
 import os
 
 DEFAULT_OUTPUT = 'output.scb'
 import numpy as np
+from trajectory.scbData import SCBFrameIndex
+from trajectory.scbCopy import copySCB
 
-def readHeader( inFile ):
-    '''Reads the header of the scb file and returns the following data:
-        version # (as a number)
-        '''
-    version = float( inFile.read( 4 )[:-1] )
-    print "Version", version
-    agtCount = struct.unpack( 'i', inFile.read( 4 ) )[0]
-    stepSize = 0.0
-    ids = None
-    
-    if ( version == 2.0 ):
-        stepSize = struct.unpack( 'f', inFile.read( 4 ) )[0]
-        idReadSize = agtCount * 4
-        ids = inFile.read( idReadSize )
-    print agtCount
-    print stepSize
-
-    return version, agtCount, stepSize, ids
-
-def writeHeader( file, version, agentCount, timeStep=0.0, ids=None ):
-    '''Writes the scb header to the file'''
-    if ( version == 1 ):
-        file.write( '1.0\x00' )
-        file.write( struct.pack( 'i', agentCount ) )
-    if ( version == 2 ):
-        file.write( '2.0\x00' )
-        file.write( struct.pack( 'i', agentCount ) )
-        file.write( struct.pack( 'f', timeStep ) )
-        file.write( ids )
-        
 def sliceSCB( inFile, outBase, count ):
     '''Reads the input scb file, inFile, and separates it into count,
     roughly equally sized, files.  All files have a name in the format:
     outBase##.scb'''
-    FLOAT_SIZE = 4      # bytes per float
-    AGENT_SIZE = 3      # floats per agent
-    version, agtCount, stepSize, ids = readHeader( inFile )
-    dataPos = inFile.tell()
-    framesize = agtCount * FLOAT_SIZE * AGENT_SIZE
-
-    # pass 1, count the number of frames
-    frameCount = 0
-    data = inFile.read( framesize )
-    while ( data != '' ):
-        frameCount += 1
-        data = inFile.read( framesize )
+    # the frame count comes from the file size; the frames themselves are never scanned
+    index = SCBFrameIndex( inFile.name )
+    print "Version", index.version
+    print index.agtCount
+    print index.simStepSize
+    frameCount = index.frameCount
+    if ( index.isTruncated() ):
+        print "Ignoring %d bytes of truncated data at the end of the file" % ( index.truncatedBytes )
 
     counts = np.zeros( count, dtype=np.int ) + frameCount
     counts /= count
@@ -62,14 +29,12 @@ def sliceSCB( inFile, outBase, count ):
     print "Total frames:", frameCount
     print "Frame counts:", counts
 
-    # pass 2, write out the files
-    inFile.seek( dataPos )
+    # each piece is a single byte range of the input
+    start = 0
     for i in range( count ):
         fName = '{0:s}{1:0{2}d}.scb'.format( outBase, i, padding )
-        f = open( fName, 'wb' )
-        writeHeader( f, version, agtCount, stepSize, ids )
-        f.write( inFile.read( framesize * counts[i] ) )
-        f.close()
+        copySCB( inFile.name, fName, start, counts[i] )
+        start += counts[i]
 
 def usage():
     print "Divide an scb file -- slice it into multiple scb files"
@@ -2,6 +2,7 @@
 
 from PyQt4 import QtCore, QtGui
 from agent_set import AgentSet
+from trajectory.frameCache import CachedFrameSet
 
 class PlayerController( QtGui.QFrame ):
     '''The playback controller for playing back scb data'''
@@ -85,6 +86,8 @@ class PlayerController( QtGui.QFrame ):
 
         last_frame = 0
         if ( frame_set ):
+            # scrubbing and playback read frames through a cache which reads ahead
+            frame_set = CachedFrameSet( frame_set )
             # TODO: Get the agent size from somewhere else.
             last_frame = frame_set.totalFrames() - 1
             self.timeSlider.setMaximum( last_frame )
@@ -124,6 +127,8 @@ class Player( QtCore.QAbstractAnimation ):
         @param      last_frame  The index of the last valid frame.
         @param      agent_set   The agent set to provide the current frame to.
         '''
+        if ( isinstance( self.frame_set, CachedFrameSet ) ):
+            self.frame_set.stopPrefetch()
         self.frame_set = frame_set
         self.agent_set = agent_set
 
@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import fakeRotation as dut
+import scbData
+
+
+class TestSCBOrientation(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = np.zeros((120, 8, 3), dtype=np.float32)
+        self.frames[:, :, :2] = np.cumsum(rng.normal(0, 0.1, (120, 8, 2)), axis=0)
+        # some agents stand still for a while
+        self.frames[:30, :3, :2] = 0.0
+        self.in_name = self.path('in.scb')
+        with scbData.SCBWriter(self.in_name, scbData.SCBVersion.V2_0, 8, 0.25, range(8)) as writer:
+            writer.writeFrames(self.frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def expected(self, window):
+        data = self.frames.transpose(1, 2, 0).copy()
+        dut.addOrientation(data, 0.25 * 0.5 * window, window)
+        return data
+
+    def test_MatchesFullData(self):
+        dut.BLOCK_BYTES, block_bytes = 8 * 12 * 7, dut.BLOCK_BYTES
+        try:
+            for window in (1, 3):
+                out_name = self.path('out.scb')
+                self.assertEqual(dut.addSCBOrientation(self.in_name, out_name, 0.5, window), 120)
+                result = scbData.NPFrameSet(out_name)
+                self.assertEqual(result.version, scbData.SCBVersion.V2_1)
+                self.assertEqual(list(result.ids), range(8))
+                data = result.fullData()
+                result.close()
+                self.assertTrue(np.all(data[:, :3] == self.expected(window)))
+                self.assertTrue(np.all(data[:, 3] == 0.0))
+        finally:
+            dut.BLOCK_BYTES = block_bytes
+
+    def test_Overwrite(self):
+        dut.addSCBOrientation(self.in_name, self.in_name, 0.5, 2, scbData.SCBVersion.V2_0)
+        result = scbData.NPFrameSet(self.in_name)
+        self.assertTrue(np.all(result.fullData() == self.expected(2)))
+        result.close()
+        self.assertFalse(os.path.exists(self.in_name + '.tmp'))
+
+    def test_OverwriteError(self):
+        # A failure part way through leaves the input unchanged and no temporary file behind.
+        with open(self.in_name, 'rb') as f:
+            original = f.read()
+        blocks = dut.orientationBlocks
+        def failing_blocks(*args):
+            for i, block in enumerate(blocks(*args)):
+                if i == 1:
+                    raise IOError('disk full')
+                yield block
+        dut.BLOCK_BYTES, block_bytes = 8 * 12 * 7, dut.BLOCK_BYTES
+        dut.orientationBlocks = failing_blocks
+        try:
+            self.assertRaises(IOError, dut.addSCBOrientation, self.in_name, self.in_name, 0.5)
+        finally:
+            dut.orientationBlocks = blocks
+            dut.BLOCK_BYTES = block_bytes
+        self.assertFalse(os.path.exists(self.in_name + '.tmp'))
+        with open(self.in_name, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+    def test_InvalidVersion(self):
+        for version in (scbData.SCBVersion.V2_3, scbData.SCBVersion.V2_4):
+            self.assertRaises(ValueError, dut.addSCBOrientation, self.in_name, self.path('out.scb'),
+                              0.5, 1, version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,359 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+# Signals must be imported before GridFileSequence (as Crowd does); they import each other
+import Signals
+import GridFileSequence as dut
+from Grid import AbstractGrid
+from primitives import Vector2
+from trajectory.scbData import NPFrameSet, SCBWriter, SCBVersion
+from trajectory.scbFilter import FilteredFrameSet
+
+
+def write_gfs(file_name, grids, corner=(-1.0, 2.0), size=(4.0, 3.0), **kwargs):
+    '''Writes a (count, w, h) array of grids as a grid file sequence.'''
+    gfs = dut.GridFileSequence(file_name, **kwargs)
+    f = gfs.openFile(file_name, grids.shape[1:])
+    f.write(gfs.header(Vector2(*corner), Vector2(*size), grids.shape[1:]))
+    for grid in grids.astype(np.float32):
+        f.write(grid.tostring())
+    gfs.fillInHeader(f, grids.shape[0], grids.min(), grids.max())
+    f.close()
+
+
+def sparse_grids(count=20, w=45, h=37):
+    '''Grids which are zero outside a small, moving region.'''
+    rng = np.random.RandomState(2)
+    grids = np.zeros((count, w, h), dtype=np.float32)
+    for i in range(count):
+        grids[i, i:i + 6, 3:12] = rng.uniform(0, 2, (6, 9))
+    return grids
+
+
+class TestMMGridFileSequenceReader(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.grids = rng.uniform(0, 5, (30, 8, 6)).astype(np.float32)
+        self.name = self.path('a.density')
+        write_gfs(self.name, self.grids)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def read_all(self, reader):
+        reader.setNext(0)
+        return [(grid.cells.copy(), index) for grid, index in reader]
+
+    def test_MatchesReader(self):
+        reader = dut.MMGridFileSequenceReader(self.name)
+        self.assertEqual(reader.grids.shape, (30, 8, 6))
+        self.assertTrue(np.all(reader[:] == self.grids))
+        self.assertEqual(reader.range, dut.GridFileSequenceReader(self.name).range)
+        for args in ((0, -1, 1), (4, 10, 1), (0, 5, 1)):
+            expected = self.read_all(dut.GridFileSequenceReader(self.name, *args))
+            result = self.read_all(dut.MMGridFileSequenceReader(self.name, *args))
+            self.assertEqual(len(result), len(expected))
+            for (cells, index), (exp_cells, exp_index) in zip(result, expected):
+                self.assertEqual(index, exp_index)
+                self.assertTrue(np.all(cells == exp_cells))
+        reader.close()
+
+    def test_RandomAccess(self):
+        reader = dut.MMGridFileSequenceReader(self.name, 3, 8, 3)
+        self.assertEqual(len(reader), 8)
+        self.assertEqual(reader.gridCount(), 8)
+        self.assertTrue(np.all(reader[2] == self.grids[9]))
+        self.assertTrue(np.all(reader.gridRange(1, 7, 2) == self.grids[6:24:6]))
+        view = reader[::2, 1:4, 2:]
+        self.assertTrue(np.all(view == self.grids[3:27:6, 1:4, 2:]))
+        # views of the file; nothing is copied
+        self.assertFalse(view.flags.owndata)
+        self.assertFalse(view.flags.writeable)
+        reader.setNext(5)
+        grid, index = reader.next()
+        self.assertEqual(index, 5)
+        self.assertTrue(np.all(grid.cells == self.grids[18]))
+
+    def test_Window(self):
+        reader = dut.MMGridFileSequenceReader(self.name)
+        # the cells are 0.5 x 0.5, starting at (-1, 2)
+        grids, domain = reader.window((0.2, 2.4), (1.0, 0.6))
+        self.assertTrue(np.all(grids == self.grids[:, 2:5, 0:2]))
+        self.assertEqual(domain.resolution, (3, 2))
+        self.assertAlmostEqual(domain.minCorner[0], 0.0)
+        self.assertAlmostEqual(domain.minCorner[1], 2.0)
+        self.assertRaises(ValueError, reader.window, (10.0, 10.0), (1.0, 1.0))
+        reader.setWindow((0.2, 2.4), (1.0, 0.6))
+        self.assertEqual(reader.domain.resolution, (3, 2))
+        cells = [c for c, i in self.read_all(reader)]
+        self.assertTrue(np.all(np.array(cells) == self.grids[:, 2:5, 0:2]))
+        reader.setWindow()
+        self.assertEqual(reader.domain.resolution, (8, 6))
+
+    def test_Truncated(self):
+        with open(self.name, 'ab') as f:
+            f.write('\0' * 10)
+        self.assertEqual(len(dut.MMGridFileSequenceReader(self.name)), 30)
+        with open(self.name, 'r+b') as f:
+            f.truncate(40 + 10 * 8 * 6 * 4 + 7)
+        self.assertEqual(len(dut.MMGridFileSequenceReader(self.name)), 10)
+
+    def test_Difference(self):
+        other = self.grids[::-1].copy()
+        write_gfs(self.path('b.density'), other)
+        gfs = dut.GridFileSequence(self.path('diff'))
+        name = gfs.computeDifference(dut.GridFileSequenceReader(self.name),
+                                     dut.GridFileSequenceReader(self.path('b.density')))
+        with open(name, 'rb') as f:
+            expected = f.read()
+        name = gfs.computeDifference(dut.MMGridFileSequenceReader(self.name),
+                                     dut.MMGridFileSequenceReader(self.path('b.density')))
+        with open(name, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+        result = dut.MMGridFileSequenceReader(name)
+        self.assertTrue(np.all(result[:] == np.abs(self.grids - other)))
+
+
+class TestEncodedGridFileSequence(unittest.TestCase):
+
+    ENCODINGS = ({'compress': True}, {'tileSize': 8}, {'compress': True, 'tileSize': 16})
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.grids = sparse_grids()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def assertGridsEqual(self, a, b):
+        self.assertTrue(np.array_equal(np.isnan(a), np.isnan(b)))
+        self.assertTrue(np.all(a[~np.isnan(a)] == b[~np.isnan(b)]))
+
+    def read_all(self, reader):
+        reader.setNext(0)
+        return np.array([grid.cells.copy() for grid, index in reader])
+
+    def test_Codec(self):
+        self.grids[3, -1, -1] = np.nan
+        for flags in (dut.GFS_COMPRESSED, dut.GFS_SPARSE, dut.GFS_COMPRESSED | dut.GFS_SPARSE):
+            for tile_size in (1, 7, 16, 64):
+                codec = dut.GridCodec((45, 37), np.float32, flags, tile_size)
+                for grid in self.grids[:5]:
+                    self.assertGridsEqual(codec.decode(codec.encode(grid)), grid)
+                    self.assertGridsEqual(codec.decode(codec.encode(grid.tostring())), grid)
+        codec = dut.GridCodec((45, 37), np.float32, dut.GFS_SPARSE, 8)
+        empty = codec.encode(np.zeros((45, 37), np.float32))
+        # only the tile mask
+        self.assertEqual(len(empty), (6 * 5 + 7) // 8)
+
+    def test_ReadWrite(self):
+        plain = self.path('plain.density')
+        write_gfs(plain, self.grids)
+        for i, kwargs in enumerate(self.ENCODINGS):
+            name = self.path('%d.density' % i)
+            write_gfs(name, self.grids, **kwargs)
+            self.assertTrue(os.path.getsize(name) < os.path.getsize(plain) / 4)
+            reader = dut.GridFileSequenceReader(name)
+            self.assertTrue(reader.isEncoded())
+            self.assertEqual(reader.arrayType, np.float32)
+            self.assertEqual(reader.count, 20)
+            self.assertEqual((reader.w, reader.h), (45, 37))
+            self.assertEqual(reader.range, dut.GridFileSequenceReader(plain).range)
+            self.assertGridsEqual(self.read_all(reader), self.grids)
+            # random access
+            reader.setNext(13)
+            grid, index = reader.next()
+            self.assertEqual(index, 13)
+            self.assertGridsEqual(grid.cells, self.grids[13])
+            self.assertGridsEqual(reader.decodeGrid(7), self.grids[7])
+            self.assertGridsEqual(self.read_all(dut.GridFileSequenceReader(name, 2, 6, 3)), self.grids[2:20:3])
+            reader.setWindow((0.0, 2.5), (1.0, 1.0))
+            self.assertGridsEqual(self.read_all(reader), self.grids[:, 11:23, 6:19])
+            self.assertRaises(ValueError, dut.MMGridFileSequenceReader, name)
+            self.assertFalse(isinstance(dut.openGridFileSequence(name), dut.MMGridFileSequenceReader))
+        self.assertTrue(isinstance(dut.openGridFileSequence(plain), dut.MMGridFileSequenceReader))
+
+    def test_PlainUnchanged(self):
+        # without an encoding, the file is exactly the header and the grids
+        name = self.path('plain.density')
+        write_gfs(name, self.grids)
+        with open(name, 'rb') as f:
+            data = f.read()
+        self.assertEqual(len(data), 40 + self.grids.nbytes)
+        self.assertEqual(data[40:], self.grids.tostring())
+        self.assertEqual(dut.readFooter(open(name, 'rb')), {})
+        self.assertFalse(dut.GridFileSequenceReader(name).isEncoded())
+
+    def test_Rasterize(self):
+        rng = np.random.RandomState(0)
+        frames = rng.uniform(-3, 3, (30, 10, 3)).astype(np.float32)
+        scb_name = self.path('in.scb')
+        with SCBWriter(scb_name, SCBVersion.V2_0, 10, 0.1, range(10)) as writer:
+            writer.writeFrames(frames)
+        domain = AbstractGrid(Vector2(-10, -10), Vector2(20, 20), (40, 40))
+        expected = None
+        for workers in (1, 2):
+            for kwargs in ({},) + self.ENCODINGS:
+                gfs = dut.GridFileSequence(self.path('out'), workers=workers, **kwargs)
+                name = gfs.splatAgents(domain, 0.5, NPFrameSet(scb_name))
+                reader = dut.GridFileSequenceReader(name)
+                self.assertEqual(reader.isEncoded(), bool(kwargs))
+                grids = self.read_all(reader)
+                if expected is None:
+                    expected = grids, reader.range
+                self.assertEqual(grids.shape, (30, 40, 40))
+                self.assertTrue(np.all(grids == expected[0]))
+                self.assertEqual(reader.range, expected[1])
+
+    def test_SerialByDefault(self):
+        # worker processes are only started when they're requested
+        self.assertEqual(dut.GridFileSequence(self.path('out')).workers, 1)
+
+
+class TestPairedFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        frames = np.random.RandomState(0).uniform(-3, 3, (10, 6, 3)).astype(np.float32)
+        self.scb_name = os.path.join(self.temp_dir, 'in.scb')
+        with SCBWriter(self.scb_name, SCBVersion.V2_0, 6, 0.1, range(6)) as writer:
+            writer.writeFrames(frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_BoundingBox(self):
+        # the frames of a bounding-box filter hold different agents; they can't be paired
+        frame_set = FilteredFrameSet(self.scb_name, bbox=(-1, -1, 1, 1))
+        gfs = dut.GridFileSequence(os.path.join(self.temp_dir, 'out'), workers=1)
+        domain = AbstractGrid(Vector2(-3, -3), Vector2(6, 6), (6, 6))
+        self.assertRaises(ValueError, gfs.computeSpeeds, domain, frame_set, 0.1)
+        self.assertRaises(ValueError, gfs.computeProgress, Vector2(-3, -3), Vector2(6, 6), (6, 6), 1.0,
+                          frame_set, 0.1, ())
+        self.assertRaises(ValueError, gfs.computeAngularSpeeds, Vector2(-3, -3), Vector2(6, 6), (6, 6), 1.0,
+                          frame_set, 0.1, ())
+        self.assertRaises(ValueError, gfs.computeRegionSpeed, frame_set, [], 0.1, ())
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'out.speed')))
+        # agent and column filters keep the rows of every frame
+        dut._requirePairedFrames(FilteredFrameSet(self.scb_name, agents=[1, 3]))
+        dut._requirePairedFrames(NPFrameSet(self.scb_name))
+
+
+class TestGridStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.grids = sparse_grids()
+        # an empty grid
+        self.grids[5] = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def check_stats(self, stats, grids):
+        table = stats.table
+        self.assertEqual(len(stats), len(grids))
+        for record, grid in zip(table, grids):
+            self.assertEqual(record['min'], grid.min())
+            self.assertEqual(record['max'], grid.max())
+            self.assertAlmostEqual(record['sum'], grid.sum(dtype=np.float64), 4)
+            self.assertEqual(record['nonzero'], np.count_nonzero(grid))
+            self.assertEqual(record['hist'].sum(), grid.size)
+
+    def test_Record(self):
+        stats = dut.GridStatistics(45 * 37)
+        for grid in self.grids:
+            stats.add(grid.tostring())
+        self.check_stats(stats, self.grids)
+        block = dut.GridStatistics.fromBlock(stats.toBlock())
+        self.assertTrue(np.all(block.table == stats.table))
+        self.assertTrue(np.all(stats.mass() == stats.table['sum']))
+        self.assertEqual(list(stats.emptyGrids()), [5])
+        self.assertEqual(stats.select(1, 4, 2).table.size, 4)
+        self.assertTrue(np.all(stats.select(1, 4, 2).table == stats.table[1:9:2]))
+        # non-finite values are ignored
+        grid = self.grids[3].copy()
+        grid[0, 0] = np.nan
+        record = stats.record(grid)
+        self.assertEqual(record['max'], self.grids[3].max())
+        self.assertEqual(record['hist'].sum(), grid.size - 1)
+
+    def test_Percentiles(self):
+        rng = np.random.RandomState(4)
+        grids = rng.uniform(0, 10, (40, 20, 20)).astype(np.float32)
+        grids[:, :10] = 0
+        stats = dut.GridStatistics(400)
+        for grid in grids:
+            stats.add(grid)
+        self.assertEqual(stats.percentileRange(0, 100), (0.0, grids.max()))
+        low, high = stats.percentileRange(5, 95, ignoreZero=True)
+        values = grids[grids != 0]
+        self.assertAlmostEqual(low, np.percentile(values, 5), delta=0.2)
+        self.assertAlmostEqual(high, np.percentile(values, 95), delta=0.2)
+        low, high = stats.percentileRange(40, 90)
+        self.assertAlmostEqual(low, 0.0, delta=0.2)
+        self.assertAlmostEqual(high, np.percentile(grids, 90), delta=0.2)
+        self.assertEqual(dut.GridStatistics(400).percentileRange(), (0.0, 0.0))
+
+    def test_Files(self):
+        for kwargs in ({}, {'compress': True}, {'tileSize': 8}):
+            name = self.path('a.density')
+            write_gfs(name, self.grids, stats=True, **kwargs)
+            for reader in (dut.GridFileSequenceReader(name), dut.openGridFileSequence(name)):
+                self.assertTrue(reader.hasStats())
+                self.check_stats(reader.gridStats(), self.grids)
+                self.assertEqual(list(reader.emptyGrids()), [5])
+                self.assertEqual(reader.percentileRange(0, 100), reader.range)
+                # the grids are unaffected by the footer
+                reader.setNext(0)
+                cells = np.array([grid.cells.copy() for grid, index in reader])
+                self.assertTrue(np.all(cells == self.grids))
+            reader = dut.GridFileSequenceReader(name, 2, 5, 3)
+            self.assertTrue(np.allclose(reader.mass(), self.grids[2:17:3].sum(axis=(1, 2))))
+            self.assertEqual(list(reader.emptyGrids()), [1])
+        write_gfs(name, self.grids)
+        reader = dut.GridFileSequenceReader(name)
+        self.assertFalse(reader.hasStats())
+        self.assertRaises(ValueError, reader.mass)
+
+    def test_Rasterize(self):
+        rng = np.random.RandomState(0)
+        frames = rng.uniform(-3, 3, (30, 10, 3)).astype(np.float32)
+        scb_name = self.path('in.scb')
+        with SCBWriter(scb_name, SCBVersion.V2_0, 10, 0.1, range(10)) as writer:
+            writer.writeFrames(frames)
+        domain = AbstractGrid(Vector2(-10, -10), Vector2(20, 20), (40, 40))
+        for workers in (1, 2):
+            for kwargs in ({}, {'compress': True}):
+                gfs = dut.GridFileSequence(self.path('out'), workers=workers, stats=True, **kwargs)
+                reader = dut.GridFileSequenceReader(gfs.splatAgents(domain, 0.5, NPFrameSet(scb_name)))
+                self.assertTrue(reader.hasStats())
+                reader.setNext(0)
+                grids = np.array([grid.cells.copy() for grid, index in reader])
+                self.assertEqual(grids.shape, (30, 40, 40))
+                self.check_stats(reader.gridStats(), grids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+import GridOutput as dut
+from Grid import AbstractGrid
+from primitives import Vector2
+
+
+class TestOrderedGridWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.name = os.path.join(self.temp_dir, 'out.density')
+        self.domain = AbstractGrid(Vector2(0, 0), Vector2(4, 3), (4, 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def produce(self, writer, indices, lock):
+        '''Submits the grids of the frames claimed from the shared list, out of order.'''
+        rng = random.Random(len(indices))
+        while True:
+            with lock:
+                if not indices:
+                    return
+                # claim a few frames and finish them in a random order
+                claimed = indices[:3]
+                del indices[:3]
+            rng.shuffle(claimed)
+            for index in claimed:
+                grid = writer.pool.getGrid(0.0)
+                grid.cells[:, :] = index
+                writer.put(index, grid)
+
+    def test_Order(self):
+        count = 200
+        with open(self.name, 'wb') as f:
+            writer = dut.OrderedGridWriter(f, dut.GridPool(self.domain, 8), window=6)
+            writer.start()
+            indices = range(count)
+            lock = threading.Lock()
+            threads = [threading.Thread(target=self.produce, args=(writer, indices, lock)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            log = writer.close()
+        data = np.fromfile(self.name, np.float32).reshape(count, 4, 3)
+        self.assertTrue(np.all(data == np.arange(count, dtype=np.float32)[:, None, None]))
+        self.assertEqual(log.count, count)
+        self.assertEqual(log.minVal, 0.0)
+        self.assertEqual(log.maxVal, count - 1)
+        self.assertTrue(0 < writer.maxDepth <= 6)
+        self.assertEqual(writer.depth(), 0)
+        # grids were recycled
+        self.assertTrue(writer.pool.reused > 0)
+        self.assertEqual(writer.pool.allocated + writer.pool.reused, count)
+
+    def test_Missing(self):
+        with open(self.name, 'wb') as f:
+            writer = dut.OrderedGridWriter(f)
+            writer.start()
+            for index in (0, 1, 3):
+                writer.put(index, self.domain.getDataGrid(float(index)))
+            self.assertRaises(ValueError, writer.close)
+        self.assertEqual(os.path.getsize(self.name), 2 * 4 * 3 * 4)
+
+
+class TestGridPool(unittest.TestCase):
+
+    def test_Recycle(self):
+        domain = AbstractGrid(Vector2(0, 0), Vector2(2, 2), (2, 2))
+        pool = dut.GridPool(domain, 1)
+        grid = pool.getGrid(3.0)
+        self.assertTrue(np.all(grid.cells == 3.0))
+        pool.recycle(grid)
+        pool.recycle(domain.getDataGrid())
+        # the pool keeps at most its capacity
+        self.assertEqual(len(pool.idle), 1)
+        self.assertTrue(pool.getGrid(-1.0) is grid)
+        self.assertTrue(np.all(grid.cells == -1.0))
+        self.assertEqual((pool.allocated, pool.reused), (1, 1))
+        # grids of another resolution are discarded
+        pool.recycle(AbstractGrid(Vector2(0, 0), Vector2(2, 2), (3, 2)).getDataGrid())
+        self.assertEqual(pool.idle, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
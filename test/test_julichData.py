@@ -0,0 +1,221 @@
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import julichData as dut
+try:
+    import julichToSCB
+except ImportError:
+    # the orientation code imports the full trajectory package (which requires matplotlib)
+    julichToSCB = None
+
+# Pedestrian 3 appears in two separate runs of lines; each run is its own pedestrian.
+LINES = ['3 10 100.0 200.0', '3 11 110.0 210.0', '3 12 120.0 220.0',
+         '5 8 0.0 0.0', '5 9 10.0 0.0',
+         '3 14 50.0 50.0', '3 15 60.0 50.0']
+
+
+class JulichTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, lines):
+        file_name = os.path.join(self.temp_dir, 'traj.txt')
+        with open(file_name, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return file_name
+
+    def read(self, lines, **kwargs):
+        data = dut.JulichData(**kwargs)
+        data.readFile(self.write_file(lines))
+        return data
+
+
+class TestParsing(JulichTestCase):
+
+    def test_ParsersAgree(self):
+        text = '\n'.join(LINES) + '\n'
+        bulk = dut.parseColumns(text)
+        lines = dut.parseLines(text)
+        for b, l in zip(bulk, lines):
+            self.assertTrue(np.all(b == l))
+        text = '1 2 3.5 4.5 6.5\n1 3 3.0 4.0 6.0'
+        ids, frames, points = dut.parseColumns(text)
+        self.assertEqual(ids.tolist(), [1, 1])
+        self.assertEqual(points.tolist(), [[3.5, 4.5, 6.5], [3.0, 4.0, 6.0]])
+
+    def test_IrregularLines(self):
+        # Mixed column counts fall back to the line parser.
+        self.assertEqual(dut.parseColumns('1 2 3 4\n1 3 3 4 5\n'), None)
+        ids, frames, points = dut.parseLines('1 2 3 4\n1 3 3 4 5\n')
+        self.assertEqual(points[:, 2].tolist(), [0.0, 5.0])
+        self.assertRaises(dut.FormatError, self.read, ['1 2 3 4', '1 3 3'])
+        self.assertRaises(dut.FormatError, self.read, ['1 2 3 4', '1 x 3 4'])
+
+
+class TestJulichData(JulichTestCase):
+
+    def test_Pedestrians(self):
+        data = self.read(LINES)
+        self.assertEqual(data.agentCount(), 3)
+        self.assertEqual([p.start for p in data.pedestrians], [2, 0, 6])
+        self.assertEqual(data.totalFrames(), 8)
+        self.assertTrue(np.allclose(data.getNPTrajectory(1), [[0, 0, 0], [0.1, 0, 0]]))
+        frame, index = data.next()
+        self.assertEqual(index, 0)
+        self.assertEqual(data.getFrameIds().tolist(), [1])
+        data.setNext(2)
+        frame, index = data.next()
+        self.assertEqual(data.getFrameIds().tolist(), [0])
+        self.assertTrue(np.allclose(frame, [[1.0, 2.0]]))
+
+    def test_Selection(self):
+        data = self.read(LINES, frameStep=2)
+        # The first line (frame 10) is the origin of the frame stride.
+        self.assertEqual([p.traj.shape[0] for p in data.pedestrians], [2, 1, 1])
+        self.assertEqual([p.start for p in data.pedestrians], [1, 0, 3])
+        data = self.read(LINES, maxFrames=1)
+        self.assertEqual(data.agentCount(), 2)
+        data = self.read(LINES, maxAgents=1, convertToMeters=False)
+        self.assertEqual(data.agentCount(), 1)
+        # The earliest frame includes the line at which reading stopped.
+        self.assertEqual(data.pedestrians[0].start, 2)
+        self.assertEqual(data.pedestrians[0].traj[0].tolist(), [100.0, 200.0, 0.0])
+
+    def test_Copy(self):
+        data = self.read(LINES)
+        moved = copy.deepcopy(data)
+        moved.pedestrians[1].traj[:, :2] += 1.0
+        moved.updateFrames()
+        frame, index = moved.next()
+        self.assertTrue(np.allclose(frame, [[1.0, 1.0]]))
+        frame, index = data.next()
+        self.assertTrue(np.allclose(frame, [[0.0, 0.0]]))
+
+    def test_RandomAccess(self):
+        data = self.read(LINES)
+        positions, ids = data.frame(3)
+        self.assertEqual(ids.tolist(), [0])
+        positions, ids = data.frame(1)
+        self.assertEqual(ids.tolist(), [1])
+        self.assertTrue(np.allclose(positions, [[0.1, 0.0]]))
+        self.assertEqual(data.frame(5)[1].size, 0)
+        self.assertEqual(data.frame(8)[1].size, 0)
+        # Frames are in increasing order of agent id.
+        data = self.read(['1 1 0 0', '1 2 0 0', '2 0 5 5', '2 1 5 5', '2 2 5 5'])
+        self.assertEqual(data.frame(1)[1].tolist(), [0, 1])
+        data.setNext(1)
+        frame, index = data.next(2)
+        self.assertEqual(index, 2)
+        self.assertEqual(data.getFrameIds().tolist(), [0, 1])
+        self.assertRaises(StopIteration, data.next)
+
+
+class TestJulichCache(JulichTestCase):
+
+    def test_Cache(self):
+        file_name = self.write_file(LINES)
+        parsed = dut.JulichData()
+        parsed.readFile(file_name, useCache=True)
+        self.assertTrue(os.path.exists(dut.JulichData.cacheName(file_name)))
+        # the parsed data is released in favor of the cache
+        self.assertTrue(isinstance(parsed.points, np.memmap))
+        cached = dut.JulichData()
+        self.assertTrue(cached.readCache(file_name))
+        self.assertTrue(isinstance(cached.points, np.memmap))
+        self.assertEqual(cached.totalFrames(), parsed.totalFrames())
+        self.assertEqual([p.start for p in cached.pedestrians], [p.start for p in parsed.pedestrians])
+        for a, b in zip(cached.pedestrians, parsed.pedestrians):
+            self.assertTrue(np.all(a.traj == b.traj))
+        for k in range(parsed.totalFrames()):
+            self.assertTrue(np.all(cached.next()[0] == parsed.next()[0]))
+            self.assertEqual(cached.getFrameIds().tolist(), parsed.getFrameIds().tolist())
+        # The cached trajectories can be modified without changing the cache.
+        cached.pedestrians[0].traj[:] = 0.0
+        reopened = dut.JulichData()
+        self.assertTrue(reopened.readCache(file_name))
+        self.assertTrue(np.all(reopened.pedestrians[0].traj == parsed.pedestrians[0].traj))
+
+    def test_Stale(self):
+        file_name = self.write_file(LINES)
+        dut.JulichData().readFile(file_name, useCache=True)
+        # Different selection parameters don't use the cache.
+        self.assertFalse(dut.JulichData(frameStep=2).readCache(file_name))
+        self.assertFalse(dut.JulichData(convertToMeters=False).readCache(file_name))
+        # Changing the file invalidates the cache; reading rebuilds it.
+        self.write_file(LINES[:3])
+        os.utime(file_name, (0, 12345))
+        self.assertFalse(dut.JulichData().readCache(file_name))
+        data = dut.JulichData()
+        data.readFile(file_name, useCache=True)
+        self.assertEqual(data.agentCount(), 1)
+        self.assertTrue(dut.JulichData().readCache(file_name))
+
+
+@unittest.skipIf(julichToSCB is None, 'julichToSCB dependencies are unavailable')
+class TestJulichToSCB(JulichTestCase):
+
+    def test_Defaults(self):
+        data = self.read(LINES)
+        sampler = julichToSCB.FrameSampler(data)
+        block = sampler.block(0, data.totalFrames())
+        self.assertEqual(block.shape, (8, 3, 2))
+        self.assertTrue(np.allclose(block[1, 1], [0.1, 0.0]))
+        # pedestrian 1 leaves after frame 1 and lies beyond its last position
+        self.assertTrue(np.allclose(block[2, 1], [1000.1, 0.0]))
+        # pedestrian 2 hasn't entered yet and lies behind its first position
+        self.assertTrue(np.allclose(block[2, 2], [-999.5, 0.5]))
+        self.assertTrue(np.all(sampler.positions(6) == block[6]))
+
+    def test_Resample(self):
+        data = self.read(LINES)
+        full = julichToSCB.FrameSampler(data).block(0, 8)
+        sampler = julichToSCB.FrameSampler(data, data.simStepSize * 0.5)
+        self.assertEqual(sampler.totalFrames(), 15)
+        half = sampler.block(0, 15)
+        self.assertTrue(np.all(half[::2] == full))
+        self.assertTrue(np.allclose(half[5, 0], [1.05, 2.05]))
+        # pedestrian 0 leaves between frames 4 and 5
+        self.assertTrue(np.all(half[9, 0] == full[5, 0]))
+
+    def test_Convert(self):
+        file_name = self.write_file(LINES)
+        scb_name = os.path.join(self.temp_dir, 'traj.scb')
+        julichToSCB.convert(file_name, scb_name, (0, 0), 1.0, 1, timeStep=1.0 / 32.0)
+        with open(scb_name, 'rb') as f:
+            self.assertEqual(f.read(4), '2.0\0')
+        self.assertEqual(os.path.getsize(scb_name), 12 + 3 * 4 + 15 * 3 * 12)
+
+    def test_ConvertCached(self):
+        file_name = self.write_file(LINES)
+        names = [os.path.join(self.temp_dir, 'traj_%d.scb' % i) for i in range(3)]
+        julichToSCB.convert(file_name, names[0], (0, 0), 1.0, 1, useCache=False)
+        self.assertFalse(os.path.exists(dut.JulichData.cacheName(file_name)))
+        # the first conversion writes the cache, the second only reads it
+        julichToSCB.convert(file_name, names[1], (0, 0), 1.0, 1)
+        self.assertTrue(os.path.exists(dut.JulichData.cacheName(file_name)))
+        julichToSCB.convert(file_name, names[2], (0, 0), 1.0, 1)
+        with open(names[0], 'rb') as f:
+            expected = f.read()
+        for name in names[1:]:
+            with open(name, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import pipeline as dut
+import fakeRotation
+import scbCopy
+import scbData
+import smoothTrajectory
+from xform import TrajXform
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = np.zeros((300, 9, 3), dtype=np.float32)
+        self.frames[:, :, :2] = np.cumsum(rng.normal(0, 0.1, (300, 9, 2)), axis=0)
+        self.in_name = self.path('in.scb')
+        with scbData.SCBWriter(self.in_name, scbData.SCBVersion.V2_0, 9, 0.1, range(9)) as writer:
+            writer.writeFrames(self.frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def read(self, name):
+        data = scbData.NPFrameSet(name)
+        frames = data.fullData().transpose(2, 0, 1)
+        info = dut.FrameInfo.fromFrameSet(data)
+        data.close()
+        return info, frames
+
+    def test_MatchesTools(self):
+        # the same preparation, one tool (and one file) at a time
+        scbCopy.copySCB(self.in_name, self.path('a.scb'), 10, 100, 2, [0, 2, 4, 6, 8])
+        info, frames = self.read(self.path('a.scb'))
+        frames[:, :, 0] += 1.0
+        frames[:, :, 1] += 2.0
+        with scbData.SCBWriter(self.path('b.scb'), info.version, 5, 0.2, info.ids) as writer:
+            writer.writeFrames(frames)
+        smoothTrajectory.smoothSCBFile(self.path('b.scb'), self.path('c.scb'), 1.5, False)
+        fakeRotation.addSCBOrientation(self.path('c.scb'), self.path('d.scb'), 0.5, 2)
+        with open(self.path('d.scb'), 'rb') as f:
+            expected = f.read()
+
+        xform = TrajXform()
+        xform.setTranslate(1.0, 2.0)
+        pipeline = dut.Pipeline([dut.SliceStage(10, 200, [0, 2, 4, 6, 8]), dut.SubsampleStage(2)])
+        pipeline.append(dut.XformStage(xform)).append(dut.SmoothStage(1.5))
+        pipeline.append(dut.OrientationStage(0.5, 2))
+        self.assertEqual(pipeline.window(), 2 * (smoothTrajectory.gaussian1D(1.5, 1.0).size + 1) + 2)
+        for block_frames in (1, 7, 1024):
+            self.assertEqual(pipeline.run(self.in_name, self.path('out.scb'), block_frames), 100)
+            with open(self.path('out.scb'), 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_Lazy(self):
+        data = scbData.NPFrameSet(self.in_name)
+        info, blocks = dut.Pipeline([dut.SliceStage(0, 20)]).stream(data, 8)
+        # nothing is read until the blocks are requested
+        self.assertEqual(data.currFrameIndex, -1)
+        self.assertEqual([b.shape[0] for b in blocks], [8, 8, 4])
+        # the slice stops reading at its last frame
+        self.assertEqual(data.currFrameIndex, 23)
+        data.close()
+
+    def test_Describe(self):
+        info = dut.Pipeline([dut.SubsampleStage(3), dut.OrientationStage()]).describe(
+            dut.FrameInfo(scbData.SCBVersion.V2_0, 9, 0.1))
+        self.assertEqual(info.version, scbData.SCBVersion.V2_1)
+        self.assertAlmostEqual(info.simStepSize, 0.3)
+        xform = TrajXform()
+        xform.setTranslate(z=1.0)
+        for stage in (dut.XformStage(xform), dut.SliceStage(agents=[9]),
+                      dut.OrientationStage(version=scbData.SCBVersion.V2_3)):
+            self.assertRaises(ValueError, dut.Pipeline([stage]).run, self.in_name, self.path('out.scb'))
+        self.assertFalse(os.path.exists(self.path('out.scb')))
+
+    def test_Overwrite(self):
+        xform = TrajXform()
+        xform.setTranslate(-1.0, 0.5)
+        dut.Pipeline([dut.XformStage(xform)]).run(self.in_name, self.in_name, 64)
+        info, frames = self.read(self.in_name)
+        self.assertEqual(list(info.ids), range(9))
+        self.assertTrue(np.all(frames[:, :, 0] == self.frames[:, :, 0] - 1.0))
+        self.assertTrue(np.all(frames[:, :, 1] == self.frames[:, :, 1] + 0.5))
+        self.assertFalse(os.path.exists(self.in_name + '.tmp'))
+
+    def test_OverwriteError(self):
+        # A failure part way through leaves the input unchanged and no temporary file behind.
+        class FailingStage(dut.Stage):
+            def stream(self, blocks, info):
+                for i, block in enumerate(blocks):
+                    if i == 1:
+                        raise IOError('disk full')
+                    yield block
+        with open(self.in_name, 'rb') as f:
+            original = f.read()
+        self.assertRaises(IOError, dut.Pipeline([FailingStage()]).run, self.in_name, self.in_name, 64)
+        self.assertFalse(os.path.exists(self.in_name + '.tmp'))
+        with open(self.in_name, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+
+class TestOrientationStream(unittest.TestCase):
+
+    def test_MatchesFullData(self):
+        rng = np.random.RandomState(1)
+        frames = np.cumsum(rng.normal(0, 0.1, (60, 5, 3)), axis=0).astype(np.float32)
+        # agent 1 stands still for a while; agent 3 never moves
+        frames[:20, 1, :2] = 0.0
+        frames[:, 3, :2] = 1.0
+        for window in (1, 3):
+            data = frames.transpose(1, 2, 0).copy()
+            fakeRotation.addOrientation(data, 0.3, window)
+            for block_frames in (1, 7, 100):
+                blocks = [frames[i:i + block_frames] for i in range(0, 60, block_frames)]
+                # searching every frame finds the same initial displacement
+                result = list(fakeRotation.orientationStream(blocks, 0.3, window, searchFrames=60))
+                self.assertTrue(np.all(np.concatenate([f for f, o in result]) == frames))
+                self.assertTrue(np.all(np.concatenate([o for f, o in result]) == data[:, 2].T))
+        self.assertRaises(ValueError, list, fakeRotation.orientationStream([frames[:3]], 0.3, 3))
+
+    def test_BoundedSearch(self):
+        rng = np.random.RandomState(2)
+        frames = np.cumsum(rng.normal(0, 0.1, (50, 4, 3)), axis=0).astype(np.float32)
+        # agent 0 never moves and agent 2's position is missing
+        frames[:, 0, :2] = 1.0
+        frames[:, 2, :2] = np.nan
+        window = 3
+        received = []
+
+        def blocks():
+            for frame in frames:
+                received.append(frame)
+                yield frame[np.newaxis]
+        produced = 0
+        for f, o in fakeRotation.orientationStream(blocks(), 0.3, window):
+            produced += f.shape[0]
+            # only the window frames are held
+            self.assertTrue(len(received) - produced <= window)
+        self.assertEqual(produced, 50)
+        # the displacements of frame window are used, as if the stream were only window + 1 frames
+        first = list(fakeRotation.orientationStream([frames], 0.3, window))[0][1][0]
+        short = list(fakeRotation.orientationStream([frames[:window + 1]], 0.3, window))[0][1][0]
+        self.assertTrue(np.array_equal(np.isnan(first), np.isnan(short)))
+        self.assertTrue(np.all(first[~np.isnan(first)] == short[~np.isnan(short)]))
+        self.assertEqual(first[0], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import ProcessRasterization as dut
+from Grid import AbstractGrid
+from primitives import Vector2
+from trajectory.frameCache import CachedFrameSet
+from trajectory.scbData import NPFrameSet, MMFrameSet, SCBWriter, SCBVersion
+from trajectory.scbFilter import FilteredFrameSet
+from trajectory.scbShards import ShardedFrameSet
+
+HEADER = 'header'
+
+
+def count_frame(frame_set, grid_domain, scale):
+    '''Rasterizes the next frame: the scaled number of agents in each cell.'''
+    frame, index = frame_set.next()
+    grid = grid_domain.getDataGrid()
+    w, h = grid_domain.resolution
+    x = frame[:, 0]
+    y = frame[:, 1]
+    keep = ~np.isnan(x)
+    counts, xe, ye = np.histogram2d(x[keep], y[keep], (w, h), ((-10, 10), (-10, 10)))
+    grid.cells[:, :] = counts * scale
+    return index, grid
+
+
+class Report:
+    def __init__(self):
+        self.maxVal = 0.0
+        self.minVal = 1e6
+        self.count = 0
+
+    def setMax(self, val):
+        self.maxVal = max(self.maxVal, val)
+
+    def setMin(self, val):
+        self.minVal = min(self.minVal, val)
+
+
+class TestProcessRasterization(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = rng.uniform(-10, 10, (90, 12, 3)).astype(np.float32)
+        self.in_name = self.path('in.scb')
+        with SCBWriter(self.in_name, SCBVersion.V2_0, 12, 0.1, range(12)) as writer:
+            writer.writeFrames(self.frames)
+        self.domain = AbstractGrid(Vector2(-10, -10), Vector2(20, 20), (8, 5))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def sequential(self, frame_set, args):
+        '''The grids and report of rasterizing the frame set in this process.'''
+        frame_set.setNext(0)
+        grids = []
+        log = Report()
+        while True:
+            try:
+                index, grid = count_frame(frame_set, *args)
+            except StopIteration:
+                break
+            self.assertEqual(index, len(grids))
+            grids.append(grid.binaryString())
+            log.setMin(grid.minVal())
+            log.setMax(grid.maxVal())
+        return HEADER + ''.join(grids), len(grids), log
+
+    def rasterize(self, frame_set, args, workers):
+        name = self.path('out.density')
+        log = Report()
+        with open(name, 'wb') as f:
+            f.write(HEADER)
+            dut.rasterizeFrames(f, len(HEADER), count_frame, args, frame_set, log, workers)
+        with open(name, 'rb') as f:
+            return f.read(), log.count, log
+
+    def check(self, frame_set):
+        args = (self.domain, 0.5)
+        data, count, log = self.sequential(frame_set, args)
+        self.assertTrue(count > 0)
+        for workers in (2, 3):
+            result, result_count, result_log = self.rasterize(frame_set, args, workers)
+            self.assertEqual(result, data)
+            self.assertEqual(result_count, count)
+            self.assertEqual(result_log.minVal, log.minVal)
+            self.assertEqual(result_log.maxVal, log.maxVal)
+
+    def test_FrameSets(self):
+        self.check(NPFrameSet(self.in_name))
+        self.check(NPFrameSet(self.in_name, 5, 40, 9, 2, 1))
+        self.check(MMFrameSet(self.in_name, 3, -1, -1, 4))
+        self.check(FilteredFrameSet(self.in_name, 2, 50, 3, agents=[1, 4, 5, 9], bbox=(-5, -5, 5, 5)))
+        self.check(CachedFrameSet(NPFrameSet(self.in_name), prefetch=False))
+        names = []
+        for i, (start, end) in enumerate(((0, 25), (25, 26), (26, 90))):
+            names.append(self.path('run_%d.scb' % i))
+            with SCBWriter(names[-1], SCBVersion.V2_0, 12, 0.1, range(12)) as writer:
+                writer.writeFrames(self.frames[start:end])
+        self.check(ShardedFrameSet(names))
+
+    def test_CanProcess(self):
+        frame_set = NPFrameSet(self.in_name)
+        self.assertTrue(dut.canProcess(frame_set, (self.domain, 0.5)))
+        self.assertFalse(dut.canProcess(frame_set, (lambda: None,)))
+        self.assertFalse(dut.canProcess([self.frames], ()))
+        self.assertEqual(dut.readerSpec([self.frames]), None)
+        self.assertRaises(ValueError, dut.rasterizeFrames, None, 0, count_frame, (), [self.frames], Report())
+
+    def test_WorkItems(self):
+        for frame_count in (0, 1, 7, 90, 1000):
+            for workers in (1, 2, 8):
+                items = dut.workItems(frame_count, workers)
+                covered = []
+                for start, count in items:
+                    self.assertTrue(0 < count <= dut.MAX_ITEM_FRAMES)
+                    covered.extend(range(start, start + count))
+                self.assertEqual(covered, range(frame_count))
+
+
+if __name__ == '__main__':
+    unittest.main()
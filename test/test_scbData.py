@@ -0,0 +1,588 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import scbData as dut
+import frameCache
+import scbCompressed
+import scbCopy
+import scbFilter
+import scbSpatialIndex
+import scbTranspose
+try:
+    # Crowd draws with pygame and plots with matplotlib
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import Crowd
+except ImportError:
+    Crowd = None
+
+# The number of floats per agent for each scb version.
+FIELD_COUNTS = {dut.SCBVersion.V1: 3, dut.SCBVersion.V2_0: 3, dut.SCBVersion.V2_1: 4,
+                dut.SCBVersion.V2_2: 8, dut.SCBVersion.V2_3: 4, dut.SCBVersion.V2_4: 4}
+
+
+class HeaderData:
+    '''The minimal frame set data required by writeNPSCB.'''
+    def __init__(self, agent_count, time_step=0.1):
+        self.simStepSize = time_step
+        self.ids = [i % 3 for i in range(agent_count)]
+
+
+class SCBTestCase(unittest.TestCase):
+    '''Creates a temporary directory for the scb files written by each test.'''
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_data(self, version, agent_count=5, frame_count=7):
+        '''Writes an scb file of the given version with known values.
+
+        @returns A 2-tuple: (file name, N x M x K array of the written data).'''
+        field_count = FIELD_COUNTS[version]
+        data = np.arange(agent_count * field_count * frame_count, dtype=np.float32)
+        data.shape = (agent_count, field_count, frame_count)
+        file_name = os.path.join(self.temp_dir, 'data_%s.scb' % version)
+        dut.writeNPSCB(file_name, data, HeaderData(agent_count), version)
+        return file_name, data
+
+
+class TestMMFrameSet(SCBTestCase):
+
+    def test_AllVersions(self):
+        for version in dut.SCBVersion.VERSIONS:
+            file_name, data = self.make_data(version)
+            frames = dut.MMFrameSet(file_name)
+            self.assertEqual(frames.totalFrames(), data.shape[2])
+            for k in range(data.shape[2]):
+                frame, index = frames.next()
+                self.assertEqual(index, k)
+                self.assertTrue(np.all(frame == data[:, :, k]))
+            self.assertRaises(StopIteration, frames.next)
+            self.assertTrue(np.all(frames.fullData() == data))
+            frames.close()
+
+    def test_MatchesNPFrameSet(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_1, agent_count=10, frame_count=20)
+        args = {'startFrame': 2, 'maxFrames': 5, 'maxAgents': 3, 'frameStep': 3, 'agtStep': 2}
+        np_frames = dut.NPFrameSet(file_name, **args)
+        mm_frames = dut.MMFrameSet(file_name, **args)
+        self.assertEqual(mm_frames.totalFrames(), 5)
+        for k in range(5):
+            np_frame, np_index = np_frames.next()
+            mm_frame, mm_index = mm_frames.next()
+            self.assertEqual(np_index, mm_index)
+            self.assertTrue(np.all(np_frame == mm_frame))
+
+    def test_RandomAccess(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=10)
+        frames = dut.MMFrameSet(file_name)
+        frames.setNext(6)
+        frame, index = frames.next()
+        self.assertEqual(index, 6)
+        self.assertTrue(np.all(frame == data[:, :, 6]))
+        block = frames.frameRange(2, 9, 3)
+        self.assertEqual(block.shape, (3, 5, 3))
+        for i, k in enumerate(range(2, 9, 3)):
+            self.assertTrue(np.all(block[i] == data[:, :, k]))
+
+    def test_TruncatedFrame(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0)
+        with open(file_name, 'ab') as f:
+            f.write('\x00' * 7)
+        frames = dut.MMFrameSet(file_name)
+        self.assertEqual(frames.totalFrames(), data.shape[2])
+
+    def test_NoAgents(self):
+        file_name = os.path.join(self.temp_dir, 'empty.scb')
+        dut.writeNPSCB(file_name, np.zeros((0, 3, 0), np.float32), HeaderData(0), dut.SCBVersion.V2_0)
+        self.assertEqual(len(dut.MMFrameSet(file_name)), 0)
+
+
+class TestBlockIteration(SCBTestCase):
+
+    def test_NextBlock(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_1, agent_count=6, frame_count=11)
+        for frame_type in (dut.NPFrameSet, dut.MMFrameSet):
+            frames = frame_type(file_name, startFrame=1, frameStep=2, agtStep=2)
+            frame, index = frames.next()
+            self.assertEqual(index, 0)
+            blocks = list(frames.iterBlocks(2))
+            self.assertEqual([list(indices) for block, indices in blocks], [[1, 2], [3, 4]])
+            for block, indices in blocks:
+                for frame, i in zip(block, indices):
+                    self.assertTrue(np.all(frame == data[::2, :, 1 + 2 * i]))
+            self.assertRaises(StopIteration, frames.nextBlock, 2)
+            # A block leaves the set ready to read the frame that follows it.
+            frames.setNext(1)
+            frames.nextBlock(2)
+            frame, index = frames.next()
+            self.assertEqual(index, 3)
+            self.assertTrue(np.all(frame == data[::2, :, 7]))
+
+    def test_MaxFrames(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=10)
+        frames = dut.NPFrameSet(file_name, maxFrames=5)
+        block, indices = frames.nextBlock(20)
+        self.assertEqual(block.shape, (5, 5, 3))
+        self.assertTrue(np.all(block == data[:, :, :5].transpose(2, 0, 1)))
+
+
+class TestSCBWriter(SCBTestCase):
+
+    def test_IncrementalWrite(self):
+        for version in dut.SCBVersion.VERSIONS:
+            file_name, data = self.make_data(version, frame_count=9)
+            frames = dut.NPFrameSet(file_name)
+            out_name = os.path.join(self.temp_dir, 'copy.scb')
+            writer = dut.SCBWriter.fromFrameSet(out_name, frames)
+            frame, index = frames.next()
+            writer.writeFrame(frame)
+            for block, indices in frames.iterBlocks(4):
+                writer.writeFrames(block)
+            self.assertEqual(writer.close(), 9)
+            with open(file_name, 'rb') as f1, open(out_name, 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_ExtraColumns(self):
+        out_name = os.path.join(self.temp_dir, 'out.scb')
+        data = np.random.rand(4, 8, 3).astype(np.float32)
+        with dut.SCBWriter(out_name, dut.SCBVersion.V2_3, 4, 0.5, [1, 2, 3, 4]) as writer:
+            writer.writeArray(data)
+        frames = dut.NPFrameSet(out_name)
+        self.assertEqual(frames.ids, [1, 2, 3, 4])
+        self.assertTrue(np.all(frames.fullData() == data[:, :4, :]))
+
+    def test_InvalidFrames(self):
+        out_name = os.path.join(self.temp_dir, 'out.scb')
+        self.assertRaises(ValueError, dut.SCBWriter, out_name, '3.0', 4)
+        self.assertRaises(ValueError, dut.SCBWriter, out_name, dut.SCBVersion.V2_0, 4, 0.1, [0])
+        writer = dut.SCBWriter(out_name, dut.SCBVersion.V2_2, 4)
+        self.assertRaises(ValueError, writer.writeFrame, np.zeros((4, 4), dtype=np.float32))
+        self.assertRaises(ValueError, writer.writeFrame, np.zeros((3, 8), dtype=np.float32))
+        writer.close()
+
+
+class TestSCBFrameIndex(SCBTestCase):
+
+    def test_FrameCount(self):
+        for version in dut.SCBVersion.VERSIONS:
+            file_name, data = self.make_data(version)
+            index = dut.SCBFrameIndex(file_name, useSidecar=False)
+            self.assertEqual(index.frameCount, data.shape[2])
+            self.assertFalse(index.isTruncated())
+            frames = dut.NPFrameSet(file_name)
+            self.assertEqual(frames.totalFrames(), data.shape[2])
+            frames.setNext(3)
+            self.assertEqual(index.frameOffset(3), frames.file.tell())
+            self.assertEqual(index.frameOffsets()[3], index.frameOffset(3))
+
+    def test_SubsetFrameCount(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=10)
+        self.assertEqual(dut.NPFrameSet(file_name, startFrame=1, frameStep=3).totalFrames(), 3)
+        self.assertEqual(dut.NPFrameSet(file_name, startFrame=2, maxFrames=2).totalFrames(), 2)
+        self.assertEqual(dut.NPFrameSet(file_name, startFrame=12).totalFrames(), 0)
+
+    def test_NoAgents(self):
+        file_name = os.path.join(self.temp_dir, 'empty.scb')
+        dut.writeNPSCB(file_name, np.zeros((0, 3, 0), np.float32), HeaderData(0), dut.SCBVersion.V2_0)
+        self.assertEqual(dut.NPFrameSet(file_name).totalFrames(), 0)
+        self.assertEqual(dut.SCBFrameIndex(file_name, useSidecar=False).frameCount, 0)
+
+    def test_Truncation(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_1)
+        with open(file_name, 'ab') as f:
+            f.write('\x00' * 7)
+        index = dut.SCBFrameIndex(file_name)
+        self.assertTrue(index.isTruncated())
+        self.assertEqual(index.truncatedBytes, 7)
+        self.assertEqual(index.frameCount, data.shape[2])
+
+    def test_Sidecar(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_2)
+        index = dut.SCBFrameIndex(file_name, writeSidecar=True)
+        self.assertTrue(os.path.exists(index.sidecarName()))
+        loaded = dut.SCBFrameIndex(file_name)
+        self.assertTrue(loaded._readSidecar())
+        for attr in ('version', 'agtCount', 'agentByteSize', 'headerSize', 'frameCount'):
+            self.assertEqual(getattr(loaded, attr), getattr(index, attr))
+        # Changing the scb file invalidates the sidecar.
+        with open(file_name, 'ab') as f:
+            f.write('\x00' * 4)
+        stale = dut.SCBFrameIndex(file_name)
+        self.assertFalse(stale._readSidecar())
+        self.assertEqual(stale.truncatedBytes, 4)
+
+
+class TestAgentMajorData(SCBTestCase):
+
+    def test_Transpose(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_1, agent_count=6, frame_count=9)
+        # A tiny chunk size forces several chunks, including a partial last one.
+        out_name = scbTranspose.transposeSCB(file_name, chunkBytes=1)
+        agents = scbTranspose.AgentMajorData(out_name)
+        self.assertEqual(agents.agentCount(), 6)
+        self.assertEqual(agents.totalFrames(), 9)
+        self.assertEqual(agents.ids, HeaderData(6).ids)
+        for a in range(6):
+            self.assertTrue(np.all(agents.agentTrajectory(a) == data[a]))
+        self.assertTrue(np.all(agents.agentBlock(2, 5) == data[2:5]))
+        starts = [start for start, block in agents.iterAgentBlocks(4)]
+        self.assertEqual(starts, [0, 4])
+
+
+class TestQuantizedSCB(SCBTestCase):
+
+    def test_RoundTrip(self):
+        for version in dut.SCBVersion.VERSIONS:
+            file_name, data = self.make_data(version, agent_count=4, frame_count=6)
+            out_name = os.path.join(self.temp_dir, 'data.scbq')
+            max_error = dut.quantizeSCB(file_name, out_name)
+            frames = dut.QuantizedFrameSet(out_name)
+            self.assertEqual(frames.version, version)
+            self.assertEqual(frames.totalFrames(), 6)
+            self.assertEqual(frames.ids, dut.NPFrameSet(file_name).ids)
+            self.assertEqual(frames.intType, np.int16)
+            self.assertTrue(np.all(max_error == frames.maxError))
+            # The test data is integral, so it is stored exactly.
+            self.assertTrue(np.all(frames.fullData() == data))
+            frame, index = frames.next()
+            self.assertEqual(frame.dtype, np.float32)
+            self.assertTrue(np.all(frame == data[:, :, 0]))
+
+    def test_ErrorBound(self):
+        data = (np.random.rand(5, 4, 20) * 200.0 - 100.0).astype(np.float32)
+        data[1, :, 3] = np.nan
+        file_name = os.path.join(self.temp_dir, 'data.scb')
+        with dut.SCBWriter(file_name, dut.SCBVersion.V2_1, 5) as writer:
+            writer.writeArray(data)
+        out_name = os.path.join(self.temp_dir, 'data.scbq')
+        max_error = dut.quantizeSCB(file_name, out_name)
+        self.assertTrue(np.all(max_error < 0.002))
+        decoded = dut.QuantizedFrameSet(out_name).fullData()
+        self.assertTrue(np.all(np.isnan(decoded[1, :, 3])))
+        valid = ~np.isnan(data)
+        error = np.abs(decoded[valid] - data[valid])
+        # Decoding to float32 adds, at most, the rounding of the decoded value.
+        self.assertTrue(np.all(error <= max_error.max() + np.spacing(np.float32(100.0))))
+        # A tighter bound requires 32-bit values.
+        dut.quantizeSCB(file_name, out_name, maxError=1e-4)
+        frames = dut.QuantizedFrameSet(out_name)
+        self.assertEqual(frames.intType, np.int32)
+        frames.setNext(10)
+        block, indices = frames.nextBlock(4)
+        self.assertEqual(list(indices), [10, 11, 12, 13])
+        self.assertTrue(np.all(np.abs(block - data[:, :, 10:14].transpose(2, 0, 1)) <= 1e-4))
+        self.assertRaises(ValueError, dut.quantizeSCB, file_name, out_name, 1e-4, np.int16)
+
+    def test_PartiallyMissing(self):
+        data = np.random.RandomState(1).uniform(0, 10, (4, 4, 6)).astype(np.float32)
+        # only y is missing; x holds the largest value of its column
+        data[2, 1, 5] = np.nan
+        data[2, 0, 5] = 50.0
+        file_name = os.path.join(self.temp_dir, 'data.scb')
+        with dut.SCBWriter(file_name, dut.SCBVersion.V2_1, 4) as writer:
+            writer.writeArray(data)
+        out_name = os.path.join(self.temp_dir, 'data.scbq')
+        max_error = dut.quantizeSCB(file_name, out_name)
+        decoded = dut.QuantizedFrameSet(out_name).fullData()
+        self.assertTrue(np.isnan(decoded[2, 1, 5]))
+        valid = ~np.isnan(data)
+        error = np.abs(decoded - data)[valid]
+        self.assertTrue(np.all(error <= max_error.max() + np.spacing(np.float32(50.0))))
+
+    def test_OutOfRange(self):
+        out_name = os.path.join(self.temp_dir, 'data.scbq')
+        writer = dut.QuantizedSCBWriter(out_name, dut.SCBVersion.V1, 2, [0, 0, 0], [1, 1, 1])
+        self.assertRaises(ValueError, writer.writeFrame, np.array([[0, 0, 0], [1e6, 0, 0]], dtype=np.float32))
+        writer.close()
+
+
+class TestCompressedSCB(SCBTestCase):
+
+    def test_RoundTrip(self):
+        for version in dut.SCBVersion.VERSIONS:
+            file_name, data = self.make_data(version, frame_count=10)
+            for delta, shuffle in ((False, False), (True, True)):
+                out_name = os.path.join(self.temp_dir, 'data.scbz')
+                count = scbCompressed.compressSCB(file_name, out_name, chunkFrames=4,
+                                                  delta=delta, shuffle=shuffle)
+                self.assertEqual(count, 10)
+                frames = scbCompressed.CompressedFrameSet(out_name)
+                self.assertEqual(frames.version, version)
+                self.assertEqual(frames.ids, dut.NPFrameSet(file_name).ids)
+                self.assertEqual(frames.totalFrames(), 10)
+                self.assertTrue(np.all(frames.fullData() == data))
+                frames.close()
+                copy_name = os.path.join(self.temp_dir, 'copy.scb')
+                scbCompressed.decompressSCB(out_name, copy_name)
+                with open(file_name, 'rb') as f1, open(copy_name, 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+    def test_Codecs(self):
+        data = np.random.rand(6, 4, 9).astype(np.float32)
+        for codec in scbCompressed.availableCodecs():
+            out_name = os.path.join(self.temp_dir, 'data.scbz')
+            with scbCompressed.CompressedSCBWriter(out_name, dut.SCBVersion.V2_1, 6,
+                                                   chunkFrames=2, codec=codec) as writer:
+                writer.writeArray(data)
+            self.assertTrue(np.all(scbCompressed.CompressedFrameSet(out_name).fullData() == data))
+
+    def test_RandomAccess(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=10)
+        out_name = os.path.join(self.temp_dir, 'data.scbz')
+        scbCompressed.compressSCB(file_name, out_name, chunkFrames=3)
+        frames = scbCompressed.CompressedFrameSet(out_name)
+        frames.setNext(7)
+        frame, index = frames.next()
+        self.assertEqual(index, 7)
+        self.assertEqual(frames.chunkIndex, 2)
+        self.assertTrue(np.all(frame == data[:, :, 7]))
+        frame, index = frames.prev(2)
+        self.assertEqual(index, 5)
+        self.assertTrue(np.all(frame == data[:, :, 5]))
+        # Blocks stop at chunk boundaries.
+        block, indices = frames.nextBlock(4)
+        self.assertEqual(list(indices), [6, 7, 8])
+        frame, index = frames.next()
+        self.assertEqual(index, 9)
+        self.assertRaises(StopIteration, frames.next)
+        self.assertRaises(IndexError, frames.frame, 10)
+
+    def test_NotCompressed(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0)
+        self.assertFalse(scbCompressed.CompressedFrameSet.isValid(file_name))
+        self.assertRaises(dut.SCBError, scbCompressed.CompressedFrameSet, file_name)
+
+
+class TestCachedFrameSet(SCBTestCase):
+
+    def test_Sequential(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_1, frame_count=12)
+        frames = frameCache.CachedFrameSet(dut.NPFrameSet(file_name), readAhead=4)
+        self.assertEqual(frames.totalFrames(), 12)
+        self.assertEqual(frames.version, dut.SCBVersion.V2_1)
+        for k in range(12):
+            frame, index = frames.next()
+            self.assertEqual(index, k)
+            self.assertTrue(np.all(frame == data[:, :, k]))
+        self.assertRaises(StopIteration, frames.next)
+        frame, index = frames.prev(3)
+        self.assertEqual(index, 8)
+        self.assertTrue(np.all(frame == data[:, :, 8]))
+        frames.close()
+
+    def test_Budget(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=20)
+        frame_bytes = data.shape[0] * data.shape[1] * 4
+        frames = frameCache.CachedFrameSet(dut.NPFrameSet(file_name), 5 * frame_bytes, prefetch=False)
+        for k in range(20):
+            frames.frame(k)
+        self.assertEqual(frames.cachedBytes(), 5 * frame_bytes)
+        self.assertEqual(sorted(frames.cache.keys()), range(15, 20))
+        # Scrubbing backwards within the cache doesn't read.
+        for k in range(19, 14, -1):
+            frame = frames.frame(k)
+            self.assertTrue(np.all(frame == data[:, :, k]))
+        self.assertEqual(frames.hits, 5)
+        self.assertEqual(frames.misses, 20)
+        # The least recently used frame is evicted.
+        frames.frame(3)
+        self.assertFalse(19 in frames.cache)
+        self.assertTrue(15 in frames.cache)
+
+    def test_ReadAhead(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=20)
+        frames = frameCache.CachedFrameSet(dut.NPFrameSet(file_name), readAhead=3)
+        frames.frame(10)
+        frames.frame(9)
+        frames.stopPrefetch()
+        # The worker reads in the direction of the last requests; it may have been interrupted
+        # but never reads frames past the read-ahead.
+        self.assertTrue(set(frames.cache.keys()) <= set([6, 7, 8, 9, 10, 11, 12, 13]))
+        for k in frames.cache:
+            self.assertTrue(np.all(frames.cache[k] == data[:, :, k]))
+        frames = frameCache.CachedFrameSet(dut.NPFrameSet(file_name), readAhead=3)
+        frames.frame(0)
+        deadline = time.time() + 5.0
+        while frames.prefetched < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        frames.stopPrefetch()
+        self.assertEqual(sorted(frames.cache.keys()), [0, 1, 2, 3])
+
+    def start_prefetch(self, frames):
+        '''Requests a frame so that the worker is reading ahead while the test reads.'''
+        frames.frame(0)
+        deadline = time.time() + 5.0
+        while frames.prefetched < 1 and time.time() < deadline:
+            time.sleep(0.001)
+
+    def test_Blocks(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=200)
+        frames = frameCache.CachedFrameSet(dut.NPFrameSet(file_name), readAhead=100)
+        self.start_prefetch(frames)
+        frames.setNext(3)
+        block, indices = frames.nextBlock(4)
+        self.assertEqual(list(indices), [3, 4, 5, 6])
+        self.assertTrue(np.all(block == data[:, :, 3:7].transpose(2, 0, 1)))
+        frame, index = frames.next()
+        self.assertEqual(index, 7)
+        blocks = list(frames.iterBlocks(16))
+        self.assertEqual(np.concatenate([i for b, i in blocks]).tolist(), range(8, 200))
+        self.assertTrue(np.all(np.concatenate([b for b, i in blocks]) == data[:, :, 8:].transpose(2, 0, 1)))
+        self.assertTrue(np.all(frames.fullData() == data))
+        frames.close()
+
+    @unittest.skipIf(Crowd is None, 'Crowd dependencies are unavailable')
+    def test_FrameBlocks(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, frame_count=200)
+        frames = frameCache.CachedFrameSet(dut.NPFrameSet(file_name), readAhead=100)
+        self.start_prefetch(frames)
+        frames.setNext(0)
+        blocks = list(Crowd.frameBlocks(frames, 8))
+        self.assertEqual(np.concatenate([i for b, i, ids in blocks]).tolist(), range(200))
+        self.assertTrue(np.all(np.concatenate([b for b, i, ids in blocks]) == data.transpose(2, 0, 1)))
+        frames.close()
+
+    def test_FrameIds(self):
+        rng = np.random.RandomState(5)
+        frames = rng.uniform(-1.0, 1.0, (150, 20, 3)).astype(np.float32)
+        file_name = os.path.join(self.temp_dir, 'random.scb')
+        with dut.SCBWriter(file_name, dut.SCBVersion.V2_0, 20) as writer:
+            writer.writeFrames(frames)
+        bbox = (-0.5, -0.5, 0.5, 0.5)
+        expected = scbFilter.FilteredFrameSet(file_name, bbox=bbox)
+        cached = frameCache.CachedFrameSet(scbFilter.FilteredFrameSet(file_name, bbox=bbox), readAhead=100)
+        self.start_prefetch(cached)
+        cached.setNext(0)
+        for k in range(150):
+            frame, index = cached.next()
+            expected_frame, expected_index = expected.next()
+            self.assertEqual(index, k)
+            self.assertEqual(cached.getFrameIds().tolist(), expected.getFrameIds().tolist())
+            self.assertTrue(np.all(frame == expected_frame))
+        cached.close()
+
+
+class TestSpatialIndex(SCBTestCase):
+
+    def make_walk(self, agent_count=30, frame_count=50):
+        '''Writes random walks; returns (file name, K x N x 3 frames).'''
+        rng = np.random.RandomState(3)
+        frames = np.cumsum(rng.randn(frame_count, agent_count, 3), axis=0).astype(np.float32)
+        frames[5:9, 4, :] = np.nan
+        file_name = os.path.join(self.temp_dir, 'walk.scb')
+        with dut.SCBWriter(file_name, dut.SCBVersion.V2_0, agent_count) as writer:
+            writer.writeFrames(frames)
+        return file_name, frames
+
+    def brute_force(self, frames, inside, start, end):
+        points = frames[start:end, :, :2]
+        hits = np.zeros(frames.shape[1], dtype=bool)
+        for k in range(points.shape[0]):
+            valid = ~np.any(np.isnan(points[k]), axis=1)
+            hits[valid] |= inside(points[k][valid])
+        return np.nonzero(hits)[0]
+
+    def test_RectQuery(self):
+        file_name, frames = self.make_walk()
+        index = scbSpatialIndex.SpatialIndex.build(dut.NPFrameSet(file_name), cellSize=1.5, blockFrames=8)
+        self.assertEqual(index.blockCount(), 7)
+        mm_frames = dut.MMFrameSet(file_name)
+        for (x0, y0, x1, y1), start, end in (((-3, -2, 1, 4), 0, None), ((0, 0, 5, 5), 10, 23),
+                                             ((-10, -10, -4, -1), 48, 50)):
+            def inside(p):
+                return (p[:, 0] >= x0) & (p[:, 0] <= x1) & (p[:, 1] >= y0) & (p[:, 1] <= y1)
+            expected = self.brute_force(frames, inside, start, end or 50)
+            exact = index.agentsInRect((x0, y0), (x1, y1), start, end, mm_frames)
+            self.assertEqual(exact.tolist(), expected.tolist())
+            # Without refinement, the answer is conservative.
+            candidates = index.agentsInRect((x0, y0), (x1, y1), start, end)
+            self.assertTrue(set(expected) <= set(candidates))
+
+    def test_PolygonQuery(self):
+        file_name, frames = self.make_walk()
+        index = scbSpatialIndex.SpatialIndex.build(dut.NPFrameSet(file_name), cellSize=1.0, blockFrames=16)
+        triangle = np.array([(-4.0, -4.0), (4.0, -3.0), (0.0, 5.0)])
+        expected = self.brute_force(frames, lambda p: scbSpatialIndex.pointsInPolygon(p, triangle), 20, 40)
+        found = index.agentsInPolygon(triangle, 20, 40, dut.NPFrameSet(file_name))
+        self.assertEqual(found.tolist(), expected.tolist())
+        inside = scbSpatialIndex.pointsInPolygon(np.array([(0.0, 0.0), (3.0, 3.0)]), triangle)
+        self.assertEqual(inside.tolist(), [True, False])
+
+    def test_Persistence(self):
+        file_name, frames = self.make_walk()
+        index = scbSpatialIndex.spatialIndex(file_name, cellSize=2.0, blockFrames=10)
+        self.assertTrue(os.path.exists(scbSpatialIndex.indexName(file_name)))
+        loaded = scbSpatialIndex.spatialIndex(file_name, cellSize=2.0, blockFrames=10)
+        self.assertEqual(loaded.frameCount, 50)
+        self.assertTrue(np.all(loaded.keys == index.keys))
+        self.assertEqual(loaded.agentsInRect((0, 0), (3, 3), 5, 30).tolist(),
+                         index.agentsInRect((0, 0), (3, 3), 5, 30).tolist())
+
+
+class TestSCBCopy(SCBTestCase):
+
+    def check_copy(self, file_name, data, start, max_frames, step, agents, **kwargs):
+        out_name = os.path.join(self.temp_dir, 'copy.scb')
+        count = scbCopy.copySCB(file_name, out_name, start, max_frames, step, agents, **kwargs)
+        expected = data[:, :, start::step]
+        if max_frames >= 0:
+            expected = expected[:, :, :max_frames]
+        if agents is not None:
+            expected = expected[agents]
+        self.assertEqual(count, expected.shape[2])
+        frames = dut.NPFrameSet(out_name)
+        self.assertEqual(frames.version, dut.NPFrameSet(file_name).version)
+        self.assertEqual(frames.agentCount(), expected.shape[0])
+        if count:
+            self.assertTrue(np.all(frames.fullData() == expected))
+        ids = dut.NPFrameSet(file_name).ids
+        if agents is not None:
+            ids = [ids[a] for a in agents]
+        self.assertEqual(frames.ids, ids)
+        if frames.version != dut.SCBVersion.V1:
+            self.assertAlmostEqual(frames.simStepSize, dut.NPFrameSet(file_name).simStepSize * step, 6)
+
+    def test_AllVersions(self):
+        for version in dut.SCBVersion.VERSIONS:
+            file_name, data = self.make_data(version, agent_count=6, frame_count=13)
+            self.check_copy(file_name, data, 0, -1, 1, None)
+            self.check_copy(file_name, data, 3, 5, 1, None, chunkBytes=7)
+            self.check_copy(file_name, data, 1, -1, 3, None, chunkBytes=100)
+            self.check_copy(file_name, data, 2, 4, 2, [4, 1, 5])
+            self.check_copy(file_name, data, 20, -1, 1, None)
+
+    def test_SparseReads(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_2, agent_count=6, frame_count=13)
+        skip = scbCopy.SKIP_BYTES
+        scbCopy.SKIP_BYTES = 1
+        try:
+            self.check_copy(file_name, data, 1, -1, 2, [2, 3, 5], chunkBytes=50)
+            self.check_copy(file_name, data, 0, 3, 4, [0])
+        finally:
+            scbCopy.SKIP_BYTES = skip
+
+    def test_MatchesFrameSetSelection(self):
+        file_name, data = self.make_data(dut.SCBVersion.V2_0, agent_count=10, frame_count=9)
+        agents = scbCopy.agentSelection(10, maxAgents=3, agentStep=2)
+        frames = dut.NPFrameSet(file_name, maxAgents=3, agtStep=2)
+        self.assertTrue(np.all(frames.fullData() == data[agents]))
+        self.assertRaises(ValueError, scbCopy.copySCB, file_name, 'unused.scb', 0, -1, 1, [10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import scbFilter as dut
+import scbData
+
+
+class TestFilteredFrameSet(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = rng.uniform(-10, 10, (30, 12, 8)).astype(np.float32)
+        self.ids = [i % 3 for i in range(12)]
+        self.scb_name = os.path.join(self.temp_dir, 'data.scb')
+        with scbData.SCBWriter(self.scb_name, scbData.SCBVersion.V2_2, 12, 0.1, self.ids) as writer:
+            writer.writeFrames(self.frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_Selection(self):
+        # a regular stride is viewed; anything else is gathered
+        for agents, view in (([2, 5, 8, 11], True), ([7, 1, 3], False)):
+            data = dut.FilteredFrameSet(self.scb_name, agents=agents, columns=[0, 1])
+            self.assertEqual(data.agentCount(), len(agents))
+            block, indices = data.nextBlock(10)
+            self.assertEqual(isinstance(block, np.memmap), view)
+            self.assertTrue(np.all(block == self.frames[:10][:, sorted(agents), :2]))
+            self.assertEqual(data.bytesRead, 10 * len(agents) * 8)
+            self.assertEqual(data.bytesRead + data.bytesSkipped, 10 * 12 * 32)
+            frame, index = data.next()
+            self.assertEqual(index, 10)
+            self.assertEqual(data.getFrameIds().tolist(), sorted(agents))
+            data.close()
+        data = dut.FilteredFrameSet(self.scb_name, startFrame=3, frameStep=2, classes=[1], columns=[6, 7, 4])
+        self.assertEqual(data.ids, [1] * 4)
+        self.assertEqual(data.getClasses().keys(), [1])
+        self.assertTrue(np.all(data.fullData() == self.frames[3::2][:, 1::3][:, :, [6, 7, 4]].transpose(1, 2, 0)))
+        data.close()
+        self.assertRaises(ValueError, dut.FilteredFrameSet, self.scb_name, agents=[12])
+        self.assertRaises(ValueError, dut.FilteredFrameSet, self.scb_name, columns=[8])
+
+    def test_BoundingBox(self):
+        bbox = (-5.0, -5.0, 5.0, 5.0)
+        data = dut.FilteredFrameSet(self.scb_name, agents=range(0, 12, 2), bbox=bbox, columns=[0, 1, 3])
+        for f in range(30):
+            frame, index = data.next()
+            positions = self.frames[f, ::2, :2]
+            inside = np.all((positions >= -5.0) & (positions <= 5.0), axis=1)
+            self.assertEqual(data.getFrameIds().tolist(), (np.arange(0, 12, 2)[inside]).tolist())
+            self.assertTrue(np.all(frame == self.frames[f, ::2][inside][:, [0, 1, 3]]))
+        # only the positions are read for the agents outside the box
+        expected = 30 * 6 * 8 + np.count_nonzero(np.all(np.abs(self.frames[:, ::2, :2]) <= 5.0, axis=2)) * 4
+        self.assertEqual(data.bytesRead, expected)
+        self.assertEqual(data.bytesSkipped, 30 * 12 * 32 - expected)
+        self.assertTrue('skipped' in data.byteReport())
+        # blocks keep every selected agent
+        data.setNext(0)
+        data.resetCounters()
+        block, indices = data.nextBlock(30)
+        self.assertEqual(block.shape, (30, 6, 3))
+        self.assertEqual(data.bytesRead, expected)
+        outside = np.isnan(block[:, :, 0])
+        self.assertEqual(np.count_nonzero(~outside), expected // 4 - 30 * 6 * 2)
+        self.assertTrue(np.all(block[~outside] == self.frames[:, ::2][:, :, [0, 1, 3]][~outside]))
+        data.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import scbMetric as dut
+import scbData
+
+
+class TestSCBMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = np.cumsum(rng.normal(0, 0.1, (200, 12, 3)), axis=0).astype(np.float32)
+        self.frames[50:60, 3, 0] = np.nan
+        self.frames[199, 7, 1] = np.nan
+        self.scb_name = os.path.join(self.temp_dir, 'data.scb')
+        with scbData.SCBWriter(self.scb_name, scbData.SCBVersion.V2_0, 12, 0.25) as writer:
+            writer.writeFrames(self.frames)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_MatchesFullData(self):
+        metrics, frames = dut.computeMetrics(self.scb_name, blockFrames=16)
+        summary = metrics.summary(0.25)
+        self.assertEqual(metrics.badAgents().tolist(), [3, 7])
+        self.assertEqual([(n['agent'], n['frames'], n['first'], n['last']) for n in summary['nanAgents']],
+                         [(3, 10, 50, 59), (7, 1, 199, 199)])
+        raw = self.frames.transpose(1, 2, 0)
+        bad, good_data = dut.findNaNPos(raw)
+        good = np.setdiff1d(np.arange(12), bad)
+        segments = dut.segmentLength(good_data)
+        (min_id, min_len), (max_id, max_len) = dut.trajectoryExtrema(segments)
+        self.assertEqual(summary['shortestTrajectory']['agent'], good[min_id])
+        self.assertAlmostEqual(summary['shortestTrajectory']['value'], min_len, 4)
+        self.assertEqual(summary['longestTrajectory']['agent'], good[max_id])
+        self.assertAlmostEqual(summary['longestTrajectory']['value'], max_len, 4)
+        (min_id, min_frame, min_speed), (max_id, max_frame, max_speed) = dut.instSpeedExtrema(segments, 0.25)
+        low = summary['lowestInstantaneousSpeed']
+        self.assertEqual((low['agent'], low['frame']), (good[min_id], min_frame))
+        self.assertAlmostEqual(low['value'], min_speed, 5)
+        high = summary['highestInstantaneousSpeed']
+        self.assertEqual((high['agent'], high['frame']), (good[max_id], max_frame))
+        self.assertAlmostEqual(high['value'], max_speed, 5)
+        speeds = segments.astype(np.float64) / 0.25
+        self.assertAlmostEqual(summary['meanSpeed'], speeds.mean(), 6)
+        self.assertAlmostEqual(summary['speedStdDev'], speeds.std(), 6)
+
+    def test_Parallel(self):
+        serial, frames = dut.computeMetrics(self.scb_name, blockFrames=7)
+        parallel, frames = dut.computeMetrics(self.scb_name, workers=3, blockFrames=7)
+        self.assertEqual(parallel.frameCount, 200)
+        a, b = serial.summary(0.25), parallel.summary(0.25)
+        for key in ('nanAgents', 'bounds'):
+            self.assertEqual(a[key], b[key])
+        for key in ('shortestTrajectory', 'highestInstantaneousSpeed', 'lowestInstantaneousSpeed'):
+            self.assertEqual(a[key]['agent'], b[key]['agent'])
+            self.assertAlmostEqual(a[key]['value'], b[key]['value'], 9)
+        self.assertAlmostEqual(a['speedStdDev'], b['speedStdDev'], 9)
+        self.assertTrue(np.allclose(serial.segM2, parallel.segM2))
+        # only consecutive ranges can be merged
+        first = dut.SCBMetrics(12)
+        first.update(self.frames[:10, :, :2])
+        later = dut.SCBMetrics(12, 20)
+        later.update(self.frames[20:30, :, :2])
+        self.assertRaises(ValueError, first.merge, later)
+
+    def test_Save(self):
+        metrics, frames = dut.computeMetrics(self.scb_name)
+        json_name = os.path.join(self.temp_dir, 'metrics.json')
+        metrics.save(json_name, 0.25)
+        with open(json_name) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['frameCount'], 200)
+        self.assertEqual(summary['agentCount'], 12)
+        npz_name = os.path.join(self.temp_dir, 'metrics.npz')
+        metrics.save(npz_name, 0.25)
+        data = np.load(npz_name)
+        self.assertEqual(data['nanFrames'].tolist(), metrics.nanFrames.tolist())
+        self.assertEqual(json.loads(str(data['summary']))['frameCount'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
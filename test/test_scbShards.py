@@ -0,0 +1,102 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import scbShards as dut
+import dataLoader
+import scbData
+
+
+class TestShardedFrameSet(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.frames = rng.uniform(-10, 10, (50, 6, 3)).astype(np.float32)
+        self.names = []
+        for i, (start, end) in enumerate(((0, 20), (20, 20), (20, 27), (27, 50))):
+            name = self.path('run_%d.scb' % i)
+            with scbData.SCBWriter(name, scbData.SCBVersion.V2_0, 6, 0.25, range(6)) as writer:
+                writer.writeFrames(self.frames[start:end])
+            self.names.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def test_Frames(self):
+        data = dut.ShardedFrameSet(self.names, maxOpen=2)
+        self.assertEqual(data.totalFrames(), 50)
+        self.assertEqual(data.locate(20), (2, 0))
+        self.assertEqual(data.locate(49), (3, 22))
+        self.assertRaises(IndexError, data.locate, 50)
+        for f in range(50):
+            frame, index = data.next()
+            self.assertEqual(index, f)
+            self.assertTrue(np.all(frame == self.frames[f]))
+        self.assertRaises(StopIteration, data.next)
+        self.assertTrue(np.all(data.frameRange(3, 45, 4) == self.frames[3:45:4]))
+        self.assertTrue(np.all(data[-1] == self.frames[-1]))
+        self.assertTrue(np.all(data.fullData() == self.frames.transpose(1, 2, 0)))
+        data.setNext(15)
+        blocks = list(data.iterBlocks(8))
+        # blocks don't span shards
+        self.assertEqual([b.shape[0] for b, i in blocks], [5, 7, 8, 8, 7])
+        self.assertTrue(np.all(np.concatenate([b for b, i in blocks]) == self.frames[15:]))
+        self.assertTrue(np.all(np.concatenate([i for b, i in blocks]) == np.arange(15, 50)))
+        # the pool holds the most recently used shards
+        self.assertTrue(len(data.openShards()) <= 2)
+        data.close()
+        self.assertEqual(data.openShards(), [])
+
+    def test_Incompatible(self):
+        name = self.path('other.scb')
+        for version, count, step, ids in ((scbData.SCBVersion.V2_1, 6, 0.25, range(6)),
+                                          (scbData.SCBVersion.V2_0, 5, 0.25, range(5)),
+                                          (scbData.SCBVersion.V2_0, 6, 0.5, range(6)),
+                                          (scbData.SCBVersion.V2_0, 6, 0.25, [1] * 6)):
+            with scbData.SCBWriter(name, version, count, step, ids) as writer:
+                writer.writeFrames(np.zeros((2, count, 4), dtype=np.float32))
+            self.assertRaises(ValueError, dut.ShardedFrameSet, self.names + [name])
+        self.assertRaises(ValueError, dut.ShardedFrameSet, [])
+
+    def test_Load(self):
+        data = dataLoader.loadSCB(self.path('run_*.scb'))
+        self.assertTrue(isinstance(data, dut.ShardedFrameSet))
+        self.assertEqual(data.fileNames, self.names)
+        self.assertEqual(data.simStepSize, 0.25)
+        self.assertEqual(data.ids, range(6))
+        data.close()
+        data = dataLoader.loadSCB(self.names[2:])
+        self.assertEqual(data.totalFrames(), 30)
+        data.close()
+
+    def test_NumericOrder(self):
+        # shard numbers of different digit counts; run_10 sorts before run_2 as text
+        names = []
+        for i, number in enumerate((1, 2, 9, 10, 11)):
+            names.append(self.path('seg_%d.scb' % number))
+            with scbData.SCBWriter(names[-1], scbData.SCBVersion.V2_0, 6, 0.25, range(6)) as writer:
+                writer.writeFrames(self.frames[i * 10:(i + 1) * 10])
+        self.assertEqual(dut.naturalOrder(reversed(names)), names)
+        self.assertEqual(dut.naturalOrder(['b10', 'a2', 'a10', 'a2x', 'a']), ['a', 'a2', 'a2x', 'a10', 'b10'])
+        data = dataLoader.loadSCB(self.path('seg_*.scb'))
+        self.assertEqual(data.fileNames, names)
+        self.assertTrue(np.all(data.fullData() == self.frames.transpose(1, 2, 0)))
+        data.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
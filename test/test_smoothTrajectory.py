@@ -0,0 +1,149 @@
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+
+# This allows execution of this file, in this directory but gives it
+# access to the parent directory (the files under test).
+ROOT_PATH = os.path.abspath(os.path.relpath('..', os.path.dirname(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'trajectory'))
+
+import smoothTrajectory as dut
+import julichData
+import scbData
+
+
+def random_paths(agent_count, frame_count, seed=0):
+    '''Random walks, as a (K, N, 2) array, with occasional discontinuities.'''
+    rng = np.random.RandomState(seed)
+    paths = np.cumsum(rng.normal(0, 0.3, (frame_count, agent_count, 2)), axis=0)
+    jumps = rng.rand(frame_count, agent_count) < 0.05
+    paths[:, :, 0] += np.cumsum(jumps * 5.0, axis=0)
+    return paths.astype(np.float32)
+
+
+def smooth_intervals(path, kernel):
+    '''Smooths a single (K, 2) path, one interval at a time.'''
+    result = np.empty_like(path)
+    for start, end in dut.findIntervals(path):
+        result[start:end] = dut.smooth(path[start:end], kernel)
+    return result
+
+
+class SmoothTestCase(unittest.TestCase):
+
+    def assertClose(self, a, b):
+        '''The engine sums the kernel products in a different order than np.convolve.'''
+        self.assertTrue(np.allclose(a, b, rtol=1e-6, atol=1e-6))
+
+
+class TestSmoothFrames(SmoothTestCase):
+
+    def test_MatchesIntervals(self):
+        paths = random_paths(20, 150)
+        for sigma in (0.5, 1.0, 3.0):
+            kernel = dut.gaussian1D(sigma, 1.0)
+            result = dut.smoothFrames(paths, paths, kernel)
+            for a in range(paths.shape[1]):
+                self.assertClose(result[:, a], smooth_intervals(paths[:, a], kernel))
+
+    def test_MissingValues(self):
+        paths = random_paths(6, 200, seed=3)
+        paths[90, 2, 1] = np.nan
+        paths[40:43, 4] = np.nan
+        kernel = dut.gaussian1D(1.0, 1.0)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            result = dut.smoothFrames(paths, paths, kernel)
+            dut.findIntervals(paths[:, 2])
+        # missing values don't produce invalid comparison warnings
+        self.assertEqual([str(w.message) for w in caught], [])
+        for a in range(paths.shape[1]):
+            expected = smooth_intervals(paths[:, a], kernel)
+            self.assertTrue(np.array_equal(np.isnan(result[:, a]), np.isnan(expected)))
+            self.assertClose(result[:, a][~np.isnan(expected)], expected[~np.isnan(expected)])
+        # a missing value only affects nearby frames, not the whole tile of filtered frames
+        self.assertTrue(np.isnan(result[:, 2, 1]).sum() < 2 * kernel.size)
+        self.assertTrue(np.isnan(result[90, 2, 1]))
+        self.assertFalse(np.any(np.isnan(result[:, [0, 1, 3, 5]])))
+
+    def test_Blocks(self):
+        paths = random_paths(10, 300, seed=1)
+        frames = np.zeros((300, 10, 4), dtype=np.float32)
+        frames[:, :, :2] = paths
+        frames[:, :, 2] = np.random.RandomState(2).uniform(0, 2 * np.pi, (300, 10))
+        frames[:, :, 3] = 7.0
+        kernel = dut.gaussian1D(2.0, 1.0)
+        for smooth_orient in (False, True):
+            whole = np.concatenate(list(dut.smoothBlocks([frames], kernel, smoothOrient=smooth_orient)))
+            blocks = [frames[i:i + 7] for i in range(0, 300, 7)]
+            chunked = np.concatenate(list(dut.smoothBlocks(blocks, kernel, smoothOrient=smooth_orient)))
+            self.assertTrue(np.all(chunked == whole))
+            self.assertTrue(np.all(chunked[:, :, 3] == 7.0))
+        # orientation is unified before smoothing, as with unifyOrient
+        unified = dut.unifyOrientBlock(frames[:, :, 2])
+        for a in range(10):
+            self.assertTrue(np.all(unified[:, a] == dut.unifyOrient(frames[:, a, 2])))
+            expected = np.empty(300, dtype=np.float32)
+            for start, end in dut.findIntervals(paths[:, a]):
+                expected[start:end] = dut.smoothOrientation(unified[start:end, a], kernel)
+            self.assertClose(chunked[:, a, 2], expected)
+
+
+class TestSmoothFiles(SmoothTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_SCBFile(self):
+        frames = np.zeros((200, 6, 3), dtype=np.float32)
+        frames[:, :, :2] = random_paths(6, 200)
+        in_name = os.path.join(self.temp_dir, 'in.scb')
+        out_name = os.path.join(self.temp_dir, 'out.scb')
+        with scbData.SCBWriter(in_name, scbData.SCBVersion.V2_0, 6, 0.25, range(6)) as writer:
+            writer.writeFrames(frames)
+        self.assertEqual(dut.smoothSCBFile(in_name, out_name, 1.5, False, blockFrames=16), 200)
+        data = scbData.NPFrameSet(in_name)
+        expected = dut.smoothSCB(data, 1.5, False).fullData()
+        data.close()
+        result = scbData.NPFrameSet(out_name)
+        self.assertEqual(result.simStepSize, 0.25)
+        self.assertEqual(list(result.ids), range(6))
+        self.assertTrue(np.all(result.fullData() == expected))
+        result.close()
+        for a in range(6):
+            path = expected[a, :2].T
+            self.assertClose(path, smooth_intervals(frames[:, a, :2], dut.gaussian1D(1.5, 1.0)))
+
+    def test_Julich(self):
+        paths = random_paths(3, 60) * 100
+        lines = []
+        for a, (start, end) in enumerate(((0, 60), (10, 25), (5, 50))):
+            for f in range(start, end):
+                lines.append('%d %d %f %f' % (a, f, paths[f, a, 0], paths[f, a, 1]))
+        file_name = os.path.join(self.temp_dir, 'traj.txt')
+        with open(file_name, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        data = julichData.JulichData()
+        data.readFile(file_name)
+        original = copy.deepcopy(data)
+        result = dut.smoothJulich(data, 1.0)
+        kernel = dut.gaussian1D(1.0, 1.0)
+        for ped, smoothed in zip(original.pedestrians, result.pedestrians):
+            self.assertClose(smoothed.traj[:, :2], smooth_intervals(ped.traj[:, :2], kernel))
+        # the input is unchanged
+        for a, b in zip(original.pedestrians, data.pedestrians):
+            self.assertTrue(np.all(a.traj == b.traj))
+
+
+if __name__ == '__main__':
+    unittest.main()
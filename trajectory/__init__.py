@@ -6,4 +6,10 @@ import scbTruncate
 from smoothTrajectory import smoothTrajectory, smoothTrajFile, gaussian1D
 from xformTrajectory import xformTrajectory, xformTrajectoryFile
 from xform import TrajXform
+from scbTranspose import AgentMajorData, transposeSCB, agentMajorCache
 
+from scbCompressed import CompressedFrameSet, CompressedSCBWriter, compressSCB, decompressSCB
+from frameCache import CachedFrameSet
+from scbFilter import FilteredFrameSet
+from scbShards import ShardedFrameSet
+from scbSpatialIndex import SpatialIndex, spatialIndex
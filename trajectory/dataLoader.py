@@ -1,9 +1,39 @@
 # handles loading trajectory functions automatically
 
 import scbData
+import scbCompressed
 import julichData
+import scbShards
+import glob
 import os
 
+def loadSCB( fileName ):
+    '''Opens scb data stored as a standard scb file, in the compressed container
+    (see scbCompressed), as quantized data (see scbData.QuantizedSCBWriter) or as
+    several scb files (see scbShards).
+
+    @param      fileName        A string.  The path to the scb data.  A sequence of paths, or a
+                                pattern matching several files (e.g., 'run_*.scb'), is opened as
+                                a single, sharded frame set; a pattern's matches are taken in
+                                numeric order (see scbShards.naturalOrder), so run_2.scb precedes
+                                run_10.scb.
+    @returns    An instance of NPFrameSet, CompressedFrameSet, QuantizedFrameSet or
+                ShardedFrameSet.
+    @raises     SCBError if the file is not scb data.
+    @raises     ValueError if the shards' headers aren't compatible.
+    '''
+    if ( not isinstance( fileName, basestring ) ):
+        return scbShards.ShardedFrameSet( fileName )
+    if ( not os.path.exists( fileName ) and glob.has_magic( fileName ) ):
+        names = scbShards.naturalOrder( glob.glob( fileName ) )
+        if ( names ):
+            return scbShards.ShardedFrameSet( names )
+    if ( scbCompressed.CompressedFrameSet.isValid( fileName ) ):
+        return scbCompressed.CompressedFrameSet( fileName )
+    if ( scbData.QuantizedFrameSet.isValid( fileName ) ):
+        return scbData.QuantizedFrameSet( fileName )
+    return scbData.NPFrameSet( fileName )
+
 def loadTrajectory( fileName ):
     '''Loads a trajectory file - actual data or simulated data.
 
@@ -14,12 +44,12 @@ def loadTrajectory( fileName ):
     @raises     ValueError if the data in the file can't be recognized.
     '''
     try:
-        data = scbData.NPFrameSet( fileName )
+        data = loadSCB( fileName )
         data.setNext(0)
     except scbData.SCBError:
         try:
             data = julichData.JulichData( 1/ 16.0 )
-            data.readFile( fileName )
+            data.readFile( fileName, useCache=True )
             data.setNext(0)
         except:
             raise ValueError, "Unrecognized trajectory data"
@@ -34,7 +64,9 @@ def isTrajectory( fileName ):
     '''
     if ( not os.path.isfile( fileName ) ):
         return False
-    valid = scbData.NPFrameSet.isValid( fileName )
+    valid = ( scbData.NPFrameSet.isValid( fileName ) or
+              scbCompressed.CompressedFrameSet.isValid( fileName ) or
+              scbData.QuantizedFrameSet.isValid( fileName ) )
     if ( not valid ):
         return julichData.JulichData.isValid( fileName )
     return valid
\ No newline at end of file
@@ -0,0 +1,251 @@
+# A caching layer for interactive access to scb frame sets.
+#
+#   Playback and scrubbing request frames one at a time, often out of order, from the UI thread.
+#   The CachedFrameSet keeps recently used frames in memory (bounded by a byte budget, evicting
+#   the least recently used frame) and reads ahead, in the direction of playback, on a worker
+#   thread so that the frames are usually in memory before they are requested.
+
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# The default number of bytes of frame data to keep in memory
+DEFAULT_BUDGET = 256 * 1024 * 1024
+# The default number of frames the worker reads ahead of the last requested frame
+DEFAULT_READ_AHEAD = 32
+
+class CachedFrameSet:
+    '''Wraps a frame set (e.g., NPFrameSet) with an LRU frame cache and a read-ahead thread.
+
+    It supports the sequential interface of the wrapped frame set (setNext, next, prev,
+    totalFrames, getFrameIds) and its block reads (nextBlock, iterBlocks, fullData); any other
+    attribute is taken from the wrapped frame set.  The wrapped frame set is shared between the
+    caller and the worker thread; all reads are serialized, so it must not be used directly while
+    it is wrapped.  The returned frames are shared with the cache and must not be modified.'''
+    def __init__( self, frameSet, memoryBudget=DEFAULT_BUDGET, readAhead=DEFAULT_READ_AHEAD, prefetch=True ):
+        '''Constructor.
+
+        @param      frameSet        The frame set to wrap.  It must support setNext and next.
+        @param      memoryBudget    An int.  The maximum number of bytes of frames to cache.
+        @param      readAhead       An int.  The number of frames to read ahead of the last
+                                    requested frame.  It is limited to half of the frames the
+                                    budget can hold.
+        @param      prefetch        A bool.  If True, a worker thread reads ahead.
+        '''
+        self.frameSet = frameSet
+        self.memoryBudget = memoryBudget
+        self.readAhead = readAhead
+        self.frameCount = frameSet.totalFrames()
+        self.cache = OrderedDict()
+        # The agent ids of each cached frame (see getFrameIds), keyed like the cache
+        self.frameIds = {}
+        # The number of frames the budget can hold; determined by the first frame read
+        self.capacity = None
+        # Serializes access to the wrapped frame set
+        self.readLock = threading.Lock()
+        # Guards the cache and the prefetch request
+        self.condition = threading.Condition()
+        self.request = None
+        self.generation = 0
+        self.stopped = False
+        self.lastIndex = -1
+        self.direction = 1
+        self.currFrame = None
+        self.currIds = None
+        self.currFrameIndex = -1
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.worker = None
+        if ( prefetch and readAhead > 0 ):
+            self.worker = threading.Thread( target=self._prefetchLoop, name='scb read-ahead' )
+            self.worker.daemon = True
+            self.worker.start()
+
+    def __getattr__( self, name ):
+        # only called for attributes the cache doesn't define; special methods aren't forwarded.
+        #   Anything that reads frames must be defined on the cache; the worker thread moves the
+        #   wrapped frame set's cursor.
+        if ( name.startswith( '__' ) ):
+            raise AttributeError, name
+        return getattr( self.frameSet, name )
+
+    def totalFrames( self ):
+        '''Reports the total number of frames in the set'''
+        return self.frameCount
+
+    def setNext( self, index ):
+        '''Sets the set so that the call to next frame will return frame index'''
+        if ( index < 0 ):
+            index = 0
+        self.currFrameIndex = index - 1
+
+    def next( self, stride=1 ):
+        '''Returns the next frame in sequence from current point'''
+        nextIndex = self.currFrameIndex + stride
+        if ( nextIndex >= self.frameCount ):
+            raise StopIteration
+        self.currFrame, self.currIds = self._fetch( nextIndex )
+        self.currFrameIndex = nextIndex
+        return self.currFrame, self.currFrameIndex
+
+    def prev( self, stride=1 ):
+        '''Returns the previous frame in sequence from current point'''
+        if ( self.currFrameIndex >= stride ):
+            self.currFrameIndex -= stride
+            self.currFrame, self.currIds = self._fetch( self.currFrameIndex )
+        return self.currFrame, self.currFrameIndex
+
+    def getFrameIds( self ):
+        '''Returns the agent ids of the last frame returned by next or prev, as reported by the
+        wrapped frame set's getFrameIds when the frame was read'''
+        return self.currIds
+
+    def nextBlock( self, k ):
+        '''Returns up to the next k frames in sequence from the current point (see
+        NPFrameSet.nextBlock).  Blocks are read directly from the wrapped frame set; they are not
+        cached.
+
+        @param      k       An int.  The maximum number of frames to return.
+        @returns    A 2-tuple (block, indices).  See NPFrameSet.nextBlock.
+        @raises     StopIteration if there are no more frames.
+        '''
+        start = self.currFrameIndex + 1
+        if ( start >= self.frameCount ):
+            raise StopIteration
+        with self.readLock:
+            self.frameSet.setNext( start )
+            block, indices = self.frameSet.nextBlock( k )
+        self.currFrameIndex = indices[ -1 ]
+        return block, indices
+
+    def iterBlocks( self, k ):
+        '''Iterates through the remaining frames in blocks of k frames (see nextBlock).
+
+        @param      k       An int.  The number of frames per block.  The last block may be smaller.
+        @returns    A generator of 2-tuples: (block, indices).
+        '''
+        while ( True ):
+            try:
+                block, indices = self.nextBlock( k )
+            except StopIteration:
+                return
+            yield block, indices
+
+    def fullData( self ):
+        '''Returns the wrapped frame set's fullData'''
+        with self.readLock:
+            return self.frameSet.fullData()
+
+    def frame( self, index ):
+        '''Returns the indicated frame, from the cache if possible.  The read-ahead worker is
+        redirected to the frames following this one (in the direction of the last two requests).
+
+        @param      index       An int.  The index of the frame in the range [0, totalFrames()).
+        @returns    A numpy array.  A copy of the frame returned by the wrapped frame set's next.
+        '''
+        return self._fetch( index )[ 0 ]
+
+    def _fetch( self, index ):
+        '''Returns the indicated frame and its agent ids (see frame).
+
+        @param      index       An int.  The index of the frame in the range [0, totalFrames()).
+        @returns    A 2-tuple (frame, ids).  The ids are None if the wrapped frame set doesn't
+                    support getFrameIds.
+        '''
+        with self.condition:
+            if ( index != self.lastIndex ):
+                self.direction = 1 if index > self.lastIndex else -1
+                self.lastIndex = index
+            frame = self.cache.pop( index, None )
+            if ( frame is not None ):
+                self.hits += 1
+                self.cache[ index ] = frame
+                ids = self.frameIds[ index ]
+            else:
+                self.misses += 1
+            self.generation += 1
+            self.request = ( index, self.direction, self.generation )
+            self.condition.notify()
+        if ( frame is None ):
+            frame, ids = self._read( index )
+            with self.condition:
+                self._store( index, frame, ids )
+        return frame, ids
+
+    def _read( self, index ):
+        '''Reads a frame, and the ids of its agents, from the wrapped frame set'''
+        with self.readLock:
+            self.frameSet.setNext( index )
+            frame, i = self.frameSet.next()
+            ids = None
+            if ( hasattr( self.frameSet, 'getFrameIds' ) ):
+                ids = self.frameSet.getFrameIds()
+            # NPFrameSet reads every frame into the same array
+            return np.array( frame ), ids
+
+    def _store( self, index, frame, ids ):
+        '''Adds a frame to the cache, evicting the least recently used frames to stay in budget.
+        The caller must hold the condition.'''
+        if ( self.capacity is None ):
+            self.capacity = max( 2, self.memoryBudget // max( 1, frame.nbytes ) )
+        self.cache.pop( index, None )
+        self.cache[ index ] = frame
+        self.frameIds[ index ] = ids
+        while ( len( self.cache ) > self.capacity ):
+            evicted, f = self.cache.popitem( last=False )
+            del self.frameIds[ evicted ]
+
+    def _prefetchLoop( self ):
+        '''The body of the read-ahead thread'''
+        while ( True ):
+            with self.condition:
+                while ( not self.stopped and self.request is None ):
+                    self.condition.wait()
+                if ( self.stopped ):
+                    return
+                start, direction, generation = self.request
+                self.request = None
+                readAhead = self.readAhead
+                if ( self.capacity is not None ):
+                    readAhead = min( readAhead, self.capacity // 2 )
+            for i in xrange( 1, readAhead + 1 ):
+                index = start + direction * i
+                if ( index < 0 or index >= self.frameCount ):
+                    break
+                with self.condition:
+                    if ( self.stopped or self.generation != generation ):
+                        break
+                    if ( index in self.cache ):
+                        continue
+                frame, ids = self._read( index )
+                with self.condition:
+                    self._store( index, frame, ids )
+                    self.prefetched += 1
+
+    def stopPrefetch( self ):
+        '''Stops the read-ahead thread.  The cache remains usable.'''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if ( self.worker is not None ):
+            self.worker.join()
+            self.worker = None
+
+    def clear( self ):
+        '''Empties the cache'''
+        with self.condition:
+            self.cache.clear()
+            self.frameIds.clear()
+
+    def cachedBytes( self ):
+        '''Reports the number of bytes of frame data in the cache'''
+        with self.condition:
+            return sum( f.nbytes for f in self.cache.itervalues() )
+
+    def close( self ):
+        '''Stops the read-ahead thread, empties the cache and closes the wrapped frame set'''
+        self.stopPrefetch()
+        self.clear()
+        self.frameSet.close()
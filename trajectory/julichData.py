@@ -1,10 +1,22 @@
 # This reads the trajectories for Seyfried's data.  It provides a similar
 #   interface as the scbData so it can be used in density analysis
 
+import copy
 import os
+import struct
 import numpy as np
 import commonData
 
+# The extension appended to a julich file name to produce the name of its binary cache
+CACHE_EXT = '.jcache'
+CACHE_MAGIC = 'JLCH'
+CACHE_VERSION = 1
+# magic, cache version, source size, source mtime, frame step, max frames, max agents, to meters,
+#   point count, pedestrian count, duration, length of the source path (which follows the header)
+CACHE_HEADER = '<4siqdiiiiqqqi'
+# The types of the cached arrays (see JulichData._cacheArrays)
+CACHE_TYPES = ( np.float64, np.int64, np.int64, np.int64, np.int64, np.int64, np.float32 )
+
 class FormatError( Exception ):
     '''There is a format problem with the trajectory file'''
     def __init__( self, lineNumber, line ):
@@ -16,10 +28,12 @@ class FormatError( Exception ):
 
 class Pedestrian:
     '''A class which wraps the trajectory of a single pedestrian'''
-    def __init__( self, startTime, id ):
+    def __init__( self, startTime, id, traj=None ):
         self.start = startTime
         self.id = id
-        self.traj = []
+        if ( traj is None ):
+            traj = []
+        self.traj = traj
 
     def addPoint( self, x, y, z ):
         '''Adds a point to the trajectory'''
@@ -54,6 +68,72 @@ class Pedestrian:
             P.append( '%d %d %f %f %f' % ( self.id, i + self.start, point[0] * scale, point[1] * scale, point[2] * scale ) )
         return '\n'.join( P )
         
+def parseColumns( text ):
+    '''Parses the text of a julich file with a vectorized tokenizer.  Every line must have the
+    same number (at least four) of whitespace-separated values: id, frame, x, y and, optionally,
+    z; any further values are ignored.
+
+    @param      text        A string.  The contents of a julich file.
+    @returns    A 3-tuple of numpy arrays ( ids, frames, points ) for L lines: L ints, L ints and
+                an L x 3 array of floats (z is zero if the file has no z-values).  None if the
+                text can't be parsed this way (see parseLines).
+    '''
+    chars = np.fromstring( text, np.uint8 )
+    if ( chars.size == 0 ):
+        return np.empty( 0, dtype=np.int64 ), np.empty( 0, dtype=np.int64 ), np.empty( ( 0, 3 ) )
+    newLine = chars == ord( '\n' )
+    space = newLine | ( chars == ord( ' ' ) ) | ( chars == ord( '\t' ) ) | ( chars == ord( '\r' ) )
+    # a token starts at every non-space character which follows a space (or the start of the text)
+    tokenStart = ~space
+    tokenStart[ 1: ] &= space[ :-1 ]
+    lineCount = np.count_nonzero( newLine ) + ( 0 if newLine[ -1 ] else 1 )
+    tokensPerLine = np.bincount( np.cumsum( newLine )[ tokenStart ], minlength=lineCount )
+    colCount = tokensPerLine[ 0 ]
+    if ( colCount < 4 or np.any( tokensPerLine != colCount ) ):
+        return None
+    values = np.fromstring( text, sep=' ' )
+    if ( values.size != lineCount * colCount ):
+        return None
+    values.shape = ( lineCount, colCount )
+    ids = values[ :, 0 ]
+    frames = values[ :, 1 ]
+    if ( np.any( ids != np.floor( ids ) ) or np.any( frames != np.floor( frames ) ) ):
+        return None
+    points = np.zeros( ( lineCount, 3 ) )
+    points[ :, :min( 3, colCount - 2 ) ] = values[ :, 2:5 ]
+    return ids.astype( np.int64 ), frames.astype( np.int64 ), points
+
+def parseLines( text ):
+    '''Parses the text of a julich file one line at a time (see parseColumns).
+
+    @param      text        A string.  The contents of a julich file.
+    @returns    A 3-tuple of numpy arrays ( ids, frames, points ).
+    @raises     FormatError if a line can't be parsed.
+    '''
+    ids = []
+    frames = []
+    points = []
+    for num, line in enumerate( text.splitlines(), 1 ):
+        tokens = line.strip().split()
+        if ( len( tokens ) < 4 ):
+            raise FormatError( num, line )
+        try:
+            pedID = int( tokens[0] )
+            frameNum = int( tokens[1] )
+            x = float( tokens[2] )
+            y = float( tokens[3] )
+            try:
+                z = float( tokens[4] )
+            except IndexError:
+                z = 0.0
+        except ValueError:
+            raise FormatError( num, line )
+        ids.append( pedID )
+        frames.append( frameNum )
+        points.append( ( x, y, z ) )
+    return ( np.array( ids, dtype=np.int64 ), np.array( frames, dtype=np.int64 ),
+             np.array( points, dtype=np.float64 ).reshape( -1, 3 ) )
+
 class JulichData:
     '''Class for reading the trajectory data stored in Seyfried's data'''
     def __init__( self, timeStep=1.0/16.0, convertToMeters=True, startFrame=0, maxFrames=-1, frameStep=1, maxAgents=-1 ):
@@ -87,7 +167,6 @@ class JulichData:
         self.currFrameID = 0        # What is the interpretation of this?  The last frame read or the id of the one that will be read when next is called?
         self.currFrame = None
         self.currIDs = None
-        self.framePop = 0
         self.startFrame = startFrame
         # generic attributes
         if ( maxFrames == -1 ):
@@ -154,80 +233,207 @@ class JulichData:
     #   this (badly named) property and I want them to be equivalent in this manner
     simStepSize = property( lambda self: self.timeStep, lambda self, ts: self._setTimeStep( ts ) )
 
-    def readFile( self, fileName ):
+    def readFile( self, fileName, useCache=False ):
         '''Reads the file indicated.
         Raises an OSError if file can't be opened.
-        Raises a FormatError if the file has formatting issues.'''
+        Raises a FormatError if the file has formatting issues.
+
+        If useCache is True, the parsed data is read from the file's binary cache (see
+        cacheName) when the cache matches the file and the reader's parameters; otherwise the
+        file is parsed and the cache is (re)written.  Either way, the data is then memory-mapped
+        from the cache (if it could be written), so the parsed arrays aren't kept in memory.'''
 
         if ( not os.path.exists( fileName ) ):
             raise OSError
+
+        if ( useCache ):
+            if ( self.readCache( fileName ) ):
+                return
+            self.readFile( fileName )
+            try:
+                self.writeCache( fileName )
+            except IOError:
+                # the cache is an optimization; an unwritable location doesn't matter
+                return
+            # release the parsed arrays in favor of the mapped ones
+            self.readCache( fileName )
+            return
         
         f = open( fileName, 'r' )
-        currPed = None
-        startFrame = 1 << 30        # in the data, the frame can start at
-                                    # arbitrarily high values (i.e. it is not normalized)
-        originFrame = None          # serves as the origin of the data - it is from this point
-                                    # that frame strides and frame counts are performed.
-        num = 0
-        for line in f.xreadlines():
-            num += 1
-            if ( line == '' ):
-                continue
-            tokens = line.strip().split()
-            if ( len( tokens ) < 4 ):
-                raise FormatError( num, line )
-            try:
-                pedID = int( tokens[0] )
-                frameNum = int( tokens[1] )
-                x = float( tokens[2] )
-                y = float( tokens[3] )
-                try:
-                    z = float( tokens[4] )
-                except IndexError:
-                    z = 0.0
-            except ValueError:
-                raise FormatError( num, line )
-            if ( self.toMeters ):
-                x *= 0.01
-                y *= 0.01
-                z *= 0.01
-            # this assumes that the first frame seen serves as an appropriate origin
-            #   if the agents were not reported in increasing start times, later agents
-            #   could have start times before this. 
-            if ( originFrame == None ): 
-                originFrame = frameNum
-            if ( frameNum < startFrame ):
-                startFrame = frameNum
-            localFrame = frameNum - originFrame
-            if ( ( localFrame % self.frameStep != 0 ) ):
-                continue
-            localFrame /= self.frameStep
-            if ( localFrame > self.maxFrames ):
-                continue
-            if ( currPed == None or pedID != currPed.id ):
-                if ( self.maxAgents >= 0  and len( self.pedestrians ) >= self.maxAgents ):
-                    break
-                currPed = Pedestrian( frameNum, pedID )
-                self.pedestrians.append( currPed )
-            currPed.addPoint( x, y, z )
-
-        # normalize all start times
-        #   produce numpy arrays of each trajectory
-        #   Determine duration of sequence
-        for i, ped in enumerate( self.pedestrians ):
-            ped.id = i
-            ped.start = (ped.start - startFrame) / self.frameStep
-            ped.finalize()
-            end = ped.start + ped.traj.shape[0]
-            if ( end > self.duration ):
-                self.duration = end
+        text = f.read()
         f.close()
-        # create a frame that is the size of all the agents (the biggest possible frame)
-        #   during calls to next, windows of this data will be returned
-        self.currFrame = np.empty( ( len( self.pedestrians ), 2 ), dtype=np.float32 )
-        self.currIDs = np.empty( len( self.pedestrians ), dtype=np.int )
+        columns = parseColumns( text )
+        if ( columns is None ):
+            # the bulk parser can't interpret the text; the line parser reports where it fails
+            columns = parseLines( text )
+        self.setColumns( *columns )
+
+    def setColumns( self, pedIDs, frameNums, points ):
+        '''Sets the trajectory data from the columns of a julich file.  The data is organized
+        exactly as readFile organizes the lines of a file: a pedestrian is a run of consecutive
+        (selected) lines with the same id, the first frame seen serves as the origin for frame
+        strides and the maximum frame count, and the pedestrian's start is relative to the
+        earliest frame.
+
+        @param      pedIDs          A numpy array of L ints.  The id on each line.
+        @param      frameNums       A numpy array of L ints.  The frame number on each line.
+        @param      points          An L x 3 numpy array of floats.  The (x, y, z) value on each
+                                    line, in the file's units.
+        '''
+        pedIDs = np.asarray( pedIDs, dtype=np.int64 )
+        frameNums = np.asarray( frameNums, dtype=np.int64 )
+        if ( pedIDs.size == 0 ):
+            self._setTrajectories( np.empty( ( 0, 3 ) ), np.empty( 0, dtype=np.int64 ),
+                                   np.zeros( 1, dtype=np.int64 ) )
+            return
+        # this assumes that the first frame seen serves as an appropriate origin
+        #   if the agents were not reported in increasing start times, later agents
+        #   could have start times before this.
+        localFrames = frameNums - frameNums[0]
+        selected = ( localFrames % self.frameStep == 0 ) & ( localFrames // self.frameStep <= self.maxFrames )
+        lines = np.flatnonzero( selected )
+        # a new pedestrian starts on every selected line whose id differs from the previous
+        #   selected line's id
+        newPed = np.ones( lines.size, dtype=bool )
+        newPed[ 1: ] = pedIDs[ lines[ 1: ] ] != pedIDs[ lines[ :-1 ] ]
+        pedLines = np.flatnonzero( newPed )
+        # frames on lines up to (and including) the first line that would exceed the agent count
+        #   count towards the earliest frame
+        lastLine = frameNums.size
+        if ( self.maxAgents >= 0 and pedLines.size > self.maxAgents ):
+            lastLine = lines[ pedLines[ self.maxAgents ] ] + 1
+            lines = lines[ :pedLines[ self.maxAgents ] ]
+            pedLines = pedLines[ :self.maxAgents ]
+        startFrame = frameNums[ :lastLine ].min()
+
+        points = np.array( points[ lines ], dtype=np.float64 )
+        if ( self.toMeters ):
+            points *= 0.01
+        starts = ( frameNums[ lines[ pedLines ] ] - startFrame ) // self.frameStep
+        offsets = np.append( pedLines, lines.size ).astype( np.int64 )
+        self._setTrajectories( points, starts, offsets )
+
+    def _setTrajectories( self, points, starts, offsets, frames=None ):
+        '''Sets the pedestrians from contiguous trajectory data.
+
+        @param      points          A P x 3 numpy array of floats.  The points of all pedestrians.
+        @param      starts          A numpy array of N ints.  The first frame of each pedestrian.
+        @param      offsets         A numpy array of N + 1 ints.  The points of pedestrian i are
+                                    points[ offsets[i]:offsets[i+1] ].
+        @param      frames          An optional 4-tuple of the frame-major arrays: ( frameRows,
+                                    frameIDs, frameOffsets, framePositions ).  If None, they are
+                                    computed from the points.
+        '''
+        self.points = points
+        self.pedStarts = np.asarray( starts, dtype=np.int64 )
+        self.pedOffsets = offsets
+        lengths = np.diff( offsets )
+        self.pedEnds = self.pedStarts + lengths
+        # each pedestrian's trajectory is a view into the contiguous points
+        self.pedestrians = [ Pedestrian( int( self.pedStarts[i] ), i, points[ offsets[i]:offsets[i+1] ] )
+                             for i in xrange( lengths.size ) ]
+        self.duration = int( self.pedEnds.max() ) if lengths.size else 0
+        # The frame-major (CSR) layout: the agents present in frame f are
+        #   frameIDs[ frameOffsets[f]:frameOffsets[f+1] ], in increasing order, and their positions
+        #   are the same rows of framePositions.  frameRows maps each row to its point.
+        if ( frames is None ):
+            pointFrames = np.repeat( self.pedStarts - offsets[ :-1 ], lengths ) + np.arange( points.shape[0] )
+            # a stable sort keeps the agents of a frame in increasing order
+            self.frameRows = np.argsort( pointFrames, kind='mergesort' )
+            self.frameIDs = np.repeat( np.arange( lengths.size ), lengths )[ self.frameRows ].astype( np.int )
+            self.frameOffsets = np.zeros( self.duration + 1, dtype=np.int64 )
+            np.cumsum( np.bincount( pointFrames, minlength=self.duration ), out=self.frameOffsets[ 1: ] )
+            self.updateFrames()
+        else:
+            self.frameRows, self.frameIDs, self.frameOffsets, self.framePositions = frames
+        self.currFrame = np.empty( ( 0, 2 ), dtype=np.float32 )
+        self.currIDs = np.empty( 0, dtype=np.int )
         self.setNext( 0 )
 
+    def updateFrames( self ):
+        '''Updates the frame-major positions from the pedestrians' trajectories.  It must be
+        called after the trajectories have been modified in place.'''
+        self.framePositions = np.ascontiguousarray( self.points[ self.frameRows, :2 ], dtype=np.float32 )
+
+    @staticmethod
+    def cacheName( fileName ):
+        '''Reports the name of the binary cache of a julich file'''
+        return fileName + CACHE_EXT
+
+    def _cacheKey( self, fileName ):
+        '''Produces the values which identify the data in a cache: the source file and the
+        parameters which select the data'''
+        stat = os.stat( fileName )
+        return ( CACHE_MAGIC, CACHE_VERSION, stat.st_size, stat.st_mtime, self.frameStep,
+                 self.maxFrames, self.maxAgents, int( self.toMeters ) )
+
+    def writeCache( self, fileName ):
+        '''Writes the parsed data to the binary cache of the given julich file.  The cache
+        is a header followed by the raw arrays, so it can be memory-mapped by readCache.
+
+        @param      fileName        A string.  The path to the julich file this data was read from.
+        @raises     IOError if the cache can't be written.
+        '''
+        path = os.path.abspath( fileName )
+        header = struct.pack( CACHE_HEADER, *( self._cacheKey( fileName ) +
+                                              ( self.points.shape[0], len( self.pedestrians ),
+                                                self.duration, len( path ) ) ) )
+        with open( JulichData.cacheName( fileName ), 'wb' ) as f:
+            f.write( header )
+            f.write( path )
+            for array, dtype in zip( self._cacheArrays(), CACHE_TYPES ):
+                f.write( '\x00' * ( -f.tell() % 8 ) )
+                f.write( np.ascontiguousarray( array, dtype=dtype ).tostring() )
+
+    def _cacheArrays( self ):
+        '''The arrays stored in the cache, in order'''
+        return ( self.points, self.pedStarts, self.pedOffsets, self.frameRows, self.frameIDs,
+                 self.frameOffsets, self.framePositions )
+
+    def readCache( self, fileName ):
+        '''Sets the data from the binary cache of the given julich file, if the cache is valid
+        for the file and this reader's parameters.  The arrays are memory-mapped (copy on write),
+        so only the data which is used is read.
+
+        @param      fileName        A string.  The path to the julich file.
+        @returns    A boolean.  True if the data was read from the cache.
+        '''
+        cacheName = JulichData.cacheName( fileName )
+        if ( not os.path.exists( cacheName ) ):
+            return False
+        headerSize = struct.calcsize( CACHE_HEADER )
+        with open( cacheName, 'rb' ) as f:
+            try:
+                values = struct.unpack( CACHE_HEADER, f.read( headerSize ) )
+            except struct.error:
+                return False
+            key = values[ :8 ]
+            pointCount, pedCount, duration, pathLength = values[ 8: ]
+            if ( key != self._cacheKey( fileName ) or f.read( pathLength ) != os.path.abspath( fileName ) ):
+                return False
+            offset = f.tell()
+        shapes = ( ( pointCount, 3 ), ( pedCount, ), ( pedCount + 1, ), ( pointCount, ),
+                   ( pointCount, ), ( duration + 1, ), ( pointCount, 2 ) )
+        arrays = []
+        for shape, dtype in zip( shapes, CACHE_TYPES ):
+            offset += -offset % 8
+            size = int( np.prod( shape ) ) * np.dtype( dtype ).itemsize
+            if ( size ):
+                arrays.append( np.memmap( cacheName, dtype=dtype, mode='c', offset=offset, shape=shape ) )
+            else:
+                arrays.append( np.empty( shape, dtype=dtype ) )
+            offset += size
+        self._setTrajectories( arrays[0], arrays[1], arrays[2], arrays[3:] )
+        return True
+
+    def __deepcopy__( self, memo ):
+        '''Copies the data; the pedestrians of the copy are views into the copy's points'''
+        data = copy.copy( self )
+        if ( hasattr( self, 'points' ) ):
+            data._setTrajectories( self.points.copy(), self.pedStarts, self.pedOffsets )
+        data.setNext( self.currFrameID + 1 )
+        return data
+
     def summary( self ):
         '''Creates a simple summary of the trajectory data'''
         s = 'Julich Trajectory data'
@@ -250,25 +456,31 @@ class JulichData:
             raise StopIteration
         # advance the identifier
         self.currFrameID += stride
-        a = 0
-        id = -1
-        for p in self.pedestrians:
-            id += 1
-            pos = p.getPosition( self.currFrameID )
-            if ( pos != None ):
-                self.currFrame[ a, : ] = pos
-                self.currIDs[ a ] = id
-                a += 1
-        self.framePop = a
+        positions, self.currIDs = self.frame( self.currFrameID )
         # TODO: This copy is for multi-threaded applications.  Pull the copy out
         #   of here and place it in the multi-threading.
-        return np.copy( self.currFrame[ :a, : ] ), self.currFrameID
+        self.currFrame = np.copy( positions )
+        return self.currFrame, self.currFrameID
+
+    def frame( self, index ):
+        '''Returns the data of an arbitrary frame.  The cost is proportional to the number of
+        agents present in the frame.
+
+        @param      index       An int.  The index of the frame.
+        @returns    A 2-tuple of read-only views: ( positions, ids ).  An N x 2 numpy array of the
+                    positions of the N agents present in the frame and the N ids of those agents.
+                    Both are empty if the index lies outside of the data.
+        '''
+        if ( index < 0 or index >= self.duration ):
+            return self.framePositions[ :0 ], self.frameIDs[ :0 ]
+        start, end = self.frameOffsets[ index ], self.frameOffsets[ index + 1 ]
+        return self.framePositions[ start:end ], self.frameIDs[ start:end ]
 
     def getFrameIds( self ):
         '''Returns the ids associated with the last frame read'''
         # TODO: This copy is for multi-threaded applications.  Pull the copy out
         #   of here and place it in the multi-threading.
-        return np.copy( self.currIDs[ :self.framePop ] )
+        return np.copy( self.currIDs )
 
     def totalFrames( self ):
         """Reports the total number of frames in the file"""
@@ -1,169 +1,277 @@
-# translate between julich and scb data formats
-
-from julichData import JulichData
-import scbData
-import numpy as np
-try:
-    import fakeRotation
-except ImportError:
-    import sys
-    sys.path.insert( 0, '../.' )
-    import fakeRotation
-from bound import AABB2D
-from primitives import Vector2
-import imp
-import os
-
-# default location for undefined agents
-DEF_X = -1000.0
-DEF_Y = -1000.0
-
-class DummyFrameSet:
-    '''This class serves as a minimal scbData.FrameSet replacement for the
-    purpose of writing out a frameSet.  It defines timestep and an empty
-    set of ids so that the scb writer code can make the correct decisions.'''
-    def __init__( self, timeStep, ids=[] ):
-        self.simStepSize = timeStep
-        self.ids = ids
-        
-def convert( inputName, outputName, undefined, maxAngVel, angleVelWindow, classFunc=None ):
-    '''Converts julich trajectory file to a corresponding v2.0 scb file.
-
-    @param      inputName       A string.  The name of the input julich file to convert.
-    @param      outputName      A string.  The name of the output SCB
-                                file to write to.
-    @param      undefined       A 2-tuple of floats.  The location to place agents with undetermined
-                                location.
-    @param      maxAngVel       A float.  The maximum allowed angular velocity.
-    @param      angleVelWindow  An int.  The size of the window (in frames) over which angular velocity
-                                is computed.
-    @param      classFunc       A callable.  If provided, it defines the per-pedestrian classification
-                                based on arbitrary arguments.  It should take a single argument:
-                                an instance of julichData.
-    @raises     OSError if the input file cannot be opened.
-    '''
-    print "Converting:"
-    print "\t", inputName
-    print "to"
-    print "\t", outputName
-    X, Y = undefined
-    data = JulichData()
-    try:
-        data.readFile( inputName )
-    except OSError:
-        print '\n*** No file written!'
-        print '*** Unable to read input file:', inputName, '***'
-        return
-    print data.summary()
-    
-    # determine the start and end positions for each agent.
-    starts = []
-    ends = []
-    for ped in data.pedestrians:
-        starts.append( ped.traj[0, :2] )
-        ends.append( ped.traj[-1, :2] )
-
-    starts = np.array( starts )
-    ends = np.array( ends )
-    disp = ends - starts
-    dists = np.sqrt( np.sum( disp * disp, axis=1 ) )
-    dists.shape = (-1, 1)
-    disp /= dists
-    starts -= disp * 1000
-    ends += disp * 1000
-        
-    # now build data
-    agtCount = data.agentCount()
-    frameCount = data.totalFrames()
-    outData = np.empty( ( agtCount, 3, frameCount ), dtype=np.float32 )
-    data.setNext( 0 )
-
-    hasEntered = np.zeros( agtCount, dtype=np.bool )
-    
-    while ( True ):
-        try:
-            frame, frameID = data.next()
-        except StopIteration:
-            break
-        frameIDs = data.getFrameIds()
-        # default position depends on whether it has entered the domain yet
-        outData[ hasEntered, :2, frameID ] = ends[ hasEntered, : ]
-        outData[ ~hasEntered, :2, frameID ] = starts[ ~hasEntered, : ]
-        outData[ :, 2, frameID ] = 0.0 # orientation
-        hasEntered[ frameIDs ] = True
-        for i, id in enumerate( frameIDs ):
-            outData[ id, :2, frameID ] = frame[ i, :2 ]
-
-    # add orientation
-    fakeRotation.addOrientation( outData, data.simStepSize * maxAngVel * angleVelWindow, angleVelWindow )
-    
-    # output file
-    ids = []
-    if ( classFunc ):
-        ids = classFunc( data )
-    frameSet = DummyFrameSet( data.simStepSize, ids )
-    try:
-        scbData.writeNPSCB( outputName, outData, frameSet, scbData.SCBVersion.V2_0 )
-    except ValueError as e:
-        print "\n*** FILE NOT WRITTEN! ", e, '***'
-
-
-if __name__ == '__main__':
-
-    import optparse, sys
-    parser = optparse.OptionParser()
-    parser.set_description( 'Convert from julich to scb data' )
-    parser.add_option( '-i', '--input', help='The input julich trajectory file.',
-                       action='store', dest='inputName', default='' )
-    parser.add_option( '-o', '--output', help='The output scb file.',
-                       action='store', dest='outputName', default='' )
-    parser.add_option( '-u', '--undefinedPos', help='The location to place agents when the position is undefined.  Defaults to <%.f, %.f>' % ( DEF_X, DEF_Y ),
-                       nargs=2, action='store', type='float', dest='undefined', default=( DEF_X, DEF_Y ) )
-    parser.add_option( '-a', '--angularVelocity', help='The maximum angular velocity for introducing orientation.  Default is %f' % fakeRotation.DEF_VEL_LIMIT,
-                       action='store', type='float', dest='maxOmega', default=fakeRotation.DEF_VEL_LIMIT )
-    parser.add_option( '-w', '--window', help='Number of frames overwhich to compute angular velocity.  This smooths the signal (default is 1)',
-                       action='store', dest='window', type='int', default=1 )
-    parser.add_option( '-m', '--module', help='The name of the classification module.  It contains the classifier to use.',
-                       action='store', dest='modName', type='str', default=None )
-    parser.add_option( '-c', '--classifier', help='The name of the classification function (a callable).  If module is defined and classifier is not, the name of the callable is assumed to be "classifier".',
-                       action='store', dest='classifier', type='str', default=None )
-    options, args = parser.parse_args()
-
-    if ( options.inputName == '' ):
-        parser.print_help()
-        print '\n *** You must specify an input file.'
-        sys.exit(1)
-
-    if ( options.outputName == '' ):
-        parser.print_help()
-        print '\n *** You must specify an output file.'
-        sys.exit(1)
-
-    # try to load the classifier
-    classifier = None
-    if ( not options.modName is None ):
-        if ( options.classifier is None ):
-            className = 'classifier'
-        else:
-            className = options.classifier
-        try:
-            if ( not os.path.exists( options.modName ) ):
-                print
-                print '*******'
-                print "Module doesn't exist: %s" % ( options.modName )
-                print "Default classifier used"
-                print '*******\n'
-                classifier = None
-            else:
-                module = imp.load_source( 'classifierMod', options.modName )
-                classifier = eval( 'module.%s' % ( className ) )
-        except ImportError:
-            print
-            print '*******'
-            print "Error importing the module %s" % ( options.modName )
-            print "Default classifier used"
-            print '*******\n'
-            classifier = None
-
-    convert( options.inputName, options.outputName, options.undefined, options.maxOmega, options.window, classifier )
+# translate between julich and scb data formats
+
+from julichData import JulichData
+import scbData
+import numpy as np
+try:
+    import fakeRotation
+except ImportError:
+    import sys
+    sys.path.insert( 0, '../.' )
+    import fakeRotation
+from bound import AABB2D
+from primitives import Vector2
+import imp
+import os
+
+# default location for undefined agents
+DEF_X = -1000.0
+DEF_Y = -1000.0
+
+# The target number of bytes of output frames to build at a time
+BLOCK_BYTES = 16 * 1024 * 1024
+
+class FrameSampler:
+    '''Produces the positions of every agent of julich data, frame by frame, in blocks of frames.
+    Agents that are not present in a frame are placed at a default position: before the agent
+    enters, it lies far behind its first position and after it leaves, it lies far beyond its last
+    position (both 1000 units along the direction from its first to its last position).
+
+    The frames can optionally be resampled to a different time step.  Output frame j lies at time
+    j * timeStep; the positions of the agents present at that time are linearly interpolated
+    between the two enclosing data frames.  Only the frames of the requested block are built, so
+    the memory used is independent of the length of the data.'''
+    def __init__( self, data, timeStep=None ):
+        '''Constructor.
+
+        @param      data        An instance of JulichData.
+        @param      timeStep    A float.  The time step of the produced frames.  If None, the data's
+                                own frames are produced.
+        '''
+        self.data = data
+        self.agtCount = data.agentCount()
+        # determine the start and end positions for each agent.
+        points = data.points[ :, :2 ]
+        starts = np.array( points[ data.pedOffsets[ :-1 ] ], dtype=np.float64 )
+        ends = np.array( points[ data.pedOffsets[ 1: ] - 1 ], dtype=np.float64 )
+        disp = ends - starts
+        dists = np.sqrt( np.sum( disp * disp, axis=1 ) )
+        dists.shape = (-1, 1)
+        disp /= dists
+        self.starts = starts - disp * 1000
+        self.ends = ends + disp * 1000
+        # an agent is present in the data frames [ pedStarts, pedEnds )
+        self.pedStarts = data.pedStarts
+        self.pedEnds = data.pedEnds
+
+        srcFrames = data.totalFrames()
+        if ( timeStep is None or timeStep == data.simStepSize ):
+            self.ratio = None
+            self.simStepSize = data.simStepSize
+            self.frameCount = srcFrames
+        else:
+            if ( timeStep <= 0 ):
+                raise ValueError, "The time step must be positive: %g" % ( timeStep )
+            self.ratio = timeStep / data.simStepSize
+            self.simStepSize = timeStep
+            self.frameCount = 0
+            if ( srcFrames > 0 ):
+                self.frameCount = int( np.floor( ( srcFrames - 1 ) / self.ratio + 1e-9 ) ) + 1
+
+    def totalFrames( self ):
+        '''Reports the number of frames produced'''
+        return self.frameCount
+
+    def agentCount( self ):
+        '''Reports the number of agents in every frame'''
+        return self.agtCount
+
+    def positions( self, index ):
+        '''Returns the positions of the agents in a single frame.
+
+        @param      index       An int.  The index of the frame in the range [0, totalFrames()).
+        @returns    An N x 2 numpy array of float32.
+        '''
+        return self.block( index, index + 1 )[ 0 ]
+
+    def block( self, start, end ):
+        '''Returns the positions of the agents in a contiguous range of frames.
+
+        @param      start       An int.  The first frame of the range.
+        @param      end         An int.  The frame after the last frame of the range.
+        @returns    A K x N x 2 numpy array of float32 for the K = end - start frames.
+        '''
+        if ( self.ratio is None ):
+            return self._dataFrames( np.arange( start, end ) )
+        t = np.arange( start, end ) * self.ratio
+        # snap to data frames that are only missed by rounding error
+        nearest = np.round( t )
+        snap = np.abs( t - nearest ) < 1e-9
+        t[ snap ] = nearest[ snap ]
+        lower = np.minimum( np.floor( t ).astype( np.int64 ), self.data.totalFrames() - 1 )
+        upper = np.minimum( lower + 1, self.data.totalFrames() - 1 )
+        frames = np.unique( np.concatenate( ( lower, upper ) ) )
+        data = self._dataFrames( frames )
+        p0 = data[ np.searchsorted( frames, lower ) ].astype( np.float64 )
+        p1 = data[ np.searchsorted( frames, upper ) ].astype( np.float64 )
+        weight = ( t - lower ).reshape( -1, 1, 1 )
+        positions = p0 + ( p1 - p0 ) * weight
+        # agents that enter or leave between the two data frames take the default position
+        t.shape = ( -1, 1 )
+        present = ( t >= self.pedStarts ) & ( t <= self.pedEnds - 1 )
+        absent = ~present
+        default = self._defaults( t < self.pedStarts )
+        positions[ absent ] = default[ absent ]
+        return positions.astype( np.float32 )
+
+    def _defaults( self, notEntered ):
+        '''Returns the default positions of the agents.
+
+        @param      notEntered  A K x N array of bools.  True for each frame and agent for which
+                                the agent hasn't yet entered.
+        @returns    A K x N x 2 numpy array of float64.
+        '''
+        return np.where( notEntered[ :, :, np.newaxis ], self.starts, self.ends )
+
+    def _dataFrames( self, frames ):
+        '''Returns the positions of the agents in a set of the data's frames.
+
+        @param      frames      A numpy array of K ints.  The indices of the data frames.
+        @returns    A K x N x 2 numpy array of float32.
+        '''
+        frames = np.asarray( frames, dtype=np.int64 )
+        block = self._defaults( frames.reshape( -1, 1 ) < self.pedStarts ).astype( np.float32 )
+        # gather the rows of all of the frames from the frame-major layout
+        offsets = self.data.frameOffsets
+        first = offsets[ frames ]
+        counts = offsets[ frames + 1 ] - first
+        total = int( counts.sum() )
+        if ( total ):
+            runStarts = np.cumsum( counts ) - counts
+            rows = np.arange( total ) + np.repeat( first - runStarts, counts )
+            frameIndex = np.repeat( np.arange( frames.size ), counts )
+            block[ frameIndex, self.data.frameIDs[ rows ] ] = self.data.framePositions[ rows ]
+        return block
+
+def convert( inputName, outputName, undefined, maxAngVel, angleVelWindow, classFunc=None, timeStep=None, useCache=True ):
+    '''Converts julich trajectory file to a corresponding v2.0 scb file.  The frames are built and
+    written in blocks, so the memory used doesn't depend on the number of frames.  With the
+    julich data's cache (see JulichData.readFile), the parsed input is memory-mapped as well;
+    only the parts of it which the blocks need are read.
+
+    @param      inputName       A string.  The name of the input julich file to convert.
+    @param      outputName      A string.  The name of the output SCB
+                                file to write to.
+    @param      undefined       A 2-tuple of floats.  The location to place agents with undetermined
+                                location.
+    @param      maxAngVel       A float.  The maximum allowed angular velocity.
+    @param      angleVelWindow  An int.  The size of the window (in frames) over which angular velocity
+                                is computed.
+    @param      classFunc       A callable.  If provided, it defines the per-pedestrian classification
+                                based on arbitrary arguments.  It should take a single argument:
+                                an instance of julichData.
+    @param      timeStep        A float.  If provided, the trajectories are resampled to this time
+                                step.  Otherwise, the data's frames are written.
+    @param      useCache        A boolean.  If True, the input is read through (and, if
+                                necessary, parsed into) its binary cache.
+    @raises     OSError if the input file cannot be opened.
+    '''
+    print "Converting:"
+    print "\t", inputName
+    print "to"
+    print "\t", outputName
+    X, Y = undefined
+    data = JulichData()
+    try:
+        data.readFile( inputName, useCache )
+    except OSError:
+        print '\n*** No file written!'
+        print '*** Unable to read input file:', inputName, '***'
+        return
+    print data.summary()
+
+    sampler = FrameSampler( data, timeStep )
+    agtCount = sampler.agentCount()
+    frameCount = sampler.totalFrames()
+    window = angleVelWindow
+    if ( frameCount <= window ):
+        print "\n*** FILE NOT WRITTEN!  %d frames are too few for an angular velocity window of %d ***" % ( frameCount, window )
+        return
+
+    # output file
+    ids = []
+    if ( classFunc ):
+        ids = classFunc( data )
+    try:
+        writer = scbData.SCBWriter( outputName, scbData.SCBVersion.V2_0, agtCount, sampler.simStepSize, ids )
+    except ValueError as e:
+        print "\n*** FILE NOT WRITTEN! ", e, '***'
+        return
+    print "Writing %s with %d agents and %d frames" % ( outputName, agtCount, frameCount )
+    if ( sampler.ratio is not None ):
+        print "Resampled from time step %g to %g" % ( data.simStepSize, sampler.simStepSize )
+
+    # orientation is computed as the frames are written (see fakeRotation.addOrientation)
+    blockFrames = max( 1, BLOCK_BYTES // ( agtCount * 12 ) )
+    for positions, orient in fakeRotation.orientationBlocks( sampler.block, frameCount, sampler.simStepSize * maxAngVel * window,
+                                                             window, blockFrames ):
+        block = np.empty( ( orient.shape[0], agtCount, 3 ), dtype=np.float32 )
+        block[ :, :, :2 ] = positions
+        block[ :, :, 2 ] = orient
+        writer.writeFrames( block )
+    writer.close()
+
+if __name__ == '__main__':
+
+    import optparse, sys
+    parser = optparse.OptionParser()
+    parser.set_description( 'Convert from julich to scb data' )
+    parser.add_option( '-i', '--input', help='The input julich trajectory file.',
+                       action='store', dest='inputName', default='' )
+    parser.add_option( '-o', '--output', help='The output scb file.',
+                       action='store', dest='outputName', default='' )
+    parser.add_option( '-u', '--undefinedPos', help='The location to place agents when the position is undefined.  Defaults to <%.f, %.f>' % ( DEF_X, DEF_Y ),
+                       nargs=2, action='store', type='float', dest='undefined', default=( DEF_X, DEF_Y ) )
+    parser.add_option( '-a', '--angularVelocity', help='The maximum angular velocity for introducing orientation.  Default is %f' % fakeRotation.DEF_VEL_LIMIT,
+                       action='store', type='float', dest='maxOmega', default=fakeRotation.DEF_VEL_LIMIT )
+    parser.add_option( '-w', '--window', help='Number of frames overwhich to compute angular velocity.  This smooths the signal (default is 1)',
+                       action='store', dest='window', type='int', default=1 )
+    parser.add_option( '-m', '--module', help='The name of the classification module.  It contains the classifier to use.',
+                       action='store', dest='modName', type='str', default=None )
+    parser.add_option( '-t', '--timeStep', help='Resample the trajectories to this time step (in seconds).  By default, the frames of the data are used.',
+                       action='store', dest='timeStep', type='float', default=None )
+    parser.add_option( '-n', '--noCache', help='Parse the input without reading or writing its binary cache.  The whole input is then held in memory.',
+                       action='store_false', dest='useCache', default=True )
+    parser.add_option( '-c', '--classifier', help='The name of the classification function (a callable).  If module is defined and classifier is not, the name of the callable is assumed to be "classifier".',
+                       action='store', dest='classifier', type='str', default=None )
+    options, args = parser.parse_args()
+
+    if ( options.inputName == '' ):
+        parser.print_help()
+        print '\n *** You must specify an input file.'
+        sys.exit(1)
+
+    if ( options.outputName == '' ):
+        parser.print_help()
+        print '\n *** You must specify an output file.'
+        sys.exit(1)
+
+    # try to load the classifier
+    classifier = None
+    if ( not options.modName is None ):
+        if ( options.classifier is None ):
+            className = 'classifier'
+        else:
+            className = options.classifier
+        try:
+            if ( not os.path.exists( options.modName ) ):
+                print
+                print '*******'
+                print "Module doesn't exist: %s" % ( options.modName )
+                print "Default classifier used"
+                print '*******\n'
+                classifier = None
+            else:
+                module = imp.load_source( 'classifierMod', options.modName )
+                classifier = eval( 'module.%s' % ( className ) )
+        except ImportError:
+            print
+            print '*******'
+            print "Error importing the module %s" % ( options.modName )
+            print "Default classifier used"
+            print '*******\n'
+            classifier = None
+
+    convert( options.inputName, options.outputName, options.undefined, options.maxOmega, options.window, classifier, options.timeStep,
+             options.useCache )
     
\ No newline at end of file
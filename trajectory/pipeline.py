@@ -0,0 +1,462 @@
+# Prepares scb data with a chain of transformations in a single pass.
+#
+#   Each of the standalone tools (xformTrajectory, smoothTrajectory, fakeRotation, scbSlice, ...)
+#   reads a full file and writes a full file.  A pipeline chains the same operations as stages.
+#   Every stage is a generator over consecutive blocks of frames; the stages are evaluated lazily,
+#   so the frames flow from the reader, through each stage, to the writer a block at a time.
+#
+#   A stage which needs temporal context (e.g., smoothing) declares a window: the number of frames
+#   of context it holds in addition to the block being processed.  Only that many frames are
+#   buffered by the stage; nothing else is held beyond the current block.
+
+import numpy as np
+from dataLoader import loadSCB
+from scbData import SCBWriter, SCBVersion, outputFile
+from smoothTrajectory import gaussian1D, smoothBlocks
+try:
+    import fakeRotation
+except ImportError:
+    import sys
+    sys.path.insert( 0, '../.' )
+    import fakeRotation
+
+# The default number of frames read at a time
+BLOCK_FRAMES = 1024
+
+class FrameInfo:
+    '''The description of a stream of scb frames: everything the writer needs for the header.'''
+    def __init__( self, version, agentCount, simStepSize, ids=None ):
+        '''Constructor.
+
+        @param      version         A string.  The scb version of the frames (see SCBVersion).
+        @param      agentCount      An int.  The number of agents in each frame.
+        @param      simStepSize     A float.  The duration of a frame.
+        @param      ids             An optional numpy array of ints.  The class id of each agent.
+        '''
+        self.version = version
+        self.agentCount = agentCount
+        self.simStepSize = simStepSize
+        self.ids = ids
+
+    def __str__( self ):
+        return "Version %s, %d agents, time step %g" % ( self.version, self.agentCount, self.simStepSize )
+
+    @staticmethod
+    def fromFrameSet( frameSet ):
+        '''Describes the frames of a frame set.
+
+        @param      frameSet        An instance of NPFrameSet (or anything loadSCB returns).
+        @returns    An instance of FrameInfo.
+        '''
+        agentCount = frameSet.agentCount()
+        ids = frameSet.ids
+        if ( ids is not None and len( ids ) != agentCount ):
+            # the frame set only reads a subset of its agents
+            ids = frameSet.ids[ :agentCount * frameSet.readAgtStride:frameSet.readAgtStride ]
+        timeStep = frameSet.simStepSize
+        if ( timeStep < 0 ):
+            timeStep = 0.1
+        return FrameInfo( frameSet.version, agentCount, timeStep, ids )
+
+    def copy( self ):
+        '''Returns a copy of this description.'''
+        return FrameInfo( self.version, self.agentCount, self.simStepSize, self.ids )
+
+    def is3D( self ):
+        '''Reports if the frames are 3D (positions in columns 0 and 2, orientation in 3).'''
+        return self.version == SCBVersion.V2_4
+
+    def hasScalarOrient( self ):
+        '''Reports if the orientation is a single angle.'''
+        return self.version != SCBVersion.V2_3
+
+    def fieldCount( self ):
+        '''Reports the number of floats per agent.'''
+        return SCBVersion.AGENT_BYTE_SIZE[ self.version ] / 4
+
+    def writer( self, fileName ):
+        '''Creates a writer for frames with this description.
+
+        @param      fileName        A string.  The path to the scb file to write.
+        @returns    An instance of SCBWriter.
+        '''
+        return SCBWriter( fileName, self.version, self.agentCount, self.simStepSize, self.ids )
+
+class Stage:
+    '''The base class of a pipeline stage.  A stage transforms a stream of consecutive blocks of
+    frames into another stream of consecutive blocks of frames.'''
+    # The number of frames of temporal context the stage holds beyond the current block
+    window = 0
+
+    def describe( self, info ):
+        '''Describes the frames this stage produces.
+
+        @param      info        An instance of FrameInfo.  The description of the input frames.
+        @returns    An instance of FrameInfo.  The description of the output frames.
+        @raises     ValueError if the stage can't process the input frames.
+        '''
+        return info
+
+    def stream( self, blocks, info ):
+        '''Transforms the blocks of frames.
+
+        @param      blocks      An iterable of numpy arrays of floats with shape (k, N, M).  The
+                                consecutive frames of N agents with M floats per agent.  The
+                                stage must not modify them.
+        @param      info        An instance of FrameInfo.  The description of the input frames.
+        @returns    A generator of numpy arrays of floats with shape (k', N', M').  The
+                    transformed frames, in order.
+        '''
+        raise NotImplementedError
+
+class XformStage( Stage ):
+    '''Transforms the agent positions (see TrajXform).'''
+    def __init__( self, xform ):
+        '''Constructor.
+
+        @param      xform       An instance of TrajXform.
+        '''
+        self.xform = xform
+
+    def __str__( self ):
+        return str( self.xform )
+
+    def describe( self, info ):
+        if ( self.xform.tz != 0.0 and not info.is3D() ):
+            raise ValueError, "Z-translation not supported for 2D trajectories"
+        return info
+
+    def stream( self, blocks, info ):
+        for block in blocks:
+            block = np.array( block, dtype=np.float32 )
+            self.xform.applyFrames( block, info.is3D() )
+            yield block
+
+class SliceStage( Stage ):
+    '''Selects a range of frames and a subset of the agents (see scbCopy.copySCB).  Once the last
+    frame of the range has passed, no more frames are requested from the earlier stages.'''
+    def __init__( self, startFrame=0, maxFrames=-1, agents=None ):
+        '''Constructor.
+
+        @param      startFrame      An int.  The first frame to keep.
+        @param      maxFrames       An int.  The maximum number of frames to keep (-1 for all).
+        @param      agents          An optional sequence of ints.  The indices of the agents to
+                                    keep, in output order.  If None, all agents are kept.
+        '''
+        self.startFrame = max( 0, startFrame )
+        self.maxFrames = maxFrames
+        self.agents = None
+        if ( agents is not None ):
+            self.agents = np.asarray( agents, dtype=np.int64 )
+
+    def __str__( self ):
+        s = "Slice: frames from %d" % self.startFrame
+        if ( self.maxFrames >= 0 ):
+            s += " (at most %d)" % self.maxFrames
+        if ( self.agents is not None ):
+            s += ", %d agents" % self.agents.size
+        return s
+
+    def describe( self, info ):
+        if ( self.agents is None ):
+            return info
+        if ( self.agents.size and ( self.agents.min() < 0 or self.agents.max() >= info.agentCount ) ):
+            raise ValueError, "Agent indices must lie in the range [0, %d)" % ( info.agentCount )
+        info = info.copy()
+        info.agentCount = self.agents.size
+        if ( info.ids is not None ):
+            info.ids = np.asarray( info.ids )[ self.agents ]
+        return info
+
+    def stream( self, blocks, info ):
+        end = None
+        if ( self.maxFrames >= 0 ):
+            end = self.startFrame + self.maxFrames
+        # the index of the first frame of the current block
+        frame = 0
+        for block in blocks:
+            first = max( 0, self.startFrame - frame )
+            last = block.shape[0]
+            if ( end is not None ):
+                last = min( last, end - frame )
+            frame += block.shape[0]
+            if ( first < last ):
+                block = block[ first:last ]
+                if ( self.agents is not None ):
+                    block = block[ :, self.agents, : ]
+                yield block
+            if ( end is not None and frame >= end ):
+                # nothing more is read
+                return
+
+class SubsampleStage( Stage ):
+    '''Keeps every frameStep-th frame, starting with the first.  The time step grows accordingly.'''
+    def __init__( self, frameStep ):
+        '''Constructor.
+
+        @param      frameStep       An int.  The number of input frames per output frame.
+        @raises     ValueError if the frame step is not positive.
+        '''
+        if ( frameStep < 1 ):
+            raise ValueError, "The frame step must be positive: %d" % ( frameStep )
+        self.frameStep = frameStep
+
+    def __str__( self ):
+        return "Subsample: every %d frames" % self.frameStep
+
+    def describe( self, info ):
+        info = info.copy()
+        info.simStepSize *= self.frameStep
+        return info
+
+    def stream( self, blocks, info ):
+        frame = 0
+        for block in blocks:
+            # the first kept frame of the block
+            first = ( -frame ) % self.frameStep
+            frame += block.shape[0]
+            if ( first < block.shape[0] ):
+                yield block[ first::self.frameStep ]
+
+class SmoothStage( Stage ):
+    '''Smooths the positions or the orientation with a gaussian kernel (see smoothBlocks).'''
+    def __init__( self, sigma, smoothOrient=False, threshSqd=1.0 ):
+        '''Constructor.
+
+        @param      sigma           A float.  The size of the standard deviation (in frames).
+        @param      smoothOrient    A bool.  If true, the orientation is smoothed. If false,
+                                    position.
+        @param      threshSqd       The maximum SQUARED displacement between two subsequent
+                                    positions that is considered to be continuous.
+        '''
+        self.sigma = sigma
+        self.smoothOrient = smoothOrient
+        self.threshSqd = threshSqd
+        self.kernel = gaussian1D( sigma, 1.0 )
+        # smoothBlocks holds this many frames on either side of the frames it produces
+        self.window = 2 * ( self.kernel.size + 1 )
+
+    def __str__( self ):
+        return "Smooth: %s with sigma %g" % ( 'orientation' if self.smoothOrient else 'position', self.sigma )
+
+    def describe( self, info ):
+        if ( self.smoothOrient and not info.hasScalarOrient() ):
+            raise ValueError, "Cannot smooth orientation for data with non-scalar orientation"
+        return info
+
+    def stream( self, blocks, info ):
+        return smoothBlocks( blocks, self.kernel, info.is3D(), self.smoothOrient, self.threshSqd )
+
+class OrientationStage( Stage ):
+    '''Replaces the orientation with one computed from the direction of travel, subject to a
+    maximum angular velocity (see fakeRotation.orientationStream).  Only window frames are held:
+    the initial direction of each agent is its displacement window frames after the first frame
+    (or, for an agent which hasn't moved by then, the direction it has).'''
+    def __init__( self, maxVel=fakeRotation.DEF_VEL_LIMIT, window=1, version=None ):
+        '''Constructor.
+
+        @param      maxVel      A float.  The maximum angular velocity (in radians/s).
+        @param      window      An int.  The number of frames over which angular velocity is
+                                computed.
+        @param      version     A string.  The version of the output frames (see
+                                fakeRotation.orientationLayout).
+        '''
+        self.maxVel = maxVel
+        self.window = window
+        self.version = version
+
+    def __str__( self ):
+        return "Orientation: maximum angular velocity %g radians/s over %d frames" % ( self.maxVel, self.window )
+
+    def describe( self, info ):
+        info = info.copy()
+        info.version = fakeRotation.orientationLayout( info.version, info.is3D(), self.version )[ 0 ]
+        return info
+
+    def stream( self, blocks, info ):
+        version, posCols, copyCols, orientCol = fakeRotation.orientationLayout( info.version, info.is3D(),
+                                                                                self.version )
+        fieldCount = SCBVersion.AGENT_BYTE_SIZE[ version ] / 4
+        maxThetaDelta = info.simStepSize * self.maxVel * self.window
+        for frames, orient in fakeRotation.orientationStream( blocks, maxThetaDelta, self.window, posCols ):
+            block = np.zeros( ( frames.shape[0], frames.shape[1], fieldCount ), dtype=np.float32 )
+            block[ :, :, copyCols ] = frames[ :, :, copyCols ]
+            block[ :, :, orientCol ] = orient
+            yield block
+
+class Pipeline:
+    '''A chain of stages evaluated in a single streaming pass.'''
+    def __init__( self, stages=None ):
+        '''Constructor.
+
+        @param      stages      An optional list of Stage instances, in the order they're applied.
+        '''
+        self.stages = []
+        if ( stages is not None ):
+            self.stages.extend( stages )
+
+    def __str__( self ):
+        return '\n'.join( [ 'Pipeline:' ] + [ '\t%s' % s for s in self.stages ] )
+
+    def append( self, stage ):
+        '''Adds a stage to the end of the pipeline.
+
+        @param      stage       An instance of Stage.
+        @returns    The pipeline (so that appends can be chained).
+        '''
+        self.stages.append( stage )
+        return self
+
+    def window( self ):
+        '''Reports the total number of frames of temporal context the stages hold.'''
+        return sum( stage.window for stage in self.stages )
+
+    def describe( self, info ):
+        '''Describes the frames the pipeline produces.
+
+        @param      info        An instance of FrameInfo.  The description of the input frames.
+        @returns    An instance of FrameInfo.
+        @raises     ValueError if a stage can't process its input frames.
+        '''
+        for stage in self.stages:
+            info = stage.describe( info )
+        return info
+
+    def stream( self, frameSet, blockFrames=BLOCK_FRAMES ):
+        '''Chains the stages onto the remaining frames of a frame set.  Nothing is read until the
+        resulting blocks are requested.
+
+        @param      frameSet        An instance of NPFrameSet (or anything loadSCB returns).
+        @param      blockFrames     An int.  The number of frames read at a time.
+        @returns    A 2-tuple: ( info, blocks ).  The FrameInfo of the output frames and a
+                    generator of its consecutive blocks of frames.
+        @raises     ValueError if a stage can't process its input frames.
+        '''
+        info = FrameInfo.fromFrameSet( frameSet )
+        blocks = ( block for block, indices in frameSet.iterBlocks( blockFrames ) )
+        for stage in self.stages:
+            # each stage is checked before any frame is read
+            outInfo = stage.describe( info )
+            blocks = stage.stream( blocks, info )
+            info = outInfo
+        return info, blocks
+
+    def run( self, inName, outName, blockFrames=BLOCK_FRAMES ):
+        '''Applies the pipeline to scb data, writing the result to an scb file.
+
+        @param      inName          A string.  The path to the scb data (see loadSCB).
+        @param      outName         A string.  The path to the scb file to write.  It can be the
+                                    input file; the input is only replaced once the output is
+                                    complete.
+        @param      blockFrames     An int.  The number of frames read at a time.
+        @returns    An int.  The number of frames written.
+        @raises     SCBError if the input is not scb data.
+        @raises     ValueError if a stage can't process its input frames.
+        '''
+        data = loadSCB( inName )
+        # the input is read while the output is written, so overwriting goes through a
+        # temporary file
+        with outputFile( inName, outName ) as writeName:
+            try:
+                data.setNext( 0 )
+                info, blocks = self.stream( data, blockFrames )
+                writer = info.writer( writeName )
+                try:
+                    for block in blocks:
+                        writer.writeFrames( block )
+                finally:
+                    frameCount = writer.close()
+            finally:
+                data.close()
+        return frameCount
+
+def main():
+    import optparse, sys
+    from xform import TrajXform
+    from scbCopy import agentSelection
+    parser = optparse.OptionParser()
+    parser.set_description( 'Prepares an scb file in a single pass.  The selected operations are applied in the order: slice, subsample, translate, smooth and orientation.' )
+    parser.add_option( '-i', '--input', help='The name of the scb file to prepare (required)',
+                       action='store', dest='inFileName', default=None )
+    parser.add_option( '-o', '--output', help='The name of the output scb file (defaults to overwriting the input file)',
+                       action='store', dest='outFileName', default=None )
+    parser.add_option( '-b', '--blockFrames', help='The number of frames read at a time (default is %d)' % BLOCK_FRAMES,
+                       action='store', dest='blockFrames', type='int', default=BLOCK_FRAMES )
+
+    group = optparse.OptionGroup( parser, 'Slice', 'Selects a range of frames and a subset of agents' )
+    group.add_option( '-s', '--start', help='The first frame to keep (default is 0)',
+                      action='store', dest='start', type='int', default=0 )
+    group.add_option( '-m', '--maxFrames', help='The maximum number of frames to keep (default is all)',
+                      action='store', dest='maxFrames', type='int', default=-1 )
+    group.add_option( '-a', '--maxAgents', help='The maximum number of agents to keep (default is all)',
+                      action='store', dest='maxAgents', type='int', default=-1 )
+    group.add_option( '', '--agentStep', help='Keep every agentStep-th agent (default is 1)',
+                      action='store', dest='agentStep', type='int', default=1 )
+    group.add_option( '-f', '--frameStep', help='Keep every frameStep-th frame (default is 1)',
+                      action='store', dest='frameStep', type='int', default=1 )
+    parser.add_option_group( group )
+
+    group = optparse.OptionGroup( parser, 'Translate' )
+    group.add_option( '-x', '--xTranslate', help='The amount to move the trajectories along the x-axis',
+                      action='store', dest='x', default=0.0, type='float' )
+    group.add_option( '-y', '--yTranslate', help='The amount to move the trajectories along the y-axis',
+                      action='store', dest='y', default=0.0, type='float' )
+    group.add_option( '-z', '--zTranslate', help='The amount to move the trajectories along the z-axis (3D data only)',
+                      action='store', dest='z', default=0.0, type='float' )
+    parser.add_option_group( group )
+
+    group = optparse.OptionGroup( parser, 'Smooth' )
+    group.add_option( '', '--sigma', help='Smooth with a gaussian kernel with this standard deviation (in frames)',
+                      action='store', dest='sigma', type='float', default=None )
+    group.add_option( '', '--heading', help='Smooth the heading instead of the position',
+                      action='store_true', dest='smoothHeading', default=False )
+    parser.add_option_group( group )
+
+    group = optparse.OptionGroup( parser, 'Orientation' )
+    group.add_option( '-r', '--orient', help='Compute the orientation from the direction of travel',
+                      action='store_true', dest='orient', default=False )
+    group.add_option( '', '--angularVelocity', help='The maximum angular velocity allowed (in radians/s).  Default is %g' % fakeRotation.DEF_VEL_LIMIT,
+                      action='store', dest='velocity', type='float', default=fakeRotation.DEF_VEL_LIMIT )
+    group.add_option( '-w', '--window', help='Number of frames over which to compute angular velocity (default is 1)',
+                      action='store', dest='window', type='int', default=1 )
+    group.add_option( '-v', '--version', help='The version of the output scb file.  Defaults to 2.1 (2.4 for 3D data)',
+                      action='store', dest='version', default=None )
+    parser.add_option_group( group )
+
+    options, args = parser.parse_args()
+
+    if ( options.inFileName is None ):
+        parser.print_help()
+        print '\n!!! You must specify an input file'
+        sys.exit( 1 )
+    outName = options.outFileName
+    if ( outName is None ):
+        outName = options.inFileName
+
+    pipeline = Pipeline()
+    agents = None
+    if ( options.maxAgents > 0 or options.agentStep > 1 ):
+        data = loadSCB( options.inFileName )
+        agentCount = data.agentCount()
+        data.close()
+        agents = agentSelection( agentCount, options.maxAgents, options.agentStep )
+    if ( options.start > 0 or options.maxFrames >= 0 or agents is not None ):
+        pipeline.append( SliceStage( options.start, options.maxFrames, agents ) )
+    if ( options.frameStep > 1 ):
+        pipeline.append( SubsampleStage( options.frameStep ) )
+    if ( options.x != 0.0 or options.y != 0.0 or options.z != 0.0 ):
+        xform = TrajXform()
+        xform.setTranslate( options.x, options.y, options.z )
+        pipeline.append( XformStage( xform ) )
+    if ( options.sigma is not None ):
+        pipeline.append( SmoothStage( options.sigma, options.smoothHeading ) )
+    if ( options.orient ):
+        pipeline.append( OrientationStage( options.velocity, options.window, options.version ) )
+
+    print pipeline
+    print "\tFrames of temporal context:", pipeline.window()
+    frameCount = pipeline.run( options.inFileName, outName, options.blockFrames )
+    print "Wrote %d frames to %s" % ( frameCount, outName )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,466 @@
+# A compressed container for scb data.
+#
+#   The frames of an scb file are grouped into chunks of a fixed number of frames and each chunk
+#   is compressed independently.  A table of chunk offsets at the end of the file allows any frame
+#   to be reached by decompressing only the chunk that contains it.
+#
+#   File layout:
+#       header (see HEADER)
+#       class id for each agent (int32)
+#       compressed chunks
+#       chunk offset table: chunk count + 1 int64 values (the last is the end of the last chunk)
+#
+#   Before compression, each chunk can optionally be preconditioned (losslessly):
+#       delta:      Each frame is replaced by its difference from the previous frame in the chunk.
+#                   The difference is computed on the integer bit patterns of the floats, so it
+#                   is exactly reversible.
+#       shuffle:    The bytes of the floats are re-ordered so that all of the first bytes come
+#                   first, then all the second bytes, etc.
+#   Both make smooth trajectories much more compressible.
+
+import bz2
+import os
+import struct
+import zlib
+import numpy as np
+import commonData
+from scbData import SCBVersion, SCBError, SCBWriter, NPFrameSet, IDMap
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = 'SCBZ'
+FORMAT_VERSION = 1
+# magic, format version, scb version, agent count, floats per agent, frame count, frames per chunk,
+#   codec, preconditioning flags, time step, offset of the chunk table
+HEADER = '<4si4siiqiiifq'
+# The byte offsets of the values which are only known once all frames have been written
+FRAME_COUNT_OFFSET = 20
+TABLE_OFFSET_OFFSET = 44
+
+# preconditioning flags
+DELTA = 1
+SHUFFLE = 2
+
+# the codec identifiers stored in the file
+ZLIB = 0
+BZ2 = 1
+LZMA = 2
+ZSTD = 3
+CODEC_NAMES = { 'zlib':ZLIB, 'bz2':BZ2, 'lzma':LZMA, 'zstd':ZSTD }
+
+DEFAULT_CHUNK_FRAMES = 64
+
+def availableCodecs():
+    '''Reports the names of the codecs that can be used in this python installation'''
+    names = [ 'zlib', 'bz2' ]
+    if ( lzma is not None ):
+        names.append( 'lzma' )
+    if ( zstandard is not None ):
+        names.append( 'zstd' )
+    return names
+
+def _compress( data, codec, level ):
+    '''Compresses a string of bytes with the given codec'''
+    if ( codec == ZLIB ):
+        return zlib.compress( data, level )
+    elif ( codec == BZ2 ):
+        return bz2.compress( data, max( 1, level ) )
+    elif ( codec == LZMA and lzma is not None ):
+        return lzma.compress( data, preset=level )
+    elif ( codec == ZSTD and zstandard is not None ):
+        return zstandard.ZstdCompressor( level=level ).compress( data )
+    raise ValueError, "Codec %d is not available" % ( codec )
+
+def _decompress( data, codec ):
+    '''Decompresses a string of bytes with the given codec'''
+    if ( codec == ZLIB ):
+        return zlib.decompress( data )
+    elif ( codec == BZ2 ):
+        return bz2.decompress( data )
+    elif ( codec == LZMA and lzma is not None ):
+        return lzma.decompress( data )
+    elif ( codec == ZSTD and zstandard is not None ):
+        return zstandard.ZstdDecompressor().decompress( data )
+    raise SCBError, "The file requires codec %d which is not available" % ( codec )
+
+def precondition( block, flags ):
+    '''Losslessly transforms a block of frames into a more compressible byte string.
+
+    @param      block       A numpy array of float32 of shape (K, N, M).
+    @param      flags       An int.  A combination of DELTA and SHUFFLE.
+    @returns    A string.  The transformed bytes.
+    '''
+    bits = np.ascontiguousarray( block, dtype=np.float32 ).view( np.uint32 )
+    if ( flags & DELTA ):
+        bits = bits.copy()
+        bits[ 1: ] -= bits[ :-1 ].copy()
+    data = bits.reshape( -1 ).view( np.uint8 )
+    if ( flags & SHUFFLE ):
+        data = data.reshape( -1, 4 ).T
+    return data.tostring()
+
+def restore( data, flags, shape ):
+    '''Inverts precondition.
+
+    @param      data        A string.  The preconditioned bytes.
+    @param      flags       An int.  The flags given to precondition.
+    @param      shape       A 3-tuple of ints.  The shape (K, N, M) of the original block.
+    @returns    A numpy array of float32 with the given shape.
+    '''
+    bytes = np.fromstring( data, np.uint8 )
+    if ( flags & SHUFFLE ):
+        bytes = np.ascontiguousarray( bytes.reshape( 4, -1 ).T )
+    bits = bytes.view( np.uint32 ).reshape( shape )
+    if ( flags & DELTA ):
+        bits = np.cumsum( bits, axis=0, dtype=np.uint32 )
+    return bits.view( np.float32 )
+
+class CompressedSCBWriter:
+    '''Writes the compressed scb container incrementally.  Frames are buffered until a chunk
+    is full; close() writes the final partial chunk and the chunk table.'''
+    def __init__( self, fileName, version, agentCount, timeStep=0.1, ids=None,
+                  chunkFrames=DEFAULT_CHUNK_FRAMES, codec='zlib', level=6, delta=True, shuffle=True ):
+        '''Constructor.
+
+        @param      fileName        A string.  The path to the file to write.
+        @param      version         A string.  The scb version of the data (see SCBVersion).
+        @param      agentCount      An int.  The number of agents in every frame.
+        @param      timeStep        A float.  The duration of a frame.
+        @param      ids             An optional list of ints.  The class id of each agent.  If not
+                                    provided, every agent gets class id 0.
+        @param      chunkFrames     An int.  The number of frames compressed together.
+        @param      codec           A string.  The name of the codec (see availableCodecs).
+        @param      level           An int.  The compression level passed to the codec.
+        @param      delta           A bool.  If True, frames are delta-encoded before compression.
+        @param      shuffle         A bool.  If True, bytes are shuffled before compression.
+        @raises     ValueError if the version or codec is unrecognized or the ids don't
+                    match the agents.
+        '''
+        if ( not version in SCBVersion.VERSIONS ):
+            raise ValueError, "Invalid write version for data: %s" % ( version )
+        if ( not codec in availableCodecs() ):
+            raise ValueError, "Unavailable codec: %s.  Use one of: %s" % ( codec, ', '.join( availableCodecs() ) )
+        if ( ids is None or len( ids ) == 0 ):
+            ids = np.zeros( agentCount, dtype=np.int32 )
+        elif ( len( ids ) != agentCount ):
+            raise ValueError, "The class id list doesn't match the number of agents.  %d ids for %d agents" % ( len( ids ), agentCount )
+        self.version = version
+        self.agentCount = agentCount
+        self.fieldCount = SCBVersion.AGENT_BYTE_SIZE[ version ] / 4
+        self.chunkFrames = chunkFrames
+        self.codec = CODEC_NAMES[ codec ]
+        self.level = level
+        self.flags = ( DELTA if delta else 0 ) | ( SHUFFLE if shuffle else 0 )
+        self.frameCount = 0
+        self.pending = []           # frames not yet compressed
+        self.pendingCount = 0
+        self.file = open( fileName, 'wb' )
+        self.file.write( struct.pack( HEADER, MAGIC, FORMAT_VERSION, '%s\x00' % version,
+                                      agentCount, self.fieldCount, 0, chunkFrames, self.codec,
+                                      self.flags, timeStep, 0 ) )
+        self.file.write( np.asarray( ids, dtype=np.int32 ).tostring() )
+        self.offsets = [ self.file.tell() ]
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, excType, excValue, traceback ):
+        self.close()
+
+    def writeFrame( self, frame ):
+        '''Appends a single (N, M) frame (see SCBWriter.writeFrame).'''
+        self.writeFrames( frame[ np.newaxis, :, : ] )
+
+    def writeFrames( self, block ):
+        '''Appends a (K, N, M) block of frames (see SCBWriter.writeFrames).'''
+        if ( block.shape[1] != self.agentCount ):
+            raise ValueError, "Frames have %d agents; the file has %d" % ( block.shape[1], self.agentCount )
+        if ( block.shape[2] < self.fieldCount ):
+            raise ValueError, "Version %s requires %d floats per agent" % ( self.version, self.fieldCount )
+        block = block[ :, :, :self.fieldCount ]
+        while ( block.shape[0] ):
+            take = min( block.shape[0], self.chunkFrames - self.pendingCount )
+            self.pending.append( np.array( block[ :take ], dtype=np.float32 ) )
+            self.pendingCount += take
+            block = block[ take: ]
+            if ( self.pendingCount == self.chunkFrames ):
+                self._writeChunk()
+
+    def writeArray( self, array ):
+        '''Appends the frames of an N X M X K array (see SCBWriter.writeArray).'''
+        for start in xrange( 0, array.shape[2], self.chunkFrames ):
+            self.writeFrames( array[ :, :, start:start + self.chunkFrames ].transpose( 2, 0, 1 ) )
+
+    def _writeChunk( self ):
+        '''Compresses and writes the pending frames as one chunk'''
+        if ( not self.pendingCount ):
+            return
+        block = np.concatenate( self.pending, axis=0 )
+        self.file.write( _compress( precondition( block, self.flags ), self.codec, self.level ) )
+        self.offsets.append( self.file.tell() )
+        self.frameCount += self.pendingCount
+        self.pending = []
+        self.pendingCount = 0
+
+    def close( self ):
+        '''Finalizes the file.
+
+        @returns    An int.  The number of frames written.
+        '''
+        if ( self.file.closed ):
+            return self.frameCount
+        self._writeChunk()
+        tableOffset = self.file.tell()
+        self.file.write( np.array( self.offsets, dtype=np.int64 ).tostring() )
+        self.file.seek( FRAME_COUNT_OFFSET )
+        self.file.write( struct.pack( '<q', self.frameCount ) )
+        self.file.seek( TABLE_OFFSET_OFFSET )
+        self.file.write( struct.pack( '<q', tableOffset ) )
+        self.file.close()
+        return self.frameCount
+
+class CompressedFrameSet:
+    '''A frame set for the compressed scb container.  It offers the same interface as
+    NPFrameSet.  Only the chunk containing the requested frame is decompressed and the most
+    recently decompressed chunk is kept for the following frames.'''
+    def __init__( self, fileName ):
+        '''Constructor.
+
+        @param      fileName        A string.  The path to the compressed file.
+        @raises     SCBError if the file is not a compressed scb file.
+        '''
+        self.fileName = fileName
+        self.file = open( fileName, 'rb' )
+        headerSize = struct.calcsize( HEADER )
+        try:
+            ( magic, formatVersion, version, self.agtCount, self.colCount, self.frameCount,
+              self.chunkFrames, self.codec, self.flags, self.simStepSize, tableOffset ) = \
+              struct.unpack( HEADER, self.file.read( headerSize ) )
+        except struct.error:
+            raise SCBError, "Not a compressed scb file: %s" % ( fileName )
+        if ( magic != MAGIC or formatVersion > FORMAT_VERSION ):
+            raise SCBError, "Not a compressed scb file: %s" % ( fileName )
+        self.version = version.rstrip( '\x00' )
+        self.agentByteSize = self.colCount * 4
+        self.is3D = self.version == SCBVersion.V2_4
+        self.hasScalarOrient = self.version != SCBVersion.V2_3
+        self.ids = np.fromstring( self.file.read( 4 * self.agtCount ), np.int32 ).tolist()
+        chunkCount = ( self.frameCount + self.chunkFrames - 1 ) // self.chunkFrames
+        self.file.seek( tableOffset )
+        self.offsets = np.fromstring( self.file.read( 8 * ( chunkCount + 1 ) ), np.int64 )
+        self.chunkIndex = -1
+        self.chunk = None
+        self.currFrame = None
+        self.currFrameIndex = -1
+
+    @staticmethod
+    def isValid( fileName ):
+        '''Reports if the given file is a compressed scb file.
+
+        @param      fileName        A string.  The name of the file to check.
+        @returns    A boolean.  True if the file starts with the container's magic number.
+        '''
+        with open( fileName, 'rb' ) as f:
+            return f.read( 4 ) == MAGIC
+
+    def getType( self ):
+        '''Returns the identifier for this type of trajectory data.
+
+        @returns        An enumeration representing the scb data.
+        '''
+        return commonData.SCB_DATA
+
+    def summary( self ):
+        '''Creates a simple summary of the trajectory data'''
+        s = 'Compressed SCB Trajectory data'
+        s += '\n\t%d pedestrians' % self.agentCount()
+        s += '\n\t%d frames of  data' % self.totalFrames()
+        s += '\n\t%d frames per chunk' % self.chunkFrames
+        return s
+
+    def getClasses( self ):
+        '''Returns a dictionary mapping class id to each agent with that class'''
+        ids = {}
+        for i, id in enumerate( self.ids ):
+            ids.setdefault( id, [] ).append( i )
+        return ids
+
+    def agentCount( self ):
+        '''Returns the agent count'''
+        return self.agtCount
+
+    def totalFrames( self ):
+        '''Reports the total number of frames in the file'''
+        return self.frameCount
+
+    def hasStateData( self ):
+        '''Reports if the scb data contains state data'''
+        return self.version == SCBVersion.V2_1 or self.version == SCBVersion.V2_2
+
+    def getFrameIds( self ):
+        '''Returns a mapping from index in the frame to global identifier'''
+        return IDMap( self.agentCount() )
+
+    def _loadChunk( self, chunkIndex ):
+        '''Makes the given chunk the current, decompressed chunk'''
+        if ( chunkIndex != self.chunkIndex ):
+            start, end = self.offsets[ chunkIndex ], self.offsets[ chunkIndex + 1 ]
+            self.file.seek( start )
+            data = _decompress( self.file.read( end - start ), self.codec )
+            frames = min( self.chunkFrames, self.frameCount - chunkIndex * self.chunkFrames )
+            self.chunk = restore( data, self.flags, ( frames, self.agtCount, self.colCount ) )
+            self.chunkIndex = chunkIndex
+        return self.chunk
+
+    def frame( self, index ):
+        '''Returns the indicated frame.
+
+        @param      index       An int.  The index of the frame in the range [0, totalFrames()).
+        @returns    A numpy array of shape (N, M).
+        @raises     IndexError if the index is out of range.
+        '''
+        if ( index < 0 or index >= self.frameCount ):
+            raise IndexError, "Frame %d is outside the range [0, %d)" % ( index, self.frameCount )
+        chunkIndex, offset = divmod( index, self.chunkFrames )
+        return self._loadChunk( chunkIndex )[ offset ]
+
+    def setNext( self, index ):
+        """Sets the set so that the call to next frame will return frame index"""
+        if ( index < 0 ):
+            index = 0
+        self.currFrameIndex = index - 1
+
+    def next( self, stride=1 ):
+        """Returns the next frame in sequence from current point"""
+        nextIndex = self.currFrameIndex + stride
+        if ( nextIndex >= self.frameCount ):
+            raise StopIteration
+        self.currFrame = self.frame( nextIndex )
+        self.currFrameIndex = nextIndex
+        return self.currFrame, self.currFrameIndex
+
+    def prev( self, stride=1 ):
+        """Returns the previous frame in sequence from current point"""
+        if ( self.currFrameIndex >= stride ):
+            self.currFrameIndex -= stride
+            self.currFrame = self.frame( self.currFrameIndex )
+        return self.currFrame, self.currFrameIndex
+
+    def nextBlock( self, k ):
+        """Returns up to the next k frames (see NPFrameSet.nextBlock).  A block never spans
+        more than one chunk, so fewer than k frames may be returned before the end of the data."""
+        start = self.currFrameIndex + 1
+        if ( start >= self.frameCount ):
+            raise StopIteration
+        chunkIndex, offset = divmod( start, self.chunkFrames )
+        block = self._loadChunk( chunkIndex )[ offset:offset + k ]
+        self.currFrameIndex += block.shape[0]
+        return block, np.arange( start, start + block.shape[0] )
+
+    def iterBlocks( self, k ):
+        """Iterates through the remaining frames in blocks of at most k frames."""
+        while ( True ):
+            try:
+                block, indices = self.nextBlock( k )
+            except StopIteration:
+                return
+            yield block, indices
+
+    def fullData( self ):
+        """Returns an N X M X K array consisting of all trajectory info for the frame set, for
+        N agents, M floats per agent and K time steps"""
+        data = np.empty( ( self.agtCount, self.colCount, self.frameCount ), dtype=np.float32 )
+        for c in xrange( len( self.offsets ) - 1 ):
+            chunk = self._loadChunk( c )
+            start = c * self.chunkFrames
+            data[ :, :, start:start + chunk.shape[0] ] = chunk.transpose( 1, 2, 0 )
+        return data
+
+    def close( self ):
+        '''Closes the file'''
+        self.chunk = None
+        self.file.close()
+
+def compressSCB( scbFile, outFile, chunkFrames=DEFAULT_CHUNK_FRAMES, codec='zlib', level=6, delta=True, shuffle=True ):
+    '''Writes a compressed copy of an scb file.  The input is streamed one chunk at a time.
+
+    @param      scbFile         A string.  The path to the scb file.
+    @param      outFile         A string.  The path to the compressed file to write.
+    @param      chunkFrames     An int.  The number of frames compressed together.
+    @param      codec           A string.  The name of the codec (see availableCodecs).
+    @param      level           An int.  The compression level.
+    @param      delta           A bool.  Whether frames are delta-encoded before compression.
+    @param      shuffle         A bool.  Whether bytes are shuffled before compression.
+    @returns    An int.  The number of frames written.
+    '''
+    frames = NPFrameSet( scbFile )
+    timeStep = frames.simStepSize if frames.simStepSize >= 0 else 0.1
+    writer = CompressedSCBWriter( outFile, frames.version, frames.agentCount(), timeStep,
+                                  frames.ids, chunkFrames, codec, level, delta, shuffle )
+    for block, indices in frames.iterBlocks( chunkFrames ):
+        writer.writeFrames( block )
+    frames.close()
+    return writer.close()
+
+def decompressSCB( inFile, scbFile ):
+    '''Writes the data of a compressed file as a standard scb file.
+
+    @param      inFile          A string.  The path to the compressed file.
+    @param      scbFile         A string.  The path to the scb file to write.
+    @returns    An int.  The number of frames written.
+    '''
+    frames = CompressedFrameSet( inFile )
+    writer = SCBWriter.fromFrameSet( scbFile, frames )
+    for block, indices in frames.iterBlocks( frames.chunkFrames ):
+        writer.writeFrames( block )
+    frames.close()
+    return writer.close()
+
+def main():
+    import optparse, sys
+    parser = optparse.OptionParser()
+    parser.set_description( 'Compresses an scb file into a chunked container (or restores it with --decompress).' )
+    parser.add_option( '-i', '--in', help='The name of the input file',
+                       action='store', dest='inFileName', default='' )
+    parser.add_option( '-o', '--out', help='The name of the output file',
+                       action='store', dest='outFileName', default='' )
+    parser.add_option( '-d', '--decompress', help='Restore a compressed file to a standard scb file',
+                       action='store_true', dest='decompress', default=False )
+    parser.add_option( '-c', '--codec', help='The compression codec: %s.  Default is zlib' % ( ', '.join( availableCodecs() ) ),
+                       action='store', dest='codec', default='zlib' )
+    parser.add_option( '-l', '--level', help='The compression level.  Default is 6',
+                       action='store', dest='level', type='int', default=6 )
+    parser.add_option( '-f', '--chunkFrames', help='The number of frames per compressed chunk.  Default is %d' % DEFAULT_CHUNK_FRAMES,
+                       action='store', dest='chunkFrames', type='int', default=DEFAULT_CHUNK_FRAMES )
+    parser.add_option( '', '--noDelta', help='Disable delta encoding of frames',
+                       action='store_false', dest='delta', default=True )
+    parser.add_option( '', '--noShuffle', help='Disable byte shuffling',
+                       action='store_false', dest='shuffle', default=True )
+    options, args = parser.parse_args()
+
+    if ( options.inFileName == '' or options.outFileName == '' ):
+        print "You must specify an input and output name"
+        parser.print_help()
+        sys.exit( 1 )
+
+    if ( options.decompress ):
+        count = decompressSCB( options.inFileName, options.outFileName )
+    else:
+        count = compressSCB( options.inFileName, options.outFileName, options.chunkFrames,
+                             options.codec, options.level, options.delta, options.shuffle )
+    inSize = os.path.getsize( options.inFileName )
+    outSize = os.path.getsize( options.outFileName )
+    print "Wrote %d frames to %s (%d bytes -> %d bytes)" % ( count, options.outFileName, inSize, outSize )
+
+if __name__ == '__main__':
+    main()
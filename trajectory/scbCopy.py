@@ -0,0 +1,156 @@
+# Copies a subset of an scb file into a new scb file in a single pass.
+#
+#   The byte offset of every frame follows from the header (see SCBFrameIndex), so the frames to
+#   copy are known before anything is read.  How they are copied depends on the subset:
+#       - A contiguous range of whole frames is a single byte range.  It is copied by the
+#         operating system (copy_file_range or sendfile) where python exposes it, and with large,
+#         buffered reads otherwise.
+#       - Strided frames or a subset of agents are gathered from large reads of consecutive
+#         frames or, when the selected bytes are sparse, from one read per selected frame
+#         covering only the span of the selected agents.
+
+import os
+import numpy as np
+from scbData import SCBFrameIndex, writeSCBHeader
+
+# The target number of bytes in a single read
+CHUNK_BYTES = 64 * 1024 * 1024
+# If a frame's unneeded bytes are at least this many, they are skipped instead of read
+SKIP_BYTES = 256 * 1024
+
+def _copyRange( src, dst, offset, length, chunkBytes ):
+    '''Copies a byte range from one file to the current end of another.
+
+    @param      src         An open, binary file.  The source.
+    @param      dst         An open, binary file.  The destination.
+    @param      offset      An int.  The offset of the range in the source.
+    @param      length      An int.  The number of bytes to copy.
+    @param      chunkBytes  An int.  The size of a single read for a buffered copy.
+    '''
+    dst.flush()
+    dstOffset = dst.tell()
+    copied = 0
+    copyFileRange = getattr( os, 'copy_file_range', None )
+    sendFile = getattr( os, 'sendfile', None )
+    try:
+        if ( copyFileRange is not None ):
+            while ( copied < length ):
+                n = copyFileRange( src.fileno(), dst.fileno(), length - copied,
+                                   offset + copied, dstOffset + copied )
+                if ( n == 0 ):
+                    break
+                copied += n
+        elif ( sendFile is not None ):
+            while ( copied < length ):
+                n = sendFile( dst.fileno(), src.fileno(), offset + copied, length - copied )
+                if ( n == 0 ):
+                    break
+                copied += n
+    except OSError:
+        # not supported for these files; copy what remains through python
+        pass
+    dst.seek( dstOffset + copied )
+    src.seek( offset + copied )
+    while ( copied < length ):
+        data = src.read( min( chunkBytes, length - copied ) )
+        if ( not data ):
+            break
+        dst.write( data )
+        copied += len( data )
+
+def copySCB( inName, outName, startFrame=0, maxFrames=-1, frameStep=1, agents=None, chunkBytes=CHUNK_BYTES ):
+    '''Copies a subset of the frames and agents of an scb file into a new scb file of the
+    same version.
+
+    @param      inName          A string.  The path to the scb file to copy.
+    @param      outName         A string.  The path to the scb file to write.
+    @param      startFrame      An int.  The first frame to copy.
+    @param      maxFrames       An int.  The maximum number of frames to copy (-1 for all).
+    @param      frameStep       An int.  Every frameStep-th frame, starting from startFrame, is
+                                copied.  The time step of the copy is frameStep times the input's.
+    @param      agents          An optional sequence of ints.  The indices of the agents to
+                                copy, in output order.  If None, all agents are copied.
+    @param      chunkBytes      An int.  The target number of bytes in a single read.
+    @returns    An int.  The number of frames copied.
+    @raises     SCBError if the input is not an scb file.
+    @raises     ValueError if the frame step is not positive or an agent index is invalid.
+    '''
+    if ( frameStep < 1 ):
+        raise ValueError, "The frame step must be positive: %d" % ( frameStep )
+    index = SCBFrameIndex( inName, useSidecar=False )
+    frameSize = index.frameSize()
+    agentSize = index.agentByteSize
+    startFrame = max( 0, startFrame )
+    frameCount = 0
+    if ( startFrame < index.frameCount ):
+        frameCount = ( index.frameCount - startFrame + frameStep - 1 ) // frameStep
+    if ( maxFrames >= 0 ):
+        frameCount = min( frameCount, maxFrames )
+
+    with open( inName, 'rb' ) as src:
+        ids = None
+        if ( index.version != '1.0' ):
+            src.seek( 12 )
+            ids = np.fromstring( src.read( 4 * index.agtCount ), np.int32 )
+        if ( agents is None ):
+            agents = np.arange( index.agtCount )
+        agents = np.asarray( agents, dtype=np.int64 )
+        if ( agents.size and ( agents.min() < 0 or agents.max() >= index.agtCount ) ):
+            raise ValueError, "Agent indices must lie in the range [0, %d)" % ( index.agtCount )
+        if ( ids is not None ):
+            ids = ids[ agents ]
+        allAgents = agents.size == index.agtCount and np.all( agents == np.arange( index.agtCount ) )
+
+        with open( outName, 'wb' ) as dst:
+            # the copied frames are frameStep time steps apart
+            writeSCBHeader( dst, index.version, agents.size, index.simStepSize * frameStep, ids )
+            if ( frameCount == 0 or agents.size == 0 ):
+                return frameCount
+            start = index.frameOffset( startFrame )
+            if ( allAgents and frameStep == 1 ):
+                _copyRange( src, dst, start, frameCount * frameSize, chunkBytes )
+                return frameCount
+
+            # the selected agents lie in the span [first, last) of each frame
+            first = int( agents.min() )
+            last = int( agents.max() ) + 1
+            spanAgents = agents - first
+            span = ( last - first ) * agentSize
+            if ( frameStep * frameSize - span >= SKIP_BYTES ):
+                # sparse: read only the span of each selected frame
+                perRead = max( 1, chunkBytes // span )
+                for i in xrange( 0, frameCount, perRead ):
+                    n = min( perRead, frameCount - i )
+                    spans = np.empty( ( n, last - first, agentSize ), dtype=np.uint8 )
+                    for k in xrange( n ):
+                        src.seek( start + ( i + k ) * frameStep * frameSize + first * agentSize )
+                        spans[ k ] = np.fromstring( src.read( span ), np.uint8 ).reshape( -1, agentSize )
+                    dst.write( spans[ :, spanAgents, : ].tostring() )
+            else:
+                # dense: read runs of consecutive frames and gather the selection
+                perRead = max( 1, chunkBytes // ( frameStep * frameSize ) )
+                src.seek( start )
+                for i in xrange( 0, frameCount, perRead ):
+                    n = min( perRead, frameCount - i )
+                    # the last selected frame of the run doesn't need the frames after it
+                    readSize = ( ( n - 1 ) * frameStep + 1 ) * frameSize
+                    src.seek( start + i * frameStep * frameSize )
+                    data = np.fromstring( src.read( readSize ), np.uint8 )
+                    data = data.reshape( -1, index.agtCount, agentSize )[ ::frameStep ]
+                    if ( not allAgents ):
+                        data = data[ :, agents, : ]
+                    dst.write( data.tostring() )
+    return frameCount
+
+def agentSelection( agentCount, maxAgents=-1, agentStep=1 ):
+    '''Produces the agent indices NPFrameSet selects with the maxAgents and agtStep arguments.
+
+    @param      agentCount      An int.  The number of agents in the file.
+    @param      maxAgents       An int.  The maximum number of agents (-1 for all).
+    @param      agentStep       An int.  Every agentStep-th agent is selected.
+    @returns    A numpy array of ints.
+    '''
+    agents = np.arange( agentCount // agentStep ) * agentStep
+    if ( maxAgents > 0 ):
+        agents = agents[ :maxAgents ]
+    return agents
@@ -9,6 +9,7 @@ except ImportError:
     from primitives import Vector2
 import os
 import struct
+from contextlib import contextmanager
 import numpy as np
 import commonData
 
@@ -20,6 +21,8 @@ class SCBVersion:
     V2_3 = '2.3'
     V2_4 = '2.4'
     VERSIONS = [ V1, V2_0, V2_1, V2_2, V2_3, V2_4 ]
+    # the number of bytes of per-agent data in a frame for each version
+    AGENT_BYTE_SIZE = { V1:12, V2_0:12, V2_1:16, V2_2:32, V2_3:16, V2_4:16 }
 
     @staticmethod
     def versionList():
@@ -29,6 +32,148 @@ class SCBVersion:
 class SCBError( Exception ):
     pass
 
+class SCBFrameIndex:
+    '''The number and location of the frames in an scb file, derived from the header and the
+    file size.
+
+    Every frame in an scb file has the same size, so the byte offset of any frame can be computed
+    directly; none of the frame data is read.  Bytes at the end of the file that don't form a
+    complete frame (e.g., from a simulation that was terminated while writing) are reported as
+    truncated.
+
+    The index can be persisted in a small sidecar file (the scb file name with INDEX_EXT appended).
+    The sidecar is only trusted if the size and modification time of the scb file match the
+    values recorded in it.'''
+    INDEX_EXT = '.idx'
+    MAGIC = 'SCBI'
+    # magic, version, agent count, agent byte size, header size, frame count, truncated bytes,
+    #   file size, file modification time, time step
+    RECORD = '<4s4siiqqqqdf'
+
+    def __init__( self, scbFile, useSidecar=True, writeSidecar=False ):
+        '''Constructor.
+
+        @param      scbFile         A string.  The path to the scb file to index.
+        @param      useSidecar      A bool.  If True, a valid sidecar file is used instead of
+                                    reading the scb header.
+        @param      writeSidecar    A bool.  If True, the sidecar is written if it doesn't exist
+                                    or is out of date.
+        @raises     SCBError if the file isn't a recognized scb file.
+        @raises     OSError if the file doesn't exist.
+        '''
+        self.fileName = scbFile
+        stat = os.stat( scbFile )
+        self.fileSize = stat.st_size
+        self.mtime = stat.st_mtime
+        loaded = useSidecar and self._readSidecar()
+        if ( not loaded ):
+            self._readHeader()
+            if ( writeSidecar ):
+                self.write()
+
+    def _readHeader( self ):
+        '''Computes the frame geometry from the scb header and the file size.
+
+        @raises     SCBError if the file isn't a recognized scb file.
+        '''
+        with open( self.fileName, 'rb' ) as f:
+            data = f.read( 8 )
+            if ( len( data ) < 8 or data[3] != '\x00' or not data[:3] in SCBVersion.VERSIONS ):
+                raise SCBError, "Not a valid scb file: %s" % ( self.fileName )
+            self.version = data[:3]
+            self.agtCount = struct.unpack( 'i', data[4:] )[0]
+            self.simStepSize = -1.0
+            if ( self.version == SCBVersion.V1 ):
+                self.headerSize = 8
+            else:
+                self.simStepSize = struct.unpack( 'f', f.read( 4 ) )[0]
+                self.headerSize = 12 + 4 * self.agtCount
+        self.agentByteSize = SCBVersion.AGENT_BYTE_SIZE[ self.version ]
+        dataSize = max( 0, self.fileSize - self.headerSize )
+        if ( self.frameSize() > 0 ):
+            self.frameCount = dataSize // self.frameSize()
+            self.truncatedBytes = dataSize % self.frameSize()
+        else:
+            self.frameCount = 0
+            self.truncatedBytes = dataSize
+
+    def sidecarName( self ):
+        '''Returns the name of the sidecar file for this index'''
+        return self.fileName + SCBFrameIndex.INDEX_EXT
+
+    def _readSidecar( self ):
+        '''Initializes the index from the sidecar file.
+
+        @returns    A bool.  True if the sidecar exists and is consistent with the scb file.
+        '''
+        try:
+            with open( self.sidecarName(), 'rb' ) as f:
+                data = f.read( struct.calcsize( SCBFrameIndex.RECORD ) )
+            values = struct.unpack( SCBFrameIndex.RECORD, data )
+        except ( IOError, struct.error ):
+            return False
+        if ( values[0] != SCBFrameIndex.MAGIC or values[7] != self.fileSize or values[8] != self.mtime ):
+            return False
+        self.version = values[1].rstrip( '\x00' )
+        self.agtCount, self.agentByteSize, self.headerSize = values[2:5]
+        self.frameCount, self.truncatedBytes = values[5:7]
+        self.simStepSize = values[9]
+        return True
+
+    def write( self ):
+        '''Writes the index to its sidecar file.
+
+        @returns    A string.  The name of the sidecar file.
+        '''
+        fileName = self.sidecarName()
+        with open( fileName, 'wb' ) as f:
+            f.write( struct.pack( SCBFrameIndex.RECORD, SCBFrameIndex.MAGIC, self.version,
+                                  self.agtCount, self.agentByteSize, self.headerSize,
+                                  self.frameCount, self.truncatedBytes, self.fileSize, self.mtime,
+                                  self.simStepSize ) )
+        return fileName
+
+    def frameSize( self ):
+        '''Reports the number of bytes in a single frame'''
+        return self.agtCount * self.agentByteSize
+
+    def frameOffset( self, index ):
+        '''Reports the byte offset of the given frame in the file.
+
+        @param      index       An int.  The index of the frame.  Negative values are counted
+                                from the end of the file.
+        @returns    An int.  The offset (in bytes) of the beginning of the frame.
+        @raises     IndexError if the frame doesn't exist.
+        '''
+        if ( index < 0 ):
+            index += self.frameCount
+        if ( index < 0 or index >= self.frameCount ):
+            raise IndexError, "Frame %d is outside the range [0, %d)" % ( index, self.frameCount )
+        return self.headerSize + index * self.frameSize()
+
+    def frameOffsets( self ):
+        '''Returns the byte offsets of all frames.
+
+        @returns    A numpy array of int64 with shape (K,) for the K complete frames.
+        '''
+        return self.headerSize + np.arange( self.frameCount, dtype=np.int64 ) * self.frameSize()
+
+    def isTruncated( self ):
+        '''Reports if the file ends with an incomplete frame'''
+        return self.truncatedBytes > 0
+
+    def summary( self ):
+        '''Creates a simple summary of the index'''
+        s = 'SCB frame index: %s' % ( self.fileName )
+        s += '\n\tVersion %s, %d agents, %d bytes per frame' % ( self.version, self.agtCount, self.frameSize() )
+        s += '\n\t%d complete frames' % ( self.frameCount )
+        if ( self.isTruncated() ):
+            s += '\n\tTruncated: %d trailing bytes do not form a complete frame' % ( self.truncatedBytes )
+        return s
+
+    def __str__( self ):
+        return self.summary()
+
 # In order for the scbData to offer the same interface as the trajectories from Julich,
 # where each frame can consist of a DIFFERENT number of agents, for each frame generated,
 #   a mapping from their index in the frame to their global identifier is provided.
@@ -173,6 +318,7 @@ class FrameSet:
         self.ids = []       # in scb2.0 we support ids for each agent.
         self.simStepSize = 0.1
         self.startFrame = startFrame
+        self.frameStep = frameStep
         # generic attributes
         if ( maxFrames == -1 ):
             self.maxFrames = 0x7FFFFFFF
@@ -291,9 +437,8 @@ class FrameSet:
         self.ids = [ 0 for i in range( self.agtCount ) ]
         data = self.file.read( 4 )
         self.simStepSize = struct.unpack( 'f', data )[0]
-        for i in range( self.agtCount ):
-            data = self.file.read( 4 )
-            self.ids[ i ] = struct.unpack( 'i', data )[0]
+        data = self.file.read( 4 * self.agtCount )
+        self.ids = np.fromstring( data, np.int32, self.agtCount ).tolist()
         # three floats per agent, 4 bytes per float
         self.agentByteSize = 12
 
@@ -412,28 +557,21 @@ class FrameSet:
             index = 0
         # TODO: if index > self.maxFrames
         self.currFrameIndex = index
-        byteAddr = ( self.startFrame + self.currFrameIndex ) * self.frameSize + self.headerOffset()
+        byteAddr = ( self.startFrame + self.currFrameIndex * self.frameStep ) * self.frameSize + self.headerOffset()
         self.file.seek( byteAddr )
         self.currFrameIndex -= 1
 
     def totalFrames( self ):
-        """Reports the total number of frames in the file"""
-        # does this by scanning the whole file
-        currentPos = self.file.tell()
-        self.setNext( 0 )
-        frameCount = 0
-        data = self.file.read( self.frameSize )
-        while ( len( data ) == self.frameSize ):
-            frameCount += 1
-            self.file.seek( self.readDelta, 1 ) # advance to next frame
-            self.file.seek( self.strideDelta, 1 ) # advance according to stride
-            data = self.file.read( self.frameSize )
-        self.file.seek( currentPos )
-
-        if ( frameCount > self.maxFrames ):
-            return self.maxFrames
-        else:
-            return frameCount
+        """Reports the total number of frames in the set.  The count is computed from the
+        size of the file; no frames are read."""
+        if ( self.frameSize == 0 ):
+            # a file without agents has no frame data
+            return 0
+        fileSize = os.fstat( self.file.fileno() ).st_size
+        fileFrames = max( 0, fileSize - self.headerOffset() ) // self.frameSize
+        available = max( 0, fileFrames - self.startFrame )
+        frameCount = ( available + self.frameStep - 1 ) // self.frameStep
+        return min( frameCount, self.maxFrames )
 
     def agentCount( self ):
         '''Returns the agent count'''
@@ -587,6 +725,55 @@ class NPFrameSet( FrameSet ):
 
         return self.currFrame, self.currFrameIndex
 
+    def nextBlock( self, k ):
+        """Returns up to the next k frames in sequence from the current point.  All of the frames
+        are fetched with a single read.
+
+        @param      k       An int.  The maximum number of frames to return.
+        @returns    A 2-tuple (block, indices).
+                        block:      A numpy array of floats of shape (k', N, M) for k' <= k frames,
+                                    N agents, and M floats per agent.  It is a new array on
+                                    each call.
+                        indices:    A numpy array of ints of shape (k',).  The index of each frame.
+        @raises     StopIteration if there are no more frames.
+        """
+        k = min( k, self.maxFrames - 1 - self.currFrameIndex )
+        if ( k <= 0 ):
+            raise StopIteration
+        original_pos = self.file.tell()
+        # the number of frames in the file spanned by the k frames, including strides
+        span = ( k - 1 ) * self.frameStep + 1
+        data = self.file.read( span * self.frameSize )
+        fileFrames = len( data ) // self.frameSize
+        if ( fileFrames == 0 ):
+            self.file.seek( original_pos, os.SEEK_SET )
+            raise StopIteration
+        count = ( fileFrames - 1 ) // self.frameStep + 1
+        data = np.fromstring( data, np.float32, fileFrames * self.frameSize / 4 )
+        data.shape = ( fileFrames, self.agtCount, self.colCount )
+        lastAgent = self.readAgtCount * self.readAgtStride
+        block = data[ ::self.frameStep, :lastAgent:self.readAgtStride, : ]
+        if ( not block.flags.c_contiguous ):
+            block = np.ascontiguousarray( block )
+        # leave the file at the start of the next frame in the set
+        self.file.seek( original_pos + count * self.frameStep * self.frameSize, os.SEEK_SET )
+        indices = np.arange( self.currFrameIndex + 1, self.currFrameIndex + 1 + count )
+        self.currFrameIndex += count
+        return block, indices
+
+    def iterBlocks( self, k ):
+        """Iterates through the remaining frames in blocks of k frames (see nextBlock).
+
+        @param      k       An int.  The number of frames per block.  The last block may be smaller.
+        @returns    A generator of 2-tuples: (block, indices).
+        """
+        while ( True ):
+            try:
+                block, indices = self.nextBlock( k )
+            except StopIteration:
+                return
+            yield block, indices
+
     def prev( self, stride=1 ):
         """Returns the next frame in sequence from current point"""
         if ( self.currFrameIndex >= stride ):
@@ -629,6 +816,271 @@ class NPFrameSet( FrameSet ):
         # For this data set, it's tautological
         return IDMap( self.agentCount() )
 
+class MMFrameSet( NPFrameSet ):
+    """A frame set that memory-maps the scb file.  Frames are returned as read-only (N, M) views
+    directly into the mapped file; nothing is copied or parsed on a call to next.
+
+    The i-th frame of the set is the file frame: startFrame + i * frameStep.  Any trailing, partial
+    frame at the end of the file is ignored."""
+    def __init__( self, scbFile, startFrame=0, maxFrames=-1, maxAgents=-1, frameStep=1, agtStep=1 ):
+        # the view must exist before the base class calls setNext
+        self.frames = None
+        NPFrameSet.__init__( self, scbFile, startFrame, maxFrames, maxAgents, frameStep, agtStep )
+        self.fileName = scbFile
+        self._map = self._mapFile( scbFile )
+        lastAgent = self.readAgtCount * self.readAgtStride
+        self.frames = self._map[ startFrame::frameStep, :lastAgent:self.readAgtStride, : ]
+        if ( self.frames.shape[0] > self.maxFrames ):
+            self.frames = self.frames[ :self.maxFrames ]
+
+    def _mapFile( self, scbFile ):
+        '''Maps the frame data of the scb file into memory.
+
+        @param      scbFile     A string.  The path to the scb file.
+        @returns    A read-only numpy array of floats with shape (K, N, M) for all K complete
+                    frames in the file, N agents, and M floats per agent.
+        '''
+        dataStart = self.headerOffset()
+        frameCount = 0
+        if ( self.frameSize > 0 ):
+            frameCount = max( 0, ( os.path.getsize( scbFile ) - dataStart ) // self.frameSize )
+        shape = ( frameCount, self.agtCount, self.colCount )
+        if ( frameCount == 0 ):
+            # numpy can't map an empty region
+            return np.empty( shape, dtype=np.float32 )
+        return np.memmap( scbFile, dtype=np.float32, mode='r', offset=dataStart, shape=shape )
+
+    def __len__( self ):
+        return self.totalFrames()
+
+    def __getitem__( self, key ):
+        '''Provides random access to the frames in the set.
+
+        @param      key     An int or a slice.  The index (or indices) of frames in the set.
+        @returns    A read-only view of the data.  For an int, an (N, M) array.  For a slice,
+                    a (K, N, M) strided array of the selected frames.
+        '''
+        return self.frames[ key ]
+
+    def frameRange( self, start, stop, step=1 ):
+        '''Returns the frames in the range [start, stop) as a single strided array.
+
+        @param      start       An int.  The index of the first frame.
+        @param      stop        An int.  One past the index of the last frame.
+        @param      step        An int.  The stride between frames.  Defaults to 1.
+        @returns    A read-only numpy array of shape (K, N, M) which views the mapped file.
+        '''
+        return self.frames[ start:stop:step ]
+
+    def next( self, stride=1 ):
+        """Returns the next frame in sequence from current point"""
+        nextIndex = self.currFrameIndex + stride
+        if ( self.frames is None or nextIndex >= self.frames.shape[0] ):
+            raise StopIteration
+        self.currFrameIndex = nextIndex
+        self.currFrame = self.frames[ nextIndex ]
+        return self.currFrame, self.currFrameIndex
+
+    def nextBlock( self, k ):
+        """Returns up to the next k frames in sequence from the current point.  The block is a
+        read-only view of the mapped file (see NPFrameSet.nextBlock)."""
+        start = self.currFrameIndex + 1
+        if ( self.frames is None or start >= self.frames.shape[0] ):
+            raise StopIteration
+        block = self.frames[ start:start + k ]
+        self.currFrameIndex += block.shape[0]
+        return block, np.arange( start, start + block.shape[0] )
+
+    def prev( self, stride=1 ):
+        """Returns the previous frame in sequence from current point"""
+        if ( self.currFrameIndex >= stride ):
+            self.currFrameIndex -= stride
+            self.currFrame = self.frames[ self.currFrameIndex ]
+        return self.currFrame, self.currFrameIndex
+
+    def setNext( self, index ):
+        """Sets the set so that the call to next frame will return frame index"""
+        if ( index < 0 ):
+            index = 0
+        self.currFrameIndex = index - 1
+
+    def totalFrames( self ):
+        """Reports the total number of frames in the set"""
+        return self.frames.shape[0]
+
+    def fullData( self ):
+        """Returns an N X M X K array consisting of all trajectory info for the frame set, for
+        N agents, M floats per agent and K time steps.  Unlike the frames, this is a writable copy."""
+        return np.array( self.frames.transpose( 1, 2, 0 ) )
+
+    def close( self ):
+        '''Closes the file and releases the mapping'''
+        self.frames = None
+        self.currFrame = None
+        self._map = None
+        NPFrameSet.close( self )
+
+class QuantizedFrameSet:
+    """A frame set for quantized scb data (see QuantizedSCBWriter).  The integer data is
+    memory-mapped and each frame is decoded into the same float32 (N, M) frame that NPFrameSet
+    returns.  Missing values (NaN when written) are decoded as NaN."""
+    MAGIC = 'SCBQ'
+    # magic, scb version, agent count, floats per agent, bytes per value, frame count, time step
+    HEADER = '<4s4siiiqf'
+    # The byte offset of the frame count in the header; it is written when the writer closes
+    FRAME_COUNT_OFFSET = 20
+    INT_TYPES = { 2:np.int16, 4:np.int32 }
+
+    def __init__( self, fileName ):
+        """Constructor.
+
+        @param      fileName        A string.  The path to the quantized file.
+        @raises     SCBError if the file is not a quantized scb file.
+        """
+        self.fileName = fileName
+        headerSize = struct.calcsize( QuantizedFrameSet.HEADER )
+        with open( fileName, 'rb' ) as f:
+            try:
+                ( magic, version, self.agtCount, self.colCount, intBytes, frameCount,
+                  self.simStepSize ) = struct.unpack( QuantizedFrameSet.HEADER, f.read( headerSize ) )
+            except struct.error:
+                raise SCBError, "Not a quantized scb file: %s" % ( fileName )
+            if ( magic != QuantizedFrameSet.MAGIC or not intBytes in QuantizedFrameSet.INT_TYPES ):
+                raise SCBError, "Not a quantized scb file: %s" % ( fileName )
+            self.version = version.rstrip( '\x00' )
+            self.intType = QuantizedFrameSet.INT_TYPES[ intBytes ]
+            self.offsets = np.fromstring( f.read( 8 * self.colCount ), np.float64 )
+            self.steps = np.fromstring( f.read( 8 * self.colCount ), np.float64 )
+            self.ids = np.fromstring( f.read( 4 * self.agtCount ), np.int32 ).tolist()
+            dataStart = f.tell()
+        # The value used for missing data
+        self.sentinel = np.iinfo( self.intType ).min
+        # The largest quantization error of any decoded value, per column (not including the
+        #   float32 rounding of the decoded value)
+        self.maxError = self.steps * 0.5
+        self.is3D = self.version == SCBVersion.V2_4
+        self.hasScalarOrient = self.version != SCBVersion.V2_3
+        frameSize = self.agtCount * self.colCount * intBytes
+        if ( frameSize ):
+            frameCount = min( frameCount, ( os.path.getsize( fileName ) - dataStart ) // frameSize )
+        shape = ( frameCount, self.agtCount, self.colCount )
+        if ( frameCount > 0 and frameSize ):
+            self.data = np.memmap( fileName, dtype=self.intType, mode='r', offset=dataStart, shape=shape )
+        else:
+            self.data = np.empty( shape, dtype=self.intType )
+        self.currFrame = None
+        self.currFrameIndex = -1
+
+    @staticmethod
+    def isValid( fileName ):
+        """Reports if the given file is a quantized scb file.
+
+        @param      fileName        A string.  The name of the file to check.
+        @returns    A boolean.  True if the file starts with the quantized magic number.
+        """
+        with open( fileName, 'rb' ) as f:
+            return f.read( 4 ) == QuantizedFrameSet.MAGIC
+
+    def getType( self ):
+        """Returns the identifier for this type of trajectory data.
+
+        @returns        An enumeration representing the scb data.
+        """
+        return commonData.SCB_DATA
+
+    def summary( self ):
+        """Creates a simple summary of the trajectory data"""
+        s = 'Quantized SCB Trajectory data'
+        s += '\n\t%d pedestrians' % self.agentCount()
+        s += '\n\t%d frames of  data' % self.totalFrames()
+        s += '\n\t%d-bit values, maximum error %g' % ( np.dtype( self.intType ).itemsize * 8, self.maxError.max() )
+        return s
+
+    def getClasses( self ):
+        """Returns a dictionary mapping class id to each agent with that class"""
+        ids = {}
+        for i, id in enumerate( self.ids ):
+            ids.setdefault( id, [] ).append( i )
+        return ids
+
+    def agentCount( self ):
+        """Returns the agent count"""
+        return self.agtCount
+
+    def totalFrames( self ):
+        """Reports the total number of frames in the file"""
+        return self.data.shape[0]
+
+    def hasStateData( self ):
+        """Reports if the scb data contains state data"""
+        return self.version == SCBVersion.V2_1 or self.version == SCBVersion.V2_2
+
+    def getFrameIds( self ):
+        """Returns a mapping from index in the frame to global identifier"""
+        return IDMap( self.agentCount() )
+
+    def decode( self, values ):
+        """Decodes quantized values into floats.
+
+        @param      values      A numpy array of the file's integer type whose last axis is
+                                the M values of an agent.
+        @returns    A numpy array of float32 with the same shape.
+        """
+        decoded = ( values * self.steps + self.offsets ).astype( np.float32 )
+        decoded[ values == self.sentinel ] = np.nan
+        return decoded
+
+    def next( self, stride=1 ):
+        """Returns the next frame in sequence from current point"""
+        nextIndex = self.currFrameIndex + stride
+        if ( nextIndex >= self.data.shape[0] ):
+            raise StopIteration
+        self.currFrameIndex = nextIndex
+        self.currFrame = self.decode( self.data[ nextIndex ] )
+        return self.currFrame, self.currFrameIndex
+
+    def nextBlock( self, k ):
+        """Returns up to the next k frames in sequence from the current point
+        (see NPFrameSet.nextBlock)."""
+        start = self.currFrameIndex + 1
+        if ( start >= self.data.shape[0] ):
+            raise StopIteration
+        block = self.decode( self.data[ start:start + k ] )
+        self.currFrameIndex += block.shape[0]
+        return block, np.arange( start, start + block.shape[0] )
+
+    def iterBlocks( self, k ):
+        """Iterates through the remaining frames in blocks of at most k frames."""
+        while ( True ):
+            try:
+                block, indices = self.nextBlock( k )
+            except StopIteration:
+                return
+            yield block, indices
+
+    def prev( self, stride=1 ):
+        """Returns the previous frame in sequence from current point"""
+        if ( self.currFrameIndex >= stride ):
+            self.currFrameIndex -= stride
+            self.currFrame = self.decode( self.data[ self.currFrameIndex ] )
+        return self.currFrame, self.currFrameIndex
+
+    def setNext( self, index ):
+        """Sets the set so that the call to next frame will return frame index"""
+        if ( index < 0 ):
+            index = 0
+        self.currFrameIndex = index - 1
+
+    def fullData( self ):
+        """Returns an N X M X K array consisting of all trajectory info for the frame set, for
+        N agents, M floats per agent and K time steps"""
+        return np.ascontiguousarray( self.decode( self.data ).transpose( 1, 2, 0 ) )
+
+    def close( self ):
+        """Releases the mapped data"""
+        self.data = np.empty( ( 0, self.agtCount, self.colCount ), dtype=self.intType )
+        self.currFrame = None
+
 class SCBDataMemory:
     '''A version of SCBData that has the full data set loaded into memory as a numpy array.'''
     def __init__( self ):
@@ -710,6 +1162,333 @@ class SCBDataMemory:
             raise AttributeError, "Cannot write scb data - none defined"
         writeNPSCB( output, self.data, self, self.version )
         
+@contextmanager
+def outputFile( inName, outName ):
+    """Provides the name of the file to write output read from an input file to.  If the output
+    is the input file, the output is written to a temporary file which replaces the input only
+    once the body of the with statement completes; if the body raises, the temporary file is
+    deleted and the input is left unchanged.  The input must be closed by the end of the body.
+
+        with outputFile( inName, outName ) as writeName:
+            ...
+
+    @param      inName          A string.  The path to the input file.
+    @param      outName         A string.  The path to the output file.
+    @returns    A context manager providing a string: the path to write the output to.
+    """
+    writeName = outName
+    if ( os.path.exists( outName ) and os.path.samefile( inName, outName ) ):
+        writeName = outName + '.tmp'
+    try:
+        yield writeName
+    except:
+        if ( writeName != outName and os.path.exists( writeName ) ):
+            os.remove( writeName )
+        raise
+    if ( writeName != outName ):
+        # on Windows, os.rename can't replace an existing file
+        os.remove( outName )
+        os.rename( writeName, outName )
+
+def writeSCBHeader( file, version, agentCount, timeStep=0.1, ids=None ):
+    """Writes an scb header to an open file.
+
+    @param      file            An open, binary file.
+    @param      version         A string.  The scb version to write (see SCBVersion).
+    @param      agentCount      An int.  The number of agents in every frame.
+    @param      timeStep        A float.  The duration of a frame.  Not written for version 1.0.
+    @param      ids             An optional list of ints.  The class id of each agent.  If not
+                                provided, every agent gets class id 0.  Not written for version 1.0.
+    """
+    file.write( '%s\x00' % version )
+    file.write( struct.pack( 'i', agentCount ) )
+    if ( version != SCBVersion.V1 ):
+        if ( ids is None or len( ids ) == 0 ):
+            ids = np.zeros( agentCount, dtype=np.int32 )
+        file.write( struct.pack( 'f', timeStep ) )
+        file.write( np.asarray( ids, dtype=np.int32 ).tostring() )
+
+class SCBWriter:
+    """Writes an scb file incrementally.  The header is written when the writer is created and
+    frames are appended, one at a time or in blocks, so the full data set never needs to be in
+    memory.  The file is complete once close has been called."""
+    # The maximum number of bytes re-ordered at a time when writing an N x M x K array
+    CHUNK_BYTES = 16 * 1024 * 1024
+
+    def __init__( self, fileName, version, agentCount, timeStep=0.1, ids=None ):
+        """Constructor.
+
+        @param      fileName        A string.  The path to the scb file to write.
+        @param      version         A string.  The scb version to write (see SCBVersion).
+        @param      agentCount      An int.  The number of agents in every frame.
+        @param      timeStep        A float.  The duration of a frame.  Not written for version 1.0.
+        @param      ids             An optional list of ints.  The class id of each agent.  If not
+                                    provided, every agent gets class id 0.  Not written for
+                                    version 1.0.
+        @raises     ValueError if the version is unrecognized or the ids don't match the agents.
+        """
+        if ( not version in SCBVersion.VERSIONS ):
+            raise ValueError, "Invalid write version for data: %s" % ( version )
+        if ( ids is None or len( ids ) == 0 ):
+            ids = np.zeros( agentCount, dtype=np.int32 )
+        elif ( len( ids ) != agentCount ):
+            raise ValueError, "The class id list doesn't match the number of agents.  %d ids for %d agents" % ( len( ids ), agentCount )
+        self.fileName = fileName
+        self.version = version
+        self.agentCount = agentCount
+        # the number of floats per agent the version requires
+        self.fieldCount = SCBVersion.AGENT_BYTE_SIZE[ version ] / 4
+        self.frameCount = 0
+        self.file = open( fileName, 'wb' )
+        writeSCBHeader( self.file, version, agentCount, timeStep, ids )
+
+    @staticmethod
+    def fromFrameSet( fileName, frameSet, version=None ):
+        """Creates a writer whose header matches the given frame set.
+
+        @param      fileName        A string.  The path to the scb file to write.
+        @param      frameSet        An instance of FrameSet (or anything with the attributes
+                                    version, simStepSize, and ids and the method agentCount).
+        @param      version         A string.  The version to write.  If None, the frame set's
+                                    version is used.
+        @returns    An instance of SCBWriter.
+        """
+        if ( version is None ):
+            version = frameSet.version
+        timeStep = frameSet.simStepSize
+        if ( timeStep < 0 ):
+            timeStep = 0.1
+        agentCount = frameSet.agentCount()
+        ids = frameSet.ids
+        if ( ids is not None and len( ids ) != agentCount ):
+            # the frame set only reads a subset of its agents
+            ids = frameSet.ids[ :agentCount * frameSet.readAgtStride:frameSet.readAgtStride ]
+        return SCBWriter( fileName, version, agentCount, timeStep, ids )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, excType, excValue, traceback ):
+        self.close()
+
+    def writeFrame( self, frame ):
+        """Appends a single frame to the file.
+
+        @param      frame       A numpy array of shape (N, M).  N must be the writer's agent count
+                                and M must be at least the number of floats the version requires.
+                                Extra columns are ignored.
+        @raises     ValueError if the frame doesn't have the required shape.
+        """
+        self.writeFrames( frame[ np.newaxis, :, : ] )
+
+    def writeFrames( self, block ):
+        """Appends a block of frames to the file with a single write.
+
+        @param      block       A numpy array of shape (K, N, M) for K frames.  N must be the
+                                writer's agent count and M must be at least the number of floats
+                                the version requires.  Extra columns are ignored.
+        @raises     ValueError if the block doesn't have the required shape.
+        """
+        if ( block.shape[1] != self.agentCount ):
+            raise ValueError, "Frames have %d agents; the file has %d" % ( block.shape[1], self.agentCount )
+        if ( block.shape[2] < self.fieldCount ):
+            raise ValueError, "Version %s requires %d floats per agent" % ( self.version, self.fieldCount )
+        data = np.ascontiguousarray( block[ :, :, :self.fieldCount ], dtype=np.float32 )
+        self.file.write( data.tostring() )
+        self.frameCount += block.shape[0]
+
+    def writeArray( self, array ):
+        """Appends the frames of an N X M X K array (the layout of NPFrameSet.fullData).
+
+        @param      array       A numpy array of shape (N, M, K) for N agents, M floats per agent
+                                and K frames.
+        @raises     ValueError if the array doesn't have the required shape.
+        """
+        # the frames are re-ordered in bounded chunks instead of copying the whole array at once
+        chunkFrames = max( 1, SCBWriter.CHUNK_BYTES // max( 1, self.agentCount * self.fieldCount * 4 ) )
+        for start in xrange( 0, array.shape[2], chunkFrames ):
+            self.writeFrames( array[ :, :, start:start + chunkFrames ].transpose( 2, 0, 1 ) )
+
+    def close( self ):
+        """Finalizes the file.
+
+        @returns    An int.  The number of frames written.
+        """
+        if ( not self.file.closed ):
+            self.file.close()
+        return self.frameCount
+
+class QuantizedSCBWriter:
+    """Writes scb data as fixed-point integers.  Each column (x, y, orientation, etc.) has an
+    offset and a quantization step; a value v is stored as round( ( v - offset ) / step ), so the
+    error of any value is at most step / 2.  NaN values are stored as the smallest integer of the
+    type and read back as NaN.  The file is read with QuantizedFrameSet."""
+    def __init__( self, fileName, version, agentCount, offsets, steps, timeStep=0.1, ids=None, intType=np.int16 ):
+        """Constructor.
+
+        @param      fileName        A string.  The path to the file to write.
+        @param      version         A string.  The scb version of the data (see SCBVersion).
+        @param      agentCount      An int.  The number of agents in every frame.
+        @param      offsets         A sequence of floats.  The offset of each of the version's columns.
+        @param      steps           A sequence of floats.  The quantization step of each column.
+        @param      timeStep        A float.  The duration of a frame.
+        @param      ids             An optional list of ints.  The class id of each agent.  If not
+                                    provided, every agent gets class id 0.
+        @param      intType         The numpy integer type to store: np.int16 or np.int32.
+        @raises     ValueError if the version, ids, offsets, steps or type are invalid.
+        """
+        if ( not version in SCBVersion.VERSIONS ):
+            raise ValueError, "Invalid write version for data: %s" % ( version )
+        intType = np.dtype( intType ).type
+        if ( not intType in QuantizedFrameSet.INT_TYPES.values() ):
+            raise ValueError, "Quantized values must be int16 or int32"
+        if ( ids is None or len( ids ) == 0 ):
+            ids = np.zeros( agentCount, dtype=np.int32 )
+        elif ( len( ids ) != agentCount ):
+            raise ValueError, "The class id list doesn't match the number of agents.  %d ids for %d agents" % ( len( ids ), agentCount )
+        self.version = version
+        self.agentCount = agentCount
+        self.fieldCount = SCBVersion.AGENT_BYTE_SIZE[ version ] / 4
+        self.offsets = np.asarray( offsets, dtype=np.float64 )
+        self.steps = np.asarray( steps, dtype=np.float64 )
+        if ( self.offsets.shape != ( self.fieldCount, ) or self.steps.shape != ( self.fieldCount, ) ):
+            raise ValueError, "Version %s requires %d offsets and steps" % ( version, self.fieldCount )
+        if ( np.any( self.steps <= 0 ) ):
+            raise ValueError, "Quantization steps must be positive"
+        self.intType = intType
+        info = np.iinfo( intType )
+        self.sentinel = info.min
+        self.limit = info.max
+        self.frameCount = 0
+        self.file = open( fileName, 'wb' )
+        self.file.write( struct.pack( QuantizedFrameSet.HEADER, QuantizedFrameSet.MAGIC, '%s\x00' % version,
+                                      agentCount, self.fieldCount, np.dtype( intType ).itemsize, 0, timeStep ) )
+        self.file.write( self.offsets.tostring() )
+        self.file.write( self.steps.tostring() )
+        self.file.write( np.asarray( ids, dtype=np.int32 ).tostring() )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, excType, excValue, traceback ):
+        self.close()
+
+    def writeFrame( self, frame ):
+        """Appends a single (N, M) frame (see SCBWriter.writeFrame)."""
+        self.writeFrames( frame[ np.newaxis, :, : ] )
+
+    def writeFrames( self, block ):
+        """Appends a (K, N, M) block of frames (see SCBWriter.writeFrames).
+
+        @raises     ValueError if the block doesn't have the required shape or a value is outside
+                    of the range the offsets and steps can represent.
+        """
+        if ( block.shape[1] != self.agentCount ):
+            raise ValueError, "Frames have %d agents; the file has %d" % ( block.shape[1], self.agentCount )
+        if ( block.shape[2] < self.fieldCount ):
+            raise ValueError, "Version %s requires %d floats per agent" % ( self.version, self.fieldCount )
+        values = np.rint( ( block[ :, :, :self.fieldCount ] - self.offsets ) / self.steps )
+        missing = np.isnan( values )
+        values[ missing ] = 0
+        if ( np.any( np.abs( values ) > self.limit ) ):
+            raise ValueError, "Values are outside of the quantized range"
+        values = values.astype( self.intType )
+        values[ missing ] = self.sentinel
+        self.file.write( values.tostring() )
+        self.frameCount += block.shape[0]
+
+    def writeArray( self, array ):
+        """Appends the frames of an N X M X K array (see SCBWriter.writeArray)."""
+        chunkFrames = max( 1, SCBWriter.CHUNK_BYTES // max( 1, self.agentCount * self.fieldCount * 4 ) )
+        for start in xrange( 0, array.shape[2], chunkFrames ):
+            self.writeFrames( array[ :, :, start:start + chunkFrames ].transpose( 2, 0, 1 ) )
+
+    def close( self ):
+        """Finalizes the file.
+
+        @returns    An int.  The number of frames written.
+        """
+        if ( not self.file.closed ):
+            self.file.seek( QuantizedFrameSet.FRAME_COUNT_OFFSET )
+            self.file.write( struct.pack( '<q', self.frameCount ) )
+            self.file.close()
+        return self.frameCount
+
+def quantizationSteps( lower, upper, intType, integral=None ):
+    """Computes the offset and step of each column which cover the given range of values with
+    the given integer type.
+
+    @param      lower       A numpy array of floats.  The minimum value of each column.
+    @param      upper       A numpy array of floats.  The maximum value of each column.
+    @param      intType     The numpy integer type: np.int16 or np.int32.
+    @param      integral    An optional numpy array of bools.  True for columns whose values are all
+                            integers (e.g., agent state); those are stored exactly, if they fit.
+    @returns    A 2-tuple of numpy arrays of floats: ( offsets, steps ).  The largest error of a
+                quantized value is steps / 2.
+    """
+    limit = np.iinfo( intType ).max
+    lower = np.where( np.isfinite( lower ), lower, 0.0 )
+    upper = np.where( np.isfinite( upper ), upper, 0.0 )
+    offsets = ( lower + upper ) * 0.5
+    steps = ( upper - lower ) / ( 2.0 * limit )
+    steps[ steps <= 0 ] = 1.0
+    if ( integral is not None ):
+        exact = integral & ( upper - lower < 2 * limit )
+        offsets[ exact ] = np.floor( offsets[ exact ] )
+        steps[ exact ] = 1.0
+    return offsets, steps
+
+def quantizeSCB( scbFile, outFile, maxError=None, intType=None ):
+    """Writes a quantized copy of an scb file.  The file is read twice: once to find the extent of
+    each column and once to write the quantized values.
+
+    @param      scbFile         A string.  The path to the scb file.
+    @param      outFile         A string.  The path to the quantized file to write.
+    @param      maxError        An optional float.  The largest acceptable error of a value.  If
+                                given, the smallest integer type that satisfies it is used.
+    @param      intType         An optional numpy integer type (np.int16 or np.int32).  If None,
+                                it is chosen from maxError (and np.int16 without a maxError).
+    @returns    A numpy array of floats.  The largest error of each column.
+    @raises     ValueError if the requested error can't be achieved.
+    """
+    frames = NPFrameSet( scbFile )
+    colCount = SCBVersion.AGENT_BYTE_SIZE[ frames.version ] / 4
+    lower = np.empty( colCount )
+    lower.fill( np.inf )
+    upper = np.empty( colCount )
+    upper.fill( -np.inf )
+    integral = np.ones( colCount, dtype=bool )
+    for block, indices in frames.iterBlocks( 256 ):
+        values = block.reshape( -1, colCount )
+        if ( values.shape[0] ):
+            # missing values are ignored column by column; the rest of the agent's values count
+            missing = np.isnan( values )
+            lower = np.minimum( lower, np.where( missing, np.inf, values ).min( axis=0 ) )
+            upper = np.maximum( upper, np.where( missing, -np.inf, values ).max( axis=0 ) )
+            integral &= np.all( missing | ( values == np.rint( values ) ), axis=0 )
+
+    if ( intType is None ):
+        candidates = [ np.int16, np.int32 ]
+    else:
+        candidates = [ intType ]
+    for candidate in candidates:
+        offsets, steps = quantizationSteps( lower, upper, candidate, integral )
+        if ( maxError is None or np.all( steps * 0.5 <= maxError ) ):
+            intType = candidate
+            break
+    else:
+        raise ValueError, "The data's extent can't be quantized with a maximum error of %g" % ( maxError )
+
+    frames.setNext( 0 )
+    timeStep = frames.simStepSize if frames.simStepSize >= 0 else 0.1
+    writer = QuantizedSCBWriter( outFile, frames.version, frames.agentCount(), offsets, steps,
+                                 timeStep, frames.ids, intType )
+    for block, indices in frames.iterBlocks( 256 ):
+        writer.writeFrames( block )
+    writer.close()
+    frames.close()
+    return steps * 0.5
+
 def writeNPSCB( fileName, array, frameSet, version='1.0' ):
     """Given an N X M X K array, writes out an scb file with the given data.
     There are N agents over K frames.  M defines the number of data points per agent.
@@ -737,44 +1516,32 @@ def _writeNPSCB_1_0( fileName, array ):
     """Given an N X 3 X K array, writes out a version 1.0 scb file with the given data"""
     if ( array.shape[1] < 3 ):
         raise ValueError, "Version 1.0 requires three floats per agent"
-    f = open( fileName, 'wb' )
-    f.write( '%s\x00' % SCBVersion.V1 )
-    f.write( struct.pack( 'i', array.shape[0] ) )
-    for frame in range( array.shape[2] ):
-        f.write( array[:,:3,frame].tostring() )
-    f.close()
+    writer = SCBWriter( fileName, SCBVersion.V1, array.shape[0] )
+    writer.writeArray( array )
+    writer.close()
 
 def _writeNPSCB_2( fileName, array, frameSet, version, fieldCount ):
     """Given an N X 3 X K array, writes out a version 2.* scb file with the given data.
     It is assumed that all file versions with the same major version have the same header"""
     if ( array.shape[1] < fieldCount ):
         raise ValueError, "Version %s requires %d floats per agent" % ( version, fieldCount )
-    f = open( fileName, 'wb' )
-    f.write( version )
     agtCount = array.shape[0]
-    f.write( struct.pack( 'i', agtCount ) )   # agent count
     
-    if ( frameSet.simStepSize < 0 ):
+    timeStep = frameSet.simStepSize
+    if ( timeStep < 0 ):
         print 'Frame set was version 1.0, using default sim step size: 0.1'
-        f.write( struct.pack( 'f', 0.1 ) )   # sim step size
-    else:
-        f.write( struct.pack( 'f', frameSet.simStepSize ) )   # sim step size
+        timeStep = 0.1
 
     # agent ids
     if ( frameSet.ids ):
         # this assertion won't be true if I'm sub-sampling the agents!
         assert( len( frameSet.ids ) == agtCount )
-        for id in frameSet.ids:
-            f.write( struct.pack( 'i', id ) )
     else:
         print 'Frame set was version 1.0, assigning every agent id 0'
-        for i in range( agtCount ):
-            f.write( struct.pack( 'i', 0 ) )
-            
-    # now write the data
-    for frame in range( array.shape[2] ):
-        f.write( array[:,:fieldCount,frame].tostring() )
-    f.close()
+
+    writer = SCBWriter( fileName, version.rstrip( '\x00' ), agtCount, timeStep, frameSet.ids )
+    writer.writeArray( array )
+    writer.close()
 
 def _writeNPSCB_2_0( fileName, array, frameSet ):
     """Given an N X 3 X K array, writes out a version 1.0 scb file with the given data"""
@@ -834,6 +1601,9 @@ def main():
     print "\t%d classes:" % ( len( classes ) ), classes.keys()
     print "\tTime step:", data.simStepSize
     print "\tDuration (frames):", data.totalFrames()
+    index = SCBFrameIndex( sys.argv[ 1 ] )
+    if ( index.isTruncated() ):
+        print "\tTruncated: %d trailing bytes do not form a complete frame" % ( index.truncatedBytes )
     print "\tInitial positions:"
     
 if __name__ == '__main__':
@@ -0,0 +1,239 @@
+# Reads only the agents and columns of scb data that an analysis needs.
+#
+#   A FilteredFrameSet memory maps the scb file (see MMFrameSet) and applies its filters before
+#   any data reaches the caller:
+#       - The agent selection (explicit agent indices and/or class ids) and the column projection
+#         are fixed.  Where the selection is a regular stride of agents (or a contiguous run of
+#         columns), it is a strided view of the mapped file; otherwise the selected values are
+#         gathered from the mapping.
+#       - A bounding box is a per-frame predicate on the agent positions.  Only the positions of
+#         the selected agents are read to evaluate it; the remaining columns are gathered for the
+#         agents inside the box.
+#   The frame set counts the bytes of the visited frames that it produced and that it skipped.
+
+import numpy as np
+from scbData import MMFrameSet
+
+class FilteredFrameSet( MMFrameSet ):
+    '''A memory-mapped frame set which produces a subset of the agents and columns of an scb file.
+
+    The agents in a frame are the selected agents, in increasing order of their index in the
+    file.  With a bounding box, next only produces the selected agents inside the box and
+    getFrameIds reports their indices in the file (just as for Julich data); blocks of frames
+    (see nextBlock) keep every selected agent and the values of those outside the box are NaN.
+    Since the rows of two such frames are different agents, the GridFileSequence routines which
+    pair the rows of two frames (e.g., computeSpeeds) reject a frame set with a bounding box;
+    those which rasterize single frames (e.g., splatAgents) accept it.
+
+    If columns are projected, the frames only contain those columns (in the given order); the
+    column attributes of the version (e.g., is3D) still describe the file.'''
+    def __init__( self, scbFile, startFrame=0, maxFrames=-1, frameStep=1, agents=None, classes=None,
+                  bbox=None, columns=None ):
+        '''Constructor.
+
+        @param      scbFile         A string.  The path to the scb file.
+        @param      startFrame      An int.  The first frame of the set.
+        @param      maxFrames       An int.  The maximum number of frames (-1 for all).
+        @param      frameStep       An int.  The stride between frames of the set.
+        @param      agents          An optional iterable of ints.  The indices of the agents to
+                                    produce.  If None, every agent is a candidate.
+        @param      classes         An optional iterable of ints.  Only agents with these class
+                                    ids are produced (see getClasses).  If None, agents of all
+                                    classes are produced.
+        @param      bbox            An optional 4-tuple of floats: ( minX, minY, maxX, maxY ).
+                                    Only agents whose position lies in this box (inclusive) are
+                                    produced.  For 3D data, the box lies on the ground plane.
+        @param      columns         An optional sequence of ints.  The columns of the per-agent
+                                    data to produce.  If None, all columns are produced.
+        @raises     ValueError if an agent index or column is out of range.
+        '''
+        MMFrameSet.__init__( self, scbFile, startFrame, maxFrames, -1, frameStep, 1 )
+        fileIds = np.asarray( self.ids, dtype=np.int32 )
+        selected = np.arange( self.agtCount )
+        if ( agents is not None ):
+            selected = np.unique( np.asarray( list( agents ), dtype=np.int64 ) )
+            if ( selected.size and ( selected[ 0 ] < 0 or selected[ -1 ] >= self.agtCount ) ):
+                raise ValueError, "Agent indices must lie in the range [0, %d)" % ( self.agtCount )
+        if ( classes is not None ):
+            classes = np.asarray( list( classes ), dtype=np.int32 )
+            selected = selected[ np.in1d( fileIds[ selected ], classes ) ]
+        self.agentIds = selected
+        fileColumns = self.agentByteSize / 4
+        if ( columns is None ):
+            self.columns = np.arange( fileColumns )
+        else:
+            self.columns = np.asarray( columns, dtype=np.int64 )
+            if ( self.columns.size and ( self.columns.min() < 0 or self.columns.max() >= fileColumns ) ):
+                raise ValueError, "Columns must lie in the range [0, %d)" % ( fileColumns )
+        self.bbox = bbox
+        self.posCols = np.array( [ 0, 2 ] if self.is3D else [ 0, 1 ] )
+
+        # the frame set describes the selection; the ids of the selected agents are kept
+        self.readAgtCount = selected.size
+        self.colCount = self.columns.size
+        self.ids = fileIds[ selected ].tolist()
+        self.currIds = selected
+        self._agentKey = self._sliceKey( selected )
+        self._columnKey = self._sliceKey( self.columns )
+        self.bytesRead = 0
+        self.bytesSkipped = 0
+
+    @staticmethod
+    def _sliceKey( indices ):
+        '''Expresses a sorted array of indices as a slice, if it is a regular stride.
+
+        @param      indices     A numpy array of ints.
+        @returns    A slice, if the indices can be viewed with one.  Otherwise, the indices.
+        '''
+        if ( indices.size == 0 ):
+            return slice( 0, 0 )
+        if ( indices.size == 1 ):
+            return slice( indices[ 0 ], indices[ 0 ] + 1 )
+        step = indices[ 1 ] - indices[ 0 ]
+        if ( step > 0 and np.all( np.diff( indices ) == step ) ):
+            return slice( indices[ 0 ], indices[ -1 ] + 1, step )
+        return indices
+
+    def _select( self, frames, agents, columns ):
+        '''Selects agents and columns from frames of the mapped file.
+
+        @param      frames      A numpy array of shape (K, N, M).  The mapped frames.
+        @param      agents      A slice or an array of agent indices.
+        @param      columns     A slice or an array of column indices.
+        @returns    A numpy array of shape (K, n, m).  A strided view if both keys are slices.
+        '''
+        if ( isinstance( agents, slice ) ):
+            frames = frames[ :, agents, : ]
+        else:
+            frames = frames.take( agents, axis=1 )
+        if ( isinstance( columns, slice ) ):
+            return frames[ :, :, columns ]
+        return frames.take( columns, axis=2 )
+
+    def _inside( self, positions ):
+        '''Reports which positions lie in the bounding box.
+
+        @param      positions       A numpy array of shape (..., 2).
+        @returns    A numpy array of bools with the shape of the positions without the last axis.
+        '''
+        minX, minY, maxX, maxY = self.bbox
+        x = positions[ ..., 0 ]
+        y = positions[ ..., 1 ]
+        return ( x >= minX ) & ( x <= maxX ) & ( y >= minY ) & ( y <= maxY )
+
+    def _count( self, frameCount, byteCount ):
+        '''Records the bytes produced from a number of visited frames.'''
+        self.bytesRead += byteCount
+        self.bytesSkipped += frameCount * self.frameSize - byteCount
+
+    def _readFrames( self, frames ):
+        '''Applies the filters to frames of the mapped file.
+
+        @param      frames      A numpy array of shape (K, N, M).  The mapped frames.
+        @returns    A numpy array of float32 of shape (K, n, m).  The values of the agents outside
+                    the bounding box are NaN.
+        '''
+        block = self._select( frames, self._agentKey, self._columnKey )
+        if ( self.bbox is None ):
+            self._count( frames.shape[0], block.size * 4 )
+            return block
+        # only the positions are read for the agents outside the box
+        inside = self._inside( self._select( frames, self._agentKey, self.posCols ) )
+        result = np.empty( block.shape, dtype=np.float32 )
+        result.fill( np.nan )
+        result[ inside ] = block[ inside ]
+        otherCols = np.setdiff1d( self.columns, self.posCols ).size
+        self._count( frames.shape[0], ( inside.size * 2 + np.count_nonzero( inside ) * otherCols ) * 4 )
+        return result
+
+    def resetCounters( self ):
+        '''Resets the counts of bytes read and skipped.'''
+        self.bytesRead = 0
+        self.bytesSkipped = 0
+
+    def byteReport( self ):
+        '''Summarizes the bytes of the visited frames which were read and skipped.
+
+        @returns    A string.
+        '''
+        total = self.bytesRead + self.bytesSkipped
+        s = 'Read %d bytes, skipped %d bytes' % ( self.bytesRead, self.bytesSkipped )
+        if ( total ):
+            s += ' (%.1f%% skipped)' % ( 100.0 * self.bytesSkipped / total )
+        return s
+
+    def summary( self ):
+        '''Creates a simple summary of the trajectory data'''
+        s = MMFrameSet.summary( self )
+        s += '\n\t%d of %d agents selected' % ( self.agentCount(), self.agtCount )
+        s += '\n\t%d of %d columns selected' % ( self.colCount, self.agentByteSize / 4 )
+        if ( self.bbox is not None ):
+            s += '\n\tBounding box: ( %g, %g ) - ( %g, %g )' % tuple( self.bbox )
+        return s
+
+    def __getitem__( self, key ):
+        '''Provides random access to the filtered frames in the set.
+
+        @param      key     An int or a slice.  The index (or indices) of frames in the set.
+        @returns    For an int, an (n, m) array.  For a slice, a (K, n, m) array.
+        '''
+        if ( isinstance( key, slice ) ):
+            return self._readFrames( self.frames[ key ] )
+        return self._readFrames( self.frames[ key:key + 1 ] )[ 0 ]
+
+    def frameRange( self, start, stop, step=1 ):
+        '''Returns the filtered frames in the range [start, stop) (see MMFrameSet.frameRange).
+
+        @returns    A numpy array of shape (K, n, m).  Without a bounding box, it is a read-only
+                    view of the mapped file if the selected agents and columns are strided.
+        '''
+        return self._readFrames( self.frames[ start:stop:step ] )
+
+    def _frame( self, index ):
+        '''Reads a single frame; with a bounding box, only the agents inside it are produced.'''
+        frames = self.frames[ index:index + 1 ]
+        if ( self.bbox is None ):
+            self.currIds = self.agentIds
+            return self._readFrames( frames )[ 0 ]
+        positions = self._select( frames, self._agentKey, self.posCols )[ 0 ]
+        inside = np.nonzero( self._inside( positions ) )[ 0 ]
+        self.currIds = self.agentIds[ inside ]
+        frame = self._select( frames, self.currIds, self._columnKey )[ 0 ]
+        otherCols = np.setdiff1d( self.columns, self.posCols ).size
+        self._count( 1, ( positions.size + inside.size * otherCols ) * 4 )
+        return frame
+
+    def next( self, stride=1 ):
+        """Returns the next filtered frame in sequence from current point"""
+        nextIndex = self.currFrameIndex + stride
+        if ( self.frames is None or nextIndex >= self.frames.shape[0] ):
+            raise StopIteration
+        self.currFrameIndex = nextIndex
+        self.currFrame = self._frame( nextIndex )
+        return self.currFrame, self.currFrameIndex
+
+    def prev( self, stride=1 ):
+        """Returns the previous filtered frame in sequence from current point"""
+        if ( self.currFrameIndex >= stride ):
+            self.currFrameIndex -= stride
+            self.currFrame = self._frame( self.currFrameIndex )
+        return self.currFrame, self.currFrameIndex
+
+    def nextBlock( self, k ):
+        """Returns up to the next k filtered frames in sequence from the current point (see
+        NPFrameSet.nextBlock).  The values of agents outside the bounding box are NaN."""
+        start = self.currFrameIndex + 1
+        if ( self.frames is None or start >= self.frames.shape[0] ):
+            raise StopIteration
+        block = self._readFrames( self.frames[ start:start + k ] )
+        self.currFrameIndex += block.shape[0]
+        return block, np.arange( start, start + block.shape[0] )
+
+    def getFrameIds( self ):
+        '''Returns the indices, in the file, of the agents of the last frame read'''
+        return np.copy( self.currIds )
+
+    def fullData( self ):
+        """Returns an n X m X K array consisting of the filtered data for the frame set.  The
+        values of agents outside the bounding box are NaN."""
+        return np.array( self._readFrames( self.frames ).transpose( 1, 2, 0 ) )
@@ -0,0 +1,286 @@
+# Presents an ordered list of scb files (e.g., the segments of a long simulation) as a single
+#   frame set.
+#
+#   Every shard's header is read up front (see SCBFrameIndex); none of the frame data is.  The
+#   frame counts give each frame a global number, and a table of the shard of every frame maps a
+#   global frame number to its shard in constant time.  The shards themselves are memory mapped
+#   (see MMFrameSet) when a frame is first requested from them; at most a fixed number are open at
+#   once, the least recently used being closed to make room.
+
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+import commonData
+from scbData import SCBFrameIndex, MMFrameSet, IDMap, SCBVersion
+
+# The default maximum number of shards open at once
+MAX_OPEN = 8
+# Splits a string into its runs of digits and the text between them
+DIGIT_RUNS = re.compile( r'(\d+)' )
+
+def naturalOrder( fileNames ):
+    '''Sorts file names so that numbered shards are in numeric order: runs of digits are compared
+    as numbers and the text between them as text (e.g., run_2.scb precedes run_10.scb).
+
+    @param      fileNames       A sequence of strings.
+    @returns    A sorted list of the strings.
+    '''
+    def key( name ):
+        parts = DIGIT_RUNS.split( name )
+        # the digit runs are the odd parts
+        parts[ 1::2 ] = [ int( p ) for p in parts[ 1::2 ] ]
+        return parts
+    return sorted( fileNames, key=key )
+
+class ShardedFrameSet:
+    """A frame set whose frames are the concatenated frames of several scb files.  The files must
+    have the same version, agents (count and class ids) and time step.  Only complete frames are
+    used; any truncated data at the end of a shard is ignored."""
+    def __init__( self, fileNames, maxOpen=MAX_OPEN ):
+        """Constructor.
+
+        @param      fileNames       A sequence of strings.  The paths to the scb files, in order.
+        @param      maxOpen         An int.  The maximum number of shards open at once.
+        @raises     SCBError if a file isn't an scb file.
+        @raises     ValueError if there are no files or their headers aren't compatible.
+        """
+        self.fileNames = list( fileNames )
+        if ( not self.fileNames ):
+            raise ValueError, "A sharded frame set requires at least one scb file"
+        self.maxOpen = max( 1, maxOpen )
+        indices = [ SCBFrameIndex( name, useSidecar=False ) for name in self.fileNames ]
+        first = indices[ 0 ]
+        self.version = first.version
+        self.agtCount = first.agtCount
+        self.colCount = first.agentByteSize / 4
+        # version 1.0 doesn't store a time step (see FrameSet)
+        self.simStepSize = 0.1 if self.version == SCBVersion.V1 else first.simStepSize
+        self.ids = self._readIds( first )
+        for index in indices[ 1: ]:
+            self._checkCompatible( index )
+        self.is3D = self.version == SCBVersion.V2_4
+        self.hasScalarOrient = self.version != SCBVersion.V2_3
+        # the frame set reads every agent (see SCBWriter.fromFrameSet)
+        self.readAgtStride = 1
+
+        counts = np.array( [ index.frameCount for index in indices ], dtype=np.int64 )
+        # the global number of the first frame of each shard (and one past the last frame)
+        self.starts = np.zeros( counts.size + 1, dtype=np.int64 )
+        self.starts[ 1: ] = np.cumsum( counts )
+        # the shard of every global frame
+        self.shardOf = np.repeat( np.arange( counts.size, dtype=np.int32 ), counts )
+
+        # the open shards, from least to most recently used
+        self.open = OrderedDict()
+        self.poolLock = threading.Lock()
+        self.opened = 0
+        self.currFrame = None
+        self.currFrameIndex = -1
+
+    def _readIds( self, index ):
+        """Reads the class ids of the agents of a shard.
+
+        @param      index       An instance of SCBFrameIndex.
+        @returns    A list of ints.
+        """
+        if ( index.version == SCBVersion.V1 ):
+            return [ 0 ] * index.agtCount
+        with open( index.fileName, 'rb' ) as f:
+            f.seek( 12 )
+            return np.fromstring( f.read( 4 * index.agtCount ), np.int32 ).tolist()
+
+    def _checkCompatible( self, index ):
+        """Confirms that a shard's header matches the first shard's.
+
+        @param      index       An instance of SCBFrameIndex.
+        @raises     ValueError if the headers differ.
+        """
+        if ( index.version != self.version ):
+            raise ValueError, "%s is version %s; expected %s" % ( index.fileName, index.version, self.version )
+        if ( index.agtCount != self.agtCount ):
+            raise ValueError, "%s has %d agents; expected %d" % ( index.fileName, index.agtCount, self.agtCount )
+        if ( index.version != SCBVersion.V1 and index.simStepSize != self.simStepSize ):
+            raise ValueError, "%s has time step %g; expected %g" % ( index.fileName, index.simStepSize, self.simStepSize )
+        if ( self._readIds( index ) != self.ids ):
+            raise ValueError, "The agent class ids of %s differ from %s" % ( index.fileName, self.fileNames[ 0 ] )
+
+    def getType( self ):
+        """Returns the identifier for this type of trajectory data.
+
+        @returns        An enumeration representing the scb data.
+        """
+        return commonData.SCB_DATA
+
+    def summary( self ):
+        """Creates a simple summary of the trajectory data"""
+        s = 'Sharded SCB Trajectory data'
+        s += '\n\t%d pedestrians' % self.agentCount()
+        s += '\n\t%d frames of  data' % self.totalFrames()
+        s += '\n\t%d shards' % len( self.fileNames )
+        return s
+
+    def getClasses( self ):
+        """Returns a dictionary mapping class id to each agent with that class"""
+        ids = {}
+        for i, id in enumerate( self.ids ):
+            ids.setdefault( id, [] ).append( i )
+        return ids
+
+    def agentCount( self ):
+        """Returns the agent count"""
+        return self.agtCount
+
+    def totalFrames( self ):
+        """Reports the total number of frames in all of the shards"""
+        return int( self.starts[ -1 ] )
+
+    def __len__( self ):
+        return self.totalFrames()
+
+    def hasStateData( self ):
+        """Reports if the scb data contains state data"""
+        return self.version == SCBVersion.V2_1 or self.version == SCBVersion.V2_2
+
+    def getFrameIds( self ):
+        """Returns a mapping from index in the frame to global identifier"""
+        return IDMap( self.agentCount() )
+
+    def locate( self, index ):
+        """Maps a global frame number to its shard.
+
+        @param      index       An int.  The global frame number.
+        @returns    A 2-tuple: ( shard, local ).  The index of the shard and the number of the
+                    frame in the shard.
+        @raises     IndexError if the frame doesn't exist.
+        """
+        if ( index < 0 or index >= self.starts[ -1 ] ):
+            raise IndexError, "Frame %d is outside the range [0, %d)" % ( index, self.starts[ -1 ] )
+        shard = int( self.shardOf[ index ] )
+        return shard, int( index - self.starts[ shard ] )
+
+    def shard( self, shard ):
+        """Returns the memory-mapped frames of a shard, opening it if necessary.
+
+        @param      shard       An int.  The index of the shard.
+        @returns    An instance of MMFrameSet.
+        """
+        with self.poolLock:
+            frameSet = self.open.pop( shard, None )
+            if ( frameSet is None ):
+                if ( len( self.open ) >= self.maxOpen ):
+                    oldest, evicted = self.open.popitem( last=False )
+                    evicted.close()
+                frameSet = MMFrameSet( self.fileNames[ shard ] )
+                self.opened += 1
+            # the most recently used shard is last
+            self.open[ shard ] = frameSet
+            return frameSet
+
+    def openShards( self ):
+        """Reports the indices of the shards which are currently open."""
+        with self.poolLock:
+            return self.open.keys()
+
+    def __getitem__( self, key ):
+        """Provides random access to the frames in the set.
+
+        @param      key     An int or a slice.  The global number (or numbers) of frames.
+        @returns    For an int, a read-only (N, M) view of the shard.  For a slice, a (K, N, M)
+                    array (see frameRange).
+        """
+        if ( isinstance( key, slice ) ):
+            start, stop, step = key.indices( self.totalFrames() )
+            return self.frameRange( start, stop, step )
+        if ( key < 0 ):
+            key += self.totalFrames()
+        shard, local = self.locate( key )
+        return self.shard( shard )[ local ]
+
+    def frameRange( self, start, stop, step=1 ):
+        """Returns the frames in the range [start, stop) as a single array.
+
+        @param      start       An int.  The global number of the first frame.
+        @param      stop        An int.  One past the global number of the last frame.
+        @param      step        An int.  The stride between frames.  Defaults to 1.
+        @returns    A numpy array of shape (K, N, M).  If the frames lie in a single shard, it is
+                    a read-only view of the mapped file; otherwise, a copy.
+        """
+        frameCount = self.totalFrames()
+        start = max( 0, start )
+        stop = min( stop, frameCount )
+        if ( start >= stop ):
+            return np.empty( ( 0, self.agtCount, self.colCount ), dtype=np.float32 )
+        parts = []
+        first = int( self.shardOf[ start ] )
+        last = int( self.shardOf[ stop - 1 ] )
+        for shard in xrange( first, last + 1 ):
+            shardStart = self.starts[ shard ]
+            # the first frame of the range in this shard
+            begin = max( start, shardStart )
+            begin += ( start - begin ) % step
+            end = min( stop, self.starts[ shard + 1 ] )
+            if ( begin < end ):
+                parts.append( self.shard( shard ).frameRange( int( begin - shardStart ), int( end - shardStart ), step ) )
+        if ( len( parts ) == 1 ):
+            return parts[ 0 ]
+        return np.concatenate( parts )
+
+    def next( self, stride=1 ):
+        """Returns the next frame in sequence from current point"""
+        nextIndex = self.currFrameIndex + stride
+        if ( nextIndex >= self.totalFrames() ):
+            raise StopIteration
+        self.currFrameIndex = nextIndex
+        self.currFrame = self[ nextIndex ]
+        return self.currFrame, self.currFrameIndex
+
+    def nextBlock( self, k ):
+        """Returns up to the next k frames in sequence from the current point
+        (see NPFrameSet.nextBlock).  A block never spans more than one shard, so fewer than k
+        frames may be returned before the end of the data.  It is a read-only view of the shard."""
+        start = self.currFrameIndex + 1
+        if ( start >= self.totalFrames() ):
+            raise StopIteration
+        shard, local = self.locate( start )
+        block = self.shard( shard ).frameRange( local, local + k )
+        self.currFrameIndex += block.shape[0]
+        return block, np.arange( start, start + block.shape[0] )
+
+    def iterBlocks( self, k ):
+        """Iterates through the remaining frames in blocks of at most k frames."""
+        while ( True ):
+            try:
+                block, indices = self.nextBlock( k )
+            except StopIteration:
+                return
+            yield block, indices
+
+    def prev( self, stride=1 ):
+        """Returns the previous frame in sequence from current point"""
+        if ( self.currFrameIndex >= stride ):
+            self.currFrameIndex -= stride
+            self.currFrame = self[ self.currFrameIndex ]
+        return self.currFrame, self.currFrameIndex
+
+    def setNext( self, index ):
+        """Sets the set so that the call to next frame will return frame index"""
+        if ( index < 0 ):
+            index = 0
+        self.currFrameIndex = index - 1
+
+    def fullData( self ):
+        """Returns an N X M X K array consisting of all trajectory info for the frame set, for
+        N agents, M floats per agent and K time steps"""
+        data = np.empty( ( self.agtCount, self.colCount, self.totalFrames() ), dtype=np.float32 )
+        for shard in xrange( len( self.fileNames ) ):
+            data[ :, :, self.starts[ shard ]:self.starts[ shard + 1 ] ] = self.shard( shard ).frames.transpose( 1, 2, 0 )
+        return data
+
+    def close( self ):
+        """Closes every open shard"""
+        with self.poolLock:
+            for frameSet in self.open.values():
+                frameSet.close()
+            self.open.clear()
+        self.currFrame = None
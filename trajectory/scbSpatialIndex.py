@@ -0,0 +1,351 @@
+# A spatio-temporal index of scb data.
+#
+#   The frames are grouped into blocks of consecutive frames.  For each block, the index records:
+#       - which agents visit each cell of a uniform grid (of unbounded extent) during the block,
+#       - the bounding box of each agent's positions during the block.
+#   A query for the agents in a region during a range of frames only examines the grid cells
+#   which overlap the region in the blocks which overlap the frame range.  The answer is
+#   conservative (a superset of the agents actually in the region) unless the candidates are
+#   refined against the frame data.
+#
+#   The index is built in a single, streaming pass over the frames and saved as a numpy .npz file.
+
+import os
+import numpy as np
+from scbData import NPFrameSet
+
+# The extension appended to an scb file name to produce the name of its index
+INDEX_EXT = '.sidx.npz'
+DEFAULT_CELL_SIZE = 2.0
+DEFAULT_BLOCK_FRAMES = 64
+# Offsets the y-cell index into the lower 32 bits of a cell key
+_Y_BIAS = 2 ** 31
+
+def cellKeys( cx, cy ):
+    '''Combines integer cell coordinates into a single, sortable key.  Keys of cells with the same
+    x-coordinate are contiguous and ordered by the y-coordinate.
+
+    @param      cx      A numpy array of ints.  The x-coordinates of the cells.
+    @param      cy      A numpy array of ints.  The y-coordinates of the cells.
+    @returns    A numpy array of int64.
+    '''
+    return ( cx.astype( np.int64 ) << 32 ) + ( cy.astype( np.int64 ) + _Y_BIAS )
+
+def pointsInPolygon( points, vertices ):
+    '''Reports which points lie inside a polygon (by the even-odd rule).
+
+    @param      points      An N x 2 numpy array of floats.
+    @param      vertices    A V x 2 numpy array of floats.  The vertices of a closed polygon.
+    @returns    A numpy array of N bools.
+    '''
+    x = points[ :, 0 ]
+    y = points[ :, 1 ]
+    inside = np.zeros( points.shape[0], dtype=bool )
+    v1 = vertices[ -1 ]
+    for v2 in vertices:
+        if ( v1[1] != v2[1] ):
+            crosses = ( ( v1[1] > y ) != ( v2[1] > y ) )
+            t = ( y - v1[1] ) / ( v2[1] - v1[1] )
+            crosses &= x < v1[0] + t * ( v2[0] - v1[0] )
+            inside ^= crosses
+        v1 = v2
+    return inside
+
+class SpatialIndex:
+    '''A spatio-temporal index over scb frames.  Create one with build or load.'''
+    def __init__( self, cellSize, blockFrames, frameCount, agentCount, blockOffsets, keys, agents, bounds ):
+        '''Constructor.
+
+        @param      cellSize        A float.  The size of a (square) grid cell.
+        @param      blockFrames     An int.  The number of frames in a block.
+        @param      frameCount      An int.  The total number of indexed frames.
+        @param      agentCount      An int.  The number of agents.
+        @param      blockOffsets    A numpy array of B + 1 ints.  The entries of block b lie in
+                                    the range [blockOffsets[b], blockOffsets[b+1]) of keys and agents.
+        @param      keys            A numpy array of int64.  The cell key of each entry (see
+                                    cellKeys).  Within a block, the entries are sorted by key.
+        @param      agents          A numpy array of int32.  The agent of each entry.
+        @param      bounds          A B x N x 4 numpy array of floats.  The bounding box (minX,
+                                    minY, maxX, maxY) of each agent in each block (NaN if the
+                                    agent has no valid positions in the block).
+        '''
+        self.cellSize = cellSize
+        self.blockFrames = blockFrames
+        self.frameCount = frameCount
+        self.agentCount = agentCount
+        self.blockOffsets = blockOffsets
+        self.keys = keys
+        self.agents = agents
+        self.bounds = bounds
+
+    @staticmethod
+    def build( frameSet, cellSize=DEFAULT_CELL_SIZE, blockFrames=DEFAULT_BLOCK_FRAMES ):
+        '''Builds the index from the remaining frames of a frame set in a single pass.
+
+        @param      frameSet        An instance of NPFrameSet (or any frame set with iterBlocks).
+        @param      cellSize        A float.  The size of a grid cell.
+        @param      blockFrames     An int.  The number of frames in a block.
+        @returns    An instance of SpatialIndex.
+        '''
+        agentCount = frameSet.agentCount()
+        yCol = 2 if frameSet.is3D else 1
+        blockOffsets = [ 0 ]
+        keyBlocks = []
+        agentBlocks = []
+        bounds = []
+        frameCount = 0
+        pending = []            # frames of a partial block
+        pendingCount = 0
+        def indexBlock( block ):
+            x = block[ :, :, 0 ]
+            y = block[ :, :, yCol ]
+            valid = ~( np.isnan( x ) | np.isnan( y ) )
+            agents = np.nonzero( valid )[1].astype( np.int32 )
+            keys = cellKeys( np.floor( x[ valid ] / cellSize ).astype( np.int64 ),
+                             np.floor( y[ valid ] / cellSize ).astype( np.int64 ) )
+            # unique (cell, agent) pairs, sorted by cell
+            order = np.lexsort( ( agents, keys ) )
+            keys = keys[ order ]
+            agents = agents[ order ]
+            if ( keys.size ):
+                unique = np.ones( keys.size, dtype=bool )
+                unique[ 1: ] = ( keys[ 1: ] != keys[ :-1 ] ) | ( agents[ 1: ] != agents[ :-1 ] )
+                keys = keys[ unique ]
+                agents = agents[ unique ]
+            keyBlocks.append( keys )
+            agentBlocks.append( agents )
+            blockOffsets.append( blockOffsets[ -1 ] + keys.size )
+            box = np.empty( ( agentCount, 4 ), dtype=np.float32 )
+            box.fill( np.nan )
+            hasData = np.any( valid, axis=0 )
+            if ( np.any( hasData ) ):
+                xd = np.where( valid, x, np.inf )
+                yd = np.where( valid, y, np.inf )
+                box[ hasData, 0 ] = xd.min( axis=0 )[ hasData ]
+                box[ hasData, 1 ] = yd.min( axis=0 )[ hasData ]
+                xd = np.where( valid, x, -np.inf )
+                yd = np.where( valid, y, -np.inf )
+                box[ hasData, 2 ] = xd.max( axis=0 )[ hasData ]
+                box[ hasData, 3 ] = yd.max( axis=0 )[ hasData ]
+            bounds.append( box )
+
+        # frame sets may return blocks of any size; regroup them into blocks of blockFrames
+        for block, indices in frameSet.iterBlocks( blockFrames ):
+            frameCount += block.shape[0]
+            while ( block.shape[0] ):
+                take = min( block.shape[0], blockFrames - pendingCount )
+                pending.append( block[ :take ] )
+                pendingCount += take
+                block = block[ take: ]
+                if ( pendingCount == blockFrames ):
+                    indexBlock( np.concatenate( pending, axis=0 ) )
+                    pending = []
+                    pendingCount = 0
+        if ( pendingCount ):
+            indexBlock( np.concatenate( pending, axis=0 ) )
+
+        if ( keyBlocks ):
+            keys = np.concatenate( keyBlocks )
+            agents = np.concatenate( agentBlocks )
+            bounds = np.array( bounds, dtype=np.float32 )
+        else:
+            keys = np.empty( 0, dtype=np.int64 )
+            agents = np.empty( 0, dtype=np.int32 )
+            bounds = np.empty( ( 0, agentCount, 4 ), dtype=np.float32 )
+        return SpatialIndex( cellSize, blockFrames, frameCount, agentCount,
+                             np.array( blockOffsets, dtype=np.int64 ), keys, agents, bounds )
+
+    def save( self, fileName ):
+        '''Writes the index to a file.
+
+        @param      fileName        A string.  The path to the file (a numpy .npz file).
+        '''
+        with open( fileName, 'wb' ) as f:
+            np.savez( f, cellSize=self.cellSize, blockFrames=self.blockFrames,
+                      frameCount=self.frameCount, agentCount=self.agentCount,
+                      blockOffsets=self.blockOffsets, keys=self.keys, agents=self.agents,
+                      bounds=self.bounds )
+
+    @staticmethod
+    def load( fileName ):
+        '''Reads an index from a file written by save.
+
+        @param      fileName        A string.  The path to the file.
+        @returns    An instance of SpatialIndex.
+        '''
+        data = np.load( fileName )
+        return SpatialIndex( float( data[ 'cellSize' ] ), int( data[ 'blockFrames' ] ),
+                             int( data[ 'frameCount' ] ), int( data[ 'agentCount' ] ),
+                             data[ 'blockOffsets' ], data[ 'keys' ], data[ 'agents' ],
+                             data[ 'bounds' ] )
+
+    def blockCount( self ):
+        '''Reports the number of frame blocks in the index'''
+        return self.blockOffsets.size - 1
+
+    def _blocks( self, startFrame, endFrame ):
+        '''Returns the range of blocks which overlap the frames [startFrame, endFrame)'''
+        if ( endFrame is None or endFrame > self.frameCount ):
+            endFrame = self.frameCount
+        startFrame = max( 0, startFrame )
+        if ( endFrame <= startFrame ):
+            return xrange( 0 )
+        return xrange( startFrame // self.blockFrames, ( endFrame - 1 ) // self.blockFrames + 1 )
+
+    def blockCandidates( self, block, minCorner, maxCorner ):
+        '''Reports the agents whose positions, in the given block, may lie in a rectangle.  Only
+        the cells which overlap the rectangle are examined and the agents are then culled by
+        their bounding boxes.
+
+        @param      block       An int.  The index of the block.
+        @param      minCorner   A 2-tuple of floats.  The minimum corner of the rectangle.
+        @param      maxCorner   A 2-tuple of floats.  The maximum corner of the rectangle.
+        @returns    A sorted numpy array of agent indices.
+        '''
+        start, end = self.blockOffsets[ block ], self.blockOffsets[ block + 1 ]
+        keys = self.keys[ start:end ]
+        cx0, cy0 = [ int( np.floor( v / self.cellSize ) ) for v in minCorner ]
+        cx1, cy1 = [ int( np.floor( v / self.cellSize ) ) for v in maxCorner ]
+        found = []
+        for cx in xrange( cx0, cx1 + 1 ):
+            lo, hi = cellKeys( np.array( [ cx, cx ] ), np.array( [ cy0, cy1 ] ) )
+            first = np.searchsorted( keys, lo, 'left' )
+            last = np.searchsorted( keys, hi, 'right' )
+            if ( last > first ):
+                found.append( self.agents[ start + first:start + last ] )
+        if ( not found ):
+            return np.empty( 0, dtype=np.int32 )
+        agents = np.unique( np.concatenate( found ) )
+        box = self.bounds[ block, agents ]
+        overlap = ( ( box[ :, 0 ] <= maxCorner[0] ) & ( box[ :, 2 ] >= minCorner[0] ) &
+                    ( box[ :, 1 ] <= maxCorner[1] ) & ( box[ :, 3 ] >= minCorner[1] ) )
+        return agents[ overlap ]
+
+    def agentsInRect( self, minCorner, maxCorner, startFrame=0, endFrame=None, frameSet=None ):
+        '''Reports the agents in a rectangle during a range of frames.
+
+        @param      minCorner   A 2-tuple of floats.  The minimum corner of the rectangle.
+        @param      maxCorner   A 2-tuple of floats.  The maximum corner of the rectangle.
+        @param      startFrame  An int.  The first frame of the range.
+        @param      endFrame    An int.  One past the last frame of the range.  If None, the
+                                range extends to the last frame.
+        @param      frameSet    An optional frame set of the indexed data (supporting setNext
+                                and nextBlock).  If provided, the candidates are tested against
+                                their actual positions and the result is exact.  Otherwise, it
+                                may include agents that are only near the rectangle.
+        @returns    A sorted numpy array of agent indices.
+        '''
+        def inside( points ):
+            return ( ( points[ :, 0 ] >= minCorner[0] ) & ( points[ :, 0 ] <= maxCorner[0] ) &
+                     ( points[ :, 1 ] >= minCorner[1] ) & ( points[ :, 1 ] <= maxCorner[1] ) )
+        return self._query( minCorner, maxCorner, startFrame, endFrame, frameSet, inside )
+
+    def agentsInPolygon( self, vertices, startFrame=0, endFrame=None, frameSet=None ):
+        '''Reports the agents in a polygon during a range of frames (see agentsInRect).
+
+        @param      vertices    A sequence of 2-tuples of floats.  The vertices of the polygon.
+        @returns    A sorted numpy array of agent indices.
+        '''
+        vertices = np.asarray( vertices, dtype=np.float64 )
+        minCorner = vertices.min( axis=0 )
+        maxCorner = vertices.max( axis=0 )
+        return self._query( minCorner, maxCorner, startFrame, endFrame, frameSet,
+                            lambda points: pointsInPolygon( points, vertices ) )
+
+    def _query( self, minCorner, maxCorner, startFrame, endFrame, frameSet, inside ):
+        '''Gathers the candidates of each block and, if a frame set is given, refines them.
+
+        @param      inside      A function mapping an N x 2 array of points to N bools.
+        '''
+        if ( endFrame is None or endFrame > self.frameCount ):
+            endFrame = self.frameCount
+        found = []
+        for block in self._blocks( startFrame, endFrame ):
+            candidates = self.blockCandidates( block, minCorner, maxCorner )
+            if ( candidates.size and frameSet is not None ):
+                first = max( startFrame, block * self.blockFrames )
+                last = min( endFrame, ( block + 1 ) * self.blockFrames )
+                candidates = candidates[ self._refine( frameSet, candidates, first, last, inside ) ]
+            found.append( candidates )
+        if ( not found ):
+            return np.empty( 0, dtype=np.int32 )
+        return np.unique( np.concatenate( found ) )
+
+    def _refine( self, frameSet, candidates, first, last, inside ):
+        '''Reports which candidates lie inside the region in any of the frames [first, last).'''
+        yCol = 2 if frameSet.is3D else 1
+        hit = np.zeros( candidates.size, dtype=bool )
+        frameSet.setNext( first )
+        remaining = last - first
+        while ( remaining > 0 ):
+            try:
+                block, indices = frameSet.nextBlock( remaining )
+            except StopIteration:
+                break
+            remaining -= block.shape[0]
+            points = block[ :, candidates, : ][ :, :, [ 0, yCol ] ].reshape( -1, 2 )
+            valid = ~np.any( np.isnan( points ), axis=1 )
+            found = np.zeros( points.shape[0], dtype=bool )
+            found[ valid ] = inside( points[ valid ] )
+            hit |= np.any( found.reshape( -1, candidates.size ), axis=0 )
+        return hit
+
+def indexName( scbFile ):
+    '''Reports the name of the index file for an scb file'''
+    return scbFile + INDEX_EXT
+
+def spatialIndex( scbFile, cellSize=DEFAULT_CELL_SIZE, blockFrames=DEFAULT_BLOCK_FRAMES ):
+    '''Returns the spatial index of an scb file, building and saving it next to the scb file
+    if it doesn't exist, is older than the scb file, or was built with other parameters.
+
+    @param      scbFile         A string.  The path to the scb file.
+    @param      cellSize        A float.  The size of a grid cell.
+    @param      blockFrames     An int.  The number of frames in a block.
+    @returns    An instance of SpatialIndex.
+    '''
+    fileName = indexName( scbFile )
+    if ( os.path.exists( fileName ) and os.path.getmtime( fileName ) >= os.path.getmtime( scbFile ) ):
+        index = SpatialIndex.load( fileName )
+        if ( index.cellSize == cellSize and index.blockFrames == blockFrames ):
+            return index
+    frames = NPFrameSet( scbFile )
+    index = SpatialIndex.build( frames, cellSize, blockFrames )
+    frames.close()
+    index.save( fileName )
+    return index
+
+def main():
+    import optparse, sys
+    from scbData import MMFrameSet
+    parser = optparse.OptionParser()
+    parser.set_description( 'Builds the spatio-temporal index of an scb file and, optionally, reports the agents in a rectangle during a range of frames.' )
+    parser.add_option( '-i', '--in', help='The name of the scb file',
+                       action='store', dest='inFileName', default='' )
+    parser.add_option( '-c', '--cellSize', help='The size of the grid cells.  Default is %g' % DEFAULT_CELL_SIZE,
+                       action='store', dest='cellSize', type='float', default=DEFAULT_CELL_SIZE )
+    parser.add_option( '-b', '--blockFrames', help='The number of frames per block.  Default is %d' % DEFAULT_BLOCK_FRAMES,
+                       action='store', dest='blockFrames', type='int', default=DEFAULT_BLOCK_FRAMES )
+    parser.add_option( '-r', '--rect', help='A rectangle to query: minX minY maxX maxY',
+                       action='store', dest='rect', nargs=4, type='float', default=None )
+    parser.add_option( '-f', '--frames', help='The range of frames to query: start end',
+                       action='store', dest='frames', nargs=2, type='int', default=None )
+    parser.add_option( '-e', '--exact', help='Refine the query against the frame data',
+                       action='store_true', dest='exact', default=False )
+    options, args = parser.parse_args()
+
+    if ( options.inFileName == '' ):
+        print "You must specify an input name"
+        parser.print_help()
+        sys.exit( 1 )
+
+    index = spatialIndex( options.inFileName, options.cellSize, options.blockFrames )
+    print "Index of %d agents over %d frames in %d blocks: %s" % ( index.agentCount, index.frameCount,
+                                                                   index.blockCount(), indexName( options.inFileName ) )
+    if ( options.rect ):
+        start, end = options.frames if options.frames else ( 0, None )
+        frames = MMFrameSet( options.inFileName ) if options.exact else None
+        agents = index.agentsInRect( options.rect[:2], options.rect[2:], start, end, frames )
+        print "%d agents:" % ( agents.size ), agents.tolist()
+
+if __name__ == '__main__':
+    main()
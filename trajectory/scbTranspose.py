@@ -0,0 +1,170 @@
+# Creates and reads an agent-major copy of scb data.
+#
+#   An scb file stores its data frame by frame; reading the full trajectory of a single agent
+#   touches every frame in the file.  The agent-major copy stores the same data agent by agent
+#   so that the trajectory of one agent (or a contiguous block of agents) is a single,
+#   contiguous read.
+
+import os
+import struct
+import numpy as np
+from scbData import MMFrameSet, SCBError
+
+# The extension appended to an scb file name to produce the name of its agent-major cache
+AGENT_MAJOR_EXT = '.agents'
+MAGIC = 'SCBT'
+# magic, scb version, agent count, floats per agent, frame count, time step
+HEADER = '<4s4siiqf'
+# The target number of bytes to transpose at a time
+CHUNK_BYTES = 64 * 1024 * 1024
+
+def transposeSCB( scbFile, outFile=None, chunkBytes=CHUNK_BYTES ):
+    '''Writes an agent-major copy of an scb file.
+
+    The conversion reads the scb file in chunks of whole frames, so memory use is bounded by
+    chunkBytes and not the size of the file.
+
+    @param      scbFile         A string.  The path to the scb file to transpose.
+    @param      outFile         A string.  The path to the agent-major file to write.  If None, the
+                                scb file name with AGENT_MAJOR_EXT appended is used.
+    @param      chunkBytes      An int.  The approximate number of bytes of frame data to
+                                transpose at a time.
+    @returns    A string.  The name of the agent-major file.
+    @raises     SCBError if the scb file can't be read.
+    '''
+    if ( outFile is None ):
+        outFile = scbFile + AGENT_MAJOR_EXT
+    frames = MMFrameSet( scbFile )
+    agtCount = frames.agentCount()
+    colCount = frames.colCount
+    frameCount = frames.totalFrames()
+
+    with open( outFile, 'wb' ) as f:
+        f.write( struct.pack( HEADER, MAGIC, '%s\x00' % frames.version, agtCount, colCount,
+                              frameCount, frames.simStepSize ) )
+        f.write( np.array( frames.ids, dtype=np.int32 ).tostring() )
+        dataStart = f.tell()
+        f.truncate( dataStart + agtCount * frameCount * colCount * 4 )
+
+    if ( agtCount and frameCount ):
+        data = np.memmap( outFile, dtype=np.float32, mode='r+', offset=dataStart,
+                          shape=( agtCount, frameCount, colCount ) )
+        chunkFrames = max( 1, chunkBytes // frames.frameSize )
+        for start in xrange( 0, frameCount, chunkFrames ):
+            stop = min( start + chunkFrames, frameCount )
+            data[ :, start:stop, : ] = frames.frameRange( start, stop ).transpose( 1, 0, 2 )
+        data.flush()
+        del data
+    frames.close()
+    return outFile
+
+def agentMajorCache( scbFile ):
+    '''Returns the agent-major data for an scb file, (re)building the cache file next to the
+    scb file if it doesn't exist or is older than the scb file.
+
+    @param      scbFile         A string.  The path to the scb file.
+    @returns    An instance of AgentMajorData.
+    '''
+    cacheName = scbFile + AGENT_MAJOR_EXT
+    if ( not os.path.exists( cacheName ) or
+         os.path.getmtime( cacheName ) < os.path.getmtime( scbFile ) ):
+        transposeSCB( scbFile, cacheName )
+    return AgentMajorData( cacheName )
+
+class AgentMajorData:
+    '''Read-only access to the agent-major copy of scb data.  The data is memory-mapped;
+    per-agent trajectories are views into the file and are only read when touched.'''
+    def __init__( self, fileName ):
+        '''Constructor.
+
+        @param      fileName        A string.  The path to an agent-major file (see transposeSCB).
+        @raises     SCBError if the file is not an agent-major file.
+        '''
+        self.fileName = fileName
+        headerSize = struct.calcsize( HEADER )
+        with open( fileName, 'rb' ) as f:
+            try:
+                magic, version, self.agtCount, self.colCount, self.frameCount, self.simStepSize = \
+                    struct.unpack( HEADER, f.read( headerSize ) )
+            except struct.error:
+                raise SCBError, "Not an agent-major scb file: %s" % ( fileName )
+            if ( magic != MAGIC ):
+                raise SCBError, "Not an agent-major scb file: %s" % ( fileName )
+            self.version = version.rstrip( '\x00' )
+            self.ids = np.fromstring( f.read( 4 * self.agtCount ), np.int32 ).tolist()
+        shape = ( self.agtCount, self.frameCount, self.colCount )
+        if ( self.agtCount and self.frameCount ):
+            self.data = np.memmap( fileName, dtype=np.float32, mode='r',
+                                   offset=headerSize + 4 * self.agtCount, shape=shape )
+        else:
+            self.data = np.empty( shape, dtype=np.float32 )
+
+    def agentCount( self ):
+        '''Returns the agent count'''
+        return self.agtCount
+
+    def totalFrames( self ):
+        '''Reports the total number of frames in the data'''
+        return self.frameCount
+
+    def getClasses( self ):
+        '''Returns a dictionary mapping class id to each agent with that class'''
+        ids = {}
+        for i, id in enumerate( self.ids ):
+            ids.setdefault( id, [] ).append( i )
+        return ids
+
+    def agentTrajectory( self, agent ):
+        '''Returns the full trajectory of a single agent.
+
+        @param      agent       An int.  The index of the agent.
+        @returns    A read-only numpy array of shape (M, K) for M floats per agent and K frames.
+                    It has the same layout as NPFrameSet.fullData()[ agent ].
+        '''
+        return self.data[ agent ].T
+
+    def agentBlock( self, start, stop ):
+        '''Returns the full trajectories of the agents in the range [start, stop).
+
+        @param      start       An int.  The index of the first agent.
+        @param      stop        An int.  One past the index of the last agent.
+        @returns    A read-only numpy array of shape (n, M, K) for n = stop - start agents, M floats
+                    per agent and K frames.  It has the same layout as NPFrameSet.fullData().
+        '''
+        return self.data[ start:stop ].transpose( 0, 2, 1 )
+
+    def iterAgentBlocks( self, blockSize ):
+        '''Iterates through the agents in contiguous blocks.
+
+        @param      blockSize   An int.  The number of agents in each block.
+        @returns    A generator of 2-tuples: ( start, block ), where block is the result of
+                    agentBlock( start, start + blockSize ).
+        '''
+        for start in xrange( 0, self.agtCount, blockSize ):
+            yield start, self.agentBlock( start, start + blockSize )
+
+    def close( self ):
+        '''Releases the mapped data'''
+        self.data = None
+
+def main():
+    import optparse, sys
+    parser = optparse.OptionParser()
+    parser.set_description( 'Writes an agent-major copy of an scb file so that per-agent trajectories can be read contiguously.' )
+    parser.add_option( '-i', '--in', help='The name of the scb file to transpose',
+                       action='store', dest='inFileName', default='' )
+    parser.add_option( '-o', '--out', help='The name of the output file (defaults to the input name with %s appended)' % AGENT_MAJOR_EXT,
+                       action='store', dest='outFileName', default=None )
+    options, args = parser.parse_args()
+
+    if ( options.inFileName == '' ):
+        print "You must specify an input name"
+        parser.print_help()
+        sys.exit( 1 )
+
+    outName = transposeSCB( options.inFileName, options.outFileName )
+    data = AgentMajorData( outName )
+    print "Wrote %d agents over %d frames to %s" % ( data.agentCount(), data.totalFrames(), outName )
+
+if __name__ == '__main__':
+    main()
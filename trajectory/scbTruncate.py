@@ -4,6 +4,7 @@
 import struct
 import sys
 import scbData
+import scbCopy
 
 DEFAULT_OUTPUT = 'output.scb'
 
@@ -15,18 +16,16 @@ def copyNFrames( inName, outName, start, count, step, tgtAgtCount, agtStride ):
     Reports number of frames copied.  Copying
     includes header.
     If count == -1, all frames are copied."""
-    data = scbData.NPFrameSet( inName, startFrame=start, maxFrames=count, maxAgents=tgtAgtCount, frameStep=step, agtStep=agtStride )
-    data.write( outName )
-    return data.totalFrames()
+    index = scbData.SCBFrameIndex( inName, useSidecar=False )
+    agents = scbCopy.agentSelection( index.agtCount, tgtAgtCount, agtStride )
+    return scbCopy.copySCB( inName, outName, start, count, step, agents )
 
 def copyAgent( inName, outName, start, count, step, agtID ):
     """Copies at most count frames from the scb inName to
     the outName for one specific agent: agtID.  It copies every step-th frame.
     Reports number of frames copied.  Copying includes header.
     If count == -1, all frames are copied."""
-    data = scbData.NPFrameSet( inName, startFrame=start, maxFrames=count, frameStep=step )
-    data.writeAgent( outName, agtID )
-    return data.totalFrames()
+    return scbCopy.copySCB( inName, outName, start, count, step, [ agtID ] )
 
 def main():
     """Determine the input file, output file and number of frames"""
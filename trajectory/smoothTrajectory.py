@@ -1,11 +1,17 @@
 # given a trajectory file and a smoothing parameter, smooths the
 #   trajectories using a gaussian kernel
+#
+#   The smoothing engine (smoothFrames) filters a (K, N, C) block of K frames of N agents at once
+#   along the time axis.  Each agent's trajectory is split into continuous intervals (see
+#   findIntervals); rather than splitting the data, the interval of every sample is found with
+#   vectorized scans and the filtered values are selected with masks.  The result is the same as
+#   smoothing each interval of each agent separately (see smooth), up to floating-point rounding.
+#   Long data is filtered in overlapping chunks of frames (see smoothBlocks).
 
-from dataLoader import loadTrajectory
+from dataLoader import loadTrajectory, loadSCB
 import numpy as np
 import commonData
-from scbData import SCBDataMemory
-import pylab as plt
+from scbData import SCBDataMemory, SCBWriter, SCBError
 from copy import deepcopy
 
 def gaussian1D( sigma, cellSize ):
@@ -43,7 +49,9 @@ def findIntervals( path, threshSqd=1.0 ):
     '''
     delta = np.diff( path, axis=0 )
     dSqd = np.sum( delta * delta, axis=1 )
-    breaks = np.where( dSqd > threshSqd )[0]
+    # a missing (NaN) position doesn't break the path
+    with np.errstate( invalid='ignore' ):
+        breaks = np.where( dSqd > threshSqd )[0]
     start = 0
     intervals = []
     if ( breaks.size > 0 ):
@@ -150,54 +158,254 @@ def unifyOrient( orient ):
     return out
         
 
-def smoothSCB( data, sigma, smoothOrient ):
+# The number of frames filtered at a time (bounds the temporary arrays)
+FILTER_ROWS = 64
+
+def intervalBounds( path, threshSqd=1.0, breaks=None ):
+    '''Finds the continuous interval (see findIntervals) containing each sample of a block of
+    paths.
+
+    @param      path        A numpy array of floats with shape (K, N, 2).  The positions of N
+                            agents over K frames.
+    @param      threshSqd   The maximum SQUARED displacement between two subsequent positions
+                            that is considered to be continuous.
+    @param      breaks      An optional numpy array of bools with shape (K - 1, N).  Additional
+                            discontinuities; if breaks[i, a] is True, agent a's path is split
+                            between frames i and i + 1.
+    @returns    A 2-tuple of numpy arrays of ints with shape (K, N): ( start, end ).  The sample at
+                frame i of agent a lies in the interval [ start[i, a], end[i, a] ).
+    '''
+    K, N = path.shape[:2]
+    delta = np.diff( path, axis=0 )
+    # a missing (NaN) position doesn't split the path
+    with np.errstate( invalid='ignore' ):
+        split = np.sum( delta * delta, axis=2 ) > threshSqd
+    if ( breaks is not None ):
+        split |= breaks
+    frames = np.arange( K ).reshape( -1, 1 )
+    # an interval starts at frame 0 and after every split
+    first = np.zeros( ( K, N ), dtype=np.int64 )
+    first[ 1: ] = np.where( split, frames[ 1: ], 0 )
+    start = np.maximum.accumulate( first, axis=0 )
+    # an interval ends at frame K and at every split
+    last = np.empty( ( K, N ), dtype=np.int64 )
+    last[ -1 ] = K
+    last[ :-1 ] = np.where( split, frames[ 1: ], K )
+    end = np.minimum.accumulate( last[ ::-1 ], axis=0 )[ ::-1 ]
+    return start, end
+
+def smoothFrames( values, path, kernel, threshSqd=1.0, breaks=None ):
+    '''Smooths a block of agent data along the time axis.  Each continuous interval of each
+    agent's path is treated as smooth treats it: values of intervals no longer than the kernel are
+    unchanged, the first and last kernel.size / 2 values of longer intervals are blended towards
+    the filtered values, and the rest are filtered.
+
+    @param      values      A numpy array of floats with shape (K, N, C).  The C values of N
+                            agents over K frames to smooth.
+    @param      path        A numpy array of floats with shape (K, N, 2).  The positions which
+                            define the continuous intervals (see intervalBounds).
+    @param      kernel      A numpy array of floats with shape (S, ).  A symmetric kernel with an
+                            odd number of samples.
+    @param      threshSqd   The maximum SQUARED displacement between two subsequent positions
+                            that is considered to be continuous.
+    @param      breaks      An optional numpy array of bools with shape (K - 1, N).  Additional
+                            discontinuities (see intervalBounds).
+    @returns    A NEW numpy array with the shape and type of values.
+    '''
+    newData = np.array( values )
+    K, N = values.shape[:2]
+    size = kernel.size
+    halfK = size / 2
+    if ( halfK == 0 or K <= size ):
+        return newData
+    start, end = intervalBounds( path, threshSqd, breaks )
+    frames = np.arange( K ).reshape( -1, 1 )
+    longEnough = ( end - start ) > size
+    head = frames - start
+    tail = end - 1 - frames
+
+    # filter every agent at once; filtered[i] is only defined for i in [halfK, K - halfK).
+    #   Each tile of frames is a sum of the kernel's samples times the frames, shifted by the
+    #   sample's offset (as np.convolve).  Only the frames within halfK of an output frame
+    #   contribute to it, so a missing (NaN) value spreads no further than it does in smooth.
+    outCount = K - 2 * halfK
+    rows = min( FILTER_ROWS, outCount )
+    weights = kernel[ ::-1 ]
+    flat = values.reshape( K, -1 )
+    filtered = np.empty( newData.shape, dtype=newData.dtype )
+    flatFiltered = filtered.reshape( K, -1 )
+    for r in xrange( 0, outCount, rows ):
+        n = min( rows, outCount - r )
+        window = flat[ r:r + n + 2 * halfK ].astype( np.float64 )
+        total = weights[ 0 ] * window[ :n ]
+        for j in xrange( 1, size ):
+            total += weights[ j ] * window[ j:j + n ]
+        flatFiltered[ r + halfK:r + halfK + n ] = total
+
+    inner = longEnough & ( head >= halfK ) & ( tail >= halfK )
+    np.copyto( newData, filtered, where=inner.reshape( inner.shape + ( 1, ) * ( values.ndim - 2 ) ) )
+
+    # linearly interpolate the first half and the last half
+    #   leading set: the change applied to the interval's sample at halfK is blended in
+    f, a = np.nonzero( longEnough & ( head < halfK ) )
+    if ( f.size ):
+        anchor = start[ f, a ] + halfK
+        delta = filtered[ anchor, a ] - values[ anchor, a ]
+        weights = np.linspace( 0.0, 1.0, halfK + 1 )[:-1][ head[ f, a ] ]
+        weights.shape = (-1, 1 )
+        newData[ f, a ] = delta * weights + values[ f, a ]
+    #   trailing set
+    f, a = np.nonzero( longEnough & ( tail < halfK ) )
+    if ( f.size ):
+        anchor = end[ f, a ] - ( halfK + 1 )
+        delta = filtered[ anchor, a ] - values[ anchor, a ]
+        weights = np.linspace( 1.0, 0.0, halfK + 1 )[1:][ halfK - 1 - tail[ f, a ] ]
+        weights.shape = (-1, 1 )
+        newData[ f, a ] = delta * weights + values[ f, a ]
+    return newData
+
+def unifyOrientBlock( orient, prev=None ):
+    '''Unifies the orientations of many agents at once (see unifyOrient).
+
+    @param  orient      A numpy array of floats with shape (K, N).  The orientations of N agents
+                        over K frames.
+    @param  prev        An optional numpy array of N floats.  The unified orientations of the
+                        frame preceding this block.  If None, the first frame is unchanged.
+    @returns    A numpy array with the shape and type of orient.  The unified values.
+    '''
+    out = np.empty_like( orient )
+    delta = np.array( ( -2.0 * np.pi, 0.0, 2.0 * np.pi ), dtype=np.float32 )
+    rows = np.arange( orient.shape[1] )
+    for i in xrange( orient.shape[0] ):
+        if ( prev is None ):
+            out[ i ] = orient[ i ]
+        else:
+            values = orient[ i ].reshape( -1, 1 ) + delta
+            err = np.abs( values - prev.reshape( -1, 1 ) )
+            out[ i ] = values[ rows, err.argmin( axis=1 ) ]
+        prev = out[ i ]
+    return out
+
+def smoothBlocks( blocks, kernel, is3D=False, smoothOrient=False, threshSqd=1.0 ):
+    '''Smooths the frames of scb data given as a sequence of blocks.  Only the blocks of frames
+    near the frames being smoothed are held in memory.  Each window of frames is smoothed with
+    enough overlap with its neighbors that the result is the same as smoothing all of the
+    frames at once.
+
+    @param      blocks          An iterable of numpy arrays of floats with shape (k, N, M).  The
+                                consecutive frames of N agents with M floats per agent (e.g., the
+                                blocks of NPFrameSet.iterBlocks).
+    @param      kernel          A numpy array of floats with shape (S, ).  The smoothing kernel.
+    @param      is3D            A bool.  If True, the positions are in columns 0 and 2 and the
+                                orientation in column 3.  Otherwise, columns 0 and 1 and 2.
+    @param      smoothOrient    A bool.  If true, the orientation is smoothed. If false, position.
+    @param      threshSqd       The maximum SQUARED displacement between two subsequent positions
+                                that is considered to be continuous.
+    @returns    A generator of numpy arrays of float32 with shape (k', N, M).  The smoothed frames,
+                in order.  The other columns are copied.
+    '''
+    if ( is3D ):
+        posCols = [ 0, 2 ]
+        orientCol = 3
+    else:
+        posCols = [ 0, 1 ]
+        orientCol = 2
+    if ( smoothOrient ):
+        smoothCols = [ orientCol ]
+    else:
+        smoothCols = posCols
+    # the frames filtered with the data of a frame's interval lie within this many frames of it
+    halo = kernel.size + 1
+
+    def smoothWindow( window ):
+        newData = window.copy()
+        newData[ :, :, smoothCols ] = smoothFrames( window[ :, :, smoothCols ], window[ :, :, posCols ],
+                                                    kernel, threshSqd )
+        return newData
+
+    # the buffered frames; the first done frames have already been produced
+    buffer = None
+    done = 0
+    prevOrient = None
+    for block in blocks:
+        block = np.array( block, dtype=np.float32 )
+        if ( block.shape[0] == 0 ):
+            continue
+        if ( smoothOrient ):
+            # put all the orientation into a "uniform" range
+            block[ :, :, orientCol ] = unifyOrientBlock( block[ :, :, orientCol ], prevOrient )
+            prevOrient = block[ -1, :, orientCol ].copy()
+        if ( buffer is None ):
+            buffer = block
+        else:
+            buffer = np.concatenate( ( buffer, block ) )
+        # the frames followed by a full halo can be finished
+        ready = buffer.shape[0] - halo
+        if ( ready > done ):
+            yield smoothWindow( buffer )[ done:ready ]
+            # keep a full halo before the next frame to produce
+            drop = max( 0, ready - halo )
+            buffer = buffer[ drop: ]
+            done = ready - drop
+    if ( buffer is not None and buffer.shape[0] > done ):
+        yield smoothWindow( buffer )[ done: ]
+
+def smoothSCB( data, sigma, smoothOrient, blockFrames=1024 ):
     '''Smooths the trajectories in the given SCB data using a gaussian kernel with
     the given standard deviation (sigma).
 
     @param      data            An instance of SCBData.
     @param      sigma           A float.  The size of the standard deviation (in frames).
     @param      smoothOrient    A bool.  If true, the orientation is smoothed. If false, position.
+    @param      blockFrames     An int.  The number of frames smoothed at a time.
     @return     A new instance of SCBData containing smoothed trajectories.  The duration of the
                 two trajectories is the same.
     @raises:    ValueError if the data is not of a recognizable format.
     '''
-    # TODO: Support 3D data
+    if ( smoothOrient and not data.hasScalarOrient ):
+        raise ValueError, "Cannot smooth orientation for data with non-scalar orientation"
     rawData = data.fullData()
     smoothData = np.empty( rawData.shape, dtype=np.float32 )
     kernel = gaussian1D( sigma, 1.0 )
-    if ( smoothOrient and not data.hasScalarOrient ):
-        raise ValueError, "Cannot smooth orientation for data with non-scalar orientation"
-    for a in xrange( rawData.shape[0] ):
-        if ( data.is3D ):
-            # grab the x and z columns
-            path = rawData[ a, :3:2, : ].T
-        else:
-            path = rawData[ a, :2, : ].T
-        intervals = findIntervals( path )
-        if ( smoothOrient ):
-            if ( data.is3D ):
-                orientColumn = 3
-            else:
-                orientColumn = 2
-            orient = rawData[ a, orientColumn, : ]
-            smoothData[ a, :orientColumn, : ] = rawData[ a, :orientColumn, : ]
-            # put all the orientation into a "uniform" range
-            orient = unifyOrient( orient )
-            for iVal in intervals:
-                iValData = orient[ iVal[0]:iVal[1] ]
-                smoothIVal = smoothOrientation( iValData, kernel )
-                smoothData[ a, orientColumn, iVal[0]:iVal[1] ] = smoothIVal
-        else:
-            # smoothing trajectory            
-            for iVal in intervals:
-                iValData = path[ iVal[0]:iVal[1], : ]
-                smoothIVal = smooth( iValData, kernel )
-                smoothData[ a, :2, iVal[0]:iVal[1] ] = smoothIVal.T
+    frameCount = rawData.shape[2]
+    blocks = ( rawData[ :, :, i:i + blockFrames ].transpose( 2, 0, 1 ) for i in xrange( 0, frameCount, blockFrames ) )
+    i = 0
+    for block in smoothBlocks( blocks, kernel, data.is3D, smoothOrient ):
+        smoothData[ :, :, i:i + block.shape[0] ] = block.transpose( 1, 2, 0 )
+        i += block.shape[0]
     newData = SCBDataMemory()
     newData.setData( smoothData, data.version, data.simStepSize )
     return newData
+
+def smoothSCBFile( inName, outName, sigma, smoothOrient, blockFrames=1024 ):
+    '''Smooths the trajectories in an scb file, writing the result to a new scb file.  The frames
+    are read, smoothed and written in blocks, so the memory used doesn't depend on the number of
+    frames.
+
+    @param      inName          A string.  The path to the scb data to smooth (see loadSCB).
+    @param      outName         A string.  The path to the scb file to write.
+    @param      sigma           A float.  The size of the standard deviation (in frames).
+    @param      smoothOrient    A bool.  If true, the orientation is smoothed. If false, position.
+    @param      blockFrames     An int.  The number of frames read at a time.
+    @returns    An int.  The number of frames written.
+    @raises:    SCBError if the input is not scb data.
+    @raises:    ValueError if the orientation can't be smoothed.
+    '''
+    data = loadSCB( inName )
+    if ( smoothOrient and not data.hasScalarOrient ):
+        data.close()
+        raise ValueError, "Cannot smooth orientation for data with non-scalar orientation"
+    kernel = gaussian1D( sigma, 1.0 )
+    writer = SCBWriter.fromFrameSet( outName, data )
+    try:
+        blocks = ( block for block, indices in data.iterBlocks( blockFrames ) )
+        for block in smoothBlocks( blocks, kernel, data.is3D, smoothOrient ):
+            writer.writeFrames( block )
+    finally:
+        data.close()
+    return writer.close()
     
-def smoothJulich( data, sigma, smoothOrient ):
+def smoothJulich( data, sigma, smoothOrient=False ):
     '''Smooths the trajectories in the given SCB data using a gaussian kernel with
     the given standard deviation (sigma).
 
@@ -209,13 +417,14 @@ def smoothJulich( data, sigma, smoothOrient ):
     # TODO: Have this smooth 3D data
     newData = deepcopy( data )
     kernel = gaussian1D( sigma, 1.0 )
-    for ped in newData.pedestrians:
-        path = ped.traj[:, :2]
-        intervals = findIntervals( path )
-        for iVal in intervals:
-            iValData = path[ iVal[0]:iVal[1], : ]
-            smoothIVal = smooth( iValData, kernel )
-            path[ iVal[0]:iVal[1], :2 ] = smoothIVal
+    if ( newData.points.shape[0] == 0 ):
+        return newData
+    # all pedestrians are smoothed at once as a single sequence, split between pedestrians
+    path = newData.points[ :, np.newaxis, :2 ]
+    breaks = np.zeros( ( path.shape[0] - 1, 1 ), dtype=np.bool )
+    breaks[ newData.pedOffsets[ 1:-1 ] - 1 ] = True
+    newData.points[ :, :2 ] = smoothFrames( path, path, kernel, breaks=breaks )[ :, 0, : ]
+    newData.updateFrames()
     return newData
     
 def smoothTrajectory( data, sigma, smoothOrient ):
@@ -272,11 +481,6 @@ def main():
         print '\n!!! You must specify an input file'
         sys.exit(1)
 
-    # smooth the data
-    
-    newData = smoothTrajFile( options.inFileName, options.sigma, options.smoothHeading )
-
-    # export the data
     outName = None
     if ( options.outFileName is None ):
         path, fileName = os.path.split( options.inFileName )
@@ -285,9 +489,22 @@ def main():
     else:
         outName = options.outFileName
 
+    # scb data is smoothed from file to file, a block of frames at a time
+    try:
+        smoothSCBFile( options.inFileName, outName, options.sigma, options.smoothHeading )
+        return
+    except SCBError:
+        pass
+
+    # smooth the data
+    
+    newData = smoothTrajFile( options.inFileName, options.sigma, options.smoothHeading )
+
+    # export the data
     newData.write( outName )
 if __name__ == '__main__':
     import optparse
+    import os
     import sys
     main()
     
\ No newline at end of file
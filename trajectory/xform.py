@@ -55,6 +55,22 @@ class TrajXform:
         newData.setData( agtData, data.version, data.simStepSize )
         return newData
 
+    def applyFrames( self, block, is3D=False ):
+        '''Applies this transformation, in place, to a block of scb frames.
+
+        @param      block       A numpy array of floats with shape (K, N, M).  The frames of N
+                                agents with M floats per agent.
+        @param      is3D        A bool.  If True, the positions are the first three columns.
+                                Otherwise, the first two.
+        @raises     AttributeError if the z-translation is non-zero for 2D frames.
+        '''
+        block[ :, :, 0 ] += self.tx
+        block[ :, :, 1 ] += self.ty
+        if ( is3D ):
+            block[ :, :, 2 ] += self.tz
+        elif ( self.tz != 0.0 ):
+            raise AttributeError, "Z-translation not supported in trajectory transform"
+
     def applyJulich( self, data ):
         '''Applies this transformation to the agents in the given SCB data.
 
@@ -65,6 +81,7 @@ class TrajXform:
         offset.shape = (1, -2 )
         for ped in newData.pedestrians:
             ped.traj[ :, :2 ] += offset
+        newData.updateFrames()
             
         return newData
     
\ No newline at end of file